@@ -1,7 +1,37 @@
-from flask import Flask, render_template, request, jsonify, send_file, Response, make_response
-from config import Config
-from database.models import db, Contact, ChatLog, AnalysisResult
+from flask import Blueprint, Flask, current_app, render_template, request, jsonify, send_file, Response, make_response
+from sqlalchemy.exc import IntegrityError
+from config import get_config
+from database.models import db, Contact, ChatLog, AnalysisResult, UsageRecord
+from database.engine import configure_engine
+from database.routing import read_only
+from database.stats import contact_summary_options, empty_contact_stats, update_contact_stats
+from database.usage import contact_usage, daily_usage, quota_status
+from database.search import search_chat_logs
+from database.shards import (
+    init_chat_log_shards, add_chat_logs as store_chat_logs, commit_chat_logs,
+    delete_chat_logs, count_chat_logs, daily_chat_log_counts, top_contacts_by_messages
+)
+from database.profiler import init_sql_profiler
+from database.archive import load_chat_logs, load_chat_logs_by_ids
+from database.timeline import TIMELINE_PAGE_SIZE, TIMELINE_MAX_PAGE_SIZE, timeline_page, timeline_summary
+from database.profile_index import FACETS, index_contact_analysis, parse_filters, find_contacts, facet_counts
+from database.tags import parse_tags, set_contact_tags, contacts_with_tags, tag_counts
 from utils.ai import get_ai_analysis, parse_ai_response, stream_ai_analysis
+from utils.backends import backend_stats
+from utils.jobs import analysis_jobs, job_key
+from utils.lifecycle import streams
+from utils.sampling import build_analysis_transcript
+from utils.sse import SSE_HEADERS
+from utils.transcript import build_transcript
+from utils.metrics import (
+    ANALYSIS_RESUMES, CONTENT_TYPE as METRICS_CONTENT_TYPE, collect as collect_metrics, init_metrics, log_event,
+    record_export, record_transcript
+)
+from utils.cache import CONTACTS_TAG, contact_tag, init_response_cache, get_response_cache
+from utils.http_cache import (
+    conditional, contact_validators, analysis_validators, contact_list_validators,
+    render_cached, invalidate_contact
+)
 from utils.exporter import (
     export_chat_logs_to_csv, export_chat_logs_to_excel, export_chat_logs_to_multiple_formats,
     export_analysis_to_excel, export_analysis_to_json, export_analysis_to_pdf, export_analysis_to_multiple_formats,
@@ -10,14 +40,28 @@ from utils.exporter import (
 import json
 from datetime import datetime, timedelta
 import os
+import time
 from collections import defaultdict
 
-app = Flask(__name__)
-app.config.from_object(Config)
+bp = Blueprint('main', __name__)
 
-db.init_app(app)
 
-@app.template_filter('activity_level_text')
+def create_app(config_name=None):
+    """应用工厂。不在这里建表：新库或升级后请先运行 python migrate_fields.py"""
+    app = Flask(__name__)
+    app.config.from_object(get_config(config_name))
+    
+    db.init_app(app)
+    configure_engine(app)
+    init_chat_log_shards(app)
+    init_response_cache(app)
+    init_metrics(app)
+    init_sql_profiler(app)
+    
+    app.register_blueprint(bp)
+    return app
+
+@bp.app_template_filter('activity_level_text')
 def _activity_level_text(level):
     level_map = {
         'high': '高活跃',
@@ -28,7 +72,7 @@ def _activity_level_text(level):
     }
     return level_map.get(level, '低活跃')
 
-@app.context_processor
+@bp.app_context_processor
 def inject_activity_level_text():
     def activity_level_text(level):
         level_map = {
@@ -41,19 +85,146 @@ def inject_activity_level_text():
         return level_map.get(level, '低活跃')
     return dict(activity_level_text=activity_level_text)
 
-with app.app_context():
-    db.create_all()
+def prepare_transcript(contact_id, chat_logs, scope):
+    """整理要发送给大模型的聊天记录（超出预算时采样），记录整理前后的 token 数"""
+    transcript = build_analysis_transcript(chat_logs, current_app.config.get('ANALYSIS_TOKEN_BUDGET'))
+    record_transcript(contact_id, scope, transcript.stats)
+    return transcript
+
+def analysis_stream_response(job, last_event_id=0):
+    """订阅分析任务的 SSE 响应；任务编号放在 X-Analysis-Job 头中，断线后凭它和 Last-Event-ID 重新连接"""
+    headers = dict(SSE_HEADERS, **{'X-Analysis-Job': job.id})
+    return Response(job.subscribe(last_event_id), mimetype='text/event-stream', headers=headers)
+
+def start_analysis_stream(contact_id, scope, chat_logs, api_key):
+    """整理聊天记录并启动分析任务，返回订阅它的 SSE 响应；
+    同一联系人、相同的整理结果和密钥已有任务在进行时合并过去，不再重复调用模型"""
+    transcript = build_analysis_transcript(chat_logs, current_app.config.get('ANALYSIS_TOKEN_BUDGET'))
+    app = current_app._get_current_object()
+    
+    def run():
+        return streams.track(run_analysis(app, contact_id, scope, len(chat_logs), transcript, api_key))
+    
+    job = analysis_jobs.start(contact_id, scope, run, key=job_key(contact_id, transcript.text, api_key))
+    return analysis_stream_response(job)
+
+def run_analysis(app, contact_id, scope, message_count, transcript, api_key):
+    """在分析任务的线程中调用模型并保存结果，产生发给客户端的事件"""
+    with app.app_context():
+        contact = Contact.query.get(contact_id)
+        record_transcript(contact_id, scope, transcript.stats)
+        log_event('analysis_stream.start', contact_id=contact_id, scope=scope,
+                  messages=message_count, tokens=transcript.stats.tokens)
+        
+        result = None
+        accumulated_content = ""
+        chunk_count = 0
+        for item in stream_ai_analysis(transcript.text, api_key, contact_id=contact_id, scope=scope):
+            chunk_count += 1
+            log_event('analysis_stream.chunk', sample=True, contact_id=contact_id, chunk=chunk_count,
+                      type=item.get('type'), total_tokens=item.get('total_tokens'))
+            
+            if 'error' in item:
+                log_event('analysis_stream.error', contact_id=contact_id, message=item['error'])
+                yield {'type': 'error', 'message': item['error']}
+                return
+            elif item.get('type') == 'content_update':
+                accumulated_content += item.get('content', '')
+                content_length = len(accumulated_content)
+                yield {
+                    'type': 'content_update',
+                    'content_length': content_length,
+                    'total_tokens': item.get('total_tokens', 0),
+                    'completion_tokens': item.get('completion_tokens', 0)
+                }
+            elif item.get('type') == 'token_update':
+                yield {
+                    'type': 'token_update',
+                    'total_tokens': item.get('total_tokens', 0),
+                    'completion_tokens': item.get('completion_tokens', 0)
+                }
+            elif 'result' in item or 'raw_response' in item:
+                result = item
+        
+        if result is None:
+            yield {'type': 'error', 'message': '未能获取分析结果'}
+            return
+        
+        if 'result' in result:
+            parsed_result = result['result']
+        else:
+            parsed_result = parse_ai_response(result)
+        
+        analysis = save_analysis(contact, parsed_result, result)
+        
+        yield {
+            'type': 'complete',
+            'analysis': analysis.to_dict(),
+            'message_count': message_count,
+            'total_tokens': result.get('total_tokens', 0),
+            'completion_tokens': result.get('completion_tokens', 0),
+            'transcript': transcript.stats.to_dict(),
+            'backend': result.get('backend')
+        }
+        log_event('analysis_stream.complete', contact_id=contact_id, messages=message_count,
+                  total_tokens=result.get('total_tokens', 0), completion_tokens=result.get('completion_tokens', 0))
 
-@app.route('/')
+def save_analysis(contact, parsed_result, raw_result):
+    """写入（或覆盖）联系人的分析结果，并同步更新画像倒排索引；
+    其他请求恰好抢先插入了该联系人的结果（唯一约束冲突）时回滚后改为覆盖那一行"""
+    try:
+        analysis = _write_analysis(contact, parsed_result, raw_result)
+    except IntegrityError:
+        db.session.rollback()
+        analysis = _write_analysis(contact, parsed_result, raw_result)
+    invalidate_contact(contact.id)
+    return analysis
+
+def _write_analysis(contact, parsed_result, raw_result):
+    analysis = AnalysisResult.query.filter_by(contact_id=contact.id).first()
+    if analysis is None:
+        analysis = AnalysisResult(contact_id=contact.id)
+        db.session.add(analysis)
+    
+    analysis.core_traits = json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False)
+    analysis.behavior_preferences = json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False)
+    analysis.social_interaction = json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False)
+    analysis.cognitive_thinking = json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False)
+    analysis.summary = parsed_result.get('summary', '')
+    analysis.interests = json.dumps(parsed_result.get('interests', []), ensure_ascii=False)
+    analysis.dos_and_donts = json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False)
+    analysis.topic_suggestions = json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False)
+    analysis.gift_suggestions = json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False)
+    analysis.raw_response = json.dumps(raw_result, ensure_ascii=False)
+    analysis.updated_at = datetime.utcnow()
+    
+    index_contact_analysis(contact.id, analysis)
+    contact.updated_at = datetime.utcnow()
+    db.session.commit()
+    return analysis
+
+@bp.route('/')
 def index():
     return render_template('landing.html')
 
-@app.route('/contacts')
+@bp.route('/contacts')
+@read_only
+@conditional(contact_list_validators)
 def contacts_page():
-    contacts = Contact.query.order_by(Contact.updated_at.desc()).all()
-    return render_template('index.html', contacts=[c.to_dict() for c in contacts])
+    def render():
+        selected_tags = parse_tags(request.args.get('tags', ''))
+        query = contacts_with_tags(selected_tags) if selected_tags else Contact.query
+        contacts = query.options(*contact_summary_options()).order_by(Contact.updated_at.desc()).all()
+        return render_template(
+            'index.html',
+            contacts=[c.to_dict() for c in contacts],
+            all_tags=tag_counts(limit=30),
+            selected_tags=selected_tags
+        )
+    
+    return render_cached('contacts', None, render)
 
-@app.route('/set_username', methods=['POST'])
+@bp.route('/set_username', methods=['POST'])
 def set_username():
     username = request.form.get('username', '').strip()
     if not username:
@@ -62,80 +233,89 @@ def set_username():
     response.set_cookie('username', username, max_age=60*60*24*30)
     return response
 
-@app.route('/home')
+@bp.route('/home')
+@read_only
 def home_page():
     username = request.cookies.get('username') or '朋友'
     now = datetime.now()
     
-    total_contacts = Contact.query.count()
-    total_messages = ChatLog.query.count()
-    total_analyses = AnalysisResult.query.count()
-    
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    new_this_month = Contact.query.filter(Contact.created_at >= month_start).count()
-    
-    thirty_days_ago = now - timedelta(days=30)
-    active_relationships = Contact.query.filter(
-        Contact.updated_at >= thirty_days_ago
-    ).count()
-    
-    analysis_rate = int(total_analyses / total_contacts * 100) if total_contacts > 0 else 0
-    
-    stats = {
-        'total_contacts': total_contacts,
-        'total_messages': total_messages,
-        'total_analyses': total_analyses,
-        'new_this_month': new_this_month,
-        'active_relationships': active_relationships,
-        'analysis_rate': analysis_rate
-    }
-    
-    recent_contacts = Contact.query.order_by(Contact.updated_at.desc()).limit(5).all()
-    
-    need_attention = []
-    for contact in recent_contacts:
-        chat_count = ChatLog.query.filter_by(contact_id=contact.id).count()
-        if chat_count > 0 and not contact.analysis:
-            need_attention.append({
-                'id': contact.id,
-                'name': contact.name,
-                'reason': '有待分析的聊天记录'
-            })
-    
-    for contact in recent_contacts[:2]:
-        chat_count = ChatLog.query.filter_by(contact_id=contact.id).count()
-        if chat_count > 30 and not contact.analysis:
-            need_attention.append({
-                'id': contact.id,
-                'name': contact.name,
-                'reason': '积累了大量聊天记录'
-            })
-    
-    activity_data = []
-    for i in range(30):
-        date = (now - timedelta(days=29 - i)).date()
-        count = ChatLog.query.filter(
-            ChatLog.chat_date == date
+    def build_dashboard():
+        total_contacts = Contact.query.count()
+        total_messages = count_chat_logs()
+        total_analyses = AnalysisResult.query.count()
+        
+        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        new_this_month = Contact.query.filter(Contact.created_at >= month_start).count()
+        
+        thirty_days_ago = now - timedelta(days=30)
+        active_relationships = Contact.query.filter(
+            Contact.updated_at >= thirty_days_ago
         ).count()
-        activity_data.append({
-            'date': str(date),
-            'count': count
-        })
-    
-    insights = None
-    if total_contacts > 0:
-        avg_messages = total_messages / total_contacts if total_contacts > 0 else 0
-        most_active = db.session.query(
-            Contact, db.func.count(ChatLog.id).label('chat_count')
-        ).join(ChatLog).group_by(Contact.id).order_by(
-            db.desc('chat_count')
-        ).first()
         
-        insights = {
-            'avg_messages_per_contact': f'{avg_messages:.1f}',
-            'most_active_contact': most_active[0].name if most_active else '-',
-            'analysis_coverage': analysis_rate
+        analysis_rate = int(total_analyses / total_contacts * 100) if total_contacts > 0 else 0
+        
+        stats = {
+            'total_contacts': total_contacts,
+            'total_messages': total_messages,
+            'total_analyses': total_analyses,
+            'new_this_month': new_this_month,
+            'active_relationships': active_relationships,
+            'analysis_rate': analysis_rate
         }
+        
+        recent_contacts = Contact.query.options(*contact_summary_options()) \
+            .order_by(Contact.updated_at.desc()).limit(5).all()
+        
+        need_attention = []
+        for contact in recent_contacts:
+            chat_count = contact.chat_count
+            if chat_count > 0 and not contact.analysis:
+                need_attention.append({
+                    'id': contact.id,
+                    'name': contact.name,
+                    'reason': '有待分析的聊天记录'
+                })
+        
+        for contact in recent_contacts[:2]:
+            chat_count = contact.chat_count
+            if chat_count > 30 and not contact.analysis:
+                need_attention.append({
+                    'id': contact.id,
+                    'name': contact.name,
+                    'reason': '积累了大量聊天记录'
+                })
+        
+        activity_data = []
+        daily_counts = daily_chat_log_counts((now - timedelta(days=29)).date(), now.date())
+        for i in range(30):
+            date = (now - timedelta(days=29 - i)).date()
+            activity_data.append({
+                'date': str(date),
+                'count': daily_counts.get(date, 0)
+            })
+        
+        insights = None
+        if total_contacts > 0:
+            avg_messages = total_messages / total_contacts if total_contacts > 0 else 0
+            top_contacts = top_contacts_by_messages(limit=1)
+            most_active = db.session.get(Contact, top_contacts[0][0]) if top_contacts else None
+        
+            insights = {
+                'avg_messages_per_contact': f'{avg_messages:.1f}',
+                'most_active_contact': most_active.name if most_active else '-',
+                'analysis_coverage': analysis_rate
+            }
+        
+        return {
+            'stats': stats,
+            'recent_contacts': [c.to_dict() for c in recent_contacts],
+            'need_attention': need_attention[:3],
+            'activity_data': activity_data,
+            'insights': insights
+        }
+    
+    # 汇总数据在各 worker 间共享缓存，任一联系人变化都会使其失效（contacts 标签）
+    dashboard = get_response_cache().get_or_set(f'home:{now.date()}', build_dashboard, [CONTACTS_TAG])
     
     greeting = now.strftime('%H:%M')
     if now.hour < 6:
@@ -153,65 +333,120 @@ def home_page():
         'home.html',
         greeting=greeting,
         username=username,
-        stats=stats,
-        recent_contacts=[c.to_dict() for c in recent_contacts],
-        need_attention=need_attention[:3],
-        activity_data=activity_data,
-        insights=insights
+        **dashboard
     )
 
-@app.route('/api/contacts', methods=['GET'])
+@bp.route('/api/contacts', methods=['GET'])
+@read_only
 def get_contacts():
-    contacts = Contact.query.order_by(Contact.updated_at.desc()).all()
-    return jsonify({'contacts': [c.to_dict() for c in contacts]})
+    selected_tags = parse_tags(request.args.get('tags', ''))
+    if selected_tags:
+        match = 'any' if request.args.get('match') == 'any' else 'all'
+        query = contacts_with_tags(selected_tags, match)
+    else:
+        query = Contact.query
+    
+    def build():
+        contacts = query.options(*contact_summary_options()).order_by(Contact.updated_at.desc()).all()
+        return {'contacts': [c.to_dict() for c in contacts], 'count': len(contacts)}
+    
+    key = f"contacts:{request.query_string.decode('utf-8', 'replace')}"
+    return jsonify(get_response_cache().get_or_set(key, build, [CONTACTS_TAG]))
+
+@bp.route('/api/tags', methods=['GET'])
+@read_only
+def get_tags():
+    prefix = request.args.get('prefix', '').strip() or None
+    limit = request.args.get('limit', type=int)
+    return jsonify({'tags': tag_counts(prefix=prefix, limit=limit)})
 
-@app.route('/api/contacts', methods=['POST'])
+@bp.route('/api/contacts', methods=['POST'])
 def create_contact():
     data = request.get_json()
     contact = Contact(
         name=data.get('name'),
         avatar=data.get('avatar', ''),
-        notes=data.get('notes', ''),
-        tags=data.get('tags', '')
+        notes=data.get('notes', '')
     )
+    contact.stats = empty_contact_stats()
     db.session.add(contact)
+    set_contact_tags(contact, data.get('tags', ''))
     db.session.commit()
+    invalidate_contact(contact.id)
     return jsonify({'contact': contact.to_dict()}), 201
 
-@app.route('/api/contacts/<int:id>', methods=['GET'])
+@bp.route('/api/contacts/<int:id>', methods=['GET'])
+@read_only
 def get_contact(id):
     contact = Contact.query.get_or_404(id)
     return jsonify({'contact': contact.to_dict()})
 
-@app.route('/api/contacts/<int:id>', methods=['PUT'])
+@bp.route('/api/contacts/<int:id>', methods=['PUT'])
 def update_contact(id):
     contact = Contact.query.get_or_404(id)
     data = request.get_json()
     contact.name = data.get('name', contact.name)
     contact.avatar = data.get('avatar', contact.avatar)
     contact.notes = data.get('notes', contact.notes)
-    contact.tags = data.get('tags', contact.tags)
+    if 'tags' in data:
+        set_contact_tags(contact, data['tags'])
     db.session.commit()
+    invalidate_contact(contact.id)
     return jsonify({'contact': contact.to_dict()})
 
-@app.route('/api/contacts/<int:id>', methods=['DELETE'])
+@bp.route('/api/contacts/<int:id>', methods=['DELETE'])
 def delete_contact(id):
     contact = Contact.query.get_or_404(id)
+    delete_chat_logs(contact.id)
     db.session.delete(contact)
     db.session.commit()
+    invalidate_contact(id)
+
+    try:
+        from utils.embeddings import remove_contact_vectors
+        remove_contact_vectors(id)
+    except Exception:
+        # build_embeddings.py 会清掉已删除联系人的向量
+        current_app.logger.exception('向量索引清理失败: contact_id=%s', id)
     return jsonify({'message': '删除成功'})
 
-@app.route('/labeling/<int:contact_id>')
+@bp.route('/labeling/<int:contact_id>')
 def labeling_page(contact_id):
     contact = Contact.query.get_or_404(contact_id)
     return render_template('labeling.html', contact=contact)
 
-@app.route('/api/contacts/<int:contact_id>/chat-logs', methods=['GET'])
+@bp.route('/api/contacts/<int:contact_id>/chat-logs', methods=['GET'])
+@read_only
 def get_chat_logs(contact_id):
-    chat_logs = ChatLog.query.filter_by(contact_id=contact_id).order_by(ChatLog.chat_date, ChatLog.created_at).all()
+    chat_logs = load_chat_logs(contact_id)
     return jsonify({'chat_logs': [log.to_dict() for log in chat_logs]})
 
-@app.route('/api/contacts/<int:contact_id>/chat-logs', methods=['POST'])
+@bp.route('/api/contacts/<int:contact_id>/timeline', methods=['GET'])
+@read_only
+@conditional(contact_validators)
+def get_timeline(contact_id):
+    """资料页原始对话的分页接口：按日期分组，cursor 为上一页返回的 next_cursor"""
+    Contact.query.get_or_404(contact_id)
+    try:
+        cursor = request.args.get('cursor')
+        cursor = datetime.strptime(cursor, '%Y-%m-%d').date() if cursor else None
+        day = request.args.get('date')
+        day = datetime.strptime(day, '%Y-%m-%d').date() if day and day != 'all' else None
+    except ValueError:
+        return jsonify({'error': '日期格式应为 YYYY-MM-DD'}), 400
+    limit = max(1, min(request.args.get('limit', TIMELINE_PAGE_SIZE, type=int), TIMELINE_MAX_PAGE_SIZE))
+    keyword = request.args.get('q', '').strip()
+    
+    return jsonify(timeline_page(contact_id, after=cursor, limit=limit, day=day, keyword=keyword))
+
+@bp.route('/api/contacts/<int:contact_id>/timeline/summary', methods=['GET'])
+@read_only
+@conditional(contact_validators)
+def get_timeline_summary(contact_id):
+    Contact.query.get_or_404(contact_id)
+    return jsonify(timeline_summary(contact_id))
+
+@bp.route('/api/contacts/<int:contact_id>/chat-logs', methods=['POST'])
 def add_chat_logs(contact_id):
     contact = Contact.query.get_or_404(contact_id)
     data = request.get_json()
@@ -219,202 +454,171 @@ def add_chat_logs(contact_id):
     lines = data.get('lines', [])
     chat_date = datetime.strptime(data.get('date', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d').date()
     
+    new_logs = []
     for line_data in lines:
+        sent_at = None
+        if line_data.get('time'):
+            try:
+                sent_time = datetime.strptime(line_data['time'], '%H:%M:%S' if line_data['time'].count(':') == 2 else '%H:%M').time()
+                sent_at = datetime.combine(chat_date, sent_time)
+            except ValueError:
+                pass
         chat_log = ChatLog(
             contact_id=contact_id,
             speaker=line_data.get('speaker', '对方'),
             content=line_data.get('content', ''),
-            chat_date=chat_date
+            chat_date=chat_date,
+            sent_at=sent_at
         )
-        db.session.add(chat_log)
+        new_logs.append(chat_log)
     
+    store_chat_logs(contact_id, new_logs)
+    index_rows = [(log.id, log.contact_id, log.content) for log in new_logs]
+    commit_chat_logs(contact_id)
+    update_contact_stats(contact, new_logs)
     contact.updated_at = datetime.utcnow()
     db.session.commit()
+    invalidate_contact(contact_id)
+    
+    try:
+        from utils.embeddings import index_chat_logs  # numpy 较重，首次写入时再加载
+        index_chat_logs(index_rows)
+    except Exception:
+        # 向量索引可通过 build_embeddings.py 补建，不影响聊天记录保存
+        current_app.logger.exception('向量索引更新失败: contact_id=%s', contact_id)
     
     return jsonify({'message': '保存成功', 'count': len(lines)})
 
-@app.route('/profile/<int:contact_id>')
+@bp.route('/api/search', methods=['GET'])
+@read_only
+def search_messages():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '请输入搜索关键词'}), 400
+    
+    contact_id = request.args.get('contact_id', type=int)
+    limit = request.args.get('limit', 20, type=int)
+    cursor = request.args.get('cursor', type=int)
+    
+    return jsonify(search_chat_logs(query, contact_id=contact_id, limit=limit, cursor=cursor))
+
+@bp.route('/api/semantic-search', methods=['GET'])
+@read_only
+def semantic_search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '请输入搜索内容'}), 400
+    
+    contact_id = request.args.get('contact_id', type=int)
+    k = min(request.args.get('k', 20, type=int), 100)
+    from utils.embeddings import get_vector_index
+    hits = get_vector_index().search(query, k=k, contact_id=contact_id)
+    
+    logs = load_chat_logs_by_ids(hit[0] for hit in hits)
+    names = dict(db.session.query(Contact.id, Contact.name).filter(Contact.id.in_({hit[1] for hit in hits})))
+    results = []
+    for log_id, _, score in hits:
+        log = logs.get(log_id)
+        if log is None:
+            continue
+        item = log.to_dict()
+        item['contact_name'] = names.get(log.contact_id)
+        item['score'] = round(score, 4)
+        results.append(item)
+    return jsonify({'results': results})
+
+@bp.route('/api/profile-index/contacts', methods=['GET'])
+@read_only
+def query_profile_index():
+    filters = parse_filters(request.args)
+    if not filters:
+        return jsonify({'error': f'请至少指定一个筛选条件: {", ".join(FACETS)}'}), 400
+    
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    offset = request.args.get('offset', 0, type=int)
+    result = find_contacts(filters, limit=limit, offset=offset)
+    result['filters'] = [{'field': field, 'term': term} for field, term in filters]
+    return jsonify(result)
+
+@bp.route('/api/profile-index/facets', methods=['GET'])
+@read_only
+def get_profile_facets():
+    fields = request.args.get('fields', ','.join(FACETS)).split(',')
+    invalid = [f for f in fields if f not in FACETS]
+    if invalid:
+        return jsonify({'error': f'不支持的分面: {", ".join(invalid)}'}), 400
+    
+    filters = parse_filters(request.args)
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    prefix = request.args.get('prefix')
+    return jsonify({
+        'facets': {field: facet_counts(field, filters, prefix=prefix, limit=limit) for field in fields}
+    })
+
+@bp.route('/profile/<int:contact_id>')
+@read_only
+@conditional(contact_validators)
 def profile_page(contact_id):
-    contact = Contact.query.get_or_404(contact_id)
-    chat_logs = ChatLog.query.filter_by(contact_id=contact_id).order_by(ChatLog.chat_date, ChatLog.created_at).all()
-    analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
+    def render():
+        contact = Contact.query.get_or_404(contact_id)
+        analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
+        # 聊天记录由前端通过 /api/contacts/<id>/timeline 分页加载
+        return render_template('profile.html', contact=contact, analysis=analysis)
     
-    return render_template('profile.html', contact=contact, chat_logs=chat_logs, analysis=analysis)
+    return render_cached('profile', contact_id, render)
 
-@app.route('/api/contacts/<int:contact_id>/analyze', methods=['POST'])
+@bp.route('/api/contacts/<int:contact_id>/analyze', methods=['POST'])
 def analyze_contact(contact_id):
     contact = Contact.query.get_or_404(contact_id)
-    chat_logs = ChatLog.query.filter_by(contact_id=contact_id).order_by(ChatLog.chat_date).all()
+    chat_logs = load_chat_logs(contact_id)
     
     if not chat_logs:
         return jsonify({'error': '没有聊天记录可分析'}), 400
     
-    chat_content = '\n'.join([
-        f"[{log.chat_date}]【我】{log.content}" if log.speaker == '我' else f"[{log.chat_date}]【对方】{log.content}"
-        for log in chat_logs
-    ])
+    transcript = prepare_transcript(contact_id, chat_logs, 'all')
     
     api_key = request.json.get('api_key') if request.json else None
-    analysis_result = get_ai_analysis(chat_content, api_key)
+    analysis_result = get_ai_analysis(transcript.text, api_key, contact_id=contact_id, scope='all')
     
+    if 'quota' in analysis_result:
+        return jsonify(analysis_result), 429, {'Retry-After': str(analysis_result['retry_after'])}
     if 'error' in analysis_result:
         return jsonify(analysis_result), 500
     
     parsed_result = parse_ai_response(analysis_result)
     
-    existing_analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
-    
-    if existing_analysis:
-        existing_analysis.core_traits = json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False)
-        existing_analysis.behavior_preferences = json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False)
-        existing_analysis.social_interaction = json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False)
-        existing_analysis.cognitive_thinking = json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False)
-        existing_analysis.summary = parsed_result.get('summary', '')
-        existing_analysis.interests = json.dumps(parsed_result.get('interests', []), ensure_ascii=False)
-        existing_analysis.dos_and_donts = json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False)
-        existing_analysis.topic_suggestions = json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False)
-        existing_analysis.gift_suggestions = json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False)
-        existing_analysis.raw_response = json.dumps(analysis_result, ensure_ascii=False)
-        existing_analysis.updated_at = datetime.utcnow()
-        analysis = existing_analysis
-    else:
-        analysis = AnalysisResult(
-            contact_id=contact_id,
-            core_traits=json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False),
-            behavior_preferences=json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False),
-            social_interaction=json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False),
-            cognitive_thinking=json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False),
-            summary=parsed_result.get('summary', ''),
-            interests=json.dumps(parsed_result.get('interests', []), ensure_ascii=False),
-            dos_and_donts=json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False),
-            topic_suggestions=json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False),
-            gift_suggestions=json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False),
-            raw_response=json.dumps(analysis_result, ensure_ascii=False)
-        )
-        db.session.add(analysis)
-    
-    contact.updated_at = datetime.utcnow()
-    db.session.commit()
+    analysis = save_analysis(contact, parsed_result, analysis_result)
     
-    return jsonify({'analysis': analysis.to_dict()})
+    return jsonify({'analysis': analysis.to_dict(), 'transcript': transcript.stats.to_dict()})
 
-@app.route('/api/contacts/<int:contact_id>/analyze/stream', methods=['POST'])
+@bp.route('/api/contacts/<int:contact_id>/analyze/stream', methods=['POST'])
 def analyze_contact_stream(contact_id):
-    print(f"[Stream Debug] API called: contact_id={contact_id}")
-    data = request.get_json()
+    if streams.draining:
+        return jsonify({'error': '服务正在重启，请稍后重试'}), 503, {'Retry-After': '10'}
+    data = request.get_json() or {}
+    Contact.query.get_or_404(contact_id)
     
-    def generate(data):
-        print(f"[Stream Debug] generate() called for contact_id={contact_id}")
-        with app.app_context():
-            contact = Contact.query.get_or_404(contact_id)
-            
-            chat_logs = ChatLog.query.filter_by(contact_id=contact_id).order_by(ChatLog.chat_date).all()
-            
-            print(f"[Stream Debug] Found {len(chat_logs)} chat logs")
-            
-            if not chat_logs:
-                yield json.dumps({'type': 'error', 'message': '没有聊天记录可分析'})
-                return
-            
-            chat_content = '\n'.join([
-                f"[{log.chat_date}]【我】{log.content}" if log.speaker == '我' else f"[{log.chat_date}]【对方】{log.content}"
-                for log in chat_logs
-            ])
-            
-            print(f"[Stream Debug] Chat content length: {len(chat_content)}")
-            
-            api_key = data.get('api_key')
-            
-            result = None
-            accumulated_content = ""
-            chunk_count = 0
-            for item in stream_ai_analysis(chat_content, api_key):
-                chunk_count += 1
-                print(f"[Stream Debug] Chunk {chunk_count}: {item}")
-                
-                if 'error' in item:
-                    yield json.dumps({'type': 'error', 'message': item['error']})
-                    return
-                elif item.get('type') == 'content_update':
-                    accumulated_content += item.get('content', '')
-                    content_length = len(accumulated_content)
-                    yield json.dumps({
-                        'type': 'content_update',
-                        'content_length': content_length,
-                        'total_tokens': item.get('total_tokens', 0),
-                        'completion_tokens': item.get('completion_tokens', 0)
-                    }) + '\n'
-                elif item.get('type') == 'token_update':
-                    yield json.dumps({
-                        'type': 'token_update',
-                        'total_tokens': item.get('total_tokens', 0),
-                        'completion_tokens': item.get('completion_tokens', 0)
-                    }) + '\n'
-                elif 'result' in item or 'raw_response' in item:
-                    result = item
-            
-            if result is None:
-                yield json.dumps({'type': 'error', 'message': '未能获取分析结果'})
-                return
-            
-            if 'result' in result:
-                parsed_result = result['result']
-            else:
-                parsed_result = parse_ai_response(result)
-            
-            existing_analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
-            
-            if existing_analysis:
-                existing_analysis.core_traits = json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False)
-                existing_analysis.behavior_preferences = json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False)
-                existing_analysis.social_interaction = json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False)
-                existing_analysis.cognitive_thinking = json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False)
-                existing_analysis.summary = parsed_result.get('summary', '')
-                existing_analysis.interests = json.dumps(parsed_result.get('interests', []), ensure_ascii=False)
-                existing_analysis.dos_and_donts = json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False)
-                existing_analysis.topic_suggestions = json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False)
-                existing_analysis.gift_suggestions = json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False)
-                existing_analysis.raw_response = json.dumps(result, ensure_ascii=False)
-                existing_analysis.updated_at = datetime.utcnow()
-                analysis = existing_analysis
-            else:
-                analysis = AnalysisResult(
-                    contact_id=contact_id,
-                    core_traits=json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False),
-                    behavior_preferences=json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False),
-                    social_interaction= json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False),
-                    cognitive_thinking=json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False),
-                    summary=parsed_result.get('summary', ''),
-                    interests=json.dumps(parsed_result.get('interests', []), ensure_ascii=False),
-                    dos_and_donts=json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False),
-                    topic_suggestions=json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False),
-                    gift_suggestions=json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False),
-                    raw_response=json.dumps(result, ensure_ascii=False)
-                )
-                db.session.add(analysis)
-            
-            contact.updated_at = datetime.utcnow()
-            db.session.commit()
-            
-            yield json.dumps({
-                'type': 'complete',
-                'analysis': analysis.to_dict(),
-                'message_count': len(chat_logs),
-                'total_tokens': result.get('total_tokens', 0),
-                'completion_tokens': result.get('completion_tokens', 0)
-            }) + '\n'
-            print(f"[Stream Debug] Sent complete event with tokens: total={result.get('total_tokens', 0)}, completion={result.get('completion_tokens', 0)}")
-    
-    return Response(generate(data), mimetype='text/event-stream')
-
-@app.route('/api/contacts/<int:contact_id>/analysis', methods=['GET'])
+    chat_logs = load_chat_logs(contact_id)
+    
+    if not chat_logs:
+        return jsonify({'error': '没有聊天记录可分析'}), 400
+    
+    return start_analysis_stream(contact_id, 'all', chat_logs, data.get('api_key'))
+
+@bp.route('/api/contacts/<int:contact_id>/analysis', methods=['GET'])
+@read_only
+@conditional(analysis_validators)
 def get_analysis(contact_id):
-    analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
+    def build():
+        analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
+        return analysis.to_dict() if analysis else None
+    
+    analysis = get_response_cache().get_or_set(f'analysis:{contact_id}', build, [contact_tag(contact_id)])
     if not analysis:
         return jsonify({'error': '没有分析结果'}), 404
-    return jsonify({'analysis': analysis.to_dict()})
+    return jsonify({'analysis': analysis})
 
-@app.route('/api/contacts/<int:contact_id>/analyze-selected', methods=['POST'])
+@bp.route('/api/contacts/<int:contact_id>/analyze-selected', methods=['POST'])
 def analyze_selected_messages(contact_id):
     contact = Contact.query.get_or_404(contact_id)
     data = request.get_json()
@@ -423,186 +627,73 @@ def analyze_selected_messages(contact_id):
     if not selected_ids:
         return jsonify({'error': '请选择要分析的聊天记录'}), 400
     
-    chat_logs = ChatLog.query.filter(
-        ChatLog.contact_id == contact_id,
-        ChatLog.id.in_(selected_ids)
-    ).order_by(ChatLog.chat_date).all()
+    chat_logs = load_chat_logs(contact_id, ids=selected_ids)
     
     if not chat_logs:
         return jsonify({'error': '没有找到选中的聊天记录'}), 400
     
-    chat_content = '\n'.join([
-        f"[{log.chat_date}]【我】{log.content}" if log.speaker == '我' else f"[{log.chat_date}]【对方】{log.content}"
-        for log in chat_logs
-    ])
-    
-    if len(chat_content) < 50:
+    if len(build_transcript(chat_logs)) < 50:
         return jsonify({'error': '聊天记录内容太少，无法进行有效分析'}), 400
     
+    transcript = prepare_transcript(contact_id, chat_logs, 'selected')
+    
     api_key = data.get('api_key')
-    analysis_result = get_ai_analysis(chat_content, api_key)
+    analysis_result = get_ai_analysis(transcript.text, api_key, contact_id=contact_id, scope='selected')
     
+    if 'quota' in analysis_result:
+        return jsonify(analysis_result), 429, {'Retry-After': str(analysis_result['retry_after'])}
     if 'error' in analysis_result:
         return jsonify(analysis_result), 500
     
     parsed_result = parse_ai_response(analysis_result)
     
-    existing_analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
-    
-    if existing_analysis:
-        existing_analysis.core_traits = json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False)
-        existing_analysis.behavior_preferences = json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False)
-        existing_analysis.social_interaction = json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False)
-        existing_analysis.cognitive_thinking = json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False)
-        existing_analysis.summary = parsed_result.get('summary', '')
-        existing_analysis.interests = json.dumps(parsed_result.get('interests', []), ensure_ascii=False)
-        existing_analysis.dos_and_donts = json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False)
-        existing_analysis.topic_suggestions = json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False)
-        existing_analysis.gift_suggestions = json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False)
-        existing_analysis.raw_response = json.dumps(analysis_result, ensure_ascii=False)
-        existing_analysis.updated_at = datetime.utcnow()
-        analysis = existing_analysis
-    else:
-        analysis = AnalysisResult(
-            contact_id=contact_id,
-            core_traits=json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False),
-            behavior_preferences=json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False),
-            social_interaction= json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False),
-            cognitive_thinking=json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False),
-            summary=parsed_result.get('summary', ''),
-            interests=json.dumps(parsed_result.get('interests', []), ensure_ascii=False),
-            dos_and_donts=json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False),
-            topic_suggestions=json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False),
-            gift_suggestions=json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False),
-            raw_response=json.dumps(analysis_result, ensure_ascii=False)
-        )
-        db.session.add(analysis)
+    analysis = save_analysis(contact, parsed_result, analysis_result)
     
-    contact.updated_at = datetime.utcnow()
-    db.session.commit()
-    
-    return jsonify({'analysis': analysis.to_dict(), 'message_count': len(chat_logs)})
+    return jsonify({'analysis': analysis.to_dict(), 'message_count': len(chat_logs),
+                    'transcript': transcript.stats.to_dict()})
 
-@app.route('/api/contacts/<int:contact_id>/analyze-selected/stream', methods=['POST'])
+@bp.route('/api/contacts/<int:contact_id>/analyze-selected/stream', methods=['POST'])
 def analyze_selected_messages_stream(contact_id):
-    print(f"[Stream Debug] analyze-selected/stream called: contact_id={contact_id}")
-    data = request.get_json()
-    print(f"[Stream Debug] Request data: {data}")
+    if streams.draining:
+        return jsonify({'error': '服务正在重启，请稍后重试'}), 503, {'Retry-After': '10'}
+    data = request.get_json() or {}
+    Contact.query.get_or_404(contact_id)
     
-    def generate(data):
-        print(f"[Stream Debug] generate() started")
-        with app.app_context():
-            contact = Contact.query.get_or_404(contact_id)
-            
-            selected_ids = data.get('message_ids', [])
-            if not selected_ids:
-                yield json.dumps({'type': 'error', 'message': '请选择要分析的聊天记录'})
-                return
-            
-            chat_logs = ChatLog.query.filter(
-                ChatLog.contact_id == contact_id,
-                ChatLog.id.in_(selected_ids)
-            ).order_by(ChatLog.chat_date).all()
-            
-            if not chat_logs:
-                yield json.dumps({'type': 'error', 'message': '没有找到选中的聊天记录'})
-                return
-            
-            chat_content = '\n'.join([
-                f"[{log.chat_date}]【我】{log.content}" if log.speaker == '我' else f"[{log.chat_date}]【对方】{log.content}"
-                for log in chat_logs
-            ])
-            
-            if len(chat_content) < 50:
-                yield json.dumps({'type': 'error', 'message': '聊天记录内容太少，无法进行有效分析'})
-                return
-            
-            api_key = data.get('api_key')
-            
-            result = None
-            accumulated_content = ""
-            for item in stream_ai_analysis(chat_content, api_key):
-                if 'error' in item:
-                    yield json.dumps({'type': 'error', 'message': item['error']})
-                    return
-                elif item.get('type') == 'content_update':
-                    accumulated_content += item.get('content', '')
-                    content_length = len(accumulated_content)
-                    yield json.dumps({
-                        'type': 'content_update',
-                        'content_length': content_length,
-                        'total_tokens': item.get('total_tokens', 0),
-                        'completion_tokens': item.get('completion_tokens', 0)
-                    }) + '\n'
-                elif item.get('type') == 'token_update':
-                    yield json.dumps({
-                        'type': 'token_update',
-                        'total_tokens': item.get('total_tokens', 0),
-                        'completion_tokens': item.get('completion_tokens', 0)
-                    }) + '\n'
-                elif 'result' in item or 'raw_response' in item:
-                    result = item
-            
-            if result is None:
-                yield json.dumps({'type': 'error', 'message': '未能获取分析结果'})
-                return
-            
-            if 'result' in result:
-                parsed_result = result['result']
-            else:
-                parsed_result = parse_ai_response(result)
-            
-            existing_analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
-            
-            if existing_analysis:
-                existing_analysis.core_traits = json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False)
-                existing_analysis.behavior_preferences = json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False)
-                existing_analysis.social_interaction = json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False)
-                existing_analysis.cognitive_thinking = json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False)
-                existing_analysis.summary = parsed_result.get('summary', '')
-                existing_analysis.interests = json.dumps(parsed_result.get('interests', []), ensure_ascii=False)
-                existing_analysis.dos_and_donts = json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False)
-                existing_analysis.topic_suggestions = json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False)
-                existing_analysis.gift_suggestions = json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False)
-                existing_analysis.raw_response = json.dumps(result, ensure_ascii=False)
-                existing_analysis.updated_at = datetime.utcnow()
-                analysis = existing_analysis
-            else:
-                analysis = AnalysisResult(
-                    contact_id=contact_id,
-                    core_traits=json.dumps(parsed_result.get('core_traits', {}), ensure_ascii=False),
-                    behavior_preferences=json.dumps(parsed_result.get('behavior_preferences', {}), ensure_ascii=False),
-                    social_interaction= json.dumps(parsed_result.get('social_interaction', {}), ensure_ascii=False),
-                    cognitive_thinking=json.dumps(parsed_result.get('cognitive_thinking', {}), ensure_ascii=False),
-                    summary=parsed_result.get('summary', ''),
-                    interests=json.dumps(parsed_result.get('interests', []), ensure_ascii=False),
-                    dos_and_donts=json.dumps(parsed_result.get('dos_and_donts', {}), ensure_ascii=False),
-                    topic_suggestions=json.dumps(parsed_result.get('topic_suggestions', []), ensure_ascii=False),
-                    gift_suggestions=json.dumps(parsed_result.get('gift_suggestions', []), ensure_ascii=False),
-                    raw_response=json.dumps(result, ensure_ascii=False)
-                )
-                db.session.add(analysis)
-            
-            contact.updated_at = datetime.utcnow()
-            db.session.commit()
-            
-            yield json.dumps({
-                'type': 'complete',
-                'analysis': analysis.to_dict(),
-                'message_count': len(chat_logs),
-                'total_tokens': result.get('total_tokens', 0),
-                'completion_tokens': result.get('completion_tokens', 0)
-            }) + '\n'
-            print(f"[Stream Debug] Sent complete event with tokens: total={result.get('total_tokens', 0)}, completion={result.get('completion_tokens', 0)}")
-    
-    return Response(generate(data), mimetype='text/event-stream')
-
-@app.route('/export/<int:contact_id>')
+    selected_ids = data.get('message_ids', [])
+    if not selected_ids:
+        return jsonify({'error': '请选择要分析的聊天记录'}), 400
+    
+    chat_logs = load_chat_logs(contact_id, ids=selected_ids)
+    
+    if not chat_logs:
+        return jsonify({'error': '没有找到选中的聊天记录'}), 400
+    
+    if len(build_transcript(chat_logs)) < 50:
+        return jsonify({'error': '聊天记录内容太少，无法进行有效分析'}), 400
+    
+    return start_analysis_stream(contact_id, 'selected', chat_logs, data.get('api_key'))
+
+@bp.route('/api/analysis-jobs/<job_id>/stream', methods=['GET'])
+def resume_analysis_stream(job_id):
+    """断线重连：从 Last-Event-ID（请求头或 last_event_id 参数）之后的事件继续输出"""
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        ANALYSIS_RESUMES.inc(outcome='expired')
+        return jsonify({'error': '分析任务不存在或已过期'}), 404
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or '0'
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else 0
+    ANALYSIS_RESUMES.inc(outcome='resumed')
+    log_event('analysis_job.resume', job=job.id, contact_id=job.contact_id, last_event_id=last_event_id,
+              latest=job.last_id, done=job.done)
+    return analysis_stream_response(job, last_event_id)
+
+@bp.route('/export/<int:contact_id>')
 def export_page(contact_id):
     contact = Contact.query.get_or_404(contact_id)
     return render_template('export.html', contact=contact)
 
-@app.route('/api/contacts/<int:contact_id>/export/chat-logs')
+@bp.route('/api/contacts/<int:contact_id>/export/chat-logs')
+@read_only
 def export_chat_logs(contact_id):
     contact = Contact.query.get_or_404(contact_id)
     
@@ -611,27 +702,25 @@ def export_chat_logs(contact_id):
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    query = ChatLog.query.filter_by(contact_id=contact_id)
-    
+    start = end = None
     if start_date:
         try:
             start = datetime.strptime(start_date, '%Y-%m-%d').date()
-            query = query.filter(ChatLog.chat_date >= start)
         except ValueError:
             pass
     
     if end_date:
         try:
             end = datetime.strptime(end_date, '%Y-%m-%d').date()
-            query = query.filter(ChatLog.chat_date <= end)
         except ValueError:
             pass
     
-    chat_logs = query.order_by(ChatLog.chat_date).all()
+    chat_logs = load_chat_logs(contact_id, start=start, end=end)
     
     if not chat_logs:
         return jsonify({'error': '没有聊天记录可导出'}), 400
     
+    started = time.perf_counter()
     if len(formats) > 1 or 'csv' in formats:
         if 'csv' in formats and 'xlsx' in formats:
             filepath, filename = export_chat_logs_to_multiple_formats(chat_logs, contact.name, formats, include_analysis)
@@ -645,6 +734,7 @@ def export_chat_logs(contact_id):
     else:
         filepath, filename = export_chat_logs_to_excel(chat_logs, contact.name, include_analysis)
         mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    record_export('chat_logs', formats, started, filepath)
     
     return send_file(
         filepath,
@@ -653,7 +743,8 @@ def export_chat_logs(contact_id):
         mimetype=mimetype
     )
 
-@app.route('/api/contacts/<int:contact_id>/export/analysis')
+@bp.route('/api/contacts/<int:contact_id>/export/analysis')
+@read_only
 def export_analysis(contact_id):
     contact = Contact.query.get_or_404(contact_id)
     analysis = AnalysisResult.query.filter_by(contact_id=contact_id).first()
@@ -666,6 +757,7 @@ def export_analysis(contact_id):
     include_interests = request.args.get('include_interests', 'true').lower() == 'true'
     include_guide = request.args.get('include_guide', 'true').lower() == 'true'
     
+    started = time.perf_counter()
     if len(formats) > 1:
         filepath, filename = export_analysis_to_multiple_formats(
             analysis, contact.name, formats,
@@ -688,6 +780,7 @@ def export_analysis(contact_id):
             include_guide=include_guide
         )
         mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    record_export('analysis', formats, started, filepath)
     
     return send_file(
         filepath,
@@ -696,6 +789,30 @@ def export_analysis(contact_id):
         mimetype=mimetype
     )
 
+@bp.route('/metrics')
+def metrics():
+    return Response(collect_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+@bp.route('/api/ai/backends')
+def ai_backends():
+    """各模型服务的请求数、失败数、首 token 延迟和熔断状态"""
+    return jsonify({'routing': current_app.config['AI_ROUTING'], 'backends': backend_stats()})
+
+@bp.route('/api/usage')
+@read_only
+def ai_usage():
+    """大模型用量：按天、按联系人汇总，以及今天的配额使用情况；带 contact_id 时只统计该联系人并附最近的调用"""
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    contact_id = request.args.get('contact_id', type=int)
+    result = {'daily': daily_usage(days, contact_id), 'quota': quota_status(contact_id)}
+    if contact_id is None:
+        result['contacts'] = contact_usage(days)
+    else:
+        recent = UsageRecord.query.filter_by(contact_id=contact_id).order_by(UsageRecord.id.desc()).limit(20).all()
+        result['recent'] = [record.to_dict() for record in recent]
+    return jsonify(result)
+
 if __name__ == '__main__':
     os.makedirs('exports', exist_ok=True)
+    app = create_app()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,41 @@
+import argparse
+
+from flask import Flask
+from config import get_config
+from database.archive import archive_chat_logs, archive_summary, available_codecs
+from database.engine import configure_engine
+from database.models import db
+from database.shards import init_chat_log_shards
+
+app = Flask(__name__)
+app.config.from_object(get_config())
+db.init_app(app)
+configure_engine(app)
+init_chat_log_shards(app)
+
+
+def run_archive(days, codec, retrain):
+    """把旧聊天记录压缩归档，可定期（如每月）重复执行"""
+    with app.app_context():
+        db.create_all()
+        print(f"📦 归档早于 {days} 天的聊天记录（可用压缩: {', '.join(available_codecs())}）")
+        report = archive_chat_logs(days, codec=codec, retrain=retrain)
+        print(f"✅ 截止 {report['cutoff']}，{report['codec']} 压缩，"
+              f"归档 {report['contacts']} 个联系人的 {report['messages']} 条消息")
+
+        summary = archive_summary()
+        if summary['blocks']:
+            ratio = summary['raw_bytes'] / summary['compressed_bytes'] if summary['compressed_bytes'] else 0
+            print(f"  归档总计: {summary['blocks']} 个块，{summary['messages']} 条消息，"
+                  f"{summary['raw_bytes'] / 1024 / 1024:.1f} MB → {summary['compressed_bytes'] / 1024 / 1024:.1f} MB"
+                  f"（压缩比 {ratio:.1f}x）")
+        print("ℹ️ SQLite 删除的空间需要执行 VACUUM 才会归还给文件系统")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='聊天记录压缩归档')
+    parser.add_argument('--days', type=int, default=app.config['ARCHIVE_AFTER_DAYS'], help='归档早于该天数的消息')
+    parser.add_argument('--codec', choices=['zstd', 'zlib'], default=app.config['ARCHIVE_CODEC'])
+    parser.add_argument('--retrain', action='store_true', help='重新训练压缩字典（只影响之后写入的归档块）')
+    args = parser.parse_args()
+    run_archive(args.days, args.codec, args.retrain)
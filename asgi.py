@@ -0,0 +1,52 @@
+"""
+ASGI 入口，供 uvicorn 或 gunicorn 的 UvicornWorker 使用
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    WEB_WORKER_MODEL=uvicorn gunicorn -c gunicorn.conf.py
+
+Flask 应用本身仍是同步的：事件循环负责维持大量空闲的长连接（如等待上游的分析流），
+视图函数在 WEB_THREADS 个线程里执行。优先使用 a2wsgi，未安装时退回 uvicorn 自带的 WSGIMiddleware。
+"""
+import asyncio
+import logging
+import os
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from uvicorn.middleware.wsgi import WSGIMiddleware
+
+from utils.lifecycle import streams
+from wsgi import app as flask_app
+
+logger = logging.getLogger(__name__)
+
+
+class LifespanApp:
+    """处理 ASGI lifespan：关闭时先拒绝新的分析流，再等待进行中的分析流结束"""
+
+    def __init__(self, app, drain_timeout):
+        self.app = app
+        self.drain_timeout = drain_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            await self.app(scope, receive, send)
+            return
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                streams.begin_drain()
+                remaining = await asyncio.to_thread(streams.wait_idle, self.drain_timeout)
+                if remaining:
+                    logger.warning('退出时仍有 %d 个分析流未结束', remaining)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = LifespanApp(
+    WSGIMiddleware(flask_app, workers=int(os.environ.get('WEB_THREADS', 8))),
+    drain_timeout=float(os.environ.get('WEB_GRACEFUL_TIMEOUT', 200))
+)
@@ -0,0 +1,164 @@
+"""
+分析流负载测试
+启动本地火山方舟替身（utils/mock_ark.py）和应用服务，以固定并发持续请求 /api/contacts/<id>/analyze/stream，
+测量端到端吞吐（每秒完成的分析数、每秒输出 token 数）、首字节 / 首个内容事件 / 完成的延迟分布，
+以及各类结果的数量：完成、上游限流、上游错误、连接失败等。上游的延迟、输出速度和故障率用与 mock_ark 相同的参数调整。
+同一联系人同时进行的分析会合并为一次模型调用（utils/jobs.py），实际的上游调用数见输出最后一行。
+
+用法:
+    python benchmarks/bench_analysis_stream.py --concurrency 16 --seconds 30 --latency 0.8 --tokens-per-second 40
+    python benchmarks/bench_analysis_stream.py --model gthread --workers 2 --rate-limit-rate 0.1 --max-concurrency 8
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_workers import CONTACTS, free_port, percentile, prepare, start_server
+from utils.mock_ark import add_arguments, options_from_args, start_mock_ark
+from utils.sse import SSEDecoder
+
+
+def classify(status, events):
+    """按最后一个事件判断结果；上游的 HTTP 状态码会出现在错误消息里"""
+    if status != 200:
+        return f'http_{status}'
+    last = events[-1] if events else None
+    if last is None or last.event not in ('complete', 'error'):
+        return 'truncated'
+    if last.event == 'complete':
+        return 'complete'
+    message = last.json().get('message', '')
+    if '429' in message:
+        return 'upstream_429'
+    if ': 5' in message:
+        return 'upstream_5xx'
+    return 'error'
+
+
+def analyze_once(conn, contact_id):
+    started = time.perf_counter()
+    conn.request('POST', f'/api/contacts/{contact_id}/analyze/stream', body='{}',
+                 headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    first_byte = first_content = None
+    decoder = SSEDecoder()
+    events = []
+    while True:
+        chunk = response.read1(65536)
+        if not chunk:
+            break
+        now = time.perf_counter()
+        if first_byte is None:
+            first_byte = now - started
+        for event in decoder.feed(chunk):
+            if first_content is None and event.event == 'content_update':
+                first_content = now - started
+            events.append(event)
+    total = time.perf_counter() - started
+    outcome = classify(response.status, events)
+    completion_tokens = events[-1].json().get('completion_tokens', 0) if outcome == 'complete' else 0
+    return {'outcome': outcome, 'total': total, 'first_byte': first_byte,
+            'first_content': first_content, 'completion_tokens': completion_tokens}
+
+
+def client_loop(port, deadline, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    while time.time() < deadline:
+        try:
+            results.append(analyze_once(conn, random.randint(1, CONTACTS)))
+        except (OSError, http.client.HTTPException):
+            results.append({'outcome': 'connection_error', 'total': None, 'first_byte': None,
+                            'first_content': None, 'completion_tokens': 0})
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    conn.close()
+
+
+def summarize(results, seconds):
+    def ms(values, pct):
+        values = [v for v in values if v is not None]
+        return percentile(values, pct) * 1000 if values else float('nan')
+
+    completed = [r for r in results if r['outcome'] == 'complete']
+    outcomes = {}
+    for r in results:
+        outcomes[r['outcome']] = outcomes.get(r['outcome'], 0) + 1
+    return {
+        'requests': len(results),
+        'completed': len(completed),
+        'analyses_per_second': round(len(completed) / seconds, 2),
+        'tokens_per_second': round(sum(r['completion_tokens'] for r in completed) / seconds, 1),
+        'latency_ms': {key: {f'p{p}': round(ms([r[key] for r in completed], p), 1) for p in (50, 95, 99)}
+                       for key in ('first_byte', 'first_content', 'total')},
+        'outcomes': outcomes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分析流负载测试')
+    parser.add_argument('--model', default='dev', help='dev 或 gunicorn worker 模型（sync、gthread、gevent、uvicorn）')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=32, help='gthread / uvicorn 每个 worker 的线程数')
+    parser.add_argument('--no-preload', action='store_true')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    mock = start_mock_ark(**options_from_args(args))
+    with tempfile.TemporaryDirectory() as workdir:
+        env = prepare(workdir, mock.url)
+        port = free_port()
+        proc = start_server(args.model, port, env, args)
+        try:
+            results = []
+            deadline = time.time() + args.seconds
+            started = time.perf_counter()
+            threads = [threading.Thread(target=client_loop, args=(port, deadline, results))
+                       for _ in range(args.concurrency)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    summary = summarize(results, elapsed)
+    summary['upstream'] = mock.stats.snapshot()
+    summary['options'] = dict(options_from_args(args), model=args.model, concurrency=args.concurrency,
+                              seconds=args.seconds)
+    mock.shutdown()
+
+    print(f"并发 {args.concurrency}，{elapsed:.1f}s 内完成 {summary['completed']}/{summary['requests']} 次分析："
+          f"{summary['analyses_per_second']} 次/秒，输出 {summary['tokens_per_second']} token/秒")
+    print(f"{'延迟':<14}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for key, label in (('first_byte', '首字节'), ('first_content', '首个内容'), ('total', '完成')):
+        row = summary['latency_ms'][key]
+        print(f"{label:<14}{row['p50']:>8.0f}ms{row['p95']:>8.0f}ms{row['p99']:>8.0f}ms")
+    print('结果: ' + '，'.join(f'{name} {count}' for name, count in sorted(summary['outcomes'].items())))
+    upstream = summary['upstream']
+    print(f"上游: 并发峰值 {upstream['peak_in_flight']}，" + '，'.join(
+        f'{name} {count}' for name, count in sorted(upstream['outcomes'].items())))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
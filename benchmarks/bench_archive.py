@@ -0,0 +1,159 @@
+"""
+聊天记录压缩归档基准测试
+生成跨度三年的合成消息，比较不同压缩方式/字典的压缩率，以及归档前后的数据库大小和读取延迟
+
+用法: python benchmarks/bench_archive.py --messages 500000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database.archive import (
+    available_codecs, archive_chat_logs, archive_summary, compress, load_chat_logs,
+    serialize_rows, train_dictionary, encode_row
+)
+from database.models import db, ChatLog
+from database.search import ensure_chat_log_fts
+
+PHRASES = [
+    '今天', '周末', '电影', '火锅', '加班', '项目', '旅行', '考试', '猫咪', '咖啡',
+    '跑步', '读书', '音乐会', '生日', '礼物', '面试', '工作', '压力', '搬家', '天气',
+    '哈哈哈', '好的', '嗯嗯', '晚安', '早上好', '在吗', '收到', '[表情]', '[图片]', '？',
+    '一起', '有空', '怎么样', '真的', '好啊', '不错', '最近', '明天', '晚上', '吃饭了吗'
+]
+SHORT_REPLIES = ['好的', '哈哈哈', '嗯嗯', '[表情]', '晚安', '收到', 'ok', '行', '可以啊']
+
+
+def random_message(rng):
+    if rng.random() < 0.3:
+        return rng.choice(SHORT_REPLIES)
+    return ''.join(rng.choice(PHRASES) for _ in range(rng.randint(2, 10)))
+
+
+def populate(db_path, contacts, messages, batch_size=50000):
+    rng = random.Random(42)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.executemany(
+        'INSERT INTO contact (id, name, avatar, notes, tags) VALUES (?, ?, ?, ?, ?)',
+        [(i, f'联系人{i}', '', '', '') for i in range(1, contacts + 1)]
+    )
+    start_date = date.today() - timedelta(days=3 * 365)
+    inserted = 0
+    while inserted < messages:
+        n = min(batch_size, messages - inserted)
+        rows = []
+        for _ in range(n):
+            chat_date = start_date + timedelta(days=rng.randint(0, 3 * 365))
+            rows.append((rng.randint(1, contacts), rng.choice(['我', '对方']), random_message(rng),
+                         chat_date.isoformat(), f'{chat_date.isoformat()} 12:00:00.000000'))
+        conn.executemany(
+            'INSERT INTO chat_log (contact_id, speaker, content, chat_date, created_at) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        conn.commit()
+        inserted += n
+        print(f'  已写入 {inserted}/{messages} 条', end='\r')
+    conn.close()
+    print()
+
+
+def vacuum_size(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.execute('VACUUM')
+    conn.close()
+    return os.path.getsize(db_path)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def time_reads(contact_ids, repeat):
+    timings = []
+    for _ in range(repeat):
+        for contact_id in contact_ids:
+            started = time.perf_counter()
+            load_chat_logs(contact_id)
+            timings.append((time.perf_counter() - started) * 1000)
+            db.session.remove()
+    return percentile(timings, 50), percentile(timings, 95)
+
+
+def compare_codecs(sample_contacts, cutoff):
+    """对部分联系人的按月块分别用各种压缩方式压缩，只统计大小不写库"""
+    blocks = []
+    samples = []
+    for contact_id in sample_contacts:
+        by_month = {}
+        for log in ChatLog.query.filter(ChatLog.contact_id == contact_id, ChatLog.chat_date < cutoff):
+            by_month.setdefault(log.chat_date.strftime('%Y-%m'), []).append(encode_row(log))
+            samples.append(log.content)
+        blocks.extend(serialize_rows(rows) for rows in by_month.values())
+    raw = sum(len(block) for block in blocks)
+    print(f"\n{'压缩方式':<16}{'压缩后':>12}{'压缩比':>8}{'平均块':>10}")
+    print(f"{'原始 JSON':<16}{raw / 1024:>10.0f}KB{1:>7.1f}x{raw / len(blocks):>9.0f}B")
+    for codec in available_codecs():
+        for use_dictionary in (False, True):
+            dictionary = train_dictionary(codec, samples) if use_dictionary else None
+            size = sum(len(compress(codec, block, dictionary)) for block in blocks)
+            label = f"{codec}{' + 字典' if use_dictionary else ''}"
+            print(f"{label:<16}{size / 1024:>10.0f}KB{raw / size:>7.1f}x{size / len(blocks):>9.0f}B")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录压缩归档基准测试')
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--contacts', type=int, default=500)
+    parser.add_argument('--days', type=int, default=90, help='归档早于该天数的消息')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--db', help='数据库文件路径，默认使用临时文件')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_archive.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        ensure_chat_log_fts()
+
+    print(f'数据库: {db_path}')
+    populate(db_path, args.contacts, args.messages)
+    before = vacuum_size(db_path)
+
+    rng = random.Random(7)
+    read_contacts = rng.sample(range(1, args.contacts + 1), min(50, args.contacts))
+    with app.app_context():
+        from database.archive import archive_cutoff
+        compare_codecs(read_contacts[:20], archive_cutoff(args.days))
+
+        read_before = time_reads(read_contacts, args.repeat)
+        started = time.perf_counter()
+        report = archive_chat_logs(args.days, log=lambda message: None)
+        elapsed = time.perf_counter() - started
+        summary = archive_summary()
+        db.session.remove()
+        read_after = time_reads(read_contacts, args.repeat)
+
+    after = vacuum_size(db_path)
+    print(f"\n归档 {report['messages']} 条消息（{report['codec']}，{summary['blocks']} 个块）耗时 {elapsed:.1f}s")
+    print(f"数据库大小: {before / 1024 / 1024:.1f} MB → {after / 1024 / 1024:.1f} MB（VACUUM 后）")
+    print(f"单个联系人全部记录读取 p50/p95: 归档前 {read_before[0]:.1f}/{read_before[1]:.1f}ms，"
+          f"归档后 {read_after[0]:.1f}/{read_after[1]:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+画像倒排索引基准测试
+生成大量联系人的画像索引词，测量分面筛选与计数查询的延迟
+
+用法: python benchmarks/bench_profile_index.py --contacts 100000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database.models import db
+from database.profile_index import find_contacts, facet_counts
+
+INTERESTS = ['电影', '美食', '篮球', '旅行', '音乐', '读书', '摄影', '健身', '游戏', '烘焙',
+             '徒步', '滑雪', '编程', '绘画', '猫', '咖啡', '露营', '动漫', '话剧', '钓鱼']
+TOPICS = ['工作', '电影', '家庭', '旅行计划', '美食探店', '考研', '投资', '健康', '宠物', '科技']
+GIFTS = ['书籍', '电影票', '咖啡豆', '运动装备', '香薰', '耳机', '手写明信片', '绿植']
+TAGS = ['朋友', '同事', '家人', '大学同学', '高中同学', '健身', '客户', '邻居']
+
+
+def populate(db_path, contacts):
+    rng = random.Random(7)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.executemany(
+        'INSERT INTO contact (id, name, avatar, notes, tags, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+        [(i, f'联系人{i}', '', '', '', '2026-01-01 00:00:00') for i in range(1, contacts + 1)]
+    )
+    rows = []
+    for contact_id in range(1, contacts + 1):
+        for field, vocab, k in [('interest', INTERESTS, 5), ('topic', TOPICS, 3),
+                                ('gift', GIFTS, 2), ('tag', TAGS, 2)]:
+            for term in rng.sample(vocab, k):
+                rows.append((contact_id, field, term))
+    conn.executemany('INSERT INTO profile_term (contact_id, field, term) VALUES (?, ?, ?)', rows)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+    return len(rows)
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95) - 1 if len(timings) > 1 else 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='画像倒排索引基准测试')
+    parser.add_argument('--contacts', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench_profile_index.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+    started = time.perf_counter()
+    rows = populate(db_path, args.contacts)
+    print(f'{args.contacts} 个联系人，{rows} 条索引词，写入耗时 {time.perf_counter() - started:.1f}s\n')
+
+    cases = [
+        ('兴趣=电影', lambda: find_contacts([('interest', '电影')], limit=50)),
+        ('兴趣=电影 且 标签=朋友', lambda: find_contacts([('interest', '电影'), ('tag', '朋友')], limit=50)),
+        ('兴趣=电影 且 话题=考研 且 礼物=耳机',
+         lambda: find_contacts([('interest', '电影'), ('topic', '考研'), ('gift', '耳机')], limit=50)),
+        ('兴趣分面计数', lambda: facet_counts('interest', limit=20)),
+        ('前缀补全 兴趣=电', lambda: facet_counts('interest', prefix='电', limit=10)),
+        ('话题分面（限定 兴趣=电影）', lambda: facet_counts('topic', [('interest', '电影')], limit=20)),
+    ]
+    with app.app_context():
+        for name, fn in cases:
+            p50, p95 = timed(fn, args.repeat)
+            print(f'{name:<28} p50 {p50:7.1f}ms  p95 {p95:7.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
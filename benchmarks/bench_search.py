@@ -0,0 +1,121 @@
+"""
+聊天记录全文检索基准测试
+生成百万级合成消息，比较 FTS5 trigram 索引与 LIKE 全表扫描的查询延迟
+
+用法: python benchmarks/bench_search.py --messages 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database.models import db
+from database.search import FTS_DDL, search_chat_logs
+
+WORDS = [
+    '今天', '周末', '电影', '火锅', '加班', '项目', '旅行', '考试', '猫咪', '咖啡',
+    '跑步', '读书', '音乐会', '生日', '礼物', '面试', '工作', '压力', '搬家', '天气',
+    '吃饭', '睡觉', '游戏', '篮球', '健身', '朋友', '家人', '假期', '机票', '酒店',
+    '一起', '有空', '怎么样', '哈哈', '真的', '好啊', '不错', '最近', '明天', '晚上'
+]
+# 包含高频词、组合词以及不存在的词（后者迫使 LIKE 扫描整表）
+QUERIES = ['电影', '音乐会', '面试 压力', '周末一起', '机票酒店咖啡', '量子力学']
+
+
+def random_sentence(rng):
+    return ''.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+def populate(db_path, contacts, messages, batch_size=50000):
+    rng = random.Random(42)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.executemany(
+        'INSERT INTO contact (id, name, avatar, notes, tags) VALUES (?, ?, ?, ?, ?)',
+        [(i, f'联系人{i}', '', '', '') for i in range(1, contacts + 1)]
+    )
+    start_date = date.today() - timedelta(days=3 * 365)
+    inserted = 0
+    started = time.perf_counter()
+    while inserted < messages:
+        n = min(batch_size, messages - inserted)
+        rows = [(
+            rng.randint(1, contacts),
+            rng.choice(['我', '对方']),
+            random_sentence(rng),
+            (start_date + timedelta(days=rng.randint(0, 3 * 365))).isoformat()
+        ) for _ in range(n)]
+        conn.executemany(
+            'INSERT INTO chat_log (contact_id, speaker, content, chat_date) VALUES (?, ?, ?, ?)',
+            rows
+        )
+        conn.commit()
+        inserted += n
+        print(f'  已写入 {inserted}/{messages} 条', end='\r')
+    elapsed = time.perf_counter() - started
+    conn.close()
+    print(f'\n写入 {messages} 条（含触发器维护索引）耗时 {elapsed:.1f}s，{messages / elapsed:.0f} 条/秒')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def time_query(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return percentile(timings, 50), percentile(timings, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录全文检索基准测试')
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--contacts', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--db', help='数据库文件路径，默认使用临时文件')
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'bench_search.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            for statement in FTS_DDL:
+                conn.exec_driver_sql(statement)
+
+    print(f'数据库: {db_path}')
+    populate(db_path, args.contacts, args.messages)
+    print(f'数据库大小: {os.path.getsize(db_path) / 1024 / 1024:.1f} MB\n')
+
+    print(f"{'查询':<12}{'FTS p50':>10}{'FTS p95':>10}{'LIKE p50':>10}{'LIKE p95':>10}")
+    with app.app_context():
+        raw = db.engine.raw_connection()
+        for query in QUERIES:
+            fts = time_query(lambda: search_chat_logs(query, limit=20), args.repeat)
+            like_sql = 'SELECT id FROM chat_log WHERE ' + ' AND '.join(
+                'content LIKE ?' for _ in query.split()
+            ) + ' ORDER BY id DESC LIMIT 21'
+            like_params = [f'%{term}%' for term in query.split()]
+            like = time_query(lambda: raw.cursor().execute(like_sql, like_params).fetchall(), args.repeat)
+            print(f'{query:<12}{fts[0]:>9.1f}ms{fts[1]:>8.1f}ms{like[0]:>9.1f}ms{like[1]:>8.1f}ms')
+        raw.close()
+
+
+if __name__ == '__main__':
+    main()
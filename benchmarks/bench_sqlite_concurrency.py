@@ -0,0 +1,138 @@
+"""
+SQLite 并发读写基准测试
+一个写线程持续执行大事务（模拟批量导入/分析结果提交），多个读线程同时执行联系人列表类查询，
+对比不同配置档下读请求的延迟与失败次数。
+
+用法: python benchmarks/bench_sqlite_concurrency.py --profiles legacy,production --seconds 10
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from config import config_by_name, engine_options
+from database.engine import apply_sqlite_pragmas
+from database.models import db
+
+READ_SQL = text(
+    "SELECT contact.id, contact.name, contact_stats.message_count "
+    "FROM contact LEFT JOIN contact_stats ON contact_stats.contact_id = contact.id "
+    "ORDER BY contact.updated_at DESC LIMIT 50"
+)
+COUNT_SQL = text("SELECT COUNT(*) FROM chat_log WHERE chat_date >= :since")
+
+
+def build_engine(profile, db_path):
+    uri = 'sqlite:///' + db_path
+    config = config_by_name[profile]
+    options = engine_options(uri, pool_size=16, max_overflow=16) if profile != 'legacy' else {}
+    engine = create_engine(uri, **options)
+    apply_sqlite_pragmas(engine, config.SQLITE_PRAGMAS)
+    return engine
+
+
+def prepare(engine, contacts):
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO contact (id, name, avatar, notes, tags, updated_at) VALUES (:id, :name, '', '', '', CURRENT_TIMESTAMP)"),
+            [{'id': i, 'name': f'联系人{i}'} for i in range(1, contacts + 1)]
+        )
+
+
+def writer(engine, stop, batch_rows, contacts, result):
+    rng = random.Random(1)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO chat_log (contact_id, speaker, content, chat_date, created_at) "
+                         "VALUES (:c, '对方', :content, DATE('now'), CURRENT_TIMESTAMP)"),
+                    [{'c': rng.randint(1, contacts), 'content': '批量导入的聊天内容' * 8} for _ in range(batch_rows)]
+                )
+                conn.execute(text("UPDATE contact SET updated_at = CURRENT_TIMESTAMP WHERE id = :id"),
+                             {'id': rng.randint(1, contacts)})
+            result['commits'] += 1
+            result['write_ms'].append((time.perf_counter() - started) * 1000)
+        except OperationalError:
+            result['errors'] += 1
+
+
+def reader(engine, stop, result):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(READ_SQL).fetchall()
+                conn.execute(COUNT_SQL, {'since': '2000-01-01'}).scalar()
+            result['latencies'].append((time.perf_counter() - started) * 1000)
+        except OperationalError:
+            result['errors'] += 1
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+
+def run_profile(profile, args):
+    db_path = os.path.join(tempfile.mkdtemp(), f'bench_{profile}.db')
+    engine = build_engine(profile, db_path)
+    prepare(engine, args.contacts)
+
+    stop = threading.Event()
+    write_result = {'commits': 0, 'errors': 0, 'write_ms': []}
+    read_results = [{'latencies': [], 'errors': 0} for _ in range(args.readers)]
+    threads = [threading.Thread(target=writer, args=(engine, stop, args.batch_rows, args.contacts, write_result))]
+    threads += [threading.Thread(target=reader, args=(engine, stop, r)) for r in read_results]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    engine.dispose()
+
+    latencies = [v for r in read_results for v in r['latencies']]
+    return {
+        'profile': profile,
+        'reads': len(latencies),
+        'read_errors': sum(r['errors'] for r in read_results),
+        'read_p50': percentile(latencies, 50),
+        'read_p99': percentile(latencies, 99),
+        'read_max': max(latencies) if latencies else float('nan'),
+        'commits': write_result['commits'],
+        'write_errors': write_result['errors'],
+        'write_p50': percentile(write_result['write_ms'], 50)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 并发读写基准测试')
+    parser.add_argument('--profiles', default='legacy,development,production')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--contacts', type=int, default=2000)
+    parser.add_argument('--batch-rows', type=int, default=20000, help='每个写事务插入的行数')
+    args = parser.parse_args()
+
+    print(f"{'配置档':<12}{'读次数':>8}{'读失败':>8}{'读p50':>10}{'读p99':>10}{'读max':>10}{'写事务':>8}{'写失败':>8}{'写p50':>10}")
+    for profile in args.profiles.split(','):
+        r = run_profile(profile, args)
+        print(f"{r['profile']:<12}{r['reads']:>8}{r['read_errors']:>8}{r['read_p50']:>8.1f}ms{r['read_p99']:>8.1f}ms"
+              f"{r['read_max']:>8.1f}ms{r['commits']:>8}{r['write_errors']:>8}{r['write_p50']:>8.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+worker 冷启动基准测试
+每次在全新的子进程里依次计时：import app、create_app()、第一个请求，以及按需加载导出引擎（pandas）的代价，
+模拟 gunicorn 等进程管理器拉起一个新 worker 直到能响应请求所需的时间。
+另外用 python -X importtime 列出导入 app 时耗时最多的顶层模块。
+
+用法: python benchmarks/bench_startup.py --runs 10 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRIAL = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app as app_module
+t1 = time.perf_counter()
+app = app_module.create_app()
+t2 = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+t3 = time.perf_counter()
+heavy = {name: name in sys.modules for name in ('pandas', 'numpy')}
+from utils.exporter import _pandas
+_pandas()
+t4 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'create_app_ms': (t2 - t1) * 1000,
+    'first_request_ms': (t3 - t2) * 1000,
+    'status': response.status_code,
+    'export_engine_ms': (t4 - t3) * 1000,
+    'loaded': heavy,
+}))
+"""
+
+
+def child_env(workdir):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': ROOT,
+        'DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'startup.db'),
+        'EMBEDDING_DIR': os.path.join(workdir, 'embeddings'),
+        'CACHE_URL': 'memory://',
+    })
+    return env
+
+
+def run_trial(env, path):
+    out = subprocess.run([sys.executable, '-c', TRIAL, path], env=env, cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_profile(env, top):
+    """解析 -X importtime 的输出，返回累计耗时最多的顶层模块（不含 app 自身）"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], env=env, cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 子模块缩进更深；两个空格的缩进表示被 app 直接导入
+        if name.startswith('   ') and not name.startswith('    '):
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='worker 冷启动基准测试')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15, help='列出耗时最多的前 N 个导入')
+    parser.add_argument('--path', default='/api/contacts', help='第一个请求访问的路径')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = child_env(workdir)
+        # 建表由迁移命令负责，应用启动时不再 create_all
+        subprocess.run([sys.executable, 'migrate_fields.py'], env=env, cwd=ROOT,
+                       stdout=subprocess.DEVNULL, check=True)
+
+        trials = [run_trial(env, args.path) for _ in range(args.runs)]
+        print(f"{'阶段':<16}{'p50':>10}{'min':>10}{'max':>10}")
+        for key, label in (('import_ms', 'import app'), ('create_app_ms', 'create_app()'),
+                           ('first_request_ms', '第一个请求'), ('export_engine_ms', '导出引擎(按需)')):
+            values = [t[key] for t in trials]
+            print(f"{label:<16}{statistics.median(values):>8.1f}ms{min(values):>8.1f}ms{max(values):>8.1f}ms")
+        cold = [t['import_ms'] + t['create_app_ms'] + t['first_request_ms'] for t in trials]
+        print(f"\n冷启动到首个响应 p50: {statistics.median(cold):.1f}ms（状态码 {trials[0]['status']}）")
+        print(f"首个请求后已加载: {', '.join(k for k, v in trials[0]['loaded'].items() if v) or '无 pandas/numpy'}")
+
+        print("\n导入 app 时耗时最多的模块（累计）:")
+        for ms, name in import_profile(env, args.top):
+            print(f"  {ms:>8.1f}ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+"""
+关键路由基准测试
+用 synthetic.py 生成（或复用）指定规模的合成数据集，复制一份工作库后在进程内逐个请求关键路由：
+首页、联系人列表、聊天记录读取与写入、导出，以及接到本地火山方舟替身（utils/mock_ark.py）上的分析（普通与流式）。
+逐条聊天记录的路由分别在消息量处于中位数和最多的联系人上测量。
+
+每个路由记录 p50/p95/p99/最大延迟、每次请求的 SQL 语句数（中位数）以及一次请求期间的 Python 内存分配峰值
+（单独再请求一次并用 tracemalloc 统计，不影响延迟数据），另外记录整个进程的 RSS 峰值。
+结果连同提交号和数据集参数写成 JSON，用 --compare 与另一次的结果逐项对比。
+
+默认关闭响应缓存（memory://?maxsize=0），测量的是每次都实际计算的路径；--cache-url 可改为测缓存命中。
+
+用法:
+    python benchmarks/bench_suite.py --contacts 10000 --messages 10000000 --dataset /data/bench.db
+    python benchmarks/bench_suite.py --contacts 1000 --messages 200000 --compare benchmarks/results/base.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.mock_ark import start_mock_ark
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+NEW_LINES = 20
+
+
+def routes():
+    """(名称, 方法, 路径, 请求体, 是否针对单个联系人)；路径中的 {id} 替换为目标联系人"""
+    new_lines = {
+        'date': date.today().isoformat(),
+        'lines': [{'speaker': '我' if i % 2 else '对方', 'time': f'21:{i:02d}', 'content': f'基准测试写入的第 {i} 条消息'}
+                  for i in range(NEW_LINES)]
+    }
+    return [
+        ('home', 'GET', '/home', None, False),
+        ('contacts', 'GET', '/contacts', None, False),
+        ('api_contacts', 'GET', '/api/contacts', None, False),
+        ('chat_logs', 'GET', '/api/contacts/{id}/chat-logs', None, True),
+        ('timeline', 'GET', '/api/contacts/{id}/timeline', None, True),
+        ('add_chat_logs', 'POST', '/api/contacts/{id}/chat-logs', new_lines, True),
+        ('analyze', 'POST', '/api/contacts/{id}/analyze', {}, True),
+        ('analyze_stream', 'POST', '/api/contacts/{id}/analyze/stream', {}, True),
+        ('export_chat_logs_csv', 'GET', '/api/contacts/{id}/export/chat-logs?formats=csv', None, True),
+        ('export_chat_logs_xlsx', 'GET', '/api/contacts/{id}/export/chat-logs?formats=xlsx', None, True),
+        # 上面的分析路由保证了目标联系人有分析结果
+        ('export_analysis', 'GET', '/api/contacts/{id}/export/analysis?formats=json', None, True),
+    ]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def pick_targets(app):
+    """消息量处于中位数和最多的联系人"""
+    from database.models import ContactStats
+    with app.app_context():
+        rows = ContactStats.query.filter(ContactStats.message_count > 0).order_by(
+            ContactStats.message_count, ContactStats.contact_id).with_entities(
+            ContactStats.contact_id, ContactStats.message_count).all()
+    median, heavy = rows[len(rows) // 2], rows[-1]
+    return {'median': {'id': median[0], 'messages': median[1]}, 'heavy': {'id': heavy[0], 'messages': heavy[1]}}
+
+
+def send(client, method, path, body):
+    response = client.open(path, method=method, json=body)
+    # 流式响应要读完才算结束
+    data = response.get_data()
+    response.close()
+    return response.status_code, len(data)
+
+
+def run_route(client, counter, method, path, body, requests, max_seconds):
+    timings, queries, errors = [], [], 0
+    deadline = time.perf_counter() + max_seconds
+    send(client, method, path, body)  # 预热：首次导入、模板编译等
+    for index in range(requests):
+        counter.count = 0
+        started = time.perf_counter()
+        status, _ = send(client, method, path, body)
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+        errors += status >= 400
+        # 慢路由（大联系人的导出等）按时间截断，但至少保留 3 个样本
+        if index >= 2 and time.perf_counter() > deadline:
+            break
+
+    tracemalloc.start()
+    send(client, method, path, body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'max_ms': round(max(timings), 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'queries': int(statistics.median(queries)),
+        'peak_alloc_mb': round(peak / 1024 / 1024, 2),
+    }
+
+
+def max_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(usage / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\n对比 {baseline_path}（{baseline['meta'].get('commit')}）")
+    print(f"{'路由':<34}{'p50':>16}{'p95':>16}{'语句数':>10}{'内存峰值MB':>14}")
+    for name, current in results['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            print(f'{name:<34}  （基线中没有）')
+            continue
+
+        def delta(key):
+            before, after = previous[key], current[key]
+            change = (after - before) / before * 100 if before else 0.0
+            return f'{after:.1f} ({change:+.0f}%)'
+
+        queries = f"{current['queries']}" + (f" ({current['queries'] - previous['queries']:+d})"
+                                             if current['queries'] != previous['queries'] else '')
+        print(f"{name:<34}{delta('p50_ms'):>16}{delta('p95_ms'):>16}{queries:>10}{delta('peak_alloc_mb'):>14}")
+    if baseline['meta'].get('dataset') != results['meta'].get('dataset'):
+        print('注意：两次使用的数据集参数不同，结果不能直接比较')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='关键路由基准测试')
+    parser.add_argument('--contacts', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end-date', type=date.fromisoformat, help='数据集的最后一天，跨提交对比时应固定')
+    parser.add_argument('--dataset', help='数据集文件，默认放在临时目录；参数相同时复用')
+    parser.add_argument('--requests', type=int, default=30, help='每个路由的请求数')
+    parser.add_argument('--max-seconds', type=float, default=20, help='每个路由最多测量多少秒')
+    parser.add_argument('--model-latency', type=float, default=0.0, help='模拟模型在首 token 前等待的秒数')
+    parser.add_argument('--model-tokens-per-second', type=float, default=0.0, help='模拟模型的输出速度，0 表示不限速')
+    parser.add_argument('--cache-url', default='memory://?maxsize=0')
+    parser.add_argument('--routes', help='只测逗号分隔的这些路由')
+    parser.add_argument('--output', help='结果 JSON 路径，默认 benchmarks/results/<时间>-<提交>.json')
+    parser.add_argument('--compare', help='与之对比的结果 JSON')
+    args = parser.parse_args()
+
+    end_date = args.end_date or date.today()
+    dataset = args.dataset or os.path.join(tempfile.gettempdir(), 'mysoullinker-bench',
+                                           f'{args.contacts}-{args.messages}-{args.seed}.db')
+    # 写入类路由会修改数据库，每次都在副本上测量，保证多次运行面对相同的数据
+    workdir = tempfile.mkdtemp(prefix='bench-suite-')
+    work_db = os.path.join(workdir, 'bench.db')
+    stub = start_mock_ark(latency=args.model_latency, jitter=0, tokens_per_second=args.model_tokens_per_second)
+    # config.py 在首次导入时读取环境变量，必须在导入 synthetic / app 之前设置
+    os.environ.update({
+        'DATABASE_URI': 'sqlite:///' + work_db,
+        'EMBEDDING_DIR': os.path.join(workdir, 'embeddings'),
+        'CACHE_URL': args.cache_url,
+        'VOLCANO_ARK_ENDPOINT': stub.url,
+        'VOLCANO_ARK_API_KEY': 'bench',
+        'EVENT_LOG_SAMPLE_RATE': '0',
+        'SQL_PROFILER': '0',
+    })
+    from synthetic import ensure_dataset
+
+    print(f'数据集: {dataset}')
+    dataset_meta = ensure_dataset(dataset, args.contacts, args.messages, seed=args.seed, end_date=end_date)
+    source, target = sqlite3.connect(dataset), sqlite3.connect(work_db)
+    source.backup(target)
+    source.close()
+    target.close()
+    # 导出路由把文件写到当前目录的 exports/ 下、再按应用根目录读出，只能在仓库根目录运行；结束后删掉本次生成的文件
+    os.chdir(ROOT)
+    exports_dir = os.path.join(ROOT, 'exports')
+    existing_exports = set(os.listdir(exports_dir)) if os.path.isdir(exports_dir) else None
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from app import create_app
+    from utils.metrics import event_logger
+
+    app = create_app()
+    event_logger.disabled = True
+    counter = QueryCounter()
+    event.listen(Engine, 'before_cursor_execute', counter)
+    client = app.test_client()
+    targets = pick_targets(app)
+    selected = set(args.routes.split(',')) if args.routes else None
+
+    commit, dirty = git_revision()
+    results = {'meta': {
+        'commit': commit, 'dirty': dirty,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'dataset': {key: dataset_meta.get(key) for key in ('contacts', 'messages', 'seed', 'end_date')},
+        'targets': targets, 'cache_url': args.cache_url, 'model_latency': args.model_latency,
+        'model_tokens_per_second': args.model_tokens_per_second,
+    }, 'routes': {}}
+
+    print(f"中位数联系人 #{targets['median']['id']}（{targets['median']['messages']} 条），"
+          f"最多的联系人 #{targets['heavy']['id']}（{targets['heavy']['messages']} 条）\n")
+    print(f"{'路由':<34}{'p50':>9}{'p95':>9}{'p99':>9}{'语句数':>8}{'内存峰值':>10}{'错误':>6}")
+    try:
+        for name, method, path, body, per_contact in routes():
+            if selected and name not in selected:
+                continue
+            for label, target in (targets.items() if per_contact else [(None, None)]):
+                key = f'{name}[{label}]' if label else name
+                stats = run_route(client, counter, method, path.format(id=target['id']) if target else path,
+                                  body, args.requests, args.max_seconds)
+                results['routes'][key] = stats
+                print(f"{key:<34}{stats['p50_ms']:>7.1f}ms{stats['p95_ms']:>7.1f}ms{stats['p99_ms']:>7.1f}ms"
+                      f"{stats['queries']:>8}{stats['peak_alloc_mb']:>8.1f}MB{stats['errors']:>6}")
+    finally:
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+        if existing_exports is None:
+            shutil.rmtree(exports_dir, ignore_errors=True)
+        elif os.path.isdir(exports_dir):
+            for name in set(os.listdir(exports_dir)) - existing_exports:
+                os.remove(os.path.join(exports_dir, name))
+
+    results['meta']['max_rss_mb'] = max_rss_mb()
+    print(f"\n进程 RSS 峰值: {results['meta']['max_rss_mb']} MB")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{results['meta']['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'结果已写入 {output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
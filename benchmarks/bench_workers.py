@@ -0,0 +1,198 @@
+"""
+worker 模型负载测试
+分别用开发服务器（基线）和 gunicorn 的 sync / gthread / gevent / uvicorn worker 启动应用，以固定并发持续发送请求：
+大部分是联系人列表、资料页、时间线等读请求，少部分是分析流。分析流的上游是本地替身 utils/mock_ark.py，
+按 --upstream-delay 的间隔逐块返回，模拟等待大模型输出的长连接。未安装的 worker 模型会被跳过。
+内存一列是服务端进程树的 PSS 之和（仅 Linux），可用 --no-preload 对比预加载共享内存的效果。
+
+用法: python benchmarks/bench_workers.py --models dev,sync,gthread,gevent,uvicorn --concurrency 32 --seconds 20
+"""
+import argparse
+import http.client
+import importlib.util
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.mock_ark import SAMPLE_CONTENT, split_tokens, start_mock_ark
+
+# worker 模型 -> 需要安装的模块
+REQUIREMENTS = {
+    'dev': [],
+    'sync': ['gunicorn'],
+    'gthread': ['gunicorn'],
+    'gevent': ['gunicorn', 'gevent'],
+    'uvicorn': ['gunicorn', 'uvicorn'],
+}
+READ_PATHS = ['/api/contacts', '/contacts', '/profile/{id}', '/api/contacts/{id}/timeline', '/api/contacts/{id}/analysis']
+CONTACTS = 5
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare(workdir, upstream_url):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': ROOT,
+        'APP_CONFIG': 'production',
+        'DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'EMBEDDING_DIR': os.path.join(workdir, 'embeddings'),
+        'CACHE_URL': 'memory://',
+        'VOLCANO_ARK_ENDPOINT': upstream_url,
+        'VOLCANO_ARK_API_KEY': 'bench',
+    })
+    subprocess.run([sys.executable, 'seed_data.py'], env=env, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+    return env
+
+
+def start_server(model, port, env, args):
+    env = dict(env, WEB_BIND=f'127.0.0.1:{port}', WEB_WORKER_MODEL=model, WEB_WORKERS=str(args.workers),
+               WEB_THREADS=str(args.threads), WEB_PRELOAD='0' if args.no_preload else '1')
+    if model == 'dev':
+        command = [sys.executable, '-c',
+                   f"from wsgi import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '']
+    proc = subprocess.Popen(command, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/contacts')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f'{model} 服务 30 秒内未就绪')
+
+
+def tree_pss_mb(pid):
+    """进程及其子进程的 PSS 之和；共享页按进程数平摊，能反映预加载节省的内存"""
+    pids = [pid]
+    try:
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+        total = 0
+        for p in pids:
+            with open(f'/proc/{p}/smaps_rollup') as f:
+                for line in f:
+                    if line.startswith('Pss:'):
+                        total += int(line.split()[1])
+        return total / 1024
+    except OSError:
+        return float('nan')
+
+
+def client_loop(port, deadline, stream_ratio, results):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    while time.time() < deadline:
+        contact_id = random.randint(1, CONTACTS)
+        stream = random.random() < stream_ratio
+        start = time.perf_counter()
+        try:
+            if stream:
+                conn.request('POST', f'/api/contacts/{contact_id}/analyze/stream', body='{}',
+                             headers={'Content-Type': 'application/json'})
+            else:
+                conn.request('GET', random.choice(READ_PATHS).format(id=contact_id))
+            response = conn.getresponse()
+            body = response.read()
+            ok = response.status == 200 and (not stream or b'event: complete' in body)
+        except (OSError, http.client.HTTPException):
+            ok = False
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+        results.append(('stream' if stream else 'read', (time.perf_counter() - start) * 1000, ok))
+    conn.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_model(model, env, args):
+    port = free_port()
+    proc = start_server(model, port, env, args)
+    try:
+        results = []
+        deadline = time.time() + args.seconds
+        threads = [threading.Thread(target=client_loop, args=(port, deadline, args.stream_ratio, results))
+                   for _ in range(args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        memory = tree_pss_mb(proc.pid)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    reads = [ms for kind, ms, ok in results if kind == 'read' and ok]
+    streams = [ms for kind, ms, ok in results if kind == 'stream' and ok]
+    return {
+        'model': model,
+        'rps': len(reads) / args.seconds,
+        'read_p50': percentile(reads, 50),
+        'read_p99': percentile(reads, 99),
+        'streams': len(streams),
+        'stream_p50': percentile(streams, 50),
+        'errors': sum(1 for _, _, ok in results if not ok),
+        'memory': memory,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='worker 模型负载测试')
+    parser.add_argument('--models', default='dev,sync,gthread,gevent,uvicorn')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='gthread / uvicorn 每个 worker 的线程数')
+    parser.add_argument('--stream-ratio', type=float, default=0.1, help='分析流请求所占比例')
+    parser.add_argument('--upstream-chunks', type=int, default=20)
+    parser.add_argument('--upstream-delay', type=float, default=0.1, help='模拟上游每块输出的间隔（秒）')
+    parser.add_argument('--no-preload', action='store_true')
+    args = parser.parse_args()
+
+    chunk_tokens = -(-len(split_tokens(SAMPLE_CONTENT)) // args.upstream_chunks)
+    upstream = start_mock_ark(chunk_tokens=chunk_tokens, tokens_per_second=chunk_tokens / args.upstream_delay)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = prepare(workdir, upstream.url)
+        print(f"{'模型':<10}{'读RPS':>10}{'读p50':>10}{'读p99':>10}{'分析流':>8}{'流p50':>10}{'失败':>8}{'内存':>10}")
+        for model in args.models.split(','):
+            missing = [name for name in REQUIREMENTS[model] if importlib.util.find_spec(name) is None]
+            if missing:
+                print(f"{model:<10}跳过：未安装 {', '.join(missing)}")
+                continue
+            r = run_model(model, env, args)
+            print(f"{r['model']:<10}{r['rps']:>10.1f}{r['read_p50']:>8.1f}ms{r['read_p99']:>8.1f}ms{r['streams']:>8}"
+                  f"{r['stream_p50']:>8.0f}ms{r['errors']:>8}{r['memory']:>8.1f}MB")
+    upstream.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+重要性采样离线评估
+对消息最多的若干联系人（或 --contact 指定的联系人），分别用全部记录和按 --budget 采样后的记录（utils/sampling.py）生成画像，
+逐字段比较两份画像的相似度：列表字段用 Jaccard，文本字段用字符二元组的 Dice 系数。
+另外给出不调用模型也能计算的覆盖率指标，并与同样预算下按日期截断（只保留最近几天）的结果对照：
+    话题覆盖：全部消息聚成若干簇后，采样结果命中的簇所含消息占全部消息的比例；
+    词汇覆盖：全部记录中出现至少 VOCAB_MIN_COUNT 次的字符二元组，有多少出现在采样结果里；
+    时间覆盖：全部记录涉及的月份中，采样结果覆盖了多少；
+    "对方"消息占比。
+时间覆盖是通过条件：任一联系人的采样结果覆盖的月份比例低于 --min-months 时以状态码 1 退出，
+防止采样重新退化成只保留最近一段时间。
+
+默认接本地火山方舟替身（对任何输入都返回同一份画像，只用来走通流程，画像相似度恒为 1），
+用 --endpoint / --api-key 接真实服务时画像比较才有意义；全部记录往往超出模型的上下文长度，
+可用 --full-budget 把"全量"一侧限制为按日期截断的最大长度。--no-model 只计算覆盖率。
+
+用法:
+    python benchmarks/eval_sampling.py --dataset /tmp/eval.db --dataset-contacts 20 --dataset-messages 400000 --no-model
+    python benchmarks/eval_sampling.py --contact 12 --budget 30000 --full-budget 200000 --endpoint https://ark.cn-beijing.volces.com/api/v3 --api-key ...
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.mock_ark import start_mock_ark
+
+VOCAB_MIN_COUNT = 3
+# 采样结果至少要覆盖全部记录所涉及月份的这一比例
+MIN_MONTHS_COVERAGE = 0.9
+TOPIC_CLUSTERS = 32
+# 聚类时最多随机取这么多条消息训练簇中心
+TOPIC_SAMPLE_SIZE = 20000
+
+_DAY_HEADER = re.compile(r'^\[(\d{4}-\d{2}-\d{2})\]$', re.M)
+
+
+def bigrams(text):
+    text = ''.join(str(text).split())
+    return {text[i:i + 2] for i in range(len(text) - 1)} or ({text} if text else set())
+
+
+def text_similarity(a, b):
+    a, b = bigrams(a), bigrams(b)
+    if not a and not b:
+        return 1.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def flatten(profile, prefix=''):
+    """把画像展开成 {字段路径: 值}，值为字符串或字符串列表"""
+    fields = {}
+    for key, value in profile.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            fields.update(flatten(value, path))
+        elif isinstance(value, list):
+            fields[path] = [json.dumps(item, ensure_ascii=False) if isinstance(item, dict) else str(item)
+                            for item in value]
+        elif value not in (None, ''):
+            fields[path] = str(value)
+    return fields
+
+
+def profile_similarity(full, sampled):
+    """返回 (总体相似度, {字段: 相似度})；只在一侧出现的字段记 0"""
+    full, sampled = flatten(full), flatten(sampled)
+    scores = {}
+    for path in sorted(set(full) | set(sampled)):
+        a, b = full.get(path), sampled.get(path)
+        if a is None or b is None:
+            scores[path] = 0.0
+        elif isinstance(a, list) and isinstance(b, list):
+            a, b = set(a), set(b)
+            scores[path] = len(a & b) / len(a | b) if a | b else 1.0
+        else:
+            scores[path] = text_similarity(' '.join(a) if isinstance(a, list) else a,
+                                           ' '.join(b) if isinstance(b, list) else b)
+    overall = sum(scores.values()) / len(scores) if scores else 0.0
+    return overall, scores
+
+
+def to_profile(result):
+    from utils.ai import parse_ai_response
+    if 'error' in result:
+        return None
+    if 'raw_response' in result or 'result' in result:
+        return parse_ai_response(result)
+    return result
+
+
+def coverage(chat_logs, selections, seed):
+    """各种选取方式（{名称: 选中的消息}）对全部记录的话题、词汇、时间覆盖率"""
+    import numpy as np
+    from utils.embeddings import _kmeans, embed_batch
+    from utils.transcript import clean_content
+
+    contents = [clean_content(log.content) for log in chat_logs]
+    indexed = [(i, content) for i, content in enumerate(contents) if content]
+
+    rng = random.Random(seed)
+    train = rng.sample(indexed, min(TOPIC_SAMPLE_SIZE, len(indexed)))
+    k = min(TOPIC_CLUSTERS, len(train))
+    centroids = _kmeans(embed_batch([content for _, content in train]), k, seed=seed)
+    cluster_of = {}
+    for start in range(0, len(indexed), 5000):
+        batch = indexed[start:start + 5000]
+        clusters = np.argmax(embed_batch([content for _, content in batch]) @ centroids.T, axis=1)
+        for (i, _), cluster in zip(batch, clusters):
+            cluster_of[id(chat_logs[i])] = int(cluster)
+    sizes = Counter(cluster_of.values())
+
+    counts = Counter()
+    for _, content in indexed:
+        counts.update(bigrams(content))
+    vocab = {gram for gram, count in counts.items() if count >= VOCAB_MIN_COUNT}
+    months = {log.chat_date.strftime('%Y-%m') for log in chat_logs}
+
+    def other_share(logs):
+        return round(sum(1 for log in logs if log.speaker == '对方') / len(logs), 3) if logs else 0.0
+
+    result = {'other_share': other_share(chat_logs)}
+    for name, selected in selections.items():
+        hit = {cluster_of[id(log)] for log in selected if id(log) in cluster_of}
+        sampled_vocab = set()
+        for log in selected:
+            sampled_vocab |= bigrams(clean_content(log.content))
+        result[name] = {
+            'topic': round(sum(sizes[c] for c in hit) / max(1, sum(sizes.values())), 3),
+            'vocabulary': round(len(vocab & sampled_vocab) / max(1, len(vocab)), 3),
+            'months': round(len(months & {log.chat_date.strftime('%Y-%m') for log in selected}) / max(1, len(months)), 3),
+            'other_share': other_share(selected),
+        }
+    return result
+
+
+def evaluate(contact_id, budget, full_budget, use_model, seed):
+    from database.archive import load_chat_logs
+    from utils.ai import get_ai_analysis
+    from utils.sampling import build_analysis_transcript, sampling_budget, select_messages
+    from utils.transcript import compact_transcript
+
+    chat_logs = load_chat_logs(contact_id)
+    started = time.perf_counter()
+    sampled = build_analysis_transcript(chat_logs, budget, seed=seed)
+    sampling_seconds = time.perf_counter() - started
+    full = compact_transcript(chat_logs, full_budget)
+    row = {
+        'contact_id': contact_id, 'messages': len(chat_logs),
+        'full_tokens': full.stats.tokens, 'sampled_tokens': sampled.stats.tokens,
+        'sampled_messages': sampled.stats.sampled_messages, 'sampling_seconds': round(sampling_seconds, 2),
+    }
+    if not sampled.stats.sampled_messages:
+        row['note'] = '整理后未超出预算，没有采样'
+        return row
+    # 与 build_analysis_transcript 使用相同的预算和种子，选出的是同一批消息
+    selected = select_messages(chat_logs, sampling_budget(budget), seed)
+    truncated = compact_transcript(chat_logs, budget)
+    kept_days = set(_DAY_HEADER.findall(truncated.text))
+    recent = [log for log in chat_logs if log.chat_date.isoformat() in kept_days]
+    row['coverage'] = coverage(chat_logs, {'sampled': selected, 'recent': recent}, seed)
+    if use_model:
+        full_profile = to_profile(get_ai_analysis(full.text))
+        sampled_profile = to_profile(get_ai_analysis(sampled.text))
+        if full_profile is None or sampled_profile is None:
+            row['profile_error'] = '模型调用失败'
+        else:
+            overall, fields = profile_similarity(full_profile, sampled_profile)
+            row['profile_similarity'] = round(overall, 3)
+            row['field_similarity'] = {path: round(score, 3) for path, score in fields.items()}
+    return row
+
+
+def top_contacts(limit):
+    from database.models import ContactStats
+    rows = ContactStats.query.order_by(ContactStats.message_count.desc()).limit(limit).all()
+    return [row.contact_id for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重要性采样离线评估')
+    parser.add_argument('--contact', type=int, action='append', help='要评估的联系人，可重复；默认取消息最多的 --top 个')
+    parser.add_argument('--top', type=int, default=3)
+    parser.add_argument('--budget', type=int, default=20000, help='采样一侧的 token 预算')
+    parser.add_argument('--full-budget', type=int, help='全量一侧的 token 上限（按日期截断），默认不限制')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-model', action='store_true', help='只计算覆盖率，不调用模型')
+    parser.add_argument('--endpoint', help='兼容 OpenAI 接口的模型服务地址，默认使用本地替身')
+    parser.add_argument('--api-key')
+    parser.add_argument('--dataset', help='用 synthetic.py 生成（或复用）的合成数据集，默认使用配置中的数据库')
+    parser.add_argument('--dataset-contacts', type=int, default=20)
+    parser.add_argument('--dataset-messages', type=int, default=400000)
+    parser.add_argument('--output', help='把结果写入 JSON 文件')
+    parser.add_argument('--min-months', type=float, default=MIN_MONTHS_COVERAGE,
+                        help='采样结果的月份覆盖率下限，低于它时以状态码 1 退出')
+    args = parser.parse_args()
+
+    mock = None
+    # config.py 在首次导入时读取环境变量，必须在导入 synthetic / app 之前设置
+    if args.endpoint:
+        os.environ['VOLCANO_ARK_ENDPOINT'] = args.endpoint
+    elif not args.no_model:
+        mock = start_mock_ark(latency=0, jitter=0, tokens_per_second=0)
+        os.environ['VOLCANO_ARK_ENDPOINT'] = mock.url
+    if args.api_key or mock:
+        os.environ['VOLCANO_ARK_API_KEY'] = args.api_key or 'eval'
+    if args.dataset:
+        os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.abspath(args.dataset)
+        from synthetic import ensure_dataset
+        ensure_dataset(args.dataset, args.dataset_contacts, args.dataset_messages)
+    os.environ['EVENT_LOG_SAMPLE_RATE'] = '0'
+
+    from app import create_app
+    from utils.metrics import event_logger
+
+    app = create_app()
+    event_logger.disabled = True
+    rows = []
+    with app.app_context():
+        for contact_id in args.contact or top_contacts(args.top):
+            row = evaluate(contact_id, args.budget, args.full_budget, not args.no_model, args.seed)
+            rows.append(row)
+            line = (f"#{contact_id}: {row['messages']} 条，全量 {row['full_tokens']} token，"
+                    f"采样 {row['sampled_messages']} 条 / {row['sampled_tokens']} token（{row['sampling_seconds']}s）")
+            if 'coverage' in row:
+                cov = row['coverage']
+                for name, label in (('sampled', '采样'), ('recent', '按日期截断')):
+                    line += (f"\n    {label}：话题覆盖 {cov[name]['topic']:.0%}，词汇 {cov[name]['vocabulary']:.0%}，"
+                             f"月份 {cov[name]['months']:.0%}，对方占比 {cov[name]['other_share']:.0%}"
+                             f"（全部 {cov['other_share']:.0%}）")
+            if 'profile_similarity' in row:
+                line += f"；画像相似度 {row['profile_similarity']:.2f}"
+            print(line + (f"；{row.get('note') or row.get('profile_error')}" if 'note' in row or 'profile_error' in row else ''))
+
+    scored = [row['profile_similarity'] for row in rows if 'profile_similarity' in row]
+    if scored:
+        print(f'平均画像相似度 {sum(scored) / len(scored):.3f}（{len(scored)} 个联系人）')
+    if mock:
+        mock.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'options': vars(args), 'contacts': rows}, f, ensure_ascii=False, indent=2)
+
+    failed = [row['contact_id'] for row in rows
+              if 'coverage' in row and row['coverage']['sampled']['months'] < args.min_months]
+    if failed:
+        print(f"❌ 月份覆盖率低于 {args.min_months:.0%} 的联系人: {', '.join(f'#{c}' for c in failed)}")
+        sys.exit(1)
+    print(f"✅ 所有采样结果的月份覆盖率均不低于 {args.min_months:.0%}")
+
+
+if __name__ == '__main__':
+    main()
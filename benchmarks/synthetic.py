@@ -0,0 +1,393 @@
+"""
+合成数据集生成器
+按给定规模生成联系人、聊天记录、统计行、标签和部分分析结果，供 bench_suite.py 等基准测试使用。
+同样的参数和随机种子总是生成同样的数据，结束日期默认取当天，可用 --end-date 固定下来以便跨提交对比。
+
+分布尽量贴近真实使用：
+    每个联系人的消息量按排名的幂律分配，少数密友占大头，多数联系人只有几十条；
+    每段关系有自己的起止时间，约三成联系人已经很久没有联系；
+    聊天按"会话"成组出现，周末更频繁，开始时间集中在午休和晚上；
+    同一人常连发几条，回复间隔从几秒到几十分钟不等，一成会话没有具体时间（手动整理的记录）；
+    内容混合短回复、表情/图片占位、带话题词的句子和偶尔的长段落。
+全部消息按时间先后交错写入，与实际使用中的 id 顺序一致；全文索引在写完后一次性重建。
+
+用法: python benchmarks/synthetic.py --contacts 10000 --messages 10000000 --db /data/bench.db
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from database.models import db
+from database.profile_index import rebuild_profile_index
+from database.search import ensure_chat_log_fts
+from database.stats import TREND_WINDOW_DAYS, compute_streaks, compute_trend, dump_summary_counts, is_response
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢'
+GIVEN = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉萍红亮建文辉力琳晨雪婷宇浩然子涵欣怡思远佳琪梓萱俊'
+NICKNAMES = ['老', '小', '阿']
+TAGS = ['朋友', '同事', '家人', '大学同学', '高中同学', '健身', '客户', '邻居', '室友', '前同事', '驴友', '网友']
+NOTES = ['', '', '', '喜欢喝咖啡', '生日在秋天', '在上海工作', '养了一只猫', '不吃辣', '最近在备考']
+
+SHORT_REPLIES = ['好的', '嗯嗯', '哈哈哈', '哈哈哈哈哈', '好', 'ok', '收到', '行', '可以啊', '好呀', '没问题',
+                 '晚安', '早', '早安', '在吗', '？', '嗯', '对', '是的', '真的假的', '笑死', '绝了', '+1', '辛苦啦']
+MEDIA = ['[表情]', '[图片]', '[动画表情]', '[语音]', '[视频]', '[链接]', '[文件]', '[位置]']
+EMOJI = ['[微笑]', '[捂脸]', '[呲牙]', '[偷笑]', '[流泪]', '[强]', '[抱拳]', '[旺柴]', '[OK]', '[爱心]']
+
+TIMES = ['今天', '明天', '周末', '晚上', '下班后', '这周六', '下周', '中午', '月底', '过两天']
+PLACES = ['三里屯', '公司楼下', '商场', '老地方', '公园', '你家附近', '学校门口', '地铁站', '那家新开的店']
+ACTIVITIES = ['吃火锅', '看电影', '打球', '喝咖啡', '逛街', '爬山', '吃烧烤', '打游戏', '健身', '唱歌', '看展']
+TOPICS = ['项目', '面试', '考试', '搬家', '装修', '旅行', '买房', '换工作', '减肥', '论文', '年终总结', '签证']
+FOODS = ['火锅', '烤肉', '奶茶', '小龙虾', '螺蛳粉', '披萨', '寿司', '麻辣烫', '饺子', '蛋糕']
+OPINIONS = ['太好笑了', '有点离谱', '还挺感人的', '我觉得一般', '强烈推荐', '看完沉默了', '完全没想到']
+FEELINGS = ['好累', '好困', '有点烦', '超开心', '压力好大', '终于放假了', '饿死了', '头疼']
+
+TEMPLATES = [
+    '{time}有空吗？一起去{activity}',
+    '{time}{activity}吗',
+    '我{time}要去{place}{activity}，你来不来',
+    '你那个{topic}怎么样了',
+    '{topic}终于搞完了，{feeling}',
+    '刚{activity}回来，{feeling}',
+    '{food}真的好好吃',
+    '想吃{food}了',
+    '你看那个视频了吗，{opinion}',
+    '{time}见，{place}',
+    '最近{topic}的事忙得要死',
+    '哈哈哈哈{opinion}',
+    '我到{place}了，你到哪了',
+    '{feeling}，{time}不想上班',
+    '上次说的{topic}，我又想了想还是算了',
+    '推荐你去{place}那家{food}，{opinion}',
+]
+
+# 一天中各小时开始会话的相对权重：午休和晚上最多，凌晨最少
+HOUR_WEIGHTS = [2, 1, 1, 0.5, 0.3, 0.3, 0.5, 2, 4, 5, 5, 6, 9, 8, 5, 5, 5, 6, 8, 10, 12, 13, 12, 7]
+# 消息量在联系人之间按 1 / rank^POWER 分配
+POWER = 0.8
+MEAN_SESSION_LENGTH = 24
+UNTIMED_SESSION_RATE = 0.1
+
+
+def _fill(rng, template):
+    return template.format(
+        time=rng.choice(TIMES), place=rng.choice(PLACES), activity=rng.choice(ACTIVITIES),
+        topic=rng.choice(TOPICS), food=rng.choice(FOODS), opinion=rng.choice(OPINIONS),
+        feeling=rng.choice(FEELINGS)
+    )
+
+
+def random_message(rng):
+    roll = rng.random()
+    if roll < 0.32:
+        return rng.choice(SHORT_REPLIES)
+    if roll < 0.40:
+        return rng.choice(MEDIA)
+    if roll < 0.97:
+        text = _fill(rng, rng.choice(TEMPLATES))
+    else:
+        # 偶尔的长段落
+        text = '，'.join(_fill(rng, rng.choice(TEMPLATES)) for _ in range(rng.randint(3, 8))) + '。'
+    if rng.random() < 0.15:
+        text += rng.choice(EMOJI)
+    return text
+
+
+def random_name(rng, used):
+    while True:
+        if rng.random() < 0.1:
+            name = rng.choice(NICKNAMES) + rng.choice(SURNAMES)
+        else:
+            name = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN) for _ in range(rng.choice((1, 2, 2))))
+        if name not in used:
+            used.add(name)
+            return name
+        if len(used) > 20000:
+            name = f'{name}{len(used)}'
+            used.add(name)
+            return name
+
+
+def allocate_messages(rng, contacts, messages):
+    """每个联系人的消息数：按排名幂律分配后打乱，保证总数精确等于 messages"""
+    weights = [1 / (rank ** POWER) for rank in range(1, contacts + 1)]
+    total = sum(weights)
+    counts = [int(messages * w / total) for w in weights]
+    for index in range(messages - sum(counts)):
+        counts[index % contacts] += 1
+    rng.shuffle(counts)
+    return counts
+
+
+def _session_days(rng, count, start, end):
+    """在 [start, end] 中选出 count 个聊天日，周末权重更高；返回升序、去重的日期"""
+    span = (end - start).days + 1
+    if count >= span:
+        return [start + timedelta(days=i) for i in range(span)]
+    days = set()
+    while len(days) < count:
+        offset = int(rng.triangular(0, span, span * rng.choice((0.2, 0.8))))
+        day = start + timedelta(days=min(offset, span - 1))
+        if day.weekday() < 5 and rng.random() < 0.35:
+            continue
+        days.add(day)
+    return sorted(days)
+
+
+def contact_messages(rng, contact_id, count, end_date, span_days):
+    """按时间顺序产生某个联系人的消息，元素为 (排序键, chat_log 行)；stats 在耗尽后填充到返回的字典中"""
+    stats = {}
+    if count == 0:
+        return iter(()), stats
+    relation_days = rng.randint(min(30, span_days), span_days)
+    start = end_date - timedelta(days=relation_days)
+    # 约三成的关系已经冷淡，最后一次聊天在很久以前
+    end = end_date if rng.random() > 0.3 else end_date - timedelta(days=rng.randint(60, max(61, relation_days // 2)))
+    end = max(end, start)
+    sessions = max(1, min(round(count / MEAN_SESSION_LENGTH * rng.uniform(0.6, 1.4)), count))
+    days = _session_days(rng, sessions, start, end)
+
+    # 把 count 条消息分配到各个会话，每个会话至少一条
+    sizes = [1] * len(days)
+    for _ in range(count - len(days)):
+        sizes[rng.randrange(len(days))] += 1
+
+    def generate():
+        speaker = rng.choice(('我', '对方'))
+        dates = []
+        message_count = response_count = 0
+        response_total = 0.0
+        prev_speaker = prev_sent_at = None
+        recent_start = end_date - timedelta(days=TREND_WINDOW_DAYS - 1)
+        previous_start = recent_start - timedelta(days=TREND_WINDOW_DAYS)
+        recent = previous = 0
+        my_count = 0
+        day_counts, hour_counts = Counter(), Counter()
+        for day, size in zip(days, sizes):
+            timed = rng.random() >= UNTIMED_SESSION_RATE
+            hour = rng.choices(range(24), HOUR_WEIGHTS)[0]
+            moment = datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, seconds=rng.randrange(3600))
+            for _ in range(size):
+                # 同一人连发的间隔很短，换人回复的间隔呈对数正态分布
+                if rng.random() < 0.45:
+                    speaker = '对方' if speaker == '我' else '我'
+                    gap = min(rng.lognormvariate(4.0, 1.4), 3 * 3600)
+                else:
+                    gap = rng.uniform(2, 40)
+                moment = min(moment + timedelta(seconds=gap),
+                             datetime.combine(day, datetime.max.time()).replace(microsecond=0))
+                sent_at = moment if timed else None
+                content = random_message(rng)
+                created_at = (sent_at or datetime.combine(day, datetime.min.time()) + timedelta(hours=12))
+                key = (day.toordinal(), moment.hour * 3600 + moment.minute * 60 + moment.second, contact_id)
+                yield key, (contact_id, speaker, content, day.isoformat(),
+                            sent_at.isoformat(' ', 'microseconds') if sent_at else None,
+                            created_at.isoformat(' ', 'microseconds'))
+
+                message_count += 1
+                my_count += speaker == '我'
+                day_counts[day.isoformat()] += 1
+                if sent_at is not None:
+                    hour_counts[str(sent_at.hour)] += 1
+                if not dates or dates[-1] != day:
+                    dates.append(day)
+                if is_response(prev_speaker, prev_sent_at, speaker, sent_at):
+                    response_count += 1
+                    response_total += (sent_at - prev_sent_at).total_seconds()
+                prev_speaker, prev_sent_at = speaker, sent_at
+                if recent_start <= day <= end_date:
+                    recent += 1
+                elif previous_start <= day < recent_start:
+                    previous += 1
+
+        longest, current = compute_streaks(dates)
+        daily_counts, hourly_counts = dump_summary_counts(day_counts, hour_counts)
+        stats.update(
+            message_count=message_count, active_days=len(dates),
+            first_chat_date=dates[0].isoformat(), last_chat_date=dates[-1].isoformat(),
+            current_streak=current, longest_streak=longest,
+            response_count=response_count, response_total_seconds=response_total,
+            last_speaker=prev_speaker,
+            last_sent_at=prev_sent_at.isoformat(' ', 'microseconds') if prev_sent_at else None,
+            relationship_trend=compute_trend(recent, previous), trend_computed_on=end_date.isoformat(),
+            my_message_count=my_count, daily_counts=daily_counts, hourly_counts=hourly_counts,
+        )
+
+    return generate(), stats
+
+
+def analysis_row(rng, contact_id, now):
+    interests = rng.sample(ACTIVITIES, 3)
+    parsed = {
+        'core_traits': {'rationality': rng.choice(['理性', '感性', '理性与感性兼具']),
+                        'personality': rng.choice(['外向', '内向', '慢热'])},
+        'behavior_preferences': {'interests': interests, 'communication_style': rng.choice(['直接', '含蓄', '幽默'])},
+        'social_interaction': {'social_energy': rng.choice(['高', '中', '低'])},
+        'cognitive_thinking': {'decision_making': rng.choice(['果断', '谨慎'])},
+        'summary': f"喜欢{'、'.join(interests)}，最近在忙{rng.choice(TOPICS)}。",
+        'interests': interests,
+        'dos_and_donts': {'dos': ['多约' + interests[0]], 'donts': ['聊' + rng.choice(TOPICS) + '时太着急']},
+        'topic_suggestions': rng.sample(TOPICS, 3),
+        'gift_suggestions': rng.sample(FOODS, 2),
+    }
+    dump = lambda value: json.dumps(value, ensure_ascii=False)  # noqa: E731
+    return (contact_id, dump(parsed['core_traits']), dump(parsed['behavior_preferences']),
+            dump(parsed['social_interaction']), dump(parsed['cognitive_thinking']), parsed['summary'],
+            dump(parsed['interests']), dump(parsed['dos_and_donts']), dump(parsed['topic_suggestions']),
+            dump(parsed['gift_suggestions']), dump(parsed), now, now)
+
+
+def _create_schema(db_path):
+    """用应用自己的模型建表；全文索引留到数据写完后再建"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def _finish_indexes(app):
+    with app.app_context():
+        ensure_chat_log_fts()
+        rebuild_profile_index()
+        db.session.commit()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('ANALYZE')
+        db.engine.dispose()
+
+
+def populate(db_path, contacts, messages, seed=42, end_date=None, span_days=3 * 365, analyzed=0.3,
+             batch_size=50000, progress=True):
+    """在空数据库 db_path 中生成数据，返回写入到元数据文件中的参数字典"""
+    end_date = end_date or date.today()
+    rng = random.Random(seed)
+    app = _create_schema(db_path)
+    started = time.perf_counter()
+    now = datetime.combine(end_date, datetime.min.time()).isoformat(' ', 'microseconds')
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+
+    used_names = set()
+    tag_ids = {name: index for index, name in enumerate(TAGS, start=1)}
+    conn.executemany('INSERT INTO tag (id, name, created_at) VALUES (?, ?, ?)',
+                     [(tag_id, name, now) for name, tag_id in tag_ids.items()])
+    contact_rows, contact_tag_rows = [], []
+    for contact_id in range(1, contacts + 1):
+        tags = rng.sample(TAGS, rng.choice((0, 1, 1, 2)))
+        contact_rows.append((contact_id, random_name(rng, used_names), '', rng.choice(NOTES), ','.join(tags), now, now))
+        contact_tag_rows.extend((contact_id, tag_ids[tag]) for tag in tags)
+    conn.executemany('INSERT INTO contact (id, name, avatar, notes, tags, created_at, updated_at) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)', contact_rows)
+    conn.executemany('INSERT INTO contact_tag (contact_id, tag_id) VALUES (?, ?)', contact_tag_rows)
+
+    counts = allocate_messages(rng, contacts, messages)
+    streams, all_stats = [], {}
+    for contact_id, count in enumerate(counts, start=1):
+        # 每个联系人用独立的随机数发生器，交错合并时的调用顺序不影响各自的内容
+        stream, stats = contact_messages(random.Random(rng.random()), contact_id, count, end_date, span_days)
+        streams.append(stream)
+        all_stats[contact_id] = stats
+
+    insert = ('INSERT INTO chat_log (contact_id, speaker, content, chat_date, sent_at, created_at) '
+              'VALUES (?, ?, ?, ?, ?, ?)')
+    batch, inserted = [], 0
+    for _, row in heapq.merge(*streams, key=lambda item: item[0]):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.executemany(insert, batch)
+            conn.commit()
+            inserted += len(batch)
+            batch = []
+            if progress:
+                print(f'  已写入 {inserted}/{messages} 条', end='\r')
+    conn.executemany(insert, batch)
+    inserted += len(batch)
+
+    columns = ('message_count', 'active_days', 'first_chat_date', 'last_chat_date', 'current_streak',
+               'longest_streak', 'response_count', 'response_total_seconds', 'last_speaker', 'last_sent_at',
+               'relationship_trend', 'trend_computed_on', 'my_message_count', 'daily_counts', 'hourly_counts')
+    conn.executemany(
+        f"INSERT INTO contact_stats (contact_id, {', '.join(columns)}, chat_log_version, updated_at) "
+        f"VALUES (?, {', '.join('?' for _ in columns)}, 0, ?)",
+        [(contact_id, *(stats[c] for c in columns), now) for contact_id, stats in all_stats.items() if stats]
+    )
+    analyzed_ids = [contact_id for contact_id, count in enumerate(counts, start=1)
+                    if count and rng.random() < analyzed]
+    conn.executemany(
+        'INSERT INTO analysis_result (contact_id, core_traits, behavior_preferences, social_interaction, '
+        'cognitive_thinking, summary, interests, dos_and_donts, topic_suggestions, gift_suggestions, '
+        'raw_response, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [analysis_row(rng, contact_id, now) for contact_id in analyzed_ids]
+    )
+    conn.commit()
+    conn.close()
+    if progress:
+        print(f'\n写入 {inserted} 条消息耗时 {time.perf_counter() - started:.1f}s，正在建立全文索引…')
+    _finish_indexes(app)
+    # 把 WAL 合并回主文件，数据集可以直接整体复制
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+    return {
+        'contacts': contacts, 'messages': messages, 'seed': seed, 'end_date': end_date.isoformat(),
+        'span_days': span_days, 'analyzed': analyzed,
+        'max_contact_messages': max(counts), 'median_contact_messages': sorted(counts)[len(counts) // 2],
+        'generate_seconds': round(time.perf_counter() - started, 1),
+    }
+
+
+def meta_path(db_path):
+    return db_path + '.meta.json'
+
+
+def ensure_dataset(db_path, contacts, messages, seed=42, end_date=None, **kwargs):
+    """db_path 已有相同参数生成的数据集时直接复用，否则重新生成；返回数据集元数据"""
+    end_date = end_date or date.today()
+    wanted = {'contacts': contacts, 'messages': messages, 'seed': seed, 'end_date': end_date.isoformat()}
+    if os.path.exists(db_path) and os.path.exists(meta_path(db_path)):
+        with open(meta_path(db_path)) as f:
+            meta = json.load(f)
+        if all(meta.get(key) == value for key, value in wanted.items()):
+            return meta
+    for suffix in ('', '-wal', '-shm', '.meta.json'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    meta = populate(db_path, contacts, messages, seed=seed, end_date=end_date, **kwargs)
+    with open(meta_path(db_path), 'w') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成数据集生成器')
+    parser.add_argument('--contacts', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=10000000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end-date', type=date.fromisoformat, help='最后一天（YYYY-MM-DD），默认今天')
+    parser.add_argument('--span-days', type=int, default=3 * 365, help='最早的关系开始于多少天前')
+    parser.add_argument('--analyzed', type=float, default=0.3, help='已有分析结果的联系人比例')
+    parser.add_argument('--db', required=True, help='输出的 SQLite 文件；参数相同的已有数据集会被复用')
+    args = parser.parse_args()
+
+    meta = ensure_dataset(args.db, args.contacts, args.messages, seed=args.seed, end_date=args.end_date,
+                          span_days=args.span_days, analyzed=args.analyzed)
+    print(json.dumps(meta, ensure_ascii=False, indent=2))
+    print(f'数据库大小: {os.path.getsize(args.db) / 1024 / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
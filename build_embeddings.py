@@ -0,0 +1,29 @@
+from flask import Flask
+from config import get_config
+from database.engine import configure_engine
+from database.models import db
+from database.shards import init_chat_log_shards
+from utils.embeddings import get_vector_index, rebuild_from_database
+
+app = Flask(__name__)
+app.config.from_object(get_config())
+db.init_app(app)
+configure_engine(app)
+init_chat_log_shards(app)
+
+
+def build_embeddings():
+    """为尚未建立向量的聊天记录补建语义搜索索引，可中断后重复执行"""
+    with app.app_context():
+        index = get_vector_index()
+        print(f"📦 向量索引目录: {app.config['EMBEDDING_DIR']}")
+        print(f"  已索引 {index.count} 条消息")
+        added = rebuild_from_database()
+        stats = index.stats()
+        print(f"✅ 新增 {added} 条，共 {stats['count']} 条，"
+              f"{'IVF 聚类 ' + str(stats['nlist']) + ' 个' if stats['trained'] else '暴力检索'}，"
+              f"向量占用 {stats['size_bytes'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    build_embeddings()
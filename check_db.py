@@ -1,18 +1,21 @@
-import sqlite3
+from flask import Flask
+from sqlalchemy import inspect
 
-conn = sqlite3.connect('database/social.db')
-cursor = conn.cursor()
+from config import get_config
+from database.models import db
 
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-tables = cursor.fetchall()
-print("Tables:", tables)
+app = Flask(__name__)
+app.config.from_object(get_config())
+db.init_app(app)
 
-for table in tables:
-    table_name = table[0]
-    print(f"\n=== {table_name} ===")
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
-    for col in columns:
-        print(f"  {col[1]} ({col[2]})")
+with app.app_context():
+    inspector = inspect(db.engine)
+    print("Dialect:", db.engine.dialect.name)
 
-conn.close()
+    tables = inspector.get_table_names()
+    print("Tables:", tables)
+
+    for table_name in tables:
+        print(f"\n=== {table_name} ===")
+        for col in inspector.get_columns(table_name):
+            print(f"  {col['name']} ({col['type']})")
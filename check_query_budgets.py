@@ -0,0 +1,96 @@
+"""
+路由 SQL 语句数检查
+在临时数据库上写入示例数据和一批额外联系人，逐个请求关键路由；语句数超过预算或检测到 N+1 时以非零状态退出。
+修改列表页、模型属性或模板之后运行，防止 N+1 回归。剖析方式见 database/profiler.py。
+
+用法: python check_query_budgets.py --contacts 20 --verbose
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+# (方法, 路径, 语句数上限, 请求体)；{id} 替换为第一个联系人
+ROUTE_BUDGETS = [
+    ('GET', '/home', 15, None),
+    ('GET', '/contacts', 10, None),
+    ('GET', '/api/contacts', 6, None),
+    ('GET', '/profile/{id}', 8, None),
+    ('GET', '/api/contacts/{id}/timeline', 6, None),
+    ('GET', '/api/contacts/{id}/timeline/summary', 6, None),
+    ('GET', '/api/contacts/{id}/chat-logs', 4, None),
+    ('GET', '/api/contacts/{id}/analysis', 4, None),
+    ('GET', '/api/search?q=火锅', 6, None),
+    # ORM 在 SQLite 上逐行 INSERT ... RETURNING，50 行约 50 条语句
+    ('POST', '/api/contacts/{id}/chat-logs', 60,
+     {'date': '2024-01-01', 'lines': [{'speaker': '对方', 'content': f'第 {i} 条消息'} for i in range(50)]}),
+]
+
+
+def add_contacts(client, count):
+    for i in range(count):
+        contact_id = client.post('/api/contacts', json={'name': f'联系人{i}', 'tags': '朋友'}).get_json()['contact']['id']
+        client.post(f'/api/contacts/{contact_id}/chat-logs', json={
+            'date': '2024-03-01',
+            'lines': [{'speaker': '我' if j % 2 else '对方', 'content': f'消息 {j}'} for j in range(10)]
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='路由 SQL 语句数检查')
+    parser.add_argument('--contacts', type=int, default=20, help='示例数据之外再创建的联系人数')
+    parser.add_argument('--verbose', action='store_true', help='打印每个路由的语句分组')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='query-budgets-')
+    os.environ.update({
+        'DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'check.db'),
+        'EMBEDDING_DIR': os.path.join(workdir, 'embeddings'),
+        'CACHE_URL': 'memory://',
+        'SQL_PROFILER': '0',
+    })
+
+    from app import create_app
+    from database.models import db, Contact
+    from database.profiler import QueryBudgetExceeded, assert_query_budget
+    from database.search import ensure_chat_log_fts
+    from database.stats import rebuild_contact_stats
+    from seed_data import seed_sample_data
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        ensure_chat_log_fts()
+        seed_sample_data()
+        # 与 migrate_fields.py 一致预先算好统计行，否则列表页首次访问时的逐个补算会被计入预算
+        for contact in Contact.query.all():
+            rebuild_contact_stats(contact.id)
+        db.session.commit()
+        contact_id = Contact.query.order_by(Contact.id).first().id
+
+    client = app.test_client()
+    add_contacts(client, args.contacts)
+
+    failures = 0
+    print(f"{'路由':<44}{'语句数':>8}{'预算':>6}  结果")
+    for method, path, budget, body in ROUTE_BUDGETS:
+        path = path.format(id=contact_id)
+        try:
+            response = assert_query_budget(client, path, budget, method=method, json=body)
+            profile = response.sql_profile
+            status = 'OK' if response.status_code < 400 else f'HTTP {response.status_code}'
+            failures += response.status_code >= 400
+            print(f'{method} {path:<40}{profile.count:>8}{budget:>6}  {status}')
+            if args.verbose:
+                print(profile.report())
+        except QueryBudgetExceeded as exc:
+            failures += 1
+            print(f'{method} {path:<40}{"":>8}{budget:>6}  失败')
+            print(exc)
+    shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
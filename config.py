@@ -17,16 +17,152 @@ BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DATABASE_DIR = os.path.join(BASE_DIR, 'database')
 os.makedirs(DATABASE_DIR, exist_ok=True)
 
+DATABASE_URI = os.environ.get('DATABASE_URI') or \
+    'sqlite:///' + os.path.join(DATABASE_DIR, 'social.db')
+# 只读副本（可选），如 postgresql+psycopg2://reader@replica-host/mysoullinker
+DATABASE_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URI')
+
+
+def engine_options(uri, pool_size, max_overflow, pool_timeout=30):
+    """按数据库类型生成 SQLAlchemy 引擎参数；内存 SQLite 使用单连接池，不能设置池大小"""
+    if uri.startswith('sqlite'):
+        if uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri:
+            return {}
+        return {
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            # 连接由连接池在线程间复用；锁等待交给 busy_timeout
+            'connect_args': {'check_same_thread': False, 'timeout': pool_timeout}
+        }
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
+
+
+def database_binds(pool_size, max_overflow):
+    """配置了只读副本时返回 SQLALCHEMY_BINDS，只读路由的查询会被路由到该连接"""
+    if not DATABASE_REPLICA_URI:
+        return {}
+    return {
+        'replica': dict(url=DATABASE_REPLICA_URI, **engine_options(DATABASE_REPLICA_URI, pool_size, max_overflow))
+    }
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-for-mysoullinker'
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or \
-        'sqlite:///' + os.path.join(DATABASE_DIR, 'social.db')
+    SQLALCHEMY_DATABASE_URI = DATABASE_URI
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # 每个 SQLite 连接建立时执行的 PRAGMA，见 database/engine.py
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'foreign_keys': 'ON'
+    }
+    
     VOLCANO_ARK_API_KEY = os.environ.get('VOLCANO_ARK_API_KEY')
-    VOLCANO_ARK_ENDPOINT = 'https://ark.cn-beijing.volces.com/api/v3'
+    VOLCANO_ARK_ENDPOINT = os.environ.get('VOLCANO_ARK_ENDPOINT') or 'https://ark.cn-beijing.volces.com/api/v3'
     AI_MODEL_ID = 'doubao-seed-1-6-251015'
+    # 多个兼容 OpenAI 接口的模型服务（JSON 数组），未设置时只用上面的火山方舟；路由、对冲和熔断见 utils/backends.py
+    AI_BACKENDS = os.environ.get('AI_BACKENDS') or None
+    AI_ROUTING = os.environ.get('AI_ROUTING', 'order')
+    # 首选服务多少秒内没有输出首个内容时向下一个服务发出对冲请求，0 表示不对冲
+    AI_HEDGE_AFTER = float(os.environ.get('AI_HEDGE_AFTER', 8))
+    AI_BREAKER_FAILURES = int(os.environ.get('AI_BREAKER_FAILURES', 3))
+    AI_BREAKER_COOLDOWN = float(os.environ.get('AI_BREAKER_COOLDOWN', 30))
+    # 分析流多少秒没有输出时发送一次 SSE 心跳注释，避免代理缓冲或按空闲超时断开，0 表示不发送
+    SSE_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', 15))
+    # 分析任务与连接解耦（utils/jobs.py）：每个任务缓冲的最近事件数，以及结束后保留多少秒供断线的客户端重新连接
+    ANALYSIS_JOB_BUFFER = int(os.environ.get('ANALYSIS_JOB_BUFFER', 256))
+    ANALYSIS_JOB_TTL = float(os.environ.get('ANALYSIS_JOB_TTL', 600))
+    # 大模型调用配额（database/usage.py）：每天（UTC）的 token 总量、单个联系人每天的 token 量、同时进行的调用数，0 表示不限制
+    AI_DAILY_TOKEN_QUOTA = int(os.environ.get('AI_DAILY_TOKEN_QUOTA', 0))
+    AI_CONTACT_DAILY_TOKEN_QUOTA = int(os.environ.get('AI_CONTACT_DAILY_TOKEN_QUOTA', 0))
+    AI_MAX_CONCURRENT_ANALYSES = int(os.environ.get('AI_MAX_CONCURRENT_ANALYSES', 0))
+    
+    # 聊天记录分片（可选）：大于 0 时 chat_log 按 contact_id 拆分到多个 SQLite 文件，见 database/shards.py
+    CHAT_LOG_SHARDS = int(os.environ.get('CHAT_LOG_SHARDS', 0))
+    CHAT_LOG_SHARD_STRATEGY = os.environ.get('CHAT_LOG_SHARD_STRATEGY', 'hash')
+    # range 策略下各分片 contact_id 的上界（不含），逗号分隔，个数为分片数 - 1
+    CHAT_LOG_SHARD_RANGES = [int(v) for v in os.environ.get('CHAT_LOG_SHARD_RANGES', '').split(',') if v.strip()]
+    CHAT_LOG_SHARD_DIR = os.environ.get('CHAT_LOG_SHARD_DIR') or os.path.join(DATABASE_DIR, 'shards')
+    
+    # 压缩归档：早于该天数的聊天记录按联系人、按月压缩存放，见 database/archive.py
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    # zstd（需安装 zstandard）或 zlib，留空时自动选择
+    ARCHIVE_CODEC = os.environ.get('ARCHIVE_CODEC') or None
+    
+    # 响应缓存后端：memory://（默认）、disk:///path/cache.db 或 redis://host:6379/0，见 utils/cache.py
+    CACHE_URL = os.environ.get('CACHE_URL') or 'memory://'
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 300))
+    
+    # 结构化日志中高频事件（流式分块、请求）的抽样比例；多进程部署时各 worker 的指标写入 METRICS_DIR 后合并
+    EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', 0.01))
+    METRICS_DIR = os.environ.get('METRICS_DIR') or None
+    
+    # 发送给大模型的聊天记录（整理后）的 token 上限，超出时在全部记录中按重要性采样，见 utils/transcript.py、utils/sampling.py
+    ANALYSIS_TOKEN_BUDGET = int(os.environ.get('ANALYSIS_TOKEN_BUDGET', 120000))
+    
+    # 按请求的 SQL 剖析与 N+1 检测（开发用），见 database/profiler.py
+    SQL_PROFILER = os.environ.get('SQL_PROFILER', '0') == '1'
+    SQL_PROFILER_N_PLUS_ONE = int(os.environ.get('SQL_PROFILER_N_PLUS_ONE', 5))
+    
+    # 本地向量索引目录（语义搜索）
+    EMBEDDING_DIR = os.environ.get('EMBEDDING_DIR') or os.path.join(DATABASE_DIR, 'embeddings')
     
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
     EXPORT_FOLDER = os.path.join(BASE_DIR, 'exports')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+
+
+class DevelopmentConfig(Config):
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(DATABASE_URI, pool_size=5, max_overflow=5)
+    SQLALCHEMY_BINDS = database_binds(pool_size=5, max_overflow=5)
+
+
+class ProductionConfig(Config):
+    # WAL 下读写互不阻塞；synchronous=NORMAL 在 WAL 模式下仍能保证崩溃后数据库一致
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 10000,
+        'foreign_keys': 'ON',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY'
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        DATABASE_URI,
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    )
+    SQLALCHEMY_BINDS = database_binds(
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    )
+
+
+class LegacyConfig(Config):
+    """不做任何连接调优（默认 rollback journal），用于对比基准测试"""
+    SQLITE_PRAGMAS = {}
+
+
+config_by_name = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'legacy': LegacyConfig
+}
+
+
+def get_config(name=None):
+    """按名称（或环境变量 APP_CONFIG）选择配置，默认 development"""
+    name = name or os.environ.get('APP_CONFIG') or 'development'
+    if name not in config_by_name:
+        raise ValueError(f"未知的配置: {name}，可选: {', '.join(config_by_name)}")
+    return config_by_name[name]
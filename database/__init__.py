@@ -1 +1 @@
-from database.models import db, Contact, ChatLog, AnalysisResult, init_db
+from database.models import db, Contact, ChatLog, ContactStats, AnalysisResult, Tag, ProfileTerm, contact_tag, chat_log_id_sequence, ChatArchive, ArchiveDictionary, init_db
@@ -0,0 +1,396 @@
+"""
+旧聊天记录的压缩归档
+
+早于 ARCHIVE_AFTER_DAYS 的消息按 (联系人, 月份) 打包成一个块：行数据序列化为紧凑 JSON 后整体压缩，
+存入 chat_log_archive 表，并从 chat_log 表删除。压缩使用 zstd（安装了 zstandard 时）或 zlib，
+两者都配合一份由历史消息训练出的共享字典，对短消息为主的聊天记录能显著提高压缩率。
+
+读取时 load_chat_logs 会把归档块解压成与 ChatLog 属性相同的 ArchivedChatLog 对象并与未归档的记录合并，
+get_chat_logs、profile_page 和导出等调用方拿到的数据与归档前一致。归档的消息同时写入单独的无内容全文检索表
+（database/search.py 的 chat_archive_fts，只有索引、不存正文），/api/search 照常能搜到，命中结果从归档块解压；
+该表只在 SQLite 上可用，PostgreSQL 下归档消息不参与检索。
+"""
+import heapq
+import json
+import zlib
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+
+try:
+    import zstandard
+except ImportError:  # 未安装时只使用 zlib
+    zstandard = None
+
+from database.models import db, ChatLog, ChatArchive, ArchiveDictionary
+from database.search import clear_archived_chat_log_index, index_archived_chat_logs, optimize_chat_log_fts
+from database.shards import chat_log_query, chat_log_session, chat_log_sessions, chat_logs_by_ids
+
+# 近 60 天的消息参与关系趋势计算，归档阈值不能短于该窗口
+MIN_ARCHIVE_AGE_DAYS = 60
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 19
+# zlib 只能利用 32KB 窗口内的字典内容
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+ZSTD_DICTIONARY_SIZE = 64 * 1024
+DICTIONARY_SAMPLE_SIZE = 20000
+NGRAM_SIZES = (2, 3, 4, 6)
+
+_dictionary_cache = {}
+
+
+def available_codecs():
+    return ['zstd', 'zlib'] if zstandard is not None else ['zlib']
+
+
+def default_codec():
+    return available_codecs()[0]
+
+
+def compress(codec, data, dictionary=None):
+    if codec == 'zstd':
+        zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zdict).compress(data)
+    if dictionary:
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(ZLIB_LEVEL)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(codec, data, dictionary=None):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('该归档块使用 zstd 压缩，请先安装 zstandard')
+        zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=zdict).decompress(data)
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def encode_row(log):
+    return [
+        log.id,
+        log.speaker,
+        log.content,
+        log.chat_date.isoformat(),
+        log.sent_at.isoformat() if log.sent_at else None,
+        log.created_at.isoformat() if log.created_at else None
+    ]
+
+
+class ArchivedChatLog:
+    """从归档块解出的消息，属性与 ChatLog 相同；不是 ORM 对象，构造开销远小于 ChatLog 实例"""
+    __slots__ = ('id', 'contact_id', 'speaker', 'content', 'chat_date', 'sent_at', 'created_at')
+    archived = True
+
+    def __init__(self, id, contact_id, speaker, content, chat_date, sent_at=None, created_at=None):
+        self.id = id
+        self.contact_id = contact_id
+        self.speaker = speaker
+        self.content = content
+        self.chat_date = chat_date
+        self.sent_at = sent_at
+        self.created_at = created_at
+
+    to_dict = ChatLog.to_dict
+
+
+def decode_row(contact_id, row):
+    log_id, speaker, content, chat_date, sent_at, created_at = row
+    return ArchivedChatLog(
+        log_id,
+        contact_id,
+        speaker,
+        content,
+        date.fromisoformat(chat_date),
+        datetime.fromisoformat(sent_at) if sent_at else None,
+        datetime.fromisoformat(created_at) if created_at else None
+    )
+
+
+def serialize_rows(rows):
+    return json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def build_zlib_dictionary(samples, size=ZLIB_DICTIONARY_SIZE):
+    """zlib 字典就是一段预置文本：挑出样本中收益（出现次数 × 长度）最高的片段拼接，收益高的放在末尾离数据最近"""
+    scores = Counter()
+    for content in samples:
+        scores[content] += len(content)
+        for n in NGRAM_SIZES:
+            for i in range(len(content) - n + 1):
+                scores[content[i:i + n]] += n
+    chosen = []
+    total = 0
+    for fragment, score in scores.most_common():
+        if score <= len(fragment):  # 只出现过一次
+            break
+        encoded = fragment.encode('utf-8')
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+    # 行结构中反复出现的分隔符和发言者
+    skeleton = serialize_rows([[0, '对方', '', '2000-01-01', None, None], [0, '我', '', '2000-01-01', None, None]])
+    return b''.join(reversed(chosen)) + skeleton
+
+
+def train_dictionary(codec, samples):
+    """samples 为消息内容列表；样本过少时返回 None，归档块不使用字典"""
+    if len(samples) < 100:
+        return None
+    if codec == 'zstd':
+        rows = [serialize_rows([[0, '对方', content, '2000-01-01', None, None]]) for content in samples]
+        return zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, rows).as_bytes()
+    return build_zlib_dictionary(samples)
+
+
+def get_dictionary(dictionary_id):
+    if dictionary_id is None:
+        return None
+    data = _dictionary_cache.get(dictionary_id)
+    if data is None:
+        data = db.session.get(ArchiveDictionary, dictionary_id).data
+        _dictionary_cache[dictionary_id] = data
+    return data
+
+
+def latest_dictionary(codec):
+    return ArchiveDictionary.query.filter_by(codec=codec).order_by(ArchiveDictionary.id.desc()).first()
+
+
+def collect_dictionary_samples(cutoff, limit=DICTIONARY_SAMPLE_SIZE):
+    sessions = chat_log_sessions()
+    per_session = max(1, limit // len(sessions))
+    samples = []
+    for session in sessions:
+        samples.extend(content for content, in session.query(ChatLog.content)
+                       .filter(ChatLog.chat_date < cutoff)
+                       .order_by(ChatLog.id.desc())
+                       .limit(per_session))
+    return samples
+
+
+def create_dictionary(codec, cutoff):
+    samples = collect_dictionary_samples(cutoff)
+    data = train_dictionary(codec, samples)
+    if data is None:
+        return None
+    dictionary = ArchiveDictionary(codec=codec, data=data, sample_count=len(samples))
+    db.session.add(dictionary)
+    db.session.commit()
+    return dictionary
+
+
+def archive_cutoff(days, today=None):
+    """归档截止日期：对齐到月初，保证同一个月的消息要么全部归档、要么全部保留"""
+    today = today or date.today()
+    days = max(days, MIN_ARCHIVE_AGE_DAYS)
+    return (today - timedelta(days=days)).replace(day=1)
+
+
+def decode_block(block):
+    raw = decompress(block.codec, block.payload, get_dictionary(block.dictionary_id))
+    return [decode_row(block.contact_id, row) for row in json.loads(raw)]
+
+
+def _write_block(session, block, contact_id, month, logs, codec, dictionary):
+    """dictionary 为 (id, data) 或 None"""
+    raw = serialize_rows([encode_row(log) for log in logs])
+    dictionary_id, dictionary_data = dictionary or (None, None)
+    fields = {
+        'message_count': len(logs),
+        'first_date': min(log.chat_date for log in logs),
+        'last_date': max(log.chat_date for log in logs),
+        'min_id': min(log.id for log in logs),
+        'max_id': max(log.id for log in logs),
+        'codec': codec,
+        'dictionary_id': dictionary_id,
+        'raw_size': len(raw),
+        'payload': compress(codec, raw, dictionary_data)
+    }
+    if block is None:
+        block = ChatArchive(contact_id=contact_id, month=month, **fields)
+        session.add(block)
+    else:
+        for name, value in fields.items():
+            setattr(block, name, value)
+    return block
+
+
+def chat_log_sort_key(log):
+    return (log.chat_date, log.created_at or datetime.min, log.id)
+
+
+def archive_contact(contact_id, cutoff, codec, dictionary=None):
+    """把联系人早于 cutoff 的消息写入按月的归档块并删除原记录，返回归档的消息数；dictionary 为 (id, data)"""
+    session = chat_log_session(contact_id)
+    logs = chat_log_query(contact_id).filter(ChatLog.chat_date < cutoff).all()
+    if not logs:
+        return 0
+
+    by_month = {}
+    for log in logs:
+        by_month.setdefault(log.chat_date.strftime('%Y-%m'), []).append(log)
+    existing = {
+        block.month: block for block in session.query(ChatArchive)
+        .filter(ChatArchive.contact_id == contact_id, ChatArchive.month.in_(list(by_month)))
+    }
+    for month, month_logs in by_month.items():
+        block = existing.get(month)
+        if block is not None:
+            # 该月已有归档块（归档后又补录了旧消息），合并后重新压缩
+            month_logs = decode_block(block) + month_logs
+        month_logs.sort(key=chat_log_sort_key)
+        _write_block(session, block, contact_id, month, month_logs, codec, dictionary)
+
+    # 合并进来的旧归档消息已经在检索表中，只写入这次新归档的
+    index_archived_chat_logs(session, logs)
+    session.query(ChatLog).filter(ChatLog.id.in_([log.id for log in logs])).delete(synchronize_session=False)
+    session.commit()
+    return len(logs)
+
+
+def reindex_archived_chat_logs():
+    """从归档块重建归档检索表（升级前已有归档块时由 migrate_fields.py 调用），返回写入的消息数"""
+    total = 0
+    for session in chat_log_sessions():
+        clear_archived_chat_log_index(session)
+        for block in session.query(ChatArchive).order_by(ChatArchive.id):
+            logs = decode_block(block)
+            index_archived_chat_logs(session, logs)
+            total += len(logs)
+        optimize_chat_log_fts(session)
+        session.commit()
+    return total
+
+
+def contacts_with_archivable_logs(cutoff):
+    contact_ids = set()
+    for session in chat_log_sessions():
+        contact_ids.update(cid for cid, in session.query(ChatLog.contact_id)
+                           .filter(ChatLog.chat_date < cutoff).distinct())
+    return sorted(contact_ids)
+
+
+def archive_chat_logs(days, codec=None, retrain=False, log=print):
+    """归档所有早于 days 天（对齐到月初）的消息；可重复执行，每个联系人单独提交"""
+    codec = codec or default_codec()
+    if codec not in available_codecs():
+        raise ValueError(f'不支持的压缩方式: {codec}，可选: {", ".join(available_codecs())}')
+    cutoff = archive_cutoff(days)
+    dictionary = None if retrain else latest_dictionary(codec)
+    if dictionary is None:
+        dictionary = create_dictionary(codec, cutoff)
+        if dictionary is not None:
+            log(f"  已训练 {codec} 字典: {len(dictionary.data)} 字节，样本 {dictionary.sample_count} 条")
+
+    if dictionary is not None:
+        dictionary = (dictionary.id, dictionary.data)
+
+    report = {'cutoff': cutoff, 'codec': codec, 'contacts': 0, 'messages': 0}
+    for contact_id in contacts_with_archivable_logs(cutoff):
+        archived = archive_contact(contact_id, cutoff, codec, dictionary)
+        report['contacts'] += 1
+        report['messages'] += archived
+    if report['messages']:
+        for session in chat_log_sessions():
+            optimize_chat_log_fts(session)
+            session.commit()
+    return report
+
+
+def archive_blocks(contact_id, start=None, end=None):
+    query = chat_log_session(contact_id).query(ChatArchive).filter(ChatArchive.contact_id == contact_id)
+    if start is not None:
+        query = query.filter(ChatArchive.last_date >= start)
+    if end is not None:
+        query = query.filter(ChatArchive.first_date <= end)
+    return query.order_by(ChatArchive.month).all()
+
+
+def load_archived_chat_logs(contact_id, start=None, end=None):
+    logs = []
+    for block in archive_blocks(contact_id, start, end):
+        logs.extend(log for log in decode_block(block)
+                    if (start is None or log.chat_date >= start) and (end is None or log.chat_date <= end))
+    return logs
+
+
+def load_chat_logs(contact_id, start=None, end=None, ids=None):
+    """返回联系人的全部聊天记录（含已归档部分），按日期、创建时间排序；可按日期闭区间或 id 过滤"""
+    query = chat_log_query(contact_id)
+    if start is not None:
+        query = query.filter(ChatLog.chat_date >= start)
+    if end is not None:
+        query = query.filter(ChatLog.chat_date <= end)
+    if ids is not None:
+        query = query.filter(ChatLog.id.in_(ids))
+    logs = query.all()
+
+    archived = load_archived_chat_logs(contact_id, start, end)
+    if ids is not None:
+        wanted = set(ids)
+        archived = [log for log in archived if log.id in wanted]
+    logs.extend(archived)
+    logs.sort(key=chat_log_sort_key)
+    return logs
+
+
+def load_chat_logs_by_ids(ids):
+    """按 id 取消息，未在 chat_log 中找到的再到归档块里查（语义搜索命中旧消息时）"""
+    ids = list(ids)
+    logs = chat_logs_by_ids(ids)
+    missing = [log_id for log_id in ids if log_id not in logs]
+    if not missing:
+        return logs
+    for session in chat_log_sessions():
+        blocks = session.query(ChatArchive).filter(
+            db.or_(*[db.and_(ChatArchive.min_id <= log_id, ChatArchive.max_id >= log_id) for log_id in missing])
+        )
+        for block in blocks:
+            for log in decode_block(block):
+                if log.id in missing:
+                    logs[log.id] = log
+    return logs
+
+
+def iter_stats_rows(contact_id):
+    """rebuild_contact_stats 使用：按 (日期, 发送时间, id) 顺序合并未归档与已归档的 (chat_date, sent_at, id, speaker)"""
+    live = chat_log_session(contact_id).query(ChatLog.chat_date, ChatLog.sent_at, ChatLog.id, ChatLog.speaker) \
+        .filter(ChatLog.contact_id == contact_id) \
+        .order_by(ChatLog.chat_date, ChatLog.sent_at.nulls_first(), ChatLog.id) \
+        .yield_per(1000)
+    archived = sorted(
+        ((log.chat_date, log.sent_at, log.id, log.speaker) for log in load_archived_chat_logs(contact_id)),
+        key=_stats_key
+    )
+    return heapq.merge(live, archived, key=_stats_key)
+
+
+def _stats_key(row):
+    return (row[0], row[1] is not None, row[1] or datetime.min, row[2])
+
+
+def archived_message_count(contact_id):
+    return chat_log_session(contact_id).query(func.coalesce(func.sum(ChatArchive.message_count), 0)) \
+        .filter(ChatArchive.contact_id == contact_id).scalar()
+
+
+def archive_summary():
+    """各分片归档块的汇总：块数、消息数、原始大小与压缩后大小"""
+    summary = Counter()
+    for session in chat_log_sessions():
+        row = session.query(
+            func.count(ChatArchive.id),
+            func.coalesce(func.sum(ChatArchive.message_count), 0),
+            func.coalesce(func.sum(ChatArchive.raw_size), 0),
+            func.coalesce(func.sum(func.length(ChatArchive.payload)), 0)
+        ).one()
+        summary['blocks'] += row[0]
+        summary['messages'] += row[1]
+        summary['raw_bytes'] += row[2]
+        summary['compressed_bytes'] += row[3]
+    return dict(summary)
@@ -0,0 +1,30 @@
+from sqlalchemy import event
+
+from database.models import db
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """在每个新建的 SQLite 连接上执行 PRAGMA；非 SQLite 引擎直接忽略"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def read_sqlite_pragmas(engine, names):
+    with engine.connect() as conn:
+        return {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar() for name in names}
+
+
+def configure_engine(app):
+    """在 db.init_app(app) 之后、首次连接数据库之前调用"""
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, app.config.get('SQLITE_PRAGMAS'))
@@ -1,7 +1,23 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
-db = SQLAlchemy()
+from database.routing import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+contact_tag = db.Table(
+    'contact_tag',
+    db.Column('contact_id', db.Integer, db.ForeignKey('contact.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_contact_tag_tag', 'tag_id', 'contact_id')
+)
+
+# 分片模式下由主库统一分配 chat_log.id，见 database/shards.py
+chat_log_id_sequence = db.Table(
+    'chat_log_id_sequence',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('next_id', db.BigInteger, nullable=False)
+)
 
 class Contact(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,51 +30,52 @@ class Contact(db.Model):
     
     chat_logs = db.relationship('ChatLog', backref='contact', lazy='dynamic', cascade='all, delete-orphan')
     analysis = db.relationship('AnalysisResult', backref='contact', uselist=False, cascade='all, delete-orphan')
+    stats = db.relationship('ContactStats', backref='contact', uselist=False, cascade='all, delete-orphan')
+    profile_terms = db.relationship('ProfileTerm', backref='contact', lazy='dynamic', cascade='all, delete-orphan')
+    tag_items = db.relationship('Tag', secondary=contact_tag, backref=db.backref('contacts', lazy='dynamic'))
+    
+    def get_stats(self):
+        from database.stats import ensure_contact_stats
+        return ensure_contact_stats(self)
+    
+    @property
+    def chat_count(self):
+        return self.get_stats().message_count
     
     @property
     def sessions(self):
-        logs = self.chat_logs.all()
-        if not logs:
-            return 0
-        dates = set()
-        for log in logs:
-            dates.add(log.chat_date)
-        return len(dates)
+        return self.get_stats().active_days
     
     @property
     def active_days(self):
-        logs = self.chat_logs.all()
-        if not logs:
-            return 0
-        dates = set()
-        for log in logs:
-            dates.add(log.chat_date)
-        return len(dates)
+        return self.get_stats().active_days
     
     @property
     def analysis_count(self):
-        return AnalysisResult.query.filter_by(contact_id=self.id).count()
+        return 1 if self.analysis is not None else 0
     
     @property
     def avg_response_time(self):
-        return None
+        return self.get_stats().avg_response_time_text
     
     @property
     def longest_streak(self):
-        return 0
+        return self.get_stats().longest_streak
     
     @property
     def last_active(self):
-        latest_log = self.chat_logs.order_by(ChatLog.chat_date.desc()).first()
-        if latest_log:
-            return latest_log.chat_date.strftime('%Y-%m-%d')
+        last_chat_date = self.get_stats().last_chat_date
+        if last_chat_date:
+            return last_chat_date.strftime('%Y-%m-%d')
         return None
     
     @property
     def relationship_trend(self):
-        return None
+        # 由写入消息和每天的 refresh_trends.py 维护，读取时不重算
+        return self.get_stats().relationship_trend
     
     def to_dict(self):
+        stats = self.get_stats()
         return {
             'id': self.id,
             'name': self.name,
@@ -67,19 +84,29 @@ class Contact(db.Model):
             'tags': self.tags,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'chat_count': self.chat_logs.count(),
-            'sessions': self.sessions,
-            'active_days': self.active_days,
+            'chat_count': stats.message_count,
+            'sessions': stats.active_days,
+            'active_days': stats.active_days,
             'analysis_count': self.analysis_count,
-            'has_analysis': self.analysis is not None
+            'has_analysis': self.analysis is not None,
+            'last_active': self.last_active,
+            'longest_streak': stats.longest_streak,
+            'avg_response_time': stats.avg_response_time_text,
+            'relationship_trend': self.relationship_trend
         }
 
 class ChatLog(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_log_contact_date', 'contact_id', 'chat_date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False)
     speaker = db.Column(db.String(20), nullable=False)
     content = db.Column(db.Text, nullable=False)
     chat_date = db.Column(db.Date, nullable=False)
+    # 消息实际发送时间（可选），用于计算平均响应时间
+    sent_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -89,9 +116,71 @@ class ChatLog(db.Model):
             'speaker': self.speaker,
             'content': self.content,
             'chat_date': self.chat_date.isoformat() if self.chat_date else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class ContactStats(db.Model):
+    """联系人聊天统计的物化结果，在新增聊天记录时增量更新"""
+    contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), primary_key=True)
+    
+    message_count = db.Column(db.Integer, default=0, nullable=False)
+    active_days = db.Column(db.Integer, default=0, nullable=False)
+    first_chat_date = db.Column(db.Date, nullable=True)
+    last_chat_date = db.Column(db.Date, nullable=True)
+    current_streak = db.Column(db.Integer, default=0, nullable=False)
+    longest_streak = db.Column(db.Integer, default=0, nullable=False)
+    
+    response_count = db.Column(db.Integer, default=0, nullable=False)
+    response_total_seconds = db.Column(db.Float, default=0.0, nullable=False)
+    last_speaker = db.Column(db.String(20), nullable=True)
+    last_sent_at = db.Column(db.DateTime, nullable=True)
+    
+    relationship_trend = db.Column(db.String(20), nullable=True)
+    trend_computed_on = db.Column(db.Date, nullable=True)
+    
+    # 时间线汇总（/api/contacts/<id>/timeline/summary）：我方消息数，JSON 格式的每天、每小时消息数。
+    # 后两列按需加载，联系人列表批量加载统计行时不读取
+    my_message_count = db.Column(db.Integer, default=0, nullable=False)
+    daily_counts = db.deferred(db.Column(db.Text, nullable=True))
+    hourly_counts = db.deferred(db.Column(db.Text, nullable=True))
+    
+    # 每次新增聊天记录加一，HTTP 缓存用它判断聊天记录是否变化，见 utils/http_cache.py
+    chat_log_version = db.Column(db.Integer, default=0, nullable=False)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @property
+    def avg_response_seconds(self):
+        if not self.response_count:
+            return None
+        return self.response_total_seconds / self.response_count
+    
+    @property
+    def avg_response_time_text(self):
+        seconds = self.avg_response_seconds
+        if seconds is None:
+            return None
+        if seconds < 60:
+            return f'{int(seconds)}秒'
+        if seconds < 3600:
+            return f'{int(seconds // 60)}分钟'
+        return f'{seconds / 3600:.1f}小时'
+    
+    def to_dict(self):
+        return {
+            'contact_id': self.contact_id,
+            'message_count': self.message_count,
+            'active_days': self.active_days,
+            'first_chat_date': self.first_chat_date.isoformat() if self.first_chat_date else None,
+            'last_chat_date': self.last_chat_date.isoformat() if self.last_chat_date else None,
+            'current_streak': self.current_streak,
+            'longest_streak': self.longest_streak,
+            'avg_response_seconds': self.avg_response_seconds,
+            'relationship_trend': self.relationship_trend,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
 class AnalysisResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False, unique=True)
@@ -166,6 +255,106 @@ class AnalysisResult(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name
+        }
+
+class ProfileTerm(db.Model):
+    """分析结果中兴趣、话题等字段的倒排索引：(field, term) → contact_id"""
+    __table_args__ = (
+        db.UniqueConstraint('contact_id', 'field', 'term', name='uq_profile_term'),
+        db.Index('ix_profile_term_lookup', 'field', 'term', 'contact_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False, index=True)
+    field = db.Column(db.String(30), nullable=False)
+    term = db.Column(db.String(100), nullable=False)
+
+class ChatArchive(db.Model):
+    """按联系人、按月压缩归档的旧聊天记录，读写见 database/archive.py"""
+    __tablename__ = 'chat_log_archive'
+    __table_args__ = (
+        db.UniqueConstraint('contact_id', 'month', name='uq_chat_archive_month'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # 分片模式下归档块与聊天记录存放在同一个分片库中，那里没有 contact 表，因此不设外键
+    contact_id = db.Column(db.Integer, nullable=False, index=True)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    message_count = db.Column(db.Integer, nullable=False)
+    first_date = db.Column(db.Date, nullable=False)
+    last_date = db.Column(db.Date, nullable=False)
+    min_id = db.Column(db.Integer, nullable=False)
+    max_id = db.Column(db.Integer, nullable=False)
+    codec = db.Column(db.String(10), nullable=False)
+    dictionary_id = db.Column(db.Integer, nullable=True)
+    raw_size = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchiveDictionary(db.Model):
+    """归档压缩使用的共享字典，由近期样本训练得到；已有归档块引用的字典不会被修改"""
+    __tablename__ = 'chat_archive_dictionary'
+
+    id = db.Column(db.Integer, primary_key=True)
+    codec = db.Column(db.String(10), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    sample_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UsageRecord(db.Model):
+    """大模型调用台账：每个上游请求（含后备与对冲，成功、失败或取消）一行，汇总与配额见 database/usage.py"""
+    __tablename__ = 'ai_usage'
+    __table_args__ = (
+        db.Index('ix_ai_usage_day_contact', 'day', 'contact_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # 台账比联系人保留得久，联系人删除后记录仍然有效，因此不设外键；离线评估等调用没有联系人
+    contact_id = db.Column(db.Integer, nullable=True, index=True)
+    scope = db.Column(db.String(20), nullable=True)  # all / selected
+    mode = db.Column(db.String(10), nullable=False)  # stream / blocking
+    outcome = db.Column(db.String(10), nullable=False)  # ok / error / cancelled
+    backend = db.Column(db.String(50), nullable=True)
+    model = db.Column(db.String(100), nullable=True)
+    # 用户自带密钥的调用不计入 token 配额
+    user_key = db.Column(db.Boolean, default=False, nullable=False)
+    prompt_tokens = db.Column(db.Integer, default=0, nullable=False)
+    completion_tokens = db.Column(db.Integer, default=0, nullable=False)
+    total_tokens = db.Column(db.Integer, default=0, nullable=False)
+    cost = db.Column(db.Float, default=0.0, nullable=False)
+    latency_ms = db.Column(db.Float, nullable=False)
+    ttft_ms = db.Column(db.Float, nullable=True)
+    day = db.Column(db.Date, nullable=False)  # UTC 日期，按天汇总和配额用
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'contact_id': self.contact_id,
+            'scope': self.scope,
+            'mode': self.mode,
+            'outcome': self.outcome,
+            'backend': self.backend,
+            'model': self.model,
+            'user_key': self.user_key,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.total_tokens,
+            'cost': self.cost,
+            'latency_ms': self.latency_ms,
+            'ttft_ms': self.ttft_ms,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 def init_db(app):
     db.init_app(app)
     with app.app_context():
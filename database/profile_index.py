@@ -0,0 +1,129 @@
+import json
+
+from sqlalchemy import func, intersect, select
+
+from database.models import db, Contact, AnalysisResult, ProfileTerm
+from database.tags import tag_contact_ids_select, tag_counts
+
+# 可查询的分面 → 分析结果中对应的 (列, 嵌套键)；嵌套键为 None 表示整列就是列表
+FACET_SOURCES = {
+    'interest': [('interests', None), ('behavior_preferences', 'interests'), ('behavior_preferences', 'hobbies')],
+    'topic': [('topic_suggestions', None), ('behavior_preferences', 'high_frequency_topics')],
+    'gift': [('gift_suggestions', None)],
+}
+# 'tag' 分面直接查询标签关联表，不在 profile_term 中重复存储
+FACETS = tuple(FACET_SOURCES) + ('tag',)
+MAX_TERM_LENGTH = 100
+
+
+def normalize_term(term):
+    if not isinstance(term, str):
+        return None
+    term = term.strip().casefold()
+    if not term:
+        return None
+    return term[:MAX_TERM_LENGTH]
+
+
+def _load_list(raw, key=None):
+    if not raw:
+        return []
+    try:
+        value = json.loads(raw)
+    except (TypeError, json.JSONDecodeError):
+        return []
+    if key is not None:
+        value = value.get(key, []) if isinstance(value, dict) else []
+    return value if isinstance(value, list) else []
+
+
+def extract_analysis_terms(analysis):
+    """从分析结果中提取 {field: set(term)}"""
+    terms = {field: set() for field in FACET_SOURCES}
+    if analysis is None:
+        return terms
+    for field, sources in FACET_SOURCES.items():
+        for column, key in sources:
+            for value in _load_list(getattr(analysis, column), key):
+                term = normalize_term(value)
+                if term:
+                    terms[field].add(term)
+    return terms
+
+
+def index_contact_analysis(contact_id, analysis):
+    """保存分析结果后调用，用新结果替换该联系人的索引词"""
+    ProfileTerm.query.filter_by(contact_id=contact_id).delete(synchronize_session=False)
+    for field, terms in extract_analysis_terms(analysis).items():
+        for term in terms:
+            db.session.add(ProfileTerm(contact_id=contact_id, field=field, term=term))
+
+
+def rebuild_profile_index():
+    ProfileTerm.query.delete(synchronize_session=False)
+    count = 0
+    for analysis in AnalysisResult.query.all():
+        index_contact_analysis(analysis.contact_id, analysis)
+        count += 1
+    return count
+
+
+def parse_filters(args):
+    """从查询参数中解析分面过滤条件，同一分面可用逗号传多个词"""
+    filters = []
+    for field in FACETS:
+        for raw in args.getlist(field):
+            for value in raw.split(','):
+                term = value.strip() if field == 'tag' else normalize_term(value)
+                if term and (field, term) not in filters:
+                    filters.append((field, term))
+    return filters
+
+
+def matching_contact_ids_query(filters):
+    """返回同时命中所有过滤条件的 contact_id 查询
+
+    每个条件都是 (field, term, contact_id) 覆盖索引上的一次范围扫描，再对结果集求交。
+    """
+    selects = [
+        tag_contact_ids_select(term) if field == 'tag' else
+        select(ProfileTerm.contact_id).where(ProfileTerm.field == field, ProfileTerm.term == term)
+        for field, term in filters
+    ]
+    if len(selects) == 1:
+        return selects[0]
+    return intersect(*selects)
+
+
+def find_contacts(filters, limit=50, offset=0):
+    matched = matching_contact_ids_query(filters).subquery()
+    total = db.session.query(func.count()).select_from(matched).scalar()
+    contacts = db.session.query(Contact.id, Contact.name, Contact.avatar) \
+        .filter(Contact.id.in_(select(matched.c.contact_id))) \
+        .order_by(Contact.updated_at.desc()) \
+        .limit(limit).offset(offset).all()
+    return {
+        'total': total,
+        'contacts': [{'id': c.id, 'name': c.name, 'avatar': c.avatar} for c in contacts]
+    }
+
+
+def facet_counts(field, filters=None, prefix=None, limit=20):
+    """统计某个分面下各词对应的联系人数；传入 filters 时只统计命中过滤条件的联系人"""
+    if field == 'tag':
+        contact_ids = matching_contact_ids_query(filters) if filters else None
+        rows = tag_counts(contact_ids, prefix=prefix.strip() if prefix else None, limit=limit)
+        return [{'term': row['name'], 'count': row['count']} for row in rows]
+    
+    query = db.session.query(ProfileTerm.term, func.count(ProfileTerm.contact_id).label('count')) \
+        .filter(ProfileTerm.field == field)
+    prefix = normalize_term(prefix) if prefix else None
+    if prefix:
+        # 用范围条件代替 LIKE，保证能走 (field, term) 索引
+        query = query.filter(ProfileTerm.term >= prefix, ProfileTerm.term < prefix + '\uffff')
+    if filters:
+        query = query.filter(ProfileTerm.contact_id.in_(matching_contact_ids_query(filters)))
+    rows = query.group_by(ProfileTerm.term) \
+        .order_by(db.desc('count'), ProfileTerm.term) \
+        .limit(limit).all()
+    return [{'term': term, 'count': count} for term, count in rows]
@@ -0,0 +1,228 @@
+"""
+按请求的 SQL 剖析与 N+1 检测（开发 / 剖析模式）
+
+SQL_PROFILER=1 时，每个请求记录执行过的所有语句：耗时、归一化后的语句文本（IN 列表折叠），以及发起查询的
+应用代码位置（跳过 SQLAlchemy、Flask 等库的栈帧，模板中的调用显示为模板文件和行号）。
+同一调用点把同一条 SELECT 执行了 SQL_PROFILER_N_PLUS_ONE 次以上即视为 N+1，常见于在循环里访问
+Contact.chat_count、last_active、analysis_count 这类会触发懒加载的属性。
+
+结果放在响应头 X-SQL-Queries、X-SQL-Time-Ms、X-SQL-N-Plus-One 中，HTML 页面底部另外追加一个调试面板。
+
+测试中用 query_budget / assert_query_budget 给路由设定语句数上限，超出或出现 N+1 时抛出 AssertionError：
+
+    with query_budget(10):
+        client.get('/contacts')
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.metrics import log_event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+N_PLUS_ONE_THRESHOLD = 5
+# 调用点最多向外追溯几层应用代码
+CALL_SITE_DEPTH = 3
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)|\(\s*%\(\w+\)s(?:\s*,\s*%\(\w+\)s)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+_local = threading.local()
+_listeners_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize_statement(statement):
+    return _IN_LIST.sub('(?...)', _WHITESPACE.sub(' ', statement).strip())
+
+
+def _is_app_frame(filename):
+    if not filename.startswith(ROOT) or filename == __file__:
+        return False
+    relative = filename[len(ROOT):]
+    return 'site-packages' not in relative and not relative.startswith(os.sep + 'benchmarks')
+
+
+def call_site(depth=CALL_SITE_DEPTH):
+    """由内向外最多 depth 个应用代码栈帧，格式为 'database/models.py:43 chat_count ← templates/index.html:80'"""
+    sites = []
+    frame = sys._getframe(1)
+    while frame is not None and len(sites) < depth:
+        code = frame.f_code
+        if _is_app_frame(code.co_filename):
+            relative = os.path.relpath(code.co_filename, ROOT).replace(os.sep, '/')
+            name = '' if code.co_name in ('<module>', 'root', 'top-level template code') else f' {code.co_name}'
+            sites.append(f'{relative}:{frame.f_lineno}{name}')
+        frame = frame.f_back
+    return ' ← '.join(sites) or '<unknown>'
+
+
+class QueryProfile:
+    def __init__(self, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+        self.threshold = n_plus_one_threshold
+        self.queries = []
+
+    def record(self, statement, duration, site):
+        self.queries.append((normalize_statement(statement), duration, site))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_ms(self):
+        return sum(duration for _, duration, _ in self.queries) * 1000
+
+    def groups(self):
+        """相同语句归为一组，按执行次数降序"""
+        groups = {}
+        for statement, duration, site in self.queries:
+            group = groups.setdefault(statement, {'statement': statement, 'count': 0, 'total_ms': 0.0,
+                                                  'sites': Counter()})
+            group['count'] += 1
+            group['total_ms'] += duration * 1000
+            group['sites'][site] += 1
+        return sorted(groups.values(), key=lambda group: (-group['count'], -group['total_ms']))
+
+    def n_plus_one(self):
+        """同一调用点重复执行同一条 SELECT 达到阈值的 (调用点, 次数, 语句)"""
+        suspects = []
+        for group in self.groups():
+            if not group['statement'].upper().startswith('SELECT'):
+                continue
+            for site, count in group['sites'].items():
+                if count >= self.threshold:
+                    suspects.append((site, count, group['statement']))
+        return sorted(suspects, key=lambda suspect: -suspect[1])
+
+    def report(self, limit=10):
+        lines = [f'{self.count} 条 SQL，共 {self.total_ms:.1f}ms']
+        for site, count, statement in self.n_plus_one():
+            lines.append(f'  N+1: {count} 次 @ {site}\n       {statement[:200]}')
+        for group in self.groups()[:limit]:
+            lines.append(f"  {group['count']:>4} 次 {group['total_ms']:>8.1f}ms  {group['statement'][:160]}")
+        return '\n'.join(lines)
+
+
+def _active_profiles():
+    stack = getattr(_local, 'profiles', None)
+    if stack is None:
+        stack = _local.profiles = []
+    return stack
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'profiles', None):
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiles = getattr(_local, 'profiles', None)
+    started = conn.info.get('profiler_started')
+    if not profiles or not started:
+        return
+    duration = time.perf_counter() - started.pop()
+    site = call_site()
+    for profile in profiles:
+        profile.record(statement, duration, site)
+
+
+def _install_listeners():
+    with _listeners_lock:
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+@contextmanager
+def profile_queries(n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+    """在当前线程上记录块内执行的全部语句"""
+    _install_listeners()
+    profile = QueryProfile(n_plus_one_threshold)
+    stack = _active_profiles()
+    stack.append(profile)
+    try:
+        yield profile
+    finally:
+        stack.remove(profile)
+
+
+@contextmanager
+def query_budget(max_queries, allow_n_plus_one=False, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+    with profile_queries(n_plus_one_threshold) as profile:
+        yield profile
+    problems = []
+    if profile.count > max_queries:
+        problems.append(f'执行了 {profile.count} 条 SQL，超过预算 {max_queries}')
+    if not allow_n_plus_one and profile.n_plus_one():
+        problems.append('检测到 N+1 查询')
+    if problems:
+        raise QueryBudgetExceeded('；'.join(problems) + '\n' + profile.report())
+
+
+def assert_query_budget(client, path, max_queries, method='GET', allow_n_plus_one=False, **kwargs):
+    """用测试客户端请求 path 并检查语句数，返回响应"""
+    with query_budget(max_queries, allow_n_plus_one) as profile:
+        response = client.open(path, method=method, **kwargs)
+    response.sql_profile = profile
+    return response
+
+
+def _start_request_profile():
+    profile = QueryProfile(g.get('sql_profiler_threshold', N_PLUS_ONE_THRESHOLD))
+    _active_profiles().append(profile)
+    g.sql_profile = profile
+
+
+def _finish_request_profile(response):
+    profile = g.pop('sql_profile', None)
+    if profile is None:
+        return response
+    _active_profiles().remove(profile)
+    suspects = profile.n_plus_one()
+    response.headers['X-SQL-Queries'] = str(profile.count)
+    response.headers['X-SQL-Time-Ms'] = f'{profile.total_ms:.1f}'
+    response.headers['X-SQL-N-Plus-One'] = str(len(suspects))
+    if suspects:
+        response.headers['X-SQL-N-Plus-One-Site'] = suspects[0][0].encode('ascii', 'replace').decode()
+        log_event('sql_n_plus_one', site=suspects[0][0], count=suspects[0][1], statement=suspects[0][2][:200],
+                  queries=profile.count)
+    if response.mimetype == 'text/html' and not response.is_streamed and response.status_code == 200:
+        panel = render_template('sql_profile_panel.html', profile=profile, groups=profile.groups()[:20],
+                                suspects=suspects)
+        body = response.get_data(as_text=True)
+        index = body.rfind('</body>')
+        response.set_data(body[:index] + panel + body[index:] if index >= 0 else body + panel)
+    return response
+
+
+def _discard_request_profile(exc=None):
+    profile = g.pop('sql_profile', None)
+    if profile is not None and profile in _active_profiles():
+        _active_profiles().remove(profile)
+
+
+def init_sql_profiler(app):
+    """SQL_PROFILER 为真时启用按请求的剖析；只应在开发或剖析环境中打开"""
+    if not app.config.get('SQL_PROFILER'):
+        return
+    _install_listeners()
+    threshold = app.config.get('SQL_PROFILER_N_PLUS_ONE', N_PLUS_ONE_THRESHOLD)
+
+    @app.before_request
+    def start():
+        g.sql_profiler_threshold = threshold
+        _start_request_profile()
+
+    app.after_request(_finish_request_profile)
+    app.teardown_request(_discard_request_profile)
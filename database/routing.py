@@ -0,0 +1,34 @@
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND_KEY = 'replica'
+
+
+def replica_requested():
+    return has_app_context() and g.get('db_read_only', False)
+
+
+class RoutingSession(Session):
+    """只读路由内的查询发往只读副本，flush（写入）始终走主库；未配置副本时行为与默认一致"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and replica_requested():
+            replica = self._db.engines.get(REPLICA_BIND_KEY)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """标记只读视图：视图内的查询会被路由到只读副本"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        previous = g.get('db_read_only', False)
+        g.db_read_only = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.db_read_only = previous
+    return wrapper
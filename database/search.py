@@ -0,0 +1,363 @@
+from markupsafe import escape, Markup
+from sqlalchemy import and_, or_, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.models import db, ChatArchive, Contact
+from database.shards import chat_log_sessions
+
+FTS_TABLE = 'chat_log_fts'
+
+# trigram 分词器按 3 个字符切分，对中文这类没有空格分词的文本也能做子串匹配
+FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"content, content='chat_log', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON chat_log BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON chat_log BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON chat_log BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+    f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+]
+
+# 归档后的消息从 chat_log 删除，由 archive_contact 在写入归档块时另外写入这张表（rowid 为消息 id），
+# 检索时与 chat_log 的结果按 id 合并。表是无内容的（content=''），只保存倒排索引，不再保存一份未压缩的正文；
+# 命中消息所在的 (联系人, 月份) 记在 ARCHIVE_FTS_MAP 中（月份存为 YYYYMM 整数，不建二级索引，每行十几个字节），
+# 结果的正文和摘要从对应的归档块解压得到
+ARCHIVE_FTS_TABLE = 'chat_archive_fts'
+ARCHIVE_FTS_MAP = 'chat_archive_fts_map'
+ARCHIVE_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {ARCHIVE_FTS_TABLE} USING fts5("
+    f"content, content='', columnsize=0, tokenize='trigram')",
+    f"CREATE TABLE IF NOT EXISTS {ARCHIVE_FTS_MAP} ("
+    f"id INTEGER PRIMARY KEY, contact_id INTEGER NOT NULL, month INTEGER NOT NULL)",
+]
+
+# PostgreSQL 下用 pg_trgm 的 GIN 索引加速 ILIKE 子串匹配
+PG_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_chat_log_content_trgm ON chat_log USING gin (content gin_trgm_ops)",
+]
+
+# trigram 索引无法匹配少于 3 个字符的词，这类词退回 LIKE 过滤
+MIN_FTS_TERM_LENGTH = 3
+SNIPPET_CONTEXT = 16
+MAX_PAGE_SIZE = 100
+
+
+def fts_available(engine=None):
+    return (engine or db.engine).dialect.name == 'sqlite'
+
+
+def ensure_chat_log_fts(engine=None):
+    """创建全文索引表和同步触发器；首次创建时从 chat_log 重建索引。engine 默认为主库，分片库也各自建一份"""
+    engine = engine or db.engine
+    if engine.dialect.name == 'postgresql':
+        return ensure_pg_trigram_index(engine)
+    if not fts_available(engine):
+        return False
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"),
+            {'name': FTS_TABLE}
+        ).first()
+        for statement in FTS_DDL:
+            conn.execute(text(statement))
+        _ensure_archive_fts(conn, upgrade=True)
+        if not exists:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    return True
+
+
+def ensure_pg_trigram_index(engine=None):
+    try:
+        with (engine or db.engine).begin() as conn:
+            for statement in PG_TRGM_DDL:
+                conn.execute(text(statement))
+        return True
+    except SQLAlchemyError as e:
+        # 没有创建扩展的权限时仍可检索，只是退化为顺序扫描
+        print(f"⚠️ 无法创建 pg_trgm 索引: {e}")
+        return False
+
+
+def drop_chat_log_fts():
+    """删除全文索引表和触发器（重置数据库时使用，下次 ensure 时会重建）"""
+    if not fts_available():
+        return
+    with db.engine.begin() as conn:
+        for suffix in ('ai', 'ad', 'au'):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {ARCHIVE_FTS_TABLE}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {ARCHIVE_FTS_MAP}"))
+
+
+def _engine_of(executor):
+    """executor 为 Session 或 Connection"""
+    return executor.engine if hasattr(executor, 'engine') else executor.get_bind()
+
+
+def _ensure_archive_fts(executor, upgrade=False):
+    """归档检索表不存在时创建，归档不依赖先运行 migrate_fields.py；upgrade 时把旧版保存正文的表换成无内容表，
+    之后需要 reindex_archived_chat_logs() 重建"""
+    if upgrade:
+        sql = executor.execute(
+            text("SELECT sql FROM sqlite_master WHERE type='table' AND name=:name"), {'name': ARCHIVE_FTS_TABLE}
+        ).scalar()
+        if sql is not None and "content=''" not in sql:
+            executor.execute(text(f"DROP TABLE {ARCHIVE_FTS_TABLE}"))
+    for statement in ARCHIVE_FTS_DDL:
+        executor.execute(text(statement))
+
+
+def index_archived_chat_logs(executor, logs):
+    """把刚归档的消息写入归档检索表，与写入归档块在同一事务中提交；非 SQLite 数据库不支持，归档消息不参与检索"""
+    if not logs or not fts_available(_engine_of(executor)):
+        return
+    _ensure_archive_fts(executor)
+    executor.execute(
+        text(f"INSERT INTO {ARCHIVE_FTS_TABLE}(rowid, content) VALUES (:id, :content)"),
+        [{'id': log.id, 'content': log.content} for log in logs]
+    )
+    executor.execute(
+        text(f"INSERT INTO {ARCHIVE_FTS_MAP}(id, contact_id, month) VALUES (:id, :contact_id, :month)"),
+        [{'id': log.id, 'contact_id': log.contact_id, 'month': log.chat_date.year * 100 + log.chat_date.month}
+         for log in logs]
+    )
+
+
+def optimize_chat_log_fts(executor):
+    """合并全文索引的段。FTS5 删除时只写入删除标记，归档大量消息后 chat_log_fts 里仍留着它们的索引，
+    合并后才真正释放；归档检索表批量写入后也合并一次"""
+    if not fts_available(_engine_of(executor)):
+        return
+    _ensure_archive_fts(executor)
+    for table in (FTS_TABLE, ARCHIVE_FTS_TABLE):
+        executor.execute(text(f"INSERT INTO {table}({table}) VALUES ('optimize')"))
+
+
+def clear_archived_chat_log_index(executor, contact_id=None):
+    """删除某个联系人（contact_id 为 None 时为全部）的归档检索数据。无内容表删除时要提供原文，
+    原文从该联系人的归档块解压得到，所以必须在删除归档块之前调用"""
+    from database.archive import decode_block
+
+    if not fts_available(_engine_of(executor)):
+        return
+    _ensure_archive_fts(executor)
+    if contact_id is None:
+        executor.execute(text(f"INSERT INTO {ARCHIVE_FTS_TABLE}({ARCHIVE_FTS_TABLE}) VALUES ('delete-all')"))
+        executor.execute(text(f"DELETE FROM {ARCHIVE_FTS_MAP}"))
+        return
+    indexed = {log_id for log_id, in executor.execute(
+        text(f"SELECT id FROM {ARCHIVE_FTS_MAP} WHERE contact_id = :contact_id"), {'contact_id': contact_id})}
+    if not indexed:
+        return
+    archive = ChatArchive.__table__
+    blocks = executor.execute(select(archive).where(archive.c.contact_id == contact_id)).all()
+    executor.execute(
+        text(f"INSERT INTO {ARCHIVE_FTS_TABLE}({ARCHIVE_FTS_TABLE}, rowid, content) VALUES ('delete', :id, :content)"),
+        [{'id': log.id, 'content': log.content} for block in blocks for log in decode_block(block) if log.id in indexed]
+    )
+    executor.execute(text(f"DELETE FROM {ARCHIVE_FTS_MAP} WHERE contact_id = :contact_id"),
+                     {'contact_id': contact_id})
+
+
+def split_terms(query):
+    terms = []
+    for term in query.split():
+        term = term.strip()
+        if term and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def build_match_expression(terms):
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    return ' AND '.join(quoted)
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def find_spans(content, terms):
+    """返回所有命中词在原文中的 [start, end) 区间，已合并重叠部分"""
+    lowered = content.lower()
+    spans = []
+    for term in terms:
+        needle = term.lower()
+        start = lowered.find(needle)
+        while start != -1:
+            spans.append([start, start + len(needle)])
+            start = lowered.find(needle, start + len(needle))
+    spans.sort()
+    merged = []
+    for span in spans:
+        if merged and span[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span[1])
+        else:
+            merged.append(span)
+    return merged
+
+
+def render_highlight(content, spans, start=0, end=None):
+    """对原文做 HTML 转义后用 <mark> 包裹命中区间"""
+    end = len(content) if end is None else end
+    parts = []
+    cursor = start
+    for span_start, span_end in spans:
+        if span_end <= start or span_start >= end:
+            continue
+        span_start = max(span_start, start)
+        span_end = min(span_end, end)
+        parts.append(str(escape(content[cursor:span_start])))
+        parts.append('<mark>' + str(escape(content[span_start:span_end])) + '</mark>')
+        cursor = span_end
+    parts.append(str(escape(content[cursor:end])))
+    return Markup(''.join(parts))
+
+
+def build_snippet(content, spans, context=SNIPPET_CONTEXT):
+    if not spans:
+        return render_highlight(content[:context * 2], [])
+    start = max(0, spans[0][0] - context)
+    end = min(len(content), spans[0][1] + context)
+    snippet = render_highlight(content, spans, start, end)
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if end < len(content) else ''
+    return Markup(prefix) + snippet + Markup(suffix)
+
+
+def search_chat_logs(query, contact_id=None, limit=20, cursor=None):
+    """按消息 id 倒序做 keyset 分页的全文检索，cursor 为上一页最后一条的 id"""
+    terms = split_terms(query or '')
+    if not terms:
+        return {'results': [], 'next_cursor': None}
+
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    rows = []
+    # 分片模式下在每个分片上各取一页，再按 id 合并；id 全局唯一，游标语义不变
+    for session in chat_log_sessions(contact_id):
+        rows.extend(_search_session(session, terms, contact_id, limit, cursor))
+        if fts_available(session.get_bind()) and _has_archive_index(session):
+            rows.extend(_search_archive(session, terms, contact_id, limit, cursor))
+    rows.sort(key=lambda row: row.id, reverse=True)
+
+    names = {}
+    contact_ids = {row.contact_id for row in rows[:limit]}
+    if contact_ids:
+        names = dict(db.session.query(Contact.id, Contact.name).filter(Contact.id.in_(contact_ids)))
+
+    results = []
+    for row in rows[:limit]:
+        spans = find_spans(row.content, terms)
+        results.append({
+            'id': row.id,
+            'contact_id': row.contact_id,
+            'contact_name': names.get(row.contact_id),
+            'speaker': row.speaker,
+            'chat_date': str(row.chat_date),
+            'content': row.content,
+            'snippet': str(build_snippet(row.content, spans)),
+            'highlight': str(render_highlight(row.content, spans)),
+            'highlights': spans
+        })
+
+    next_cursor = results[-1]['id'] if len(rows) > limit else None
+    return {'results': results, 'next_cursor': next_cursor}
+
+
+def _search_session(session, terms, contact_id, limit, cursor):
+    dialect = session.get_bind().dialect.name
+    fts_terms = [t for t in terms if len(t) >= MIN_FTS_TERM_LENGTH] if dialect == 'sqlite' else []
+    like_terms = [t for t in terms if t not in fts_terms]
+
+    params = {'limit': limit + 1}
+    conditions = []
+    if fts_terms:
+        source = f"{FTS_TABLE} JOIN chat_log ON chat_log.id = {FTS_TABLE}.rowid"
+        conditions.append(f"{FTS_TABLE} MATCH :match")
+        params['match'] = build_match_expression(fts_terms)
+        id_column = f"{FTS_TABLE}.rowid"
+    else:
+        source = "chat_log"
+        id_column = "chat_log.id"
+
+    like = 'ILIKE' if dialect == 'postgresql' else 'LIKE'
+    for i, term in enumerate(like_terms):
+        conditions.append(f"chat_log.content {like} :like_{i} ESCAPE '\\'")
+        params[f'like_{i}'] = _like_pattern(term)
+
+    if contact_id is not None:
+        conditions.append("chat_log.contact_id = :contact_id")
+        params['contact_id'] = contact_id
+    if cursor is not None:
+        conditions.append(f"{id_column} < :cursor")
+        params['cursor'] = cursor
+
+    sql = (
+        f"SELECT chat_log.id, chat_log.contact_id, chat_log.speaker, "
+        f"chat_log.content, chat_log.chat_date "
+        f"FROM {source} "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {id_column} DESC LIMIT :limit"
+    )
+    return session.execute(text(sql), params).fetchall()
+
+
+def _has_archive_index(session):
+    """还没归档过、也没运行过 migrate_fields.py 的库里没有归档检索表，检索路径只读，不在这里创建"""
+    return session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"), {'name': ARCHIVE_FTS_MAP}
+    ).first() is not None
+
+
+def _search_archive(session, terms, contact_id, limit, cursor):
+    """在归档检索表中查找，返回解压出的 ArchivedChatLog（属性与 _search_session 的列相同）。
+    不足 3 个字符的词无法用索引匹配，只能在解压后过滤，此时按 id 倒序分批取候选直到凑满一页"""
+    from database.archive import decode_block
+
+    fts_terms = [t for t in terms if len(t) >= MIN_FTS_TERM_LENGTH]
+    like_terms = [t.lower() for t in terms if t not in fts_terms]
+    params = {'limit': limit + 1}
+    conditions = []
+    if fts_terms:
+        source = f"{ARCHIVE_FTS_TABLE} JOIN {ARCHIVE_FTS_MAP} ON {ARCHIVE_FTS_MAP}.id = {ARCHIVE_FTS_TABLE}.rowid"
+        conditions.append(f"{ARCHIVE_FTS_TABLE} MATCH :match")
+        params['match'] = build_match_expression(fts_terms)
+        id_column = f"{ARCHIVE_FTS_TABLE}.rowid"
+    else:
+        source = ARCHIVE_FTS_MAP
+        id_column = f"{ARCHIVE_FTS_MAP}.id"
+    if contact_id is not None:
+        conditions.append(f"{ARCHIVE_FTS_MAP}.contact_id = :contact_id")
+        params['contact_id'] = contact_id
+    conditions.append(f"{id_column} < :cursor")
+    sql = (
+        f"SELECT {ARCHIVE_FTS_MAP}.id, {ARCHIVE_FTS_MAP}.contact_id, {ARCHIVE_FTS_MAP}.month "
+        f"FROM {source} "
+        f"WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {id_column} DESC LIMIT :limit"
+    )
+
+    blocks = {}
+    results = []
+    params['cursor'] = cursor if cursor is not None else 2 ** 63 - 1
+    while len(results) <= limit:
+        candidates = session.execute(text(sql), params).fetchall()
+        candidates = [(log_id, cid, f'{month // 100:04d}-{month % 100:02d}') for log_id, cid, month in candidates]
+        wanted = {(cid, month) for _, cid, month in candidates} - set(blocks)
+        if wanted:
+            for block in session.query(ChatArchive).filter(
+                    or_(*[and_(ChatArchive.contact_id == cid, ChatArchive.month == month) for cid, month in wanted])):
+                blocks[(block.contact_id, block.month)] = {log.id: log for log in decode_block(block)}
+        for log_id, cid, month in candidates:
+            log = blocks.get((cid, month), {}).get(log_id)
+            if log is not None and all(term in log.content.lower() for term in like_terms):
+                results.append(log)
+        if len(candidates) <= limit or not like_terms:
+            break
+        params['cursor'] = candidates[-1][0]
+    return results[:limit + 1]
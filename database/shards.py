@@ -0,0 +1,427 @@
+"""
+聊天记录分片存储（可选）
+
+配置 CHAT_LOG_SHARDS > 0 后，chat_log 表按 contact_id 拆分到 CHAT_LOG_SHARD_DIR 下的多个 SQLite 文件，
+联系人、分析结果等其余表仍留在主库。同一联系人的全部消息总在同一个分片，所以单个联系人的读写只访问一个分片；
+首页等全局统计在各分片上并行执行后合并。消息 id 由主库的 chat_log_id_sequence 统一分配，跨分片全局唯一，
+全文检索的游标和向量索引因此不受影响。
+
+未开启分片时，这里的函数全部退回 db.session 上的普通查询，调用方无需区分两种模式。
+"""
+import bisect
+import glob
+import os
+import threading
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import case, create_engine, func, insert, select, union_all, update
+from sqlalchemy.orm import Session
+
+from config import engine_options
+from database.engine import apply_sqlite_pragmas
+from database.models import db, ChatLog, ChatArchive, chat_log_id_sequence
+
+SHARD_FILE_PATTERN = 'chat_log_{:03d}.db'
+EXTENSION_KEY = 'chat_log_shards'
+# 分片库里没有 contact 表，外键约束只能在主库检查
+SHARD_PRAGMA_EXCLUDE = ('foreign_keys',)
+
+
+class ShardRouter:
+    """根据 contact_id 选择分片；strategy 为 'hash'（crc32 取模）或 'range'（按 contact_id 上界切分）"""
+
+    def __init__(self, directory, count, strategy='hash', ranges=None, pragmas=None):
+        if strategy not in ('hash', 'range'):
+            raise ValueError(f'未知的分片策略: {strategy}')
+        ranges = sorted(ranges or [])
+        if strategy == 'range' and len(ranges) != count - 1:
+            raise ValueError(f'range 策略需要 {count - 1} 个分界值，实际为 {len(ranges)} 个')
+        self.directory = directory
+        self.count = count
+        self.strategy = strategy
+        self.ranges = ranges
+        self.pragmas = {k: v for k, v in (pragmas or {}).items() if k not in SHARD_PRAGMA_EXCLUDE}
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def shard_for(self, contact_id):
+        if self.strategy == 'range':
+            return bisect.bisect_right(self.ranges, contact_id)
+        return zlib.crc32(str(contact_id).encode('ascii')) % self.count
+
+    def path(self, shard):
+        return os.path.join(self.directory, SHARD_FILE_PATTERN.format(shard))
+
+    def engine(self, shard):
+        with self._lock:
+            engine = self._engines.get(shard)
+            if engine is None:
+                engine = open_shard_engine(self.path(shard), self.pragmas)
+                self._engines[shard] = engine
+            return engine
+
+    def engines(self):
+        return [self.engine(shard) for shard in range(self.count)]
+
+    def dispose(self, close=True):
+        """close=False 用于 fork 之后的子进程：只丢弃继承来的连接，不去关闭父进程仍在使用的句柄"""
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose(close=close)
+            self._engines.clear()
+
+
+def open_shard_engine(path, pragmas=None):
+    """打开（必要时创建）一个分片文件，建好 chat_log、归档表、索引和全文检索表"""
+    from database.search import ensure_chat_log_fts
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    url = 'sqlite:///' + path
+    engine = create_engine(url, **engine_options(url, pool_size=5, max_overflow=5))
+    apply_sqlite_pragmas(engine, pragmas)
+    ChatLog.__table__.create(engine, checkfirst=True)
+    ChatArchive.__table__.create(engine, checkfirst=True)
+    ensure_chat_log_fts(engine)
+    return engine
+
+
+def existing_shard_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, SHARD_FILE_PATTERN.replace('{:03d}', '*'))))
+
+
+def init_chat_log_shards(app):
+    """在 configure_engine(app) 之后调用；CHAT_LOG_SHARDS 为 0 时不做任何事"""
+    count = app.config.get('CHAT_LOG_SHARDS', 0)
+    if not count:
+        return None
+    router = ShardRouter(
+        app.config['CHAT_LOG_SHARD_DIR'],
+        count,
+        strategy=app.config.get('CHAT_LOG_SHARD_STRATEGY', 'hash'),
+        ranges=app.config.get('CHAT_LOG_SHARD_RANGES'),
+        pragmas=app.config.get('SQLITE_PRAGMAS')
+    )
+    app.extensions[EXTENSION_KEY] = router
+    app.teardown_appcontext(close_shard_sessions)
+    return router
+
+
+def get_shard_router():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(EXTENSION_KEY)
+
+
+def sharding_enabled():
+    return get_shard_router() is not None
+
+
+def _shard_session(shard):
+    sessions = g.setdefault('chat_log_shard_sessions', {})
+    session = sessions.get(shard)
+    if session is None:
+        session = Session(bind=get_shard_router().engine(shard))
+        sessions[shard] = session
+    return session
+
+
+def close_shard_sessions(exc=None):
+    for session in g.pop('chat_log_shard_sessions', {}).values():
+        session.close()
+
+
+def chat_log_session(contact_id):
+    """返回存放该联系人聊天记录的会话"""
+    router = get_shard_router()
+    if router is None:
+        return db.session
+    return _shard_session(router.shard_for(contact_id))
+
+
+def chat_log_sessions(contact_id=None):
+    """返回需要扫描的全部会话：指定联系人时只有一个，否则为所有分片"""
+    router = get_shard_router()
+    if router is None:
+        return [db.session]
+    if contact_id is not None:
+        return [chat_log_session(contact_id)]
+    return [_shard_session(shard) for shard in range(router.count)]
+
+
+def chat_log_query(contact_id):
+    """某个联系人的聊天记录查询，用法与 ChatLog.query.filter_by(contact_id=...) 相同"""
+    return chat_log_session(contact_id).query(ChatLog).filter(ChatLog.contact_id == contact_id)
+
+
+def _max_chat_log_id():
+    max_id = db.session.query(func.max(ChatLog.id)).scalar() or 0
+    router = get_shard_router()
+    if router is not None:
+        for engine in router.engines():
+            with engine.connect() as conn:
+                max_id = max(max_id, conn.execute(select(func.max(ChatLog.id))).scalar() or 0)
+    return max_id
+
+
+def _seed_chat_log_id_sequence(conn):
+    """首次分配时按现有最大 id 插入序列行；多个进程同时首次分配时只有一个插入生效，其余忽略冲突"""
+    table = chat_log_id_sequence
+    values = {'id': 1, 'next_id': _max_chat_log_id() + 1}
+    if conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(**values).on_conflict_do_nothing(index_elements=['id'])
+    elif conn.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(table).values(**values).on_conflict_do_nothing(index_elements=['id'])
+    else:
+        stmt = insert(table).values(**values).prefix_with('IGNORE')
+    conn.execute(stmt)
+
+
+def reserve_chat_log_ids(count):
+    """从主库的序列表预留 count 个连续 id，返回第一个；在独立事务中提交，分片写入失败也不会复用"""
+    table = chat_log_id_sequence
+    advance = update(table).where(table.c.id == 1).values(next_id=table.c.next_id + count)
+    with db.engine.begin() as conn:
+        if not conn.execute(advance).rowcount:
+            _seed_chat_log_id_sequence(conn)
+            conn.execute(advance)
+        end = conn.execute(select(table.c.next_id).where(table.c.id == 1)).scalar()
+    return end - count
+
+
+def add_chat_logs(contact_id, logs):
+    """把新消息写入该联系人所在的会话并 flush；分片模式下先分配全局 id"""
+    if not logs:
+        return logs
+    session = chat_log_session(contact_id)
+    if session is not db.session:
+        first_id = reserve_chat_log_ids(len(logs))
+        for offset, log in enumerate(logs):
+            log.id = first_id + offset
+    session.add_all(logs)
+    session.flush()
+    return logs
+
+
+def commit_chat_logs(contact_id):
+    """分片模式下提交分片事务；应在提交主库（统计等）之前调用"""
+    session = chat_log_session(contact_id)
+    if session is not db.session:
+        session.commit()
+
+
+def delete_chat_logs(contact_id):
+    """删除联系人时调用；单库模式下 chat_log 由 Contact.chat_logs 的级联删除处理，归档块随主库事务提交"""
+    from database.search import clear_archived_chat_log_index
+
+    session = chat_log_session(contact_id)
+    clear_archived_chat_log_index(session, contact_id)
+    session.query(ChatArchive).filter(ChatArchive.contact_id == contact_id).delete(synchronize_session=False)
+    if session is not db.session:
+        session.query(ChatLog).filter(ChatLog.contact_id == contact_id).delete(synchronize_session=False)
+        session.commit()
+
+
+def chat_logs_by_ids(ids):
+    """按 id 批量取消息（语义搜索命中等），返回 {id: ChatLog}"""
+    ids = list(ids)
+    if not ids:
+        return {}
+    logs = {}
+    for session in chat_log_sessions():
+        for log in session.query(ChatLog).filter(ChatLog.id.in_(ids)):
+            logs[log.id] = log
+    return logs
+
+
+def _map_engines(fn):
+    """在每个分片上并行执行 fn(connection)，返回结果列表；未分片时只在主库执行一次"""
+    router = get_shard_router()
+    if router is None:
+        return [fn(db.session)]
+    engines = router.engines()
+
+    def run(engine):
+        with engine.connect() as conn:
+            return fn(conn)
+
+    with ThreadPoolExecutor(max_workers=min(len(engines), 8)) as pool:
+        return list(pool.map(run, engines))
+
+
+def count_chat_logs():
+    """消息总数，包含已归档的消息"""
+    def count(conn):
+        live = conn.execute(select(func.count(ChatLog.id))).scalar() or 0
+        archived = conn.execute(select(func.sum(ChatArchive.message_count))).scalar() or 0
+        return live + archived
+    return sum(_map_engines(count))
+
+
+def daily_chat_log_counts(start, end):
+    """返回 {date: 消息数}，覆盖 [start, end] 闭区间内有消息的日期"""
+    stmt = select(ChatLog.chat_date, func.count(ChatLog.id)) \
+        .where(ChatLog.chat_date >= start, ChatLog.chat_date <= end) \
+        .group_by(ChatLog.chat_date)
+    totals = Counter()
+    for rows in _map_engines(lambda conn: conn.execute(stmt).all()):
+        for chat_date, count in rows:
+            totals[chat_date] += count
+    return totals
+
+
+def trend_window_counts(previous_start, recent_start, end):
+    """按联系人统计两个相邻窗口的消息数，返回 {contact_id: (近期 [recent_start, end], 前一窗口 [previous_start, recent_start))}"""
+    is_recent = ChatLog.chat_date >= recent_start
+    stmt = select(ChatLog.contact_id, func.sum(case((is_recent, 1), else_=0)), func.sum(case((is_recent, 0), else_=1))) \
+        .where(ChatLog.chat_date >= previous_start, ChatLog.chat_date <= end) \
+        .group_by(ChatLog.contact_id)
+    counts = {}
+    for rows in _map_engines(lambda conn: conn.execute(stmt).all()):
+        for contact_id, recent, previous in rows:
+            counts[contact_id] = (int(recent or 0), int(previous or 0))
+    return counts
+
+
+def top_contacts_by_messages(limit=1):
+    """返回消息最多的 [(contact_id, count)]；同一联系人只在一个分片中，各分片取前 limit 个后合并即可"""
+    counts = union_all(
+        select(ChatLog.contact_id, func.count(ChatLog.id).label('count')).group_by(ChatLog.contact_id),
+        select(ChatArchive.contact_id, func.sum(ChatArchive.message_count).label('count')).group_by(ChatArchive.contact_id)
+    ).subquery()
+    total = func.sum(counts.c.count)
+    stmt = select(counts.c.contact_id, total) \
+        .group_by(counts.c.contact_id) \
+        .order_by(total.desc(), counts.c.contact_id) \
+        .limit(limit)
+    merged = []
+    for rows in _map_engines(lambda conn: conn.execute(stmt).all()):
+        merged.extend((contact_id, count) for contact_id, count in rows)
+    merged.sort(key=lambda item: (-item[1], item[0]))
+    return merged[:limit]
+
+
+def iter_chat_log_batches(columns, after_id=0, batch_size=5000):
+    """按 id 升序分批遍历所有分片中的消息，每批为 columns 对应的行列表"""
+    while True:
+        rows = []
+        for session in chat_log_sessions():
+            rows.extend(session.query(*columns)
+                        .filter(ChatLog.id > after_id)
+                        .order_by(ChatLog.id)
+                        .limit(batch_size).all())
+        if not rows:
+            return
+        # 取各分片结果合并后的前 batch_size 行：任何 id 更小的行都已包含在某个分片的这一批里
+        rows.sort(key=lambda row: row.id)
+        rows = rows[:batch_size]
+        yield rows
+        after_id = rows[-1].id
+
+
+def delete_all_chat_logs():
+    """清空所有聊天记录（重置开发环境时使用）；单库模式下随主库事务一起提交"""
+    from database.search import clear_archived_chat_log_index
+
+    for session in chat_log_sessions():
+        session.query(ChatLog).delete(synchronize_session=False)
+        clear_archived_chat_log_index(session)
+        session.query(ChatArchive).delete(synchronize_session=False)
+        if session is not db.session:
+            session.commit()
+
+
+def _copy_contact_logs(source, target, contact_id, batch_size):
+    from database.archive import decode_block
+    from database.search import clear_archived_chat_log_index, index_archived_chat_logs
+
+    table = ChatLog.__table__
+    copied = 0
+    last_id = 0
+    while True:
+        with source.connect() as conn:
+            rows = conn.execute(
+                select(table)
+                .where(table.c.contact_id == contact_id, table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).mappings().all()
+        if not rows:
+            break
+        # 中断后重跑时目标分片里可能已有部分记录，按 id 忽略重复
+        with target.begin() as conn:
+            conn.execute(table.insert().prefix_with('OR IGNORE'), [dict(row) for row in rows])
+        copied += len(rows)
+        last_id = rows[-1]['id']
+
+    # 归档块的 id 是各库自增的，复制时重新分配；(contact_id, month) 唯一约束保证重跑不会重复。
+    # 归档检索数据与归档块在同一事务中写入，重跑时先按目标分片已有的块清掉上次写入的部分
+    archive = ChatArchive.__table__
+    with source.connect() as conn:
+        blocks = conn.execute(select(archive).where(archive.c.contact_id == contact_id)).all()
+    if blocks:
+        with target.begin() as conn:
+            clear_archived_chat_log_index(conn, contact_id)
+            conn.execute(archive.insert().prefix_with('OR IGNORE'),
+                         [{k: v for k, v in block._mapping.items() if k != 'id'} for block in blocks])
+            index_archived_chat_logs(conn, [log for block in blocks for log in decode_block(block)])
+    return copied
+
+
+def rebalance_chat_logs(router, batch_size=5000, include_primary=True, dry_run=False, log=print):
+    """把每个联系人的消息移动到 router 当前配置指定的分片。
+
+    扫描主库 chat_log 表（从单库迁移到分片时）以及目录下所有已有的分片文件（修改分片数或策略后），
+    逐个联系人先复制到目标分片再从原处删除（归档块及其检索数据一起移动），可中断后重复执行。运行期间应停止写入。
+    """
+    from database.search import clear_archived_chat_log_index
+
+    sources = []
+    if include_primary:
+        sources.append(('主库', db.engine))
+    router_paths = {os.path.abspath(router.path(shard)): shard for shard in range(router.count)}
+    extra_engines = []
+    for path in existing_shard_paths(router.directory):
+        shard = router_paths.get(os.path.abspath(path))
+        if shard is not None:
+            sources.append((os.path.basename(path), router.engine(shard)))
+        else:
+            engine = open_shard_engine(path, router.pragmas)
+            extra_engines.append(engine)
+            sources.append((os.path.basename(path), engine))
+
+    report = {'contacts': 0, 'messages': 0, 'by_target': Counter()}
+    try:
+        for name, source in sources:
+            with source.connect() as conn:
+                counts = union_all(
+                    select(ChatLog.contact_id, func.count(ChatLog.id).label('count')).group_by(ChatLog.contact_id),
+                    select(ChatArchive.contact_id, func.sum(ChatArchive.message_count).label('count'))
+                    .group_by(ChatArchive.contact_id)
+                ).subquery()
+                contact_counts = conn.execute(
+                    select(counts.c.contact_id, func.sum(counts.c.count)).group_by(counts.c.contact_id)
+                ).all()
+            moves = [(cid, count, router.shard_for(cid)) for cid, count in contact_counts
+                     if router.engine(router.shard_for(cid)) is not source]
+            if moves:
+                log(f"  {name}: {len(moves)} 个联系人、{sum(m[1] for m in moves)} 条消息需要迁移")
+            for contact_id, count, shard in moves:
+                report['contacts'] += 1
+                report['messages'] += count
+                report['by_target'][shard] += count
+                if dry_run:
+                    continue
+                _copy_contact_logs(source, router.engine(shard), contact_id, batch_size)
+                with source.begin() as conn:
+                    clear_archived_chat_log_index(conn, contact_id)
+                    conn.execute(ChatLog.__table__.delete().where(ChatLog.contact_id == contact_id))
+                    conn.execute(ChatArchive.__table__.delete().where(ChatArchive.contact_id == contact_id))
+    finally:
+        for engine in extra_engines:
+            engine.dispose()
+    return report
@@ -0,0 +1,255 @@
+import json
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+
+from database.models import db, Contact, ChatLog, ContactStats, AnalysisResult
+from database.archive import iter_stats_rows
+from database.shards import chat_log_query, trend_window_counts
+
+# 关系趋势比较的滚动窗口长度（天）
+TREND_WINDOW_DAYS = 30
+# 近期窗口消息量相对前一窗口变化超过该比例才视为升温/降温
+TREND_THRESHOLD = 0.2
+# 超过该间隔的回复不计入响应时间（通常是换了话题而不是回复）
+MAX_RESPONSE_SECONDS = 6 * 3600
+
+
+def compute_streaks(sorted_dates):
+    """对已排序且去重的日期做单次遍历，返回 (最长连续天数, 截至最后一天的连续天数)"""
+    longest = 0
+    current = 0
+    prev = None
+    for d in sorted_dates:
+        if prev is not None and (d - prev).days == 1:
+            current += 1
+        else:
+            current = 1
+        longest = max(longest, current)
+        prev = d
+    return longest, current
+
+
+def is_response(prev_speaker, prev_sent_at, speaker, sent_at):
+    if prev_speaker != '我' or speaker == '我':
+        return False
+    if prev_sent_at is None or sent_at is None:
+        return False
+    if prev_sent_at.date() != sent_at.date():
+        return False
+    delta = (sent_at - prev_sent_at).total_seconds()
+    return 0 <= delta <= MAX_RESPONSE_SECONDS
+
+
+def compute_trend(recent_count, previous_count):
+    if recent_count == 0 and previous_count == 0:
+        return None
+    if previous_count == 0:
+        return 'up'
+    change = (recent_count - previous_count) / previous_count
+    if change > TREND_THRESHOLD:
+        return 'up'
+    if change < -TREND_THRESHOLD:
+        return 'down'
+    return 'stable'
+
+
+def _window_starts(today):
+    """(近期窗口起点, 前一窗口起点)；近期窗口为截至 today 的 TREND_WINDOW_DAYS 天"""
+    recent_start = today - timedelta(days=TREND_WINDOW_DAYS - 1)
+    return recent_start, recent_start - timedelta(days=TREND_WINDOW_DAYS)
+
+
+def _window_counts(contact_id, today):
+    recent_start, previous_start = _window_starts(today)
+    base = chat_log_query(contact_id)
+    recent = base.filter(ChatLog.chat_date >= recent_start, ChatLog.chat_date <= today).count()
+    previous = base.filter(ChatLog.chat_date >= previous_start, ChatLog.chat_date < recent_start).count()
+    return recent, previous
+
+
+def _refresh_trend(stats, today=None):
+    today = today or date.today()
+    recent, previous = _window_counts(stats.contact_id, today)
+    stats.relationship_trend = compute_trend(recent, previous)
+    stats.trend_computed_on = today
+
+
+def refresh_relationship_trends(today=None):
+    """重算所有不是今天计算的关系趋势并提交，返回更新的联系人数。
+
+    趋势窗口随日期滚动，没有新消息的联系人也会过期；写入消息时会顺带更新，其余的由每天定时执行的
+    refresh_trends.py 批量处理：每个分片一条按联系人分组的查询，读请求从不重算或写库。
+    """
+    today = today or date.today()
+    recent_start, previous_start = _window_starts(today)
+    counts = trend_window_counts(previous_start, recent_start, today)
+    stale = ContactStats.query.filter(
+        or_(ContactStats.trend_computed_on.is_(None), ContactStats.trend_computed_on != today)
+    ).all()
+    for stats in stale:
+        stats.relationship_trend = compute_trend(*counts.get(stats.contact_id, (0, 0)))
+        stats.trend_computed_on = today
+    db.session.commit()
+    return len(stale)
+
+
+def load_summary_counts(stats):
+    """(每天消息数, 每小时消息数)，键分别为 ISO 日期和小时的字符串"""
+    days = Counter(json.loads(stats.daily_counts)) if stats.daily_counts else Counter()
+    hours = Counter(json.loads(stats.hourly_counts)) if stats.hourly_counts else Counter()
+    return days, hours
+
+
+def dump_summary_counts(days, hours):
+    """load_summary_counts 的逆操作，返回 (daily_counts, hourly_counts) 两列的 JSON 文本"""
+    return (json.dumps(dict(sorted(days.items()))),
+            json.dumps({str(h): hours[str(h)] for h in sorted(int(h) for h in hours)}))
+
+
+def _store_summary_counts(stats, days, hours):
+    stats.daily_counts, stats.hourly_counts = dump_summary_counts(days, hours)
+
+
+def rebuild_contact_stats(contact_id, stats=None):
+    """全量重算某个联系人的统计并加入会话（迁移旧库或补录历史记录时使用），由调用方提交"""
+    if stats is None:
+        stats = db.session.get(ContactStats, contact_id) or ContactStats(contact_id=contact_id)
+    _compute_contact_stats(contact_id, stats)
+    db.session.add(stats)
+    return stats
+
+
+def compute_contact_stats(contact_id):
+    """全量计算一份不加入会话的统计，供读请求在统计行缺失时临时使用"""
+    return _compute_contact_stats(contact_id, ContactStats(contact_id=contact_id))
+
+
+def _compute_contact_stats(contact_id, stats):
+    # 已归档的旧消息同样计入，见 database/archive.py
+    message_count = 0
+    dates = []
+    response_count = 0
+    response_total = 0.0
+    prev_speaker = None
+    prev_sent_at = None
+    my_count = 0
+    days = Counter()
+    hours = Counter()
+    for chat_date, sent_at, _, speaker in iter_stats_rows(contact_id):
+        message_count += 1
+        my_count += speaker == '我'
+        days[chat_date.isoformat()] += 1
+        if sent_at is not None:
+            hours[str(sent_at.hour)] += 1
+        if not dates or dates[-1] != chat_date:
+            dates.append(chat_date)
+        if is_response(prev_speaker, prev_sent_at, speaker, sent_at):
+            response_count += 1
+            response_total += (sent_at - prev_sent_at).total_seconds()
+        prev_speaker = speaker
+        prev_sent_at = sent_at
+
+    stats.message_count = message_count
+    stats.active_days = len(dates)
+    stats.first_chat_date = dates[0] if dates else None
+    stats.last_chat_date = dates[-1] if dates else None
+    stats.longest_streak, stats.current_streak = compute_streaks(dates)
+    stats.response_count = response_count
+    stats.response_total_seconds = response_total
+    stats.last_speaker = prev_speaker
+    stats.last_sent_at = prev_sent_at
+    stats.my_message_count = my_count
+    _store_summary_counts(stats, days, hours)
+
+    _refresh_trend(stats)
+    return stats
+
+
+def contact_summary_options():
+    """列表类页面会对每个联系人调用 to_dict()、chat_count 等属性：一次批量加载统计行和分析结果的主键，
+    避免逐个懒加载（N+1）。分析结果只用来判断是否存在，不加载正文"""
+    return (
+        selectinload(Contact.stats),
+        selectinload(Contact.analysis).load_only(AnalysisResult.id, AnalysisResult.contact_id),
+    )
+
+
+def empty_contact_stats(contact_id=None):
+    """新建联系人时的统计行"""
+    return ContactStats(contact_id=contact_id, message_count=0, active_days=0, current_streak=0, longest_streak=0,
+                        response_count=0, response_total_seconds=0.0, chat_log_version=0, my_message_count=0,
+                        daily_counts='{}', hourly_counts='{}')
+
+
+def ensure_contact_stats(contact):
+    """返回联系人的统计行，只读不写：列表、详情等读请求都会经过这里。
+
+    旧数据库中还没有统计行时临时算一份返回但不保存，持久化由 migrate_fields.py 或下一次写入消息完成。
+    """
+    if contact.stats is not None:
+        return contact.stats
+    if contact.id is None:
+        return empty_contact_stats()
+    return compute_contact_stats(contact.id)
+
+
+def update_contact_stats(contact, new_logs):
+    """新增聊天记录后增量更新统计，new_logs 需已 flush 到当前会话。
+
+    只有补录早于最后聊天日期的记录时才需要全量重算，其余情况只处理新记录本身。
+    """
+    stats = contact.stats
+    if stats is None:
+        stats = rebuild_contact_stats(contact.id)
+        contact.stats = stats
+        return _bump_chat_log_version(stats)
+    if not new_logs:
+        return stats
+
+    new_logs = sorted(new_logs, key=lambda log: (log.chat_date, log.sent_at or log.created_at, log.id or 0))
+    if stats.last_chat_date and new_logs[0].chat_date < stats.last_chat_date:
+        return _bump_chat_log_version(rebuild_contact_stats(contact.id, stats))
+
+    stats.message_count += len(new_logs)
+    stats.my_message_count = (stats.my_message_count or 0) + sum(log.speaker == '我' for log in new_logs)
+    days, hours = load_summary_counts(stats)
+    for log in new_logs:
+        days[log.chat_date.isoformat()] += 1
+        if log.sent_at is not None:
+            hours[str(log.sent_at.hour)] += 1
+    _store_summary_counts(stats, days, hours)
+
+    for chat_date in sorted({log.chat_date for log in new_logs}):
+        if stats.last_chat_date == chat_date:
+            continue
+        if stats.last_chat_date and (chat_date - stats.last_chat_date).days == 1:
+            stats.current_streak += 1
+        else:
+            stats.current_streak = 1
+        stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+        stats.active_days += 1
+        if stats.first_chat_date is None:
+            stats.first_chat_date = chat_date
+        stats.last_chat_date = chat_date
+
+    prev_speaker = stats.last_speaker
+    prev_sent_at = stats.last_sent_at
+    for log in new_logs:
+        if is_response(prev_speaker, prev_sent_at, log.speaker, log.sent_at):
+            stats.response_count += 1
+            stats.response_total_seconds += (log.sent_at - prev_sent_at).total_seconds()
+        prev_speaker = log.speaker
+        prev_sent_at = log.sent_at
+    stats.last_speaker = prev_speaker
+    stats.last_sent_at = prev_sent_at
+
+    _refresh_trend(stats)
+    return _bump_chat_log_version(stats)
+
+
+def _bump_chat_log_version(stats):
+    stats.chat_log_version = (stats.chat_log_version or 0) + 1
+    return stats
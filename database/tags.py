@@ -0,0 +1,89 @@
+import re
+
+from sqlalchemy import func, intersect, select, union
+
+from database.models import db, Contact, Tag, contact_tag
+
+MAX_TAG_LENGTH = 50
+TAG_SEPARATORS = re.compile(r'[,，、]')
+
+
+def parse_tags(value):
+    """把逗号分隔的字符串或列表解析为去重后的标签名列表，保持原有顺序"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = TAG_SEPARATORS.split(value)
+    names = []
+    for name in value:
+        if not isinstance(name, str):
+            continue
+        name = name.strip()[:MAX_TAG_LENGTH]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def get_or_create_tags(names):
+    if not names:
+        return []
+    existing = {tag.name: tag for tag in Tag.query.filter(Tag.name.in_(names))}
+    tags = []
+    for name in names:
+        tag = existing.get(name)
+        if tag is None:
+            tag = Tag(name=name)
+            db.session.add(tag)
+            existing[name] = tag
+        tags.append(tag)
+    return tags
+
+
+def set_contact_tags(contact, value):
+    """更新联系人的标签关联，同时保留 Contact.tags 字符串供模板直接显示"""
+    names = parse_tags(value)
+    contact.tag_items = get_or_create_tags(names)
+    contact.tags = ','.join(names)
+    return names
+
+
+def tag_counts(contact_ids=None, prefix=None, limit=None):
+    """返回 [{'name', 'count'}]，按使用次数倒序；传入 contact_ids 查询时只统计这些联系人"""
+    query = db.session.query(Tag.name, func.count(contact_tag.c.contact_id).label('count')) \
+        .join(contact_tag, contact_tag.c.tag_id == Tag.id)
+    if prefix:
+        query = query.filter(Tag.name >= prefix, Tag.name < prefix + '\uffff')
+    if contact_ids is not None:
+        query = query.filter(contact_tag.c.contact_id.in_(contact_ids))
+    query = query.group_by(Tag.id).order_by(db.desc('count'), Tag.name)
+    if limit:
+        query = query.limit(limit)
+    return [{'name': name, 'count': count} for name, count in query]
+
+
+def tag_contact_ids_select(name):
+    return select(contact_tag.c.contact_id) \
+        .join(Tag, Tag.id == contact_tag.c.tag_id) \
+        .where(Tag.name == name)
+
+
+def contact_ids_with_tags(names, match='all'):
+    """返回带有指定标签的 contact_id 查询；match='all' 取交集，'any' 取并集"""
+    selects = [tag_contact_ids_select(name) for name in names]
+    if len(selects) == 1:
+        return selects[0]
+    return intersect(*selects) if match == 'all' else union(*selects)
+
+
+def contacts_with_tags(names, match='all'):
+    matched = contact_ids_with_tags(names, match).subquery()
+    return Contact.query.filter(Contact.id.in_(select(matched.c.contact_id)))
+
+
+def migrate_tags_from_csv():
+    """从旧的 Contact.tags 逗号分隔字段生成标签表和关联表，可重复执行"""
+    count = 0
+    for contact in Contact.query.all():
+        set_contact_tags(contact, contact.tags)
+        count += 1
+    return count
@@ -0,0 +1,144 @@
+"""
+资料页聊天时间线的分页读取
+
+时间线按日期升序分页，每页大约 limit 条消息，但同一天的消息总是完整地落在同一页，
+游标是上一页最后一天的日期。未归档部分先按日期聚合计数（走 ix_chat_log_contact_date），
+归档块只在本页日期范围与其相交时才解压，因此每页的开销只与页大小相关，与联系人的消息总量无关。
+"""
+from collections import Counter
+from datetime import timedelta
+
+from sqlalchemy import func
+from sqlalchemy.orm import defer
+
+from database.models import db, ChatLog, ChatArchive, ContactStats
+from database.archive import decode_block, chat_log_sort_key
+from database.shards import chat_log_query, chat_log_session
+from database.stats import compute_contact_stats, load_summary_counts
+
+TIMELINE_PAGE_SIZE = 200
+TIMELINE_MAX_PAGE_SIZE = 1000
+WEEKDAYS = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+
+def _live_query(contact_id, start=None, end=None, keyword=None):
+    query = chat_log_query(contact_id)
+    if start is not None:
+        query = query.filter(ChatLog.chat_date >= start)
+    if end is not None:
+        query = query.filter(ChatLog.chat_date <= end)
+    if keyword:
+        query = query.filter(func.lower(ChatLog.content).contains(keyword.lower(), autoescape=True))
+    return query
+
+
+def _archive_block_heads(contact_id, start=None, end=None):
+    """只取归档块的元数据，payload 在真正解压时才加载"""
+    query = chat_log_session(contact_id).query(ChatArchive) \
+        .options(defer(ChatArchive.payload)) \
+        .filter(ChatArchive.contact_id == contact_id)
+    if start is not None:
+        query = query.filter(ChatArchive.last_date >= start)
+    if end is not None:
+        query = query.filter(ChatArchive.first_date <= end)
+    return query.order_by(ChatArchive.month).all()
+
+
+def _matches(log, start, end, keyword):
+    if start is not None and log.chat_date < start:
+        return False
+    if end is not None and log.chat_date > end:
+        return False
+    return not keyword or keyword.lower() in log.content.lower()
+
+
+def _page_end(counts, limit):
+    """按日期累加消息数，返回累计达到 limit 的那一天；不足一页时返回 None"""
+    total = 0
+    for chat_date in sorted(counts):
+        total += counts[chat_date]
+        if total >= limit:
+            return chat_date
+    return None
+
+
+def group_by_date(logs):
+    groups = []
+    for log in logs:
+        if not groups or groups[-1]['date'] != log.chat_date.isoformat():
+            groups.append({
+                'date': log.chat_date.isoformat(),
+                'weekday': WEEKDAYS[log.chat_date.weekday()],
+                'messages': []
+            })
+        groups[-1]['messages'].append(log.to_dict())
+    return groups
+
+
+def timeline_page(contact_id, after=None, limit=TIMELINE_PAGE_SIZE, day=None, keyword=None):
+    """返回 after 之后（不含）的一页按日期分组的消息。
+
+    指定 day 时只返回这一天；keyword 按内容子串过滤（不区分大小写）。
+    返回 {'groups': [...], 'next_cursor': 下一页游标或 None}。
+    """
+    if day is not None:
+        start, end = day, day
+    else:
+        start = after + timedelta(days=1) if after is not None else None
+        end = None
+
+    # 未归档部分：每天的消息数，最多取 limit + 1 天，足以凑满一页
+    live_counts = _live_query(contact_id, start, end, keyword) \
+        .with_entities(ChatLog.chat_date, func.count(ChatLog.id)) \
+        .group_by(ChatLog.chat_date) \
+        .order_by(ChatLog.chat_date) \
+        .limit(limit + 1) \
+        .all()
+    counts = Counter(dict(live_counts))
+    live_exhausted = len(live_counts) <= limit
+
+    # 归档块按月份不重叠，只要下一块的起始日期不晚于当前页的结束日期就需要解压它
+    pending = _archive_block_heads(contact_id, start, end)
+    archived = []
+    page_end = _page_end(counts, limit)
+    while pending and (page_end is None or pending[0].first_date <= page_end):
+        block = pending.pop(0)
+        for log in decode_block(block):
+            if _matches(log, start, end, keyword):
+                archived.append(log)
+                counts[log.chat_date] += 1
+        page_end = _page_end(counts, limit)
+
+    if page_end is None:
+        if not counts:
+            return {'groups': [], 'next_cursor': None}
+        page_end = max(counts)
+    has_more = bool(pending) or not live_exhausted or any(d > page_end for d in counts)
+
+    logs = _live_query(contact_id, start, page_end, keyword).all()
+    logs.extend(log for log in archived if log.chat_date <= page_end)
+    logs.sort(key=chat_log_sort_key)
+    return {
+        'groups': group_by_date(logs),
+        'next_cursor': page_end.isoformat() if has_more and day is None else None
+    }
+
+
+def timeline_summary(contact_id):
+    """整个时间线的轻量汇总：双方消息数、每天消息数和按小时分布，供日期筛选、热力图和消息分布图使用。
+
+    直接读取 ContactStats 中随新增消息增量维护的计数，不扫描聊天记录也不解压归档块；
+    旧库还没有计数时临时全量计算一次，migrate_fields.py 会把它们补齐。
+    """
+    stats = db.session.get(ContactStats, contact_id)
+    if stats is None or stats.daily_counts is None:
+        stats = compute_contact_stats(contact_id)
+    days, hours = load_summary_counts(stats)
+    me = stats.my_message_count or 0
+    return {
+        'total': stats.message_count,
+        'me': me,
+        'other': stats.message_count - me,
+        'days': dict(days),
+        'hours': dict(hours)
+    }
@@ -0,0 +1,241 @@
+"""
+大模型调用的用量台账与配额
+
+每个上游请求（首选、后备、对冲，成功、失败或取消）在 ai_usage 表中记一行：联系人、范围、服务与模型、token 数、
+耗时、按服务单价（AI_BACKENDS 的 cost，每千 token）折算的费用。一次分析由 utils/ai.py 创建一个 CallUsage，
+utils/backends.py 的每个 _Attempt 结束时通过它调用 record_usage，所以对冲落败、后备前失败的请求也都记账。
+上游没有返回用量（被取消或中途失败）时按 utils.transcript.count_tokens 估算 prompt 和已收到内容的 token 数。
+daily_usage / contact_usage 给出按天、按联系人的汇总，由 /api/usage 返回。
+
+调用前 acquire_quota 检查配额，超出时抛出 QuotaExceeded，调用方不再请求模型：
+    AI_DAILY_TOKEN_QUOTA：当天（UTC）所有调用的 token 总数上限；
+    AI_CONTACT_DAILY_TOKEN_QUOTA：单个联系人当天的 token 上限；
+    AI_MAX_CONCURRENT_ANALYSES：同时进行的上游请求数上限，按进程计，多 worker 部署时总上限为其乘以 worker 数。
+        对冲请求同样占用名额，名额已满时不发出对冲；后备请求接替已结束的请求，不受上限拦截。
+用户自带密钥的调用照常记账，但不计入 token 配额。配额只拦截新的调用，已经开始的调用不会中断，
+所以当天的用量可能略超上限。各项为 0 表示不限制。
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import case, func
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import Config
+from database.models import db, UsageRecord
+from utils.metrics import AI_QUOTA_REJECTIONS, log_event
+
+logger = logging.getLogger(__name__)
+
+_active = 0
+_active_lock = threading.Lock()
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, message, quota, retry_after):
+        super().__init__(message)
+        self.quota = quota
+        self.retry_after = retry_after
+
+
+def _today():
+    return datetime.utcnow().date()
+
+
+def _seconds_until_tomorrow():
+    now = datetime.utcnow()
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return int((tomorrow - now).total_seconds()) + 1
+
+
+def tokens_used(day=None, contact_id=None):
+    """某天计入配额的 token 总数（不含用户自带密钥的调用）"""
+    query = db.session.query(func.coalesce(func.sum(UsageRecord.total_tokens), 0)).filter(
+        UsageRecord.day == (day or _today()), UsageRecord.user_key.is_(False))
+    if contact_id is not None:
+        query = query.filter(UsageRecord.contact_id == contact_id)
+    return int(query.scalar())
+
+
+def active_calls():
+    return _active
+
+
+def acquire_quota(contact_id=None, user_key=False):
+    """调用模型前检查配额并占用一个并发名额；通过后请求结束时必须 release_quota()"""
+    global _active
+    limit = Config.AI_MAX_CONCURRENT_ANALYSES
+    with _active_lock:
+        if limit and _active >= limit:
+            _reject('concurrency', contact_id)
+            raise QuotaExceeded(f'同时进行的分析已达上限（{limit} 个），请稍后重试', 'concurrency', 10)
+        _active += 1
+    try:
+        if not user_key:
+            _check_daily(contact_id)
+    except BaseException:
+        release_quota()
+        raise
+
+
+def try_acquire_slot(force=False):
+    """不检查 token 配额，只占用一个并发名额；名额已满时返回 False，force 为 True 时总是占用"""
+    global _active
+    limit = Config.AI_MAX_CONCURRENT_ANALYSES
+    with _active_lock:
+        if not force and limit and _active >= limit:
+            return False
+        _active += 1
+        return True
+
+
+def release_quota():
+    global _active
+    with _active_lock:
+        _active -= 1
+
+
+def _check_daily(contact_id):
+    limit = Config.AI_DAILY_TOKEN_QUOTA
+    if limit and tokens_used() >= limit:
+        _reject('daily_tokens', contact_id)
+        raise QuotaExceeded(f'今日大模型 token 用量已达上限（{limit}），请明天再试或使用自己的 API Key',
+                            'daily_tokens', _seconds_until_tomorrow())
+    limit = Config.AI_CONTACT_DAILY_TOKEN_QUOTA
+    if limit and contact_id is not None and tokens_used(contact_id=contact_id) >= limit:
+        _reject('contact_daily_tokens', contact_id)
+        raise QuotaExceeded(f'该联系人今日的分析用量已达上限（{limit} token），请明天再试',
+                            'contact_daily_tokens', _seconds_until_tomorrow())
+
+
+def _reject(quota, contact_id):
+    AI_QUOTA_REJECTIONS.inc(quota=quota)
+    log_event('ai_quota_rejected', quota=quota, contact_id=contact_id)
+
+
+def record_usage(mode, outcome, item, latency, ttft=None, contact_id=None, scope=None, user_key=False):
+    """记一行台账；item 含一个上游请求的 token 数、backend、model，写入失败只记日志，不影响分析本身"""
+    from utils.backends import get_backends
+
+    total_tokens = item.get('total_tokens') or 0
+    completion_tokens = item.get('completion_tokens') or 0
+    backend = item.get('backend')
+    unit_cost = next((b.cost for b in get_backends() if b.name == backend), 0.0)
+    record = UsageRecord(
+        contact_id=contact_id, scope=scope, mode=mode, outcome=outcome, backend=backend, model=item.get('model'),
+        user_key=user_key, prompt_tokens=max(0, total_tokens - completion_tokens),
+        completion_tokens=completion_tokens, total_tokens=total_tokens,
+        cost=round(total_tokens / 1000 * unit_cost, 6), latency_ms=round(latency * 1000, 1),
+        ttft_ms=round(ttft * 1000, 1) if ttft is not None else None, day=_today()
+    )
+    try:
+        db.session.add(record)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        logger.warning('写入用量台账失败', exc_info=True)
+        return None
+    return record
+
+
+class CallUsage:
+    """一次分析的台账上下文：reserve() 检查配额并为首个上游请求预占名额，之后每个上游请求
+    begin_attempt() 占用名额、end_attempt() 归还名额并记一行。上游请求在后台线程中结束，
+    所以在创建时记下当前应用，记账时再进入它的上下文"""
+
+    def __init__(self, mode, contact_id=None, scope=None, user_key=False):
+        self.mode = mode
+        self.contact_id = contact_id
+        self.scope = scope
+        self.user_key = user_key
+        self.app = current_app._get_current_object() if has_app_context() else None
+        self._reserved = False
+
+    def reserve(self):
+        """超出配额时抛出 QuotaExceeded"""
+        acquire_quota(self.contact_id, self.user_key)
+        self._reserved = True
+
+    def begin_attempt(self, hedge=False):
+        """发出上游请求前调用；对冲请求在名额已满时返回 False，不再发出"""
+        if self._reserved:
+            self._reserved = False
+            return True
+        return try_acquire_slot(force=not hedge)
+
+    def abandon_attempt(self):
+        """begin_attempt() 之后没有发出请求（服务都在熔断中）时归还名额"""
+        release_quota()
+
+    def end_attempt(self, outcome, item, latency, ttft=None):
+        release_quota()
+        if self.app is None:
+            return
+        with self.app.app_context():
+            record_usage(self.mode, outcome, item, latency, ttft=ttft, contact_id=self.contact_id,
+                         scope=self.scope, user_key=self.user_key)
+
+    def close(self):
+        """一次请求都没有发出时归还预占的名额"""
+        if self._reserved:
+            self._reserved = False
+            release_quota()
+
+
+def _aggregates():
+    return (
+        func.count(UsageRecord.id),
+        func.sum(case((UsageRecord.outcome != 'ok', 1), else_=0)),
+        func.coalesce(func.sum(UsageRecord.prompt_tokens), 0),
+        func.coalesce(func.sum(UsageRecord.completion_tokens), 0),
+        func.coalesce(func.sum(UsageRecord.total_tokens), 0),
+        func.coalesce(func.sum(UsageRecord.cost), 0.0),
+        func.avg(UsageRecord.latency_ms),
+    )
+
+
+def _row_dict(calls, errors, prompt_tokens, completion_tokens, total_tokens, cost, latency_ms):
+    return {
+        'calls': calls,
+        'errors': int(errors or 0),
+        'prompt_tokens': int(prompt_tokens),
+        'completion_tokens': int(completion_tokens),
+        'total_tokens': int(total_tokens),
+        'cost': round(float(cost), 4),
+        'avg_latency_ms': round(latency_ms, 1) if latency_ms is not None else None,
+    }
+
+
+def daily_usage(days=30, contact_id=None):
+    """最近 days 天（含今天）每天的调用数、失败数、token 数、费用和平均耗时，没有调用的日期不出现"""
+    query = db.session.query(UsageRecord.day, *_aggregates()).filter(
+        UsageRecord.day >= _today() - timedelta(days=days - 1))
+    if contact_id is not None:
+        query = query.filter(UsageRecord.contact_id == contact_id)
+    rows = query.group_by(UsageRecord.day).order_by(UsageRecord.day).all()
+    return [dict(day=row[0].isoformat(), **_row_dict(*row[1:])) for row in rows]
+
+
+def contact_usage(days=30, limit=20):
+    """最近 days 天 token 用量最多的联系人"""
+    total = func.coalesce(func.sum(UsageRecord.total_tokens), 0)
+    rows = (db.session.query(UsageRecord.contact_id, *_aggregates())
+            .filter(UsageRecord.day >= _today() - timedelta(days=days - 1), UsageRecord.contact_id.isnot(None))
+            .group_by(UsageRecord.contact_id).order_by(total.desc()).limit(limit).all())
+    return [dict(contact_id=row[0], **_row_dict(*row[1:])) for row in rows]
+
+
+def quota_status(contact_id=None):
+    status = {
+        'day': _today().isoformat(),
+        'tokens_used': tokens_used(),
+        'daily_token_quota': Config.AI_DAILY_TOKEN_QUOTA,
+        'contact_daily_token_quota': Config.AI_CONTACT_DAILY_TOKEN_QUOTA,
+        'active_calls': active_calls(),
+        'max_concurrent_analyses': Config.AI_MAX_CONCURRENT_ANALYSES,
+    }
+    if contact_id is not None:
+        status['contact_tokens_used'] = tokens_used(contact_id=contact_id)
+    return status
@@ -0,0 +1,94 @@
+"""
+gunicorn 配置：gunicorn -c gunicorn.conf.py
+
+WEB_WORKER_MODEL 选择 worker 模型：
+    sync     每个进程同时只处理一个请求；分析流会占住整个进程，适合 CPU 密集、请求很短的场景
+    gthread  （默认）每个进程 WEB_THREADS 个线程，分析流只占用一个线程
+    gevent   协程，需安装 gevent；适合大量并发的长连接
+    uvicorn  ASGI（asgi:app），需安装 uvicorn，建议同时安装 a2wsgi
+
+其他环境变量：WEB_BIND、WEB_WORKERS、WEB_THREADS、WEB_PRELOAD（默认 1）、WEB_GRACEFUL_TIMEOUT、WEB_MAX_REQUESTS。
+未设置 APP_CONFIG 时使用 production 配置。对比各模型的负载测试见 benchmarks/bench_workers.py。
+"""
+import multiprocessing
+import os
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+WORKER_MODELS = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+worker_model = os.environ.get('WEB_WORKER_MODEL', 'gthread')
+if worker_model not in WORKER_MODELS:
+    raise ValueError(f"未知的 WEB_WORKER_MODEL: {worker_model}，可选: {', '.join(WORKER_MODELS)}")
+
+os.environ.setdefault('APP_CONFIG', 'production')
+
+cpu_count = multiprocessing.cpu_count()
+
+wsgi_app = 'asgi:app' if worker_model == 'uvicorn' else 'wsgi:app'
+worker_class = WORKER_MODELS[worker_model]
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS') or (cpu_count * 2 + 1 if worker_model == 'sync' else cpu_count))
+threads = int(os.environ.get('WEB_THREADS', 8))
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+preload_app = os.environ.get('WEB_PRELOAD', '1') != '0'
+
+# 分析流最长等待上游 180 秒；sync worker 处理请求期间不发心跳，超时必须比它长
+timeout = 200 if worker_model == 'sync' else 60
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 200))
+keepalive = 5
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    # 上一次运行留下的各 worker 指标文件会被 /metrics 一并合并，启动时先清掉
+    if os.environ.get('METRICS_DIR'):
+        from utils.metrics import clear_metrics_dir
+        clear_metrics_dir(os.environ['METRICS_DIR'])
+
+
+def when_ready(server):
+    # 在 master 中、第一次 fork 之前执行
+    if server.cfg.preload_app:
+        from utils.lifecycle import preload_shared_state
+        from wsgi import app
+        preload_shared_state(app)
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from utils.lifecycle import after_fork
+        from wsgi import app
+        after_fork(app)
+
+
+def post_worker_init(worker):
+    # worker 已经装好自己的信号处理函数；uvicorn worker 由 asgi.py 的 lifespan 负责
+    from utils.lifecycle import install_drain_handler
+    install_drain_handler()
+
+
+def worker_exit(server, worker):
+    from utils.lifecycle import streams
+    from utils.metrics import remove_process_metrics
+    # 分析任务在 daemon 线程中运行（见 utils/jobs.py），不占用请求，gunicorn 不会等它们；
+    # 进程退出前在这里等待，最多 graceful_timeout 秒，否则模型调用和结果保存会被中途打断
+    streams.begin_drain()
+    remaining = streams.wait_idle(server.cfg.graceful_timeout)
+    if remaining:
+        server.log.warning('worker %s 退出时仍有 %d 个分析流未结束', worker.pid, remaining)
+    # 退出的 worker 不再出现在 /metrics 中
+    remove_process_metrics()
@@ -1,53 +1,86 @@
-import os
-import sqlite3
-from flask import Flask
+from sqlalchemy import Column, DateTime, Integer, Text, inspect, text
+from sqlalchemy.schema import CreateIndex
+from app import create_app
 from database.models import db, Contact, AnalysisResult, ChatLog
-from config import Config
-import sys
+from database.stats import rebuild_contact_stats, refresh_relationship_trends
+from database.archive import reindex_archived_chat_logs
+from database.search import ensure_chat_log_fts
+from database.profile_index import rebuild_profile_index
+from database.tags import migrate_tags_from_csv
+
+# 旧库缺少的列：(表名, 列定义)，用各数据库方言编译 ALTER TABLE 语句
+ADDED_COLUMNS = [
+    ('analysis_result', Column('topic_suggestions', Text, server_default='')),
+    ('analysis_result', Column('gift_suggestions', Text, server_default='')),
+    ('chat_log', Column('sent_at', DateTime)),
+    ('contact_stats', Column('chat_log_version', Integer, server_default='0')),
+    ('contact_stats', Column('my_message_count', Integer, server_default='0')),
+    ('contact_stats', Column('daily_counts', Text)),
+    ('contact_stats', Column('hourly_counts', Text)),
+]
+
+
+def add_column(conn, table_name, column):
+    column_type = column.type.compile(dialect=conn.dialect)
+    ddl = f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}'
+    if column.server_default is not None:
+        ddl += f" DEFAULT '{column.server_default.arg}'"
+    conn.execute(text(ddl))
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db_path = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-print(f"Database path: {db_path}")
 
 def migrate_add_fields():
+    """建表与升级旧库的唯一入口：应用启动时不再自动 create_all"""
+    app = create_app()
     with app.app_context():
-        if not os.path.exists(db_path):
-            print("数据库文件不存在，将创建新数据库...")
+        print(f"Database: {db.engine.url.render_as_string(hide_password=True)}")
+        inspector = inspect(db.engine)
+        tables = inspector.get_table_names()
+        print(f"Database tables: {tables}")
+
+        if not tables:
+            print("数据库为空，将创建新数据库...")
             db.create_all()
+            ensure_chat_log_fts()
             print("✅ 数据库和表已创建!")
         else:
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
+            with db.engine.begin() as conn:
+                for table_name, column in ADDED_COLUMNS:
+                    if table_name not in tables:
+                        continue
+                    columns = [col['name'] for col in inspector.get_columns(table_name)]
+                    if column.name not in columns:
+                        add_column(conn, table_name, column)
+                        print(f"✅ 已添加 {table_name}.{column.name} 字段")
+                    else:
+                        print(f"ℹ️ {table_name}.{column.name} 字段已存在")
+
+                if 'chat_log' in tables:
+                    indexes = [ix['name'] for ix in inspector.get_indexes('chat_log')]
+                    for index in ChatLog.__table__.indexes:
+                        if index.name not in indexes:
+                            conn.execute(CreateIndex(index))
+
+            db.create_all()
+            ensure_chat_log_fts()
+            print("✅ 聊天记录全文索引已就绪")
+            archived = reindex_archived_chat_logs()
+            if archived:
+                print(f"✅ 已为 {archived} 条归档消息重建检索索引")
             
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = cursor.fetchall()
-            print(f"Database tables: {[t[0] for t in tables]}")
+            contacts = Contact.query.all()
+            for contact in contacts:
+                rebuild_contact_stats(contact.id)
+            db.session.commit()
+            print(f"✅ 已重算 {len(contacts)} 个联系人的聊天统计")
+            refresh_relationship_trends()
             
-            if 'analysis_result' in [t[0] for t in tables]:
-                cursor.execute("PRAGMA table_info(analysis_result)")
-                columns = [row[1] for row in cursor.fetchall()]
-                print(f"Current columns: {columns}")
-                
-                if 'topic_suggestions' not in columns:
-                    cursor.execute("ALTER TABLE analysis_result ADD COLUMN topic_suggestions TEXT DEFAULT ''")
-                    print("✅ 已添加 topic_suggestions 字段")
-                else:
-                    print("ℹ️ topic_suggestions 字段已存在")
-                
-                if 'gift_suggestions' not in columns:
-                    cursor.execute("ALTER TABLE analysis_result ADD COLUMN gift_suggestions TEXT DEFAULT ''")
-                    print("✅ 已添加 gift_suggestions 字段")
-                else:
-                    print("ℹ️ gift_suggestions 字段已存在")
-                
-                conn.commit()
-            else:
-                print("analysis_result 表不存在，将创建...")
-                db.create_all()
-                print("✅ 表已创建!")
+            tagged = migrate_tags_from_csv()
+            db.session.commit()
+            print(f"✅ 已将 {tagged} 个联系人的标签迁移到标签表")
             
-            conn.close()
+            rebuild_profile_index()
+            db.session.commit()
+            print("✅ 画像倒排索引已重建")
         
         print("✅ 数据库迁移完成！")
 
@@ -0,0 +1,52 @@
+import argparse
+
+from flask import Flask
+from config import get_config
+from database.engine import configure_engine
+from database.models import db
+from database.shards import ShardRouter, existing_shard_paths, rebalance_chat_logs
+
+app = Flask(__name__)
+app.config.from_object(get_config())
+db.init_app(app)
+configure_engine(app)
+
+
+def rebalance_shards(count, strategy, ranges, batch_size, include_primary, dry_run):
+    """按目标分片配置迁移聊天记录；完成后把 CHAT_LOG_SHARDS 等环境变量改成同样的值再启动应用"""
+    with app.app_context():
+        directory = app.config['CHAT_LOG_SHARD_DIR']
+        router = ShardRouter(directory, count, strategy=strategy, ranges=ranges,
+                             pragmas=app.config.get('SQLITE_PRAGMAS'))
+        print(f"📦 分片目录: {directory}")
+        print(f"  目标: {count} 个分片，策略 {strategy}" + (f"，分界 {ranges}" if ranges else ''))
+        try:
+            report = rebalance_chat_logs(router, batch_size=batch_size,
+                                         include_primary=include_primary, dry_run=dry_run)
+        finally:
+            router.dispose()
+
+        action = '需要迁移' if dry_run else '已迁移'
+        print(f"✅ {action} {report['contacts']} 个联系人、{report['messages']} 条消息")
+        for shard, messages in sorted(report['by_target'].items()):
+            print(f"  → {router.path(shard)}: {messages} 条")
+
+        stale = [path for path in existing_shard_paths(directory)
+                 if path not in {router.path(shard) for shard in range(count)}]
+        if stale and not dry_run:
+            print(f"ℹ️ 以下分片已不再使用，确认无误后可删除: {', '.join(stale)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='聊天记录分片迁移 / 重新平衡')
+    parser.add_argument('--shards', type=int, default=app.config['CHAT_LOG_SHARDS'], help='目标分片数')
+    parser.add_argument('--strategy', choices=['hash', 'range'], default=app.config['CHAT_LOG_SHARD_STRATEGY'])
+    parser.add_argument('--ranges', default=None, help='range 策略的 contact_id 分界值，逗号分隔')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--skip-primary', action='store_true', help='不迁移主库 chat_log 表中的记录')
+    parser.add_argument('--dry-run', action='store_true', help='只统计需要迁移的数据量')
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error('请通过 --shards 或 CHAT_LOG_SHARDS 指定至少 1 个分片')
+    ranges = [int(v) for v in args.ranges.split(',') if v.strip()] if args.ranges else app.config['CHAT_LOG_SHARD_RANGES']
+    rebalance_shards(args.shards, args.strategy, ranges, args.batch_size, not args.skip_primary, args.dry_run)
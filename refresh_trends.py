@@ -0,0 +1,15 @@
+from app import create_app
+from database.stats import refresh_relationship_trends
+
+app = create_app()
+
+
+def run_refresh():
+    """重算当天还没更新过的关系趋势；趋势窗口按天滚动，读请求不会重算，需要每天（如 cron 凌晨）执行一次"""
+    with app.app_context():
+        updated = refresh_relationship_trends()
+        print(f"✅ 已更新 {updated} 个联系人的关系趋势")
+
+
+if __name__ == '__main__':
+    run_refresh()
@@ -2,7 +2,9 @@ import os
 import shutil
 
 from app import create_app, db
-from database.models import Contact, ChatLog, AnalysisResult
+from database.models import Contact, AnalysisResult
+from database.search import drop_chat_log_fts, ensure_chat_log_fts
+from database.shards import delete_all_chat_logs
 from seed_data import seed_sample_data
 
 
@@ -18,7 +20,7 @@ def reset_dev_environment():
         print("  ✅ 已清理分析结果")
         
         # 删除所有聊天记录
-        ChatLog.query.delete()
+        delete_all_chat_logs()
         print("  ✅ 已清理聊天记录")
         
         # 删除所有联系人
@@ -29,11 +31,12 @@ def reset_dev_environment():
         db.session.commit()
         print("  ✅ 数据库变更已提交")
         
-        # 重置数据库文件（如果存在）
-        db_path = os.path.join('database', 'social.db')
-        if os.path.exists(db_path):
-            os.remove(db_path)
-            print(f"  ✅ 已删除数据库文件: {db_path}")
+        # 重建所有表（对 SQLite 和 PostgreSQL 都适用，不再直接删除数据库文件）
+        drop_chat_log_fts()
+        db.drop_all()
+        db.create_all()
+        ensure_chat_log_fts()
+        print("  ✅ 已重建数据库表")
         
         # 删除 uploads 和 exports 目录
         for folder in ['uploads', 'exports']:
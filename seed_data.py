@@ -1,16 +1,16 @@
-from flask import Flask
+from contextlib import nullcontext
 from datetime import datetime, timedelta
+from app import create_app
 from database.models import db, Contact, ChatLog, AnalysisResult
+from database.profile_index import rebuild_profile_index
+from database.search import ensure_chat_log_fts
+from database.shards import add_chat_logs, commit_chat_logs
+from database.tags import set_contact_tags
 import json
 
-def create_sample_data():
-    app = Flask(__name__)
-    app.config.from_object('config.Config')
-    db.init_app(app)
-
-    with app.app_context():
-        db.create_all()
-
+def seed_sample_data(app=None):
+    """写入示例联系人、聊天记录和分析结果，表结构需已存在；不传 app 时在当前应用上下文中执行"""
+    with app.app_context() if app is not None else nullcontext():
         contacts_data = [
             {
                 "name": "张明",
@@ -380,22 +380,25 @@ def create_sample_data():
                 name=contact_data["name"],
                 avatar=contact_data["avatar"],
                 notes=contact_data["notes"],
-                tags=contact_data["tags"],
                 created_at=datetime.utcnow() - timedelta(days=30),
                 updated_at=datetime.utcnow()
             )
             db.session.add(contact)
+            set_contact_tags(contact, contact_data["tags"])
             db.session.flush()
 
-            for log_data in contact_data["chat_logs"]:
-                chat_log = ChatLog(
+            chat_logs = [
+                ChatLog(
                     contact_id=contact.id,
                     speaker=log_data["speaker"],
                     content=log_data["content"],
                     chat_date=datetime.utcnow().date() - timedelta(days=log_data["days_ago"]),
                     created_at=datetime.utcnow() - timedelta(days=log_data["days_ago"])
                 )
-                db.session.add(chat_log)
+                for log_data in contact_data["chat_logs"]
+            ]
+            add_chat_logs(contact.id, chat_logs)
+            commit_chat_logs(contact.id)
 
             analysis_data = contact_data["analysis"]
             analysis = AnalysisResult(
@@ -412,8 +415,18 @@ def create_sample_data():
             )
             db.session.add(analysis)
 
+        rebuild_profile_index()
         db.session.commit()
         print("示例数据创建成功！共创建了 5 个联系人及其相关数据。")
 
+
+def create_sample_data():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        ensure_chat_log_fts()
+    seed_sample_data(app)
+
+
 if __name__ == "__main__":
     create_sample_data()
@@ -19,6 +19,10 @@ function initTabs() {
             
             this.classList.add('active');
             document.getElementById(targetTab)?.classList.add('active');
+            
+            if (targetTab === 'chats') {
+                renderChatWindow();
+            }
         });
     });
 }
@@ -203,20 +207,12 @@ function renderRadarChart(traits) {
     window.addEventListener('resize', () => chart.resize());
 }
 
-function renderMessageDistribution() {
-    const chatItems = document.querySelectorAll('.chat-item');
-    
-    let myCount = 0;
-    let otherCount = 0;
-    
-    chatItems.forEach(item => {
-        if (item.classList.contains('me')) {
-            myCount++;
-        } else {
-            otherCount++;
-        }
-    });
+async function renderMessageDistribution() {
+    const summary = await getTimelineSummary();
+    if (!summary) return;
     
+    const myCount = summary.me;
+    const otherCount = summary.other;
     const total = myCount + otherCount;
     
     if (total === 0) return;
@@ -315,14 +311,8 @@ function renderQuickInsights(parsed) {
         }
     }
     
-    const chatItems = document.querySelectorAll('.chat-item');
-    if (chatItems.length > 0) {
-        const dates = new Set();
-        chatItems.forEach(item => {
-            const date = item.dataset.date;
-            if (date) dates.add(date);
-        });
-        const activeDays = dates.size;
+    const activeDays = parseInt(document.getElementById('chatsContainer')?.dataset.activeDays || '0');
+    if (activeDays > 0) {
         insights.push({
             icon: '📅',
             text: `活跃天数: ${activeDays} 天`
@@ -525,6 +515,46 @@ function renderGuide(parsed) {
     }
 }
 
+const ANALYSIS_RESUME_ATTEMPTS = 5;
+const ANALYSIS_RESUME_DELAY = 2000;
+
+// 读取分析流；网络中断时凭 X-Analysis-Job 和 Last-Event-ID 重新连接同一个分析任务，
+// 服务端的模型调用不受断线影响，重连后从断开处继续接收事件
+async function followAnalysisStream(response, onEvent) {
+    const jobId = response.headers.get('X-Analysis-Job');
+    let decoder = new SSEDecoder();
+    let settled = false;
+    const handle = event => {
+        if (event.event === 'complete' || event.event === 'error') settled = true;
+        return onEvent(event);
+    };
+    
+    for (let attempt = 0; ; attempt++) {
+        try {
+            if (response) await readEventStream(response, handle, decoder);
+        } catch (error) {
+            // complete / error 事件的处理中抛出的异常（例如分析失败）直接交给调用方
+            if (settled) throw error;
+        }
+        if (settled || !jobId || attempt >= ANALYSIS_RESUME_ATTEMPTS) return;
+        
+        await new Promise(resolve => setTimeout(resolve, decoder.retry || ANALYSIS_RESUME_DELAY));
+        const lastEventId = decoder.lastEventId;
+        decoder = new SSEDecoder();
+        decoder.lastEventId = lastEventId;
+        try {
+            response = await fetch(`/api/analysis-jobs/${jobId}/stream`, {
+                headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {}
+            });
+        } catch (error) {
+            response = null;
+            continue;
+        }
+        // 任务已过期或落到了别的进程，无法续传
+        if (!response.ok) return;
+    }
+}
+
 async function startAnalysis() {
     console.log('[Frontend] startAnalysis() called');
     const contactId = window.location.pathname.split('/').pop();
@@ -561,86 +591,74 @@ async function startAnalysis() {
         });
         
         if (!response.ok) {
-            throw new Error('请求失败');
+            const body = await response.json().catch(() => ({}));
+            throw new Error(body.error || '请求失败');
         }
         
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-        let buffer = '';
-        
         if (analysisStatus) analysisStatus.textContent = '正在分析聊天记录...';
         updateStep(2);
         
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
+        let finished = false;
+        await followAnalysisStream(response, event => {
+            const data = JSON.parse(event.data);
             
-            buffer += decoder.decode(value, { stream: true });
-            const lines = buffer.split('\n');
-            buffer = lines.pop() || '';
-            
-            for (const line of lines) {
-                if (line.trim()) {
-                    try {
-                        const data = JSON.parse(line);
-                        
-                        if (data.type === 'content_update') {
-                            const contentLength = data.content_length || 0;
-                            const total = data.total_tokens || 0;
-                            const completion = data.completion_tokens || 0;
-                            
-                            if (generatedTokensEl) generatedTokensEl.textContent = completion.toLocaleString();
-                            if (totalTokensEl) totalTokensEl.textContent = total.toLocaleString();
-                            
-                            const progress = Math.min(95, 20 + (contentLength / 100) * 75);
-                            if (progressBar) progressBar.style.width = progress + '%';
-                            if (progressText) progressText.textContent = Math.round(progress) + '%';
-                            
-                            if (contentLength > 50) {
-                                updateStep(3);
-                            }
-                        } else if (data.type === 'token_update') {
-                            const total = data.total_tokens || 0;
-                            const completion = data.completion_tokens || 0;
-                            
-                            if (generatedTokensEl) generatedTokensEl.textContent = completion.toLocaleString();
-                            if (totalTokensEl) totalTokensEl.textContent = total.toLocaleString();
-                            
-                            const progress = Math.min(95, 20 + (completion / 2000) * 75);
-                            if (progressBar) progressBar.style.width = progress + '%';
-                            if (progressText) progressText.textContent = Math.round(progress) + '%';
-                            
-                            if (completion > 500) {
-                                updateStep(3);
-                            }
-                        } else if (data.type === 'error') {
-                            throw new Error(data.message);
-                        } else if (data.type === 'complete') {
-                            if (progressBar) progressBar.style.width = '100%';
-                            if (progressText) progressText.textContent = '100%';
-                            if (generatedTokensEl) generatedTokensEl.textContent = (data.completion_tokens || 0).toLocaleString();
-                            if (totalTokensEl) totalTokensEl.textContent = (data.total_tokens || 0).toLocaleString();
-                            if (analysisStatus) analysisStatus.textContent = '分析完成！';
-                            
-                            document.getElementById('analysisSpinner').style.display = 'none';
-                            document.getElementById('analysisHint').style.display = 'none';
-                            
-                            const rawDataSection = document.getElementById('rawDataSection');
-                            const rawDataContent = document.getElementById('rawDataContent');
-                            const analysisActions = document.getElementById('analysisActions');
-                            
-                            if (rawDataContent) rawDataContent.textContent = JSON.stringify(data.analysis, null, 2);
-                            if (rawDataSection) rawDataSection.style.display = 'block';
-                            if (analysisActions) analysisActions.style.display = 'block';
-                            
-                            updateStep(3);
-                            return;
-                        }
-                    } catch (e) {
-                        continue;
-                    }
+            if (event.event === 'content_update') {
+                const contentLength = data.content_length || 0;
+                const total = data.total_tokens || 0;
+                const completion = data.completion_tokens || 0;
+                
+                if (generatedTokensEl) generatedTokensEl.textContent = completion.toLocaleString();
+                if (totalTokensEl) totalTokensEl.textContent = total.toLocaleString();
+                
+                const progress = Math.min(95, 20 + (contentLength / 100) * 75);
+                if (progressBar) progressBar.style.width = progress + '%';
+                if (progressText) progressText.textContent = Math.round(progress) + '%';
+                
+                if (contentLength > 50) {
+                    updateStep(3);
+                }
+            } else if (event.event === 'token_update') {
+                const total = data.total_tokens || 0;
+                const completion = data.completion_tokens || 0;
+                
+                if (generatedTokensEl) generatedTokensEl.textContent = completion.toLocaleString();
+                if (totalTokensEl) totalTokensEl.textContent = total.toLocaleString();
+                
+                const progress = Math.min(95, 20 + (completion / 2000) * 75);
+                if (progressBar) progressBar.style.width = progress + '%';
+                if (progressText) progressText.textContent = Math.round(progress) + '%';
+                
+                if (completion > 500) {
+                    updateStep(3);
                 }
+            } else if (event.event === 'error') {
+                throw new Error(data.message);
+            } else if (event.event === 'complete') {
+                if (progressBar) progressBar.style.width = '100%';
+                if (progressText) progressText.textContent = '100%';
+                if (generatedTokensEl) generatedTokensEl.textContent = (data.completion_tokens || 0).toLocaleString();
+                if (totalTokensEl) totalTokensEl.textContent = (data.total_tokens || 0).toLocaleString();
+                if (analysisStatus) analysisStatus.textContent = '分析完成！';
+                
+                document.getElementById('analysisSpinner').style.display = 'none';
+                document.getElementById('analysisHint').style.display = 'none';
+                
+                const rawDataSection = document.getElementById('rawDataSection');
+                const rawDataContent = document.getElementById('rawDataContent');
+                const analysisActions = document.getElementById('analysisActions');
+                
+                if (rawDataContent) rawDataContent.textContent = JSON.stringify(data.analysis, null, 2);
+                if (rawDataSection) rawDataSection.style.display = 'block';
+                if (analysisActions) analysisActions.style.display = 'block';
+                
+                updateStep(3);
+                finished = true;
+                return false;
             }
+        });
+        
+        if (!finished) {
+            throw new Error('与服务器的连接中断，分析未完成');
         }
         
     } catch (error) {
@@ -670,6 +688,288 @@ function finishAnalysis() {
     }, 500);
 }
 
+const CHAT_PAGE_SIZE = 200;
+const CHAT_OVERSCAN_PX = 600;
+const CHAT_ROW_ESTIMATE = {
+    date: 44,
+    message: 92,
+    compact: 60
+};
+
+const chatList = {
+    contactId: null,
+    rows: [],
+    heights: [],
+    offsets: [],
+    indexById: new Map(),
+    logsById: new Map(),
+    selected: new Set(),
+    expanded: new Set(),
+    nextCursor: null,
+    done: false,
+    loading: false,
+    generation: 0,
+    renderQueued: false,
+    filters: { q: '', date: 'all' }
+};
+
+let timelineSummaryPromise = null;
+
+function getTimelineSummary() {
+    if (!timelineSummaryPromise) {
+        const contactId = document.getElementById('chatsContainer')?.dataset.contactId
+            || window.location.pathname.split('/').pop();
+        timelineSummaryPromise = fetch(`/api/contacts/${contactId}/timeline/summary`)
+            .then(response => response.ok ? response.json() : null)
+            .catch(() => null);
+    }
+    return timelineSummaryPromise;
+}
+
+function initChatList() {
+    const container = document.getElementById('chatsContainer');
+    if (!container) return;
+    
+    chatList.contactId = container.dataset.contactId;
+    container.classList.add('virtual-list');
+    
+    const wrapper = container.closest('.chats-wrapper');
+    if (wrapper) {
+        wrapper.addEventListener('scroll', scheduleChatRender, { passive: true });
+    }
+    window.addEventListener('resize', scheduleChatRender);
+    
+    container.addEventListener('change', function(e) {
+        const checkbox = e.target.closest('.chat-select-checkbox');
+        if (!checkbox) return;
+        setChatSelected(parseInt(checkbox.value), checkbox.checked);
+        lastSelectedId = parseInt(checkbox.value);
+        renderChatWindow();
+        updateSelectedCount();
+        showQuickActionsToolbar();
+    });
+    
+    resetChatList();
+}
+
+function resetChatList() {
+    chatList.generation++;
+    chatList.rows = [];
+    chatList.heights = [];
+    chatList.offsets = [];
+    chatList.indexById = new Map();
+    chatList.nextCursor = null;
+    chatList.done = false;
+    chatList.loading = false;
+    
+    const wrapper = document.querySelector('.chats-wrapper');
+    if (wrapper) wrapper.scrollTop = 0;
+    
+    renderChatWindow();
+    loadNextChatPage();
+}
+
+async function loadNextChatPage() {
+    if (chatList.loading || chatList.done || !chatList.contactId) return;
+    
+    chatList.loading = true;
+    const generation = chatList.generation;
+    updateChatListStatus();
+    
+    const params = new URLSearchParams({ limit: CHAT_PAGE_SIZE });
+    if (chatList.nextCursor) params.set('cursor', chatList.nextCursor);
+    if (chatList.filters.q) params.set('q', chatList.filters.q);
+    if (chatList.filters.date !== 'all') params.set('date', chatList.filters.date);
+    
+    try {
+        const response = await fetch(`/api/contacts/${chatList.contactId}/timeline?${params}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const page = await response.json();
+        if (generation !== chatList.generation) return;
+        
+        appendChatGroups(page.groups || []);
+        chatList.nextCursor = page.next_cursor;
+        chatList.done = !page.next_cursor;
+    } catch (error) {
+        if (generation !== chatList.generation) return;
+        chatList.done = true;
+        showToast('聊天记录加载失败', 'error');
+    } finally {
+        if (generation === chatList.generation) {
+            chatList.loading = false;
+            updateChatListStatus();
+            renderChatWindow();
+        }
+    }
+}
+
+function appendChatGroups(groups) {
+    const compact = document.getElementById('chatsContainer')?.classList.contains('compact-view');
+    
+    groups.forEach(group => {
+        pushChatRow({ type: 'date', date: group.date, weekday: group.weekday }, CHAT_ROW_ESTIMATE.date);
+        group.messages.forEach(log => {
+            chatList.logsById.set(log.id, log);
+            chatList.indexById.set(log.id, chatList.rows.length);
+            pushChatRow({ type: 'message', log: log }, compact ? CHAT_ROW_ESTIMATE.compact : CHAT_ROW_ESTIMATE.message);
+        });
+    });
+}
+
+function pushChatRow(row, height) {
+    const last = chatList.rows.length - 1;
+    const offset = last >= 0 ? chatList.offsets[last] + chatList.heights[last] : 0;
+    chatList.rows.push(row);
+    chatList.heights.push(height);
+    chatList.offsets.push(offset);
+}
+
+function recomputeChatOffsets(from) {
+    for (let i = Math.max(from, 1); i < chatList.rows.length; i++) {
+        chatList.offsets[i] = chatList.offsets[i - 1] + chatList.heights[i - 1];
+    }
+}
+
+function chatListHeight() {
+    const last = chatList.rows.length - 1;
+    return last >= 0 ? chatList.offsets[last] + chatList.heights[last] : 0;
+}
+
+function findChatRowAt(offset) {
+    let low = 0;
+    let high = chatList.rows.length - 1;
+    while (low < high) {
+        const mid = (low + high + 1) >> 1;
+        if (chatList.offsets[mid] <= offset) {
+            low = mid;
+        } else {
+            high = mid - 1;
+        }
+    }
+    return low;
+}
+
+function scheduleChatRender() {
+    if (chatList.renderQueued) return;
+    chatList.renderQueued = true;
+    requestAnimationFrame(() => {
+        chatList.renderQueued = false;
+        renderChatWindow();
+    });
+}
+
+function renderChatWindow() {
+    const container = document.getElementById('chatsContainer');
+    const windowEl = document.getElementById('chatsWindow');
+    const spacer = document.getElementById('chatsSpacer');
+    const wrapper = container?.closest('.chats-wrapper');
+    if (!container || !windowEl || !spacer || !wrapper) return;
+    
+    if (chatList.rows.length === 0) {
+        windowEl.innerHTML = '';
+        spacer.style.height = '0px';
+        return;
+    }
+    
+    const viewportHeight = wrapper.clientHeight || 600;
+    const viewTop = Math.max(0, wrapper.scrollTop - container.offsetTop);
+    const start = findChatRowAt(Math.max(0, viewTop - CHAT_OVERSCAN_PX));
+    const end = findChatRowAt(viewTop + viewportHeight + CHAT_OVERSCAN_PX);
+    
+    let html = '';
+    for (let i = start; i <= end; i++) {
+        html += renderChatRow(chatList.rows[i], i);
+    }
+    windowEl.innerHTML = html;
+    windowEl.style.transform = `translateY(${chatList.offsets[start]}px)`;
+    
+    if (wrapper.clientHeight > 0) {
+        let changed = false;
+        Array.from(windowEl.children).forEach((element, k) => {
+            const height = element.offsetHeight;
+            if (height && height !== chatList.heights[start + k]) {
+                chatList.heights[start + k] = height;
+                changed = true;
+            }
+        });
+        if (changed) recomputeChatOffsets(start + 1);
+    }
+    spacer.style.height = chatListHeight() + 'px';
+    
+    if (end >= chatList.rows.length - 20) {
+        loadNextChatPage();
+    }
+}
+
+function renderChatRow(row, index) {
+    if (row.type === 'date') {
+        const [, month, day] = row.date.split('-');
+        return `
+            <div class="virtual-row chat-date-row" data-index="${index}" data-date="${row.date}">
+                <div class="date-divider">
+                    <span class="date-badge">${month}月${day}日</span>
+                    <span class="date-weekday">${row.weekday}</span>
+                </div>
+            </div>
+        `;
+    }
+    
+    const log = row.log;
+    const side = log.speaker === '我' ? 'me' : 'other';
+    const selected = chatList.selected.has(log.id);
+    const expanded = chatList.expanded.has(log.id);
+    const speaker = escapeHtml(log.speaker);
+    return `
+        <div class="virtual-row">
+            <div class="chat-item ${side}${selected ? ' selected' : ''}${expanded ? ' expanded' : ''}" data-index="${index}" data-date="${log.chat_date}" data-time="${chatLogTime(log)}" data-id="${log.id}">
+                <label class="chat-checkbox">
+                    <input type="checkbox" class="chat-select-checkbox" value="${log.id}"${selected ? ' checked' : ''}>
+                </label>
+                <div class="chat-bubble">
+                    <div class="bubble-header">
+                        <span class="speaker-avatar ${side}">${escapeHtml(log.speaker.slice(0, 1))}</span>
+                        <span class="speaker-name">${speaker}</span>
+                        <span class="chat-time">${chatLogTime(log)}</span>
+                    </div>
+                    <p class="chat-content${expanded ? ' expanded' : ''}">${escapeHtml(log.content)}</p>
+                </div>
+            </div>
+        </div>
+    `;
+}
+
+function chatLogTime(log) {
+    return log.sent_at ? log.sent_at.slice(11, 16) : '';
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+function updateChatListStatus() {
+    const loadingEl = document.getElementById('chatsLoading');
+    const emptyEl = document.getElementById('chatsEmpty');
+    const emptyText = document.getElementById('chatsEmptyText');
+    const filtered = chatList.filters.q || chatList.filters.date !== 'all';
+    
+    if (loadingEl) loadingEl.hidden = !chatList.loading;
+    if (emptyEl) emptyEl.hidden = chatList.loading || chatList.rows.length > 0;
+    if (emptyText) emptyText.textContent = filtered ? '没有符合条件的聊天记录' : '还没有聊天记录';
+}
+
+function remeasureChatRows() {
+    const compact = document.getElementById('chatsContainer')?.classList.contains('compact-view');
+    chatList.rows.forEach((row, i) => {
+        chatList.heights[i] = row.type === 'date'
+            ? CHAT_ROW_ESTIMATE.date
+            : (compact ? CHAT_ROW_ESTIMATE.compact : CHAT_ROW_ESTIMATE.message);
+    });
+    recomputeChatOffsets(1);
+    renderChatWindow();
+}
+
 function toggleChatViewMode() {
     const container = document.getElementById('chatsContainer');
     const viewModeIcon = document.getElementById('viewModeIcon');
@@ -692,70 +992,25 @@ function toggleChatViewMode() {
         if (viewModeText) viewModeText.textContent = '展开视图';
         localStorage.setItem('chatViewMode', 'compact');
     }
+    
+    remeasureChatRows();
 }
 
+let filterChatsTimer = null;
+
 function filterChats() {
-    const searchText = document.getElementById('chatSearch')?.value?.toLowerCase() || '';
-    const dateFilter = document.getElementById('chatDateFilter')?.value || 'all';
-    
-    const chatItems = document.querySelectorAll('.chat-item');
-    const dateGroups = document.querySelectorAll('.chat-date-group');
-    
-    let visibleDates = new Set();
-    
-    chatItems.forEach(item => {
-        const content = item.querySelector('.chat-content')?.textContent?.toLowerCase() || '';
-        const itemDate = item.dataset.date;
-        let visible = true;
-        
-        if (searchText && !content.includes(searchText)) {
-            visible = false;
-        }
+    clearTimeout(filterChatsTimer);
+    filterChatsTimer = setTimeout(() => {
+        const searchText = document.getElementById('chatSearch')?.value?.trim() || '';
+        const dateFilter = document.getElementById('chatDateFilter')?.value || 'all';
         
-        if (dateFilter !== 'all' && itemDate !== dateFilter) {
-            visible = false;
-        }
+        if (searchText === chatList.filters.q && dateFilter === chatList.filters.date) return;
         
-        item.style.display = visible ? '' : 'none';
-        
-        if (visible && itemDate) {
-            visibleDates.add(itemDate);
-        }
-    });
-    
-    dateGroups.forEach(group => {
-        const groupDate = group.dataset.date;
-        const hasVisibleItems = group.querySelectorAll('.chat-item[style=""]').length > 0 ||
-                               group.querySelectorAll('.chat-item:not([style*="display: none"])').length > 0;
-        group.style.display = hasVisibleItems ? '' : 'none';
-    });
-    
-    updateDateFilterOptions();
-}
-
-function updateDateFilterOptions() {
-    const dateFilter = document.getElementById('chatDateFilter');
-    if (!dateFilter) return;
-    
-    const availableDates = new Set();
-    document.querySelectorAll('.chat-item').forEach(item => {
-        const date = item.dataset.date;
-        if (date && item.style.display !== 'none') {
-            availableDates.add(date);
-        }
-    });
-    
-    const currentValue = dateFilter.value;
-    const options = dateFilter.querySelectorAll('option');
-    options.forEach((option, index) => {
-        if (index > 0) {
-            option.style.display = availableDates.has(option.value) ? '' : 'none';
-        }
-    });
-    
-    if (currentValue !== 'all' && !availableDates.has(currentValue)) {
-        dateFilter.value = 'all';
-    }
+        chatList.filters = { q: searchText, date: dateFilter };
+        lastSelectedId = null;
+        resetChatList();
+        updateSelectedCount();
+    }, 250);
 }
 
 function showQuickActionsToolbar() {
@@ -795,7 +1050,7 @@ function showQuickActionsToolbar() {
         document.body.appendChild(toolbar);
     }
     
-    const selectedCount = document.querySelectorAll('.chat-select-checkbox:checked').length;
+    const selectedCount = chatList.selected.size;
     const countEl = document.getElementById('quickSelectedCount');
     if (countEl) {
         countEl.textContent = selectedCount;
@@ -811,27 +1066,38 @@ function hideQuickActionsToolbar() {
     }
 }
 
+function setChatSelected(id, selected) {
+    if (selected) {
+        chatList.selected.add(id);
+    } else {
+        chatList.selected.delete(id);
+    }
+}
+
+function selectedChatLogs() {
+    return Array.from(chatList.selected)
+        .map(id => chatList.logsById.get(id))
+        .filter(Boolean)
+        .sort((a, b) => a.chat_date.localeCompare(b.chat_date) || a.id - b.id);
+}
+
+function formatSelectedMessages() {
+    return selectedChatLogs().map(log => {
+        const speaker = log.speaker === '我' ? '我' : '对方';
+        const time = chatLogTime(log) || log.chat_date;
+        return `[${time}] ${speaker}: ${log.content}\n`;
+    }).join('');
+}
+
 function exportSelectedMessages() {
-    const checkboxes = document.querySelectorAll('.chat-select-checkbox:checked');
-    const selectedIds = Array.from(checkboxes).map(cb => parseInt(cb.value));
+    const selectedCount = chatList.selected.size;
     
-    if (selectedIds.length === 0) {
+    if (selectedCount === 0) {
         showToast('请先选择要导出的聊天记录', 'warning');
         return;
     }
     
-    const chatItems = document.querySelectorAll('.chat-item');
-    let exportContent = '';
-    
-    chatItems.forEach(item => {
-        const checkbox = item.querySelector('.chat-select-checkbox');
-        if (checkbox && checkbox.checked) {
-            const speaker = item.classList.contains('me') ? '我' : '对方';
-            const time = item.dataset.time || '';
-            const content = item.querySelector('.chat-content')?.textContent || '';
-            exportContent += `[${time}] ${speaker}: ${content}\n`;
-        }
-    });
+    const exportContent = formatSelectedMessages();
     
     const blob = new Blob([exportContent], { type: 'text/plain;charset=utf-8' });
     const url = URL.createObjectURL(blob);
@@ -841,45 +1107,32 @@ function exportSelectedMessages() {
     a.click();
     URL.revokeObjectURL(url);
     
-    showToast(`已导出 ${selectedIds.length} 条聊天记录`, 'success');
+    showToast(`已导出 ${selectedCount} 条聊天记录`, 'success');
 }
 
 function copySelectedMessages() {
-    const checkboxes = document.querySelectorAll('.chat-select-checkbox:checked');
-    const selectedIds = Array.from(checkboxes).map(cb => parseInt(cb.value));
+    const selectedCount = chatList.selected.size;
     
-    if (selectedIds.length === 0) {
+    if (selectedCount === 0) {
         showToast('请先选择要复制的聊天记录', 'warning');
         return;
     }
     
-    const chatItems = document.querySelectorAll('.chat-item');
-    let copyText = '';
-    
-    chatItems.forEach(item => {
-        const checkbox = item.querySelector('.chat-select-checkbox');
-        if (checkbox && checkbox.checked) {
-            const speaker = item.classList.contains('me') ? '我' : '对方';
-            const time = item.dataset.time || '';
-            const content = item.querySelector('.chat-content')?.textContent || '';
-            copyText += `[${time}] ${speaker}: ${content}\n`;
-        }
-    });
-    
-    navigator.clipboard.writeText(copyText).then(() => {
-        showToast(`已复制 ${selectedIds.length} 条聊天记录`, 'success');
+    navigator.clipboard.writeText(formatSelectedMessages()).then(() => {
+        showToast(`已复制 ${selectedCount} 条聊天记录`, 'success');
     }).catch(err => {
         showToast('复制失败，请手动复制', 'error');
     });
 }
 
 function clearSelection() {
-    const checkboxes = document.querySelectorAll('.chat-select-checkbox:checked');
-    checkboxes.forEach(cb => cb.checked = false);
+    chatList.selected.clear();
+    lastSelectedId = null;
     
     const selectAllCheckbox = document.getElementById('selectAllChats');
     if (selectAllCheckbox) selectAllCheckbox.checked = false;
     
+    renderChatWindow();
     updateSelectedCount();
     showQuickActionsToolbar();
 }
@@ -907,69 +1160,68 @@ function initKeyboardShortcuts() {
 }
 
 function initClickSelection() {
-    const chatItems = document.querySelectorAll('.chat-item');
+    const container = document.getElementById('chatsContainer');
+    if (!container) return;
     
-    chatItems.forEach(item => {
-        item.addEventListener('click', function(e) {
-            if (e.target.type === 'checkbox' || e.target.closest('.chat-checkbox')) {
-                return;
-            }
-            
-            if (e.ctrlKey || e.metaKey) {
-                const checkbox = this.querySelector('.chat-select-checkbox');
-                if (checkbox) {
-                    checkbox.checked = !checkbox.checked;
-                    updateSelectedCount();
-                    showQuickActionsToolbar();
-                }
-            } else if (e.shiftKey) {
-                selectRange(this);
-            }
-        });
+    container.addEventListener('click', function(e) {
+        const item = e.target.closest('.chat-item');
+        if (!item) return;
+        if (e.target.type === 'checkbox' || e.target.closest('.chat-checkbox')) {
+            return;
+        }
         
-        item.addEventListener('dblclick', function() {
-            expandChatItem(this);
-        });
+        const id = parseInt(item.dataset.id);
+        if (e.ctrlKey || e.metaKey) {
+            setChatSelected(id, !chatList.selected.has(id));
+            lastSelectedId = id;
+            renderChatWindow();
+            updateSelectedCount();
+            showQuickActionsToolbar();
+        } else if (e.shiftKey) {
+            selectRange(id);
+        }
+    });
+    
+    container.addEventListener('dblclick', function(e) {
+        const item = e.target.closest('.chat-item');
+        if (item) expandChatItem(item);
     });
 }
 
 let isDragging = false;
-let dragStartItem = null;
-let dragEndItem = null;
+let dragStartIndex = null;
+let dragEndIndex = null;
 let dragSelectionMode = 'add';
 
 function initDragSelection() {
     const container = document.getElementById('chatsContainer');
     if (!container) return;
     
-    let startX, startY;
-    
     container.addEventListener('mousedown', function(e) {
         if (e.button !== 0) return;
         if (e.target.type === 'checkbox' || e.target.closest('.chat-checkbox')) return;
         if (e.target.tagName === 'INPUT' || e.target.tagName === 'TEXTAREA') return;
         
-        isDragging = true;
-        dragStartItem = e.target.closest('.chat-item');
+        const startItem = e.target.closest('.chat-item');
+        if (!startItem) return;
         
-        if (dragStartItem) {
-            const checkbox = dragStartItem.querySelector('.chat-select-checkbox');
-            dragSelectionMode = checkbox && checkbox.checked ? 'remove' : 'add';
-        }
-        
-        startX = e.clientX;
-        startY = e.clientY;
+        isDragging = true;
+        dragStartIndex = parseInt(startItem.dataset.index);
+        dragEndIndex = null;
+        dragSelectionMode = chatList.selected.has(parseInt(startItem.dataset.id)) ? 'remove' : 'add';
         
         document.body.style.userSelect = 'none';
         document.body.style.cursor = 'crosshair';
     });
     
     document.addEventListener('mousemove', function(e) {
-        if (!isDragging || !dragStartItem) return;
+        if (!isDragging || dragStartIndex === null) return;
         
-        const currentItem = e.target.closest('.chat-item');
-        if (currentItem && currentItem !== dragEndItem) {
-            dragEndItem = currentItem;
+        const currentItem = e.target.closest?.('.chat-item');
+        if (!currentItem) return;
+        const currentIndex = parseInt(currentItem.dataset.index);
+        if (currentIndex !== dragEndIndex) {
+            dragEndIndex = currentIndex;
             updateDragSelection();
         }
     });
@@ -978,8 +1230,8 @@ function initDragSelection() {
         if (!isDragging) return;
         
         isDragging = false;
-        dragStartItem = null;
-        dragEndItem = null;
+        dragStartIndex = null;
+        dragEndIndex = null;
         
         document.body.style.userSelect = '';
         document.body.style.cursor = '';
@@ -989,79 +1241,57 @@ function initDragSelection() {
     });
 }
 
-function updateDragSelection() {
-    if (!dragStartItem || !dragEndItem) return;
-    
-    const allItems = Array.from(document.querySelectorAll('.chat-item'));
-    const startIndex = allItems.indexOf(dragStartItem);
-    const endIndex = allItems.indexOf(dragEndItem);
-    
-    const start = Math.min(startIndex, endIndex);
-    const end = Math.max(startIndex, endIndex);
+function selectChatRows(fromIndex, toIndex, selected) {
+    const start = Math.min(fromIndex, toIndex);
+    const end = Math.max(fromIndex, toIndex);
     
     for (let i = start; i <= end; i++) {
-        const checkbox = allItems[i].querySelector('.chat-select-checkbox');
-        if (checkbox) {
-            checkbox.checked = dragSelectionMode === 'add';
+        const row = chatList.rows[i];
+        if (row && row.type === 'message') {
+            setChatSelected(row.log.id, selected);
         }
     }
 }
 
-function clearDragSelection() {
-    const allItems = document.querySelectorAll('.chat-item');
-    allItems.forEach(item => {
-        item.classList.remove('selection-range');
-    });
+function updateDragSelection() {
+    if (dragStartIndex === null || dragEndIndex === null) return;
+    
+    selectChatRows(dragStartIndex, dragEndIndex, dragSelectionMode === 'add');
+    renderChatWindow();
 }
 
-let lastSelectedItem = null;
+let lastSelectedId = null;
 
-function selectRange(currentItem) {
-    if (!lastSelectedItem) {
-        const checkbox = currentItem.querySelector('.chat-select-checkbox');
-        if (checkbox) {
-            checkbox.checked = true;
-            lastSelectedItem = currentItem;
-            updateSelectedCount();
-            showQuickActionsToolbar();
-        }
-        return;
-    }
-    
-    const allItems = Array.from(document.querySelectorAll('.chat-item'));
-    const currentIndex = allItems.indexOf(currentItem);
-    const lastIndex = allItems.indexOf(lastSelectedItem);
-    
-    const start = Math.min(currentIndex, lastIndex);
-    const end = Math.max(currentIndex, lastIndex);
+function selectRange(currentId) {
+    const currentIndex = chatList.indexById.get(currentId);
+    const lastIndex = lastSelectedId === null ? undefined : chatList.indexById.get(lastSelectedId);
     
-    for (let i = start; i <= end; i++) {
-        const checkbox = allItems[i].querySelector('.chat-select-checkbox');
-        if (checkbox) {
-            checkbox.checked = true;
-        }
+    if (lastIndex === undefined) {
+        setChatSelected(currentId, true);
+    } else {
+        selectChatRows(currentIndex, lastIndex, true);
     }
     
-    lastSelectedItem = currentItem;
+    lastSelectedId = currentId;
+    renderChatWindow();
     updateSelectedCount();
     showQuickActionsToolbar();
 }
 
 function expandChatItem(item) {
-    item.classList.toggle('expanded');
-    const content = item.querySelector('.chat-content');
-    if (content) {
-        content.classList.toggle('expanded');
+    const id = parseInt(item.dataset.id);
+    if (chatList.expanded.has(id)) {
+        chatList.expanded.delete(id);
+    } else {
+        chatList.expanded.add(id);
     }
+    renderChatWindow();
 }
 
 document.addEventListener('DOMContentLoaded', function() {
     initTabs();
     renderMessageDistribution();
     loadAnalysisIfExists();
-    initKeyboardShortcuts();
-    initClickSelection();
-    initDragSelection();
     
     const savedMode = localStorage.getItem('chatViewMode');
     if (savedMode === 'compact') {
@@ -1073,20 +1303,23 @@ document.addEventListener('DOMContentLoaded', function() {
         if (viewModeText) viewModeText.textContent = '展开视图';
     }
     
+    initChatList();
+    initKeyboardShortcuts();
+    initClickSelection();
+    initDragSelection();
+    
     populateDateFilter();
 });
 
-function populateDateFilter() {
+async function populateDateFilter() {
     const dateFilter = document.getElementById('chatDateFilter');
     if (!dateFilter) return;
     
-    const dates = new Set();
-    document.querySelectorAll('.chat-item').forEach(item => {
-        const date = item.dataset.date;
-        if (date) dates.add(date);
-    });
+    const summary = await getTimelineSummary();
+    if (!summary) return;
     
-    const sortedDates = Array.from(dates).sort();
+    const sortedDates = Object.keys(summary.days).sort();
+    const fragment = document.createDocumentFragment();
     
     sortedDates.forEach(date => {
         const option = document.createElement('option');
@@ -1099,29 +1332,24 @@ function populateDateFilter() {
         const weekday = weekdays[dateObj.getDay()];
         
         option.textContent = `${month}月${day}日 ${weekday}`;
-        dateFilter.appendChild(option);
+        fragment.appendChild(option);
     });
+    dateFilter.appendChild(fragment);
 }
 
-function renderTimeline() {
-    const chatItems = document.querySelectorAll('.chat-item');
+async function renderTimeline() {
+    const summary = await getTimelineSummary();
     
-    if (chatItems.length === 0) {
+    if (!summary || summary.total === 0) {
         renderEmptyTimeline();
         return;
     }
     
-    const activityData = {};
-    chatItems.forEach(item => {
-        const date = item.dataset.date;
-        if (date) {
-            activityData[date] = (activityData[date] || 0) + 1;
-        }
-    });
+    const activityData = summary.days;
     
     renderHeatmap(activityData);
     renderTimelineSummary(activityData);
-    renderActivitySummary(activityData);
+    renderActivitySummary(activityData, summary.hours);
     renderRecentActivity(activityData);
 }
 
@@ -1344,7 +1572,7 @@ function generateHeatmapHTML(activityData) {
     return html;
 }
 
-function renderActivitySummary(activityData) {
+function renderActivitySummary(activityData, hourCounts = {}) {
     const dates = Object.keys(activityData).sort();
     const totalDays = dates.length;
     const totalMessages = Object.values(activityData).reduce((sum, count) => sum + count, 0);
@@ -1374,16 +1602,6 @@ function renderActivitySummary(activityData) {
     
     const peakHourEl = document.getElementById('peakHour');
     if (peakHourEl) {
-        const chatItems = document.querySelectorAll('.chat-item');
-        const hourCounts = {};
-        chatItems.forEach(item => {
-            const time = item.dataset.time;
-            if (time) {
-                const hour = time.split(':')[0];
-                hourCounts[hour] = (hourCounts[hour] || 0) + 1;
-            }
-        });
-        
         let peakHour = '';
         let maxHourCount = 0;
         Object.entries(hourCounts).forEach(([hour, count]) => {
@@ -1439,16 +1657,16 @@ function formatDate(dateStr) {
 
 function toggleSelectAllChats() {
     const selectAllCheckbox = document.getElementById('selectAllChats');
-    const checkboxes = document.querySelectorAll('.chat-select-checkbox');
-    checkboxes.forEach(checkbox => {
-        checkbox.checked = selectAllCheckbox.checked;
-    });
+    if (chatList.rows.length > 0) {
+        selectChatRows(0, chatList.rows.length - 1, selectAllCheckbox.checked);
+    }
+    renderChatWindow();
     updateSelectedCount();
+    showQuickActionsToolbar();
 }
 
 function updateSelectedCount() {
-    const checkboxes = document.querySelectorAll('.chat-select-checkbox:checked');
-    const count = checkboxes.length;
+    const count = chatList.selected.size;
     
     const selectedCountEl = document.getElementById('selectedCount');
     if (selectedCountEl) {
@@ -1463,12 +1681,12 @@ function updateSelectedCount() {
 }
 
 function updateSelectAllState() {
-    const checkboxes = document.querySelectorAll('.chat-select-checkbox');
     const selectAllCheckbox = document.getElementById('selectAllChats');
-    if (selectAllCheckbox && checkboxes.length > 0) {
-        const checkedCount = document.querySelectorAll('.chat-select-checkbox:checked').length;
-        selectAllCheckbox.checked = checkedCount === checkboxes.length;
-        selectAllCheckbox.indeterminate = checkedCount > 0 && checkedCount < checkboxes.length;
+    const loadedIds = chatList.rows.filter(row => row.type === 'message').map(row => row.log.id);
+    if (selectAllCheckbox && loadedIds.length > 0) {
+        const checkedCount = loadedIds.filter(id => chatList.selected.has(id)).length;
+        selectAllCheckbox.checked = checkedCount === loadedIds.length;
+        selectAllCheckbox.indeterminate = checkedCount > 0 && checkedCount < loadedIds.length;
     }
 }
 
@@ -1517,8 +1735,7 @@ async function analyzeSelectedMessages() {
     console.log('[Frontend] analyzeSelectedMessages() called');
     const contactId = window.location.pathname.split('/').pop();
     console.log('[Frontend] contactId:', contactId);
-    const checkboxes = document.querySelectorAll('.chat-select-checkbox:checked');
-    const selectedIds = Array.from(checkboxes).map(cb => parseInt(cb.value));
+    const selectedIds = Array.from(chatList.selected);
     
     if (selectedIds.length === 0) {
         showToast('请先选择要分析的聊天记录', 'warning');
@@ -1559,83 +1776,71 @@ async function analyzeSelectedMessages() {
         });
         
         if (!response.ok) {
-            throw new Error('请求失败');
+            const body = await response.json().catch(() => ({}));
+            throw new Error(body.error || '请求失败');
         }
         
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-        let buffer = '';
-        
         analysisStatus.textContent = '正在分析聊天记录...';
         updateStep(2);
         
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-            
-            buffer += decoder.decode(value, { stream: true });
-            const lines = buffer.split('\n');
-            buffer = lines.pop() || '';
+        let finished = false;
+        await followAnalysisStream(response, event => {
+            const data = JSON.parse(event.data);
             
-            for (const line of lines) {
-                if (line.trim()) {
-                    try {
-                        const data = JSON.parse(line);
-                        
-                        if (data.type === 'content_update') {
-                            const contentLength = data.content_length || 0;
-                            
-                            if (generatedTokensEl) generatedTokensEl.textContent = contentLength.toLocaleString();
-                            if (totalTokensEl) totalTokensEl.textContent = contentLength.toLocaleString();
-                            
-                            const progress = Math.min(95, 20 + (contentLength / 100) * 75);
-                            if (progressBar) progressBar.style.width = progress + '%';
-                            if (progressText) progressText.textContent = Math.round(progress) + '%';
-                            
-                            if (contentLength > 50) {
-                                updateStep(3);
-                            }
-                        } else if (data.type === 'token_update') {
-                            const total = data.total_tokens || 0;
-                            const completion = data.completion_tokens || 0;
-                            
-                            generatedTokensEl.textContent = completion.toLocaleString();
-                            totalTokensEl.textContent = total.toLocaleString();
-                            
-                            const progress = Math.min(95, 20 + (completion / 2000) * 75);
-                            progressBar.style.width = progress + '%';
-                            progressText.textContent = Math.round(progress) + '%';
-                            
-                            if (completion > 500) {
-                                updateStep(3);
-                            }
-                        } else if (data.type === 'error') {
-                            throw new Error(data.message);
-                        } else if (data.type === 'complete') {
-                            progressBar.style.width = '100%';
-                            progressText.textContent = '100%';
-                            
-                            analysisStatus.textContent = '分析完成！';
-                            
-                            document.getElementById('analysisSpinner').style.display = 'none';
-                            document.getElementById('analysisHint').style.display = 'none';
-                            
-                            const rawDataSection = document.getElementById('rawDataSection');
-                            const rawDataContent = document.getElementById('rawDataContent');
-                            const analysisActions = document.getElementById('analysisActions');
-                            
-                            rawDataContent.textContent = JSON.stringify(data.analysis, null, 2);
-                            rawDataSection.style.display = 'block';
-                            analysisActions.style.display = 'block';
-                            
-                            updateStep(3);
-                            return;
-                        }
-                    } catch (e) {
-                        continue;
-                    }
+            if (event.event === 'content_update') {
+                const contentLength = data.content_length || 0;
+                
+                if (generatedTokensEl) generatedTokensEl.textContent = contentLength.toLocaleString();
+                if (totalTokensEl) totalTokensEl.textContent = contentLength.toLocaleString();
+                
+                const progress = Math.min(95, 20 + (contentLength / 100) * 75);
+                if (progressBar) progressBar.style.width = progress + '%';
+                if (progressText) progressText.textContent = Math.round(progress) + '%';
+                
+                if (contentLength > 50) {
+                    updateStep(3);
                 }
+            } else if (event.event === 'token_update') {
+                const total = data.total_tokens || 0;
+                const completion = data.completion_tokens || 0;
+                
+                generatedTokensEl.textContent = completion.toLocaleString();
+                totalTokensEl.textContent = total.toLocaleString();
+                
+                const progress = Math.min(95, 20 + (completion / 2000) * 75);
+                progressBar.style.width = progress + '%';
+                progressText.textContent = Math.round(progress) + '%';
+                
+                if (completion > 500) {
+                    updateStep(3);
+                }
+            } else if (event.event === 'error') {
+                throw new Error(data.message);
+            } else if (event.event === 'complete') {
+                progressBar.style.width = '100%';
+                progressText.textContent = '100%';
+                
+                analysisStatus.textContent = '分析完成！';
+                
+                document.getElementById('analysisSpinner').style.display = 'none';
+                document.getElementById('analysisHint').style.display = 'none';
+                
+                const rawDataSection = document.getElementById('rawDataSection');
+                const rawDataContent = document.getElementById('rawDataContent');
+                const analysisActions = document.getElementById('analysisActions');
+                
+                rawDataContent.textContent = JSON.stringify(data.analysis, null, 2);
+                rawDataSection.style.display = 'block';
+                analysisActions.style.display = 'block';
+                
+                updateStep(3);
+                finished = true;
+                return false;
             }
+        });
+        
+        if (!finished) {
+            throw new Error('与服务器的连接中断，分析未完成');
         }
         
     } catch (error) {
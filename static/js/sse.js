@@ -0,0 +1,112 @@
+// Server-Sent Events 解码，规则与 utils/sse.py 的 SSEDecoder 相同：
+// 输入 fetch 读到的原始字节块，行和多字节字符可以被拆在任意两个块之间；
+// 支持 \n、\r、\r\n 换行，多行 data 用 \n 拼接，冒号开头的注释行（服务端心跳）只计数不产生事件。
+// 分析接口是 POST 请求，浏览器自带的 EventSource 只能发 GET，所以用 fetch 读取响应体再在这里解码。
+
+class SSEDecoder {
+    constructor() {
+        this.lastEventId = null;
+        this.retry = null;
+        this.comments = 0;
+        this.buffer = '';
+        this.started = false;
+        this.skipLF = false;
+        this.textDecoder = new TextDecoder();
+        this.reset();
+    }
+
+    reset() {
+        this.eventType = null;
+        this.data = [];
+        this.hasFields = false;
+    }
+
+    get pending() {
+        return this.buffer.length > 0 || this.hasFields;
+    }
+
+    feed(bytes) {
+        let text = typeof bytes === 'string' ? bytes : this.textDecoder.decode(bytes, { stream: true });
+        if (!text) return [];
+        if (this.skipLF && text[0] === '\n') text = text.slice(1);
+        this.skipLF = false;
+
+        const buffer = this.buffer + text;
+        const events = [];
+        let start = 0;
+        const lineBreak = /\r\n|\r|\n/g;
+        let match;
+        while ((match = lineBreak.exec(buffer)) !== null) {
+            if (match[0] === '\r' && match.index === buffer.length - 1) {
+                // \r 在块末尾，下一块若以 \n 开头则属于同一个换行
+                this.skipLF = true;
+            }
+            const event = this.line(buffer.slice(start, match.index));
+            if (event) events.push(event);
+            start = lineBreak.lastIndex;
+        }
+        this.buffer = buffer.slice(start);
+        return events;
+    }
+
+    line(line) {
+        if (!this.started) {
+            this.started = true;
+            if (line.charCodeAt(0) === 0xFEFF) line = line.slice(1);
+        }
+        if (line === '') {
+            let event = null;
+            if (this.data.length) {
+                event = {
+                    event: this.eventType || 'message',
+                    data: this.data.join('\n'),
+                    id: this.lastEventId,
+                    retry: this.retry
+                };
+            }
+            this.reset();
+            return event;
+        }
+        if (line[0] === ':') {
+            this.comments += 1;
+            return null;
+        }
+        const colon = line.indexOf(':');
+        const field = colon === -1 ? line : line.slice(0, colon);
+        let value = colon === -1 ? '' : line.slice(colon + 1);
+        if (value[0] === ' ') value = value.slice(1);
+        this.hasFields = true;
+        if (field === 'data') {
+            this.data.push(value);
+        } else if (field === 'event') {
+            this.eventType = value;
+        } else if (field === 'id') {
+            if (!value.includes('\0')) this.lastEventId = value;
+        } else if (field === 'retry') {
+            if (/^\d+$/.test(value)) this.retry = parseInt(value, 10);
+        }
+        return null;
+    }
+}
+
+// 逐个事件回调 onEvent(event)，回调返回 false 时停止读取，抛出异常时取消读取并向外抛出；
+// 返回解码器，可从中取 lastEventId 和 pending。断线重连时可传入自己的 decoder，异常后仍能读到 lastEventId
+async function readEventStream(response, onEvent, decoder = new SSEDecoder()) {
+    const reader = response.body.getReader();
+    try {
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            for (const event of decoder.feed(value)) {
+                if (onEvent(event) === false) {
+                    reader.cancel();
+                    return decoder;
+                }
+            }
+        }
+    } catch (error) {
+        reader.cancel();
+        throw error;
+    }
+    return decoder;
+}
@@ -6,6 +6,7 @@ import json
 import sys
 import requests
 from config import Config
+from utils.sse import iter_events
 
 AI_SYSTEM_PROMPT = """你是一个专业的心理分析师，擅长通过分析社交聊天记录来洞察一个人的性格特质、行为偏好、社交模式和思维方式。
 
@@ -225,28 +226,25 @@ def test_streaming(chat_content):
             content = ""
             chunk_count = 0
 
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data = line[6:]
-                        if data != '[DONE]':
-                            try:
-                                chunk = json.loads(data)
-                                chunk_count += 1
-
-                                if 'usage' in chunk and chunk['usage']:
-                                    total_tokens = chunk['usage'].get('total_tokens', 0)
-                                    completion_tokens = chunk['usage'].get('completion_tokens', 0)
-
-                                if 'choices' in chunk and len(chunk['choices']) > 0:
-                                    delta = chunk['choices'][0].get('delta', {})
-                                    chunk_content = delta.get('content', '')
-                                    if chunk_content:
-                                        content += chunk_content
-                                        print(chunk_content, end='', flush=True)
-                            except json.JSONDecodeError:
-                                continue
+            for event in iter_events(response.iter_content(chunk_size=None)):
+                if event.data == '[DONE]':
+                    break
+                try:
+                    chunk = event.json()
+                except json.JSONDecodeError:
+                    continue
+                chunk_count += 1
+
+                if 'usage' in chunk and chunk['usage']:
+                    total_tokens = chunk['usage'].get('total_tokens', 0)
+                    completion_tokens = chunk['usage'].get('completion_tokens', 0)
+
+                if 'choices' in chunk and len(chunk['choices']) > 0:
+                    delta = chunk['choices'][0].get('delta', {})
+                    chunk_content = delta.get('content', '')
+                    if chunk_content:
+                        content += chunk_content
+                        print(chunk_content, end='', flush=True)
 
             print("\n")
             print("=" * 60)
@@ -271,9 +269,11 @@ def test_streaming(chat_content):
 
 def load_chat_content_from_db(contact_id):
     """从数据库加载指定联系人的聊天记录"""
-    from app import app, db
+    from app import create_app, db
     from database.models import Contact, ChatLog
+    from utils.sampling import build_analysis_transcript
 
+    app = create_app()
     with app.app_context():
         contact = Contact.query.get(contact_id)
         if not contact:
@@ -287,13 +287,15 @@ def load_chat_content_from_db(contact_id):
         if not chat_logs:
             print("没有找到聊天记录")
             return None
-        # 这里改过
-        chat_content = '\n'.join([
-            f"[{log.chat_date}]【我】{log.content}" if log.speaker == '我' else f"[{log.chat_date}]【对方】{log.content}"
-            for log in chat_logs
-        ])
+        # 与分析路由发送的内容一致：整理后的聊天记录
+        transcript = build_analysis_transcript(chat_logs, app.config.get('ANALYSIS_TOKEN_BUDGET'))
+        chat_content = transcript.text
+        stats = transcript.stats
 
         print(f"加载了 {len(chat_logs)} 条聊天记录")
+        print(f"整理后 token: {stats.original_tokens} -> {stats.tokens}（节省 {stats.tokens_saved}），"
+              f"去掉占位/系统消息 {stats.dropped_noise} 条，重复 {stats.dropped_duplicates} 条，"
+              f"省略 {stats.omitted_days} 天" + (f"，采样 {stats.sampled_messages} 条" if stats.sampled_messages else ""))
         print(f"对方消息: {sum(1 for log in chat_logs if log.speaker == '对方')}")
         print(f"我的消息: {sum(1 for log in chat_logs if log.speaker == '我')}")
         print("-" * 60)
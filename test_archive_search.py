@@ -0,0 +1,78 @@
+"""
+归档消息检索测试：归档后、分片重新平衡后仍能按联系人搜到归档的消息，原分片不留下检索数据
+
+用法: python -m pytest -q test_archive_search.py
+"""
+import os
+import tempfile
+from datetime import date, timedelta
+
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(_tmp, 'test.db'))
+os.environ.setdefault('EMBEDDING_DIR', os.path.join(_tmp, 'embeddings'))
+os.environ.setdefault('CACHE_URL', 'memory://')
+
+from sqlalchemy import text
+
+from app import create_app
+from database.archive import archive_chat_logs
+from database.models import db, ChatLog, Contact
+from database.search import ARCHIVE_FTS_MAP, ARCHIVE_FTS_TABLE, ensure_chat_log_fts, search_chat_logs
+from database.shards import ShardRouter, init_chat_log_shards, rebalance_chat_logs
+
+CONTACTS = 4
+
+
+def _populate():
+    old = date.today() - timedelta(days=400)
+    for contact_id in range(1, CONTACTS + 1):
+        db.session.add(Contact(id=contact_id, name=f'联系人{contact_id}'))
+        for i in range(5):
+            db.session.add(ChatLog(contact_id=contact_id, speaker='对方', chat_date=old + timedelta(days=i),
+                                   content=f'我们约好的暗号是青山{contact_id}号，第{i}次'))
+        db.session.add(ChatLog(contact_id=contact_id, speaker='我', chat_date=date.today(),
+                               content=f'最近的消息{contact_id}'))
+    db.session.commit()
+
+
+def _archive_index_rows(engine):
+    with engine.connect() as conn:
+        return (conn.execute(text(f"SELECT count(*) FROM {ARCHIVE_FTS_MAP}")).scalar(),
+                conn.execute(text(f"SELECT count(*) FROM {ARCHIVE_FTS_TABLE} WHERE {ARCHIVE_FTS_TABLE} MATCH '青山'"))
+                .scalar())
+
+
+def test_archived_messages_searchable_after_rebalance():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        ensure_chat_log_fts()
+        _populate()
+        report = archive_chat_logs(90, log=lambda message: None)
+        assert report['messages'] == CONTACTS * 5
+
+        found = search_chat_logs('约好的暗号', contact_id=2)['results']
+        assert len(found) == 5 and {r['contact_id'] for r in found} == {2}
+        assert '<mark>约好的暗号</mark>' in found[0]['snippet']
+        # 不足 3 个字符的词在解压后过滤
+        assert len(search_chat_logs('青山 3号')['results']) == 5
+
+        router = ShardRouter(os.path.join(_tmp, 'shards'), 2)
+        rebalance_chat_logs(router, log=lambda message: None)
+        assert _archive_index_rows(db.engine) == (0, 0)
+        assert sum(_archive_index_rows(router.engine(shard))[0] for shard in range(2)) == CONTACTS * 5
+        router.dispose()
+
+    app.config.update(CHAT_LOG_SHARDS=2, CHAT_LOG_SHARD_DIR=os.path.join(_tmp, 'shards'))
+    init_chat_log_shards(app)
+    with app.app_context():
+        for contact_id in range(1, CONTACTS + 1):
+            found = search_chat_logs(f'青山{contact_id}号', contact_id=contact_id)['results']
+            assert len(found) == 5
+            assert all(r['content'].startswith('我们约好的暗号') for r in found)
+        assert len(search_chat_logs('约好的暗号', limit=100)['results']) == CONTACTS * 5
+
+
+if __name__ == '__main__':
+    test_archived_messages_searchable_after_rebalance()
+    print('✅ 通过')
@@ -1,2 +1,16 @@
-from utils.ai import get_ai_analysis, parse_ai_response, stream_ai_analysis
-from utils.exporter import export_chat_logs_to_excel, export_analysis_to_excel, generate_summary_report
+# 按需导入：utils.exporter 依赖 pandas，utils.ai 依赖 requests，都不应在导入 utils 子模块时被顺带加载
+_EXPORTS = {
+    'get_ai_analysis': 'utils.ai',
+    'parse_ai_response': 'utils.ai',
+    'stream_ai_analysis': 'utils.ai',
+    'export_chat_logs_to_excel': 'utils.exporter',
+    'export_analysis_to_excel': 'utils.exporter',
+    'generate_summary_report': 'utils.exporter',
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'utils' has no attribute {name!r}")
+    import importlib
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
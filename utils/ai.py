@@ -1,7 +1,10 @@
 import json
-import requests
-from config import Config
-from functools import wraps
+import time
+from database.usage import CallUsage, QuotaExceeded
+from utils.backends import stream_completion
+from utils.metrics import (
+    AI_DURATION, AI_REQUESTS, AI_TOKENS_PER_SECOND, AI_TTFT, log_event, observe_ai_tokens
+)
 
 AI_SYSTEM_PROMPT = """你是一个专业的心理分析师，擅长通过分析社交聊天记录来洞察一个人的性格特质、行为偏好、社交模式和思维方式。
 
@@ -93,52 +96,49 @@ AI_SYSTEM_PROMPT = """你是一个专业的心理分析师，擅长通过分析
 6. 礼物建议应该考虑"对方"的实际需求和兴趣方向
 7. 如果发现某些行为特征更像是"我"的，请在相应描述中说明
 """
-def get_ai_analysis(chat_content, api_key=None):
-    if not api_key:
-        api_key = Config.VOLCANO_ARK_API_KEY
-    
-    if not api_key:
-        return {"error": "未配置API密钥，请设置VOLCANO_ARK_API_KEY环境变量"}
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    messages = [
+def get_ai_analysis(chat_content, api_key=None, contact_id=None, scope=None):
+    """contact_id、scope 只用于用量台账（每个上游请求一行，见 database/usage.py）；
+    超出配额时不调用模型，返回带 quota 和 retry_after 的错误"""
+    usage = CallUsage('blocking', contact_id, scope, user_key=bool(api_key))
+    try:
+        usage.reserve()
+    except QuotaExceeded as e:
+        return {"error": str(e), "quota": e.quota, "retry_after": e.retry_after}
+    started = time.perf_counter()
+    try:
+        final = _get_ai_analysis(chat_content, api_key, usage)
+    finally:
+        usage.close()
+    duration = time.perf_counter() - started
+    outcome = 'error' if 'error' in final else 'ok'
+    AI_REQUESTS.inc(mode='blocking', outcome=outcome)
+    AI_DURATION.observe(duration, mode='blocking')
+    log_event('ai_call', mode='blocking', outcome=outcome, backend=final.get('backend'),
+              duration_ms=round(duration * 1000, 1))
+    
+    if 'error' in final:
+        return {"error": final['error']}
+    
+    observe_ai_tokens(final.get('total_tokens', 0), final.get('completion_tokens', 0))
+    if 'result' in final:
+        return final['result']
+    return {"raw_response": final.get('raw_response', '')}
+
+def _messages(chat_content):
+    return [
         {"role": "system", "content": AI_SYSTEM_PROMPT},
         {"role": "user", "content": f"请分析以下聊天记录：\n\n{chat_content}"}
     ]
-    
-    payload = {
-        "model": Config.AI_MODEL_ID,
-        "messages": messages,
-        "max_tokens": 4096,
-        "temperature": 0.7
-    }
-    
-    try:
-        response = requests.post(
-            f"{Config.VOLCANO_ARK_ENDPOINT}/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=120
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            content = result['choices'][0]['message']['content']
-            
-            try:
-                json_content = json.loads(content)
-                return json_content
-            except json.JSONDecodeError:
-                return {"raw_response": content}
-        else:
-            return {"error": f"API调用失败: {response.status_code}, {response.text}"}
-    
-    except requests.exceptions.RequestException as e:
-        return {"error": f"网络请求错误: {str(e)}"}
+
+def _get_ai_analysis(chat_content, api_key=None, usage=None):
+    """返回最终结果或错误条目"""
+    # 同样走流式接口，才能在首 token 迟迟不来时对冲到其他模型服务，见 utils/backends.py
+    final = {}
+    for item in stream_completion(_messages(chat_content), api_key, usage):
+        # 内容分块带 type，最终结果和错误没有
+        if 'type' not in item:
+            final = item
+    return final
 
 def parse_ai_response(analysis_result):
     if "error" in analysis_result:
@@ -177,86 +177,50 @@ def parse_ai_response(analysis_result):
     
     return parsed
 
-def stream_ai_analysis(chat_content, api_key=None):
-    if not api_key:
-        api_key = Config.VOLCANO_ARK_API_KEY
-    
-    if not api_key:
-        yield {"error": "未配置API密钥，请设置VOLCANO_ARK_API_KEY环境变量"}
+def stream_ai_analysis(chat_content, api_key=None, contact_id=None, scope=None):
+    """流式调用大模型，同时记录首 token 延迟、输出速度和 token 用量；超出配额时只产生一个错误条目"""
+    usage = CallUsage('stream', contact_id, scope, user_key=bool(api_key))
+    try:
+        usage.reserve()
+    except QuotaExceeded as e:
+        yield {'error': str(e)}
         return
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    messages = [
-        {"role": "system", "content": AI_SYSTEM_PROMPT},
-        {"role": "user", "content": f"请分析以下聊天记录：\n\n{chat_content}"}
-    ]
-    
-    payload = {
-        "model": Config.AI_MODEL_ID,
-        "messages": messages,
-        "max_tokens": 4096,
-        "temperature": 0.7,
-        "stream": True
-    }
-    
+    started = time.perf_counter()
+    first_token_at = None
+    outcome = 'error'
+    final = {}
     try:
-        response = requests.post(
-            f"{Config.VOLCANO_ARK_ENDPOINT}/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=180,
-            stream=True
-        )
-        
-        if response.status_code != 200:
-            yield {"error": f"API调用失败: {response.status_code}, {response.text}"}
-            return
-        
-        total_tokens = 0
-        completion_tokens = 0
-        content = ""
-        content_length = 0
-        chunk_count = 0
-        
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data = line[6:]
-                    if data != '[DONE]':
-                        try:
-                            chunk = json.loads(data)
-                            chunk_count += 1
-                            
-                            if 'usage' in chunk and chunk['usage']:
-                                total_tokens = chunk['usage'].get('total_tokens', 0)
-                                completion_tokens = chunk['usage'].get('completion_tokens', 0)
-                            
-                            if 'choices' in chunk and len(chunk['choices']) > 0:
-                                delta = chunk['choices'][0].get('delta', {})
-                                chunk_content = delta.get('content', '')
-                                if chunk_content:
-                                    content += chunk_content
-                                    content_length += len(chunk_content)
-                                    yield {
-                                        "type": "content_update",
-                                        "content": chunk_content,
-                                        "total_length": content_length,
-                                        "total_tokens": total_tokens,
-                                        "completion_tokens": completion_tokens
-                                    }
-                        except json.JSONDecodeError:
-                            continue
-        
-        try:
-            json_content = json.loads(content)
-            yield {"result": json_content, "total_tokens": total_tokens, "completion_tokens": completion_tokens}
-        except json.JSONDecodeError:
-            yield {"raw_response": content, "total_tokens": total_tokens, "completion_tokens": completion_tokens}
-    
-    except requests.exceptions.RequestException as e:
-        yield {"error": f"网络请求错误: {str(e)}"}
+        for item in _stream_ai_analysis(chat_content, api_key, usage):
+            if first_token_at is None and item.get('type') == 'content_update':
+                first_token_at = time.perf_counter()
+                AI_TTFT.observe(first_token_at - started)
+            elif 'result' in item or 'raw_response' in item:
+                outcome = 'ok'
+                final = item
+            elif 'error' in item:
+                final = item
+            yield item
+    except GeneratorExit:
+        # 调用方提前关闭了生成器
+        outcome = 'cancelled'
+        raise
+    finally:
+        usage.close()
+        finished = time.perf_counter()
+        tokens = (final.get('total_tokens', 0), final.get('completion_tokens', 0))
+        AI_REQUESTS.inc(mode='stream', outcome=outcome)
+        AI_DURATION.observe(finished - started, mode='stream')
+        tokens_per_second = None
+        if outcome == 'ok':
+            observe_ai_tokens(*tokens)
+            if first_token_at is not None and tokens[1] and finished > first_token_at:
+                tokens_per_second = tokens[1] / (finished - first_token_at)
+                AI_TOKENS_PER_SECOND.observe(tokens_per_second)
+        log_event('ai_call', mode='stream', outcome=outcome, backend=final.get('backend'),
+                  duration_ms=round((finished - started) * 1000, 1),
+                  ttft_ms=round((first_token_at - started) * 1000, 1) if first_token_at else None,
+                  total_tokens=tokens[0], completion_tokens=tokens[1],
+                  tokens_per_second=round(tokens_per_second, 1) if tokens_per_second else None)
+
+def _stream_ai_analysis(chat_content, api_key=None, usage=None):
+    return stream_completion(_messages(chat_content), api_key, usage)
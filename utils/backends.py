@@ -0,0 +1,436 @@
+"""
+兼容 OpenAI 接口的多个模型服务：路由、对冲请求、熔断与各服务的延迟统计
+
+AI_BACKENDS 为 JSON 数组，每项描述一个服务，例如:
+    [{"name": "ark", "endpoint": "https://ark.cn-beijing.volces.com/api/v3", "model": "doubao-seed-1-6-251015",
+      "api_key_env": "VOLCANO_ARK_API_KEY", "cost": 0.8},
+     {"name": "local", "endpoint": "http://127.0.0.1:8000/v1", "model": "qwen2.5-14b-instruct", "cost": 0}]
+api_key 可以直接写在 api_key 中，也可以用 api_key_env 指定环境变量；声明了 api_key_env 但变量为空的服务视为未配置。
+cost 为每千 token 的价格，只用于按成本排序。未设置 AI_BACKENDS 时只有由 VOLCANO_ARK_* 构成的 ark 一个服务。
+
+每次调用按 AI_ROUTING 给可用的服务排序：order 按配置顺序（第一个为主，其余为后备）、latency 按首 token 延迟的
+指数滑动平均、cost 按价格；还没有延迟数据的服务视为最快，先被尝试一次。
+    后备：首选服务在输出任何内容之前失败（网络错误、5xx、429 等）时换下一个服务重试；已经开始输出后失败则直接报错，
+    避免拼接两个模型的内容。
+    对冲：AI_HEDGE_AFTER 秒内首选服务还没有输出首个内容时，同时向下一个服务发出请求，先输出内容的一方胜出，
+    另一方的连接立即关闭。对冲会多花一部分 token（落败的请求同样记入用量台账），设为 0 关闭。
+    熔断：某个服务连续失败 AI_BREAKER_FAILURES 次后跳过它 AI_BREAKER_COOLDOWN 秒，之后放行一次试探请求，
+    成功则恢复，失败则继续熔断。鉴权失败等 4xx 错误是配置或用户密钥的问题，不计入熔断。
+
+调用方传入 api_key（用户自己的密钥）时只使用第一个服务，不做后备和对冲。
+各服务的请求数、失败数、首 token 延迟分位数和熔断状态见 backend_stats()，由 /api/ai/backends 返回。
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import requests
+import urllib3
+
+from config import Config
+from utils.metrics import AI_BACKEND_REQUESTS, AI_BACKEND_TTFT, AI_HEDGES, log_event
+from utils.sse import SSEDecoder, iter_events
+from utils.transcript import count_tokens
+
+EWMA_ALPHA = 0.2
+RECENT_SAMPLES = 200
+# 这些状态码说明服务本身有问题，计入熔断并换下一个服务重试
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _iter_body(response):
+    """按到达的顺序逐块读取响应体，收到多少返回多少；iter_content 遇到不分块、以关闭连接结束的响应时会一直读到结束"""
+    raw = response.raw
+    if not hasattr(raw, 'read1'):
+        # urllib3 1.x 没有 read1
+        yield from response.iter_content(chunk_size=None)
+        return
+    while True:
+        chunk = raw.read1(65536, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _abort_response(response):
+    """从另一个线程中断响应的读取。close() 不会唤醒阻塞在 recv 上的线程，需先对 socket 执行 shutdown（urllib3 2.3 起支持）"""
+    shutdown = getattr(response.raw, 'shutdown', None)
+    if shutdown is not None:
+        try:
+            shutdown()
+        except (ValueError, RuntimeError, OSError):
+            pass
+    response.close()
+
+
+class Backend:
+    def __init__(self, name, endpoint, model, api_key=None, cost=0.0, timeout=180, configured=True):
+        self.name = name
+        self.endpoint = endpoint.rstrip('/')
+        self.model = model
+        self.api_key = api_key
+        self.cost = float(cost)
+        self.timeout = timeout
+        self.configured = configured
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ttft_ewma = None
+        self.recent_ttft = deque(maxlen=RECENT_SAMPLES)
+        self.open_until = 0.0
+        self.probing = False
+
+    # ---- 熔断与统计 ----
+
+    def acquire(self, now=None):
+        """熔断中返回 False；冷却期过后只放行一个试探请求"""
+        now = now or time.monotonic()
+        with self._lock:
+            if self.consecutive_failures < Config.AI_BREAKER_FAILURES:
+                return True
+            if now < self.open_until or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self, ttft):
+        with self._lock:
+            self.requests += 1
+            self.consecutive_failures = 0
+            self.probing = False
+            if ttft is not None:
+                self.recent_ttft.append(ttft)
+                self.ttft_ewma = ttft if self.ttft_ewma is None else (
+                    EWMA_ALPHA * ttft + (1 - EWMA_ALPHA) * self.ttft_ewma)
+        AI_BACKEND_REQUESTS.inc(backend=self.name, outcome='ok')
+        if ttft is not None:
+            AI_BACKEND_TTFT.observe(ttft, backend=self.name)
+
+    def record_failure(self, error):
+        counted = getattr(error, 'retryable', True)
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.probing = False
+            if counted:
+                self.consecutive_failures += 1
+                tripped = self.consecutive_failures >= Config.AI_BREAKER_FAILURES
+                if tripped:
+                    self.open_until = time.monotonic() + Config.AI_BREAKER_COOLDOWN
+            else:
+                tripped = False
+        AI_BACKEND_REQUESTS.inc(backend=self.name, outcome='error')
+        log_event('ai_backend_failure', backend=self.name, error=str(error)[:200], breaker_open=tripped)
+
+    def record_cancelled(self):
+        with self._lock:
+            self.probing = False
+        AI_BACKEND_REQUESTS.inc(backend=self.name, outcome='cancelled')
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self.recent_ttft)
+            breaker_open = self.consecutive_failures >= Config.AI_BREAKER_FAILURES
+
+            def pct(p):
+                return round(recent[min(len(recent) - 1, int(p / 100 * len(recent)))], 3) if recent else None
+
+            return {
+                'name': self.name, 'endpoint': self.endpoint, 'model': self.model, 'cost': self.cost,
+                'configured': self.configured, 'requests': self.requests, 'failures': self.failures,
+                'consecutive_failures': self.consecutive_failures,
+                'breaker': ('half_open' if time.monotonic() >= self.open_until else 'open') if breaker_open else 'closed',
+                'ttft_ewma': round(self.ttft_ewma, 3) if self.ttft_ewma is not None else None,
+                'ttft_p50': pct(50), 'ttft_p95': pct(95),
+            }
+
+    # ---- 请求 ----
+
+    def stream(self, messages, api_key=None, cancelled=None, on_response=None):
+        """流式调用，产生与 utils.ai 相同格式的 content_update 和最终结果；服务出错时抛出 UpstreamError。
+        on_response(response) 在收到响应头后调用，对冲落败时 _Attempt 用它关闭连接"""
+        api_key = api_key or self.api_key
+        headers = {'Content-Type': 'application/json'}
+        if api_key:
+            headers['Authorization'] = f'Bearer {api_key}'
+        payload = {
+            'model': self.model,
+            'messages': messages,
+            'max_tokens': 4096,
+            'temperature': 0.7,
+            'stream': True
+        }
+        try:
+            response = requests.post(f'{self.endpoint}/chat/completions', headers=headers, json=payload,
+                                     timeout=self.timeout, stream=True)
+        except requests.exceptions.RequestException as e:
+            raise UpstreamError(f'网络请求错误: {str(e)}')
+        if on_response is not None:
+            on_response(response)
+
+        with response:
+            if response.status_code != 200:
+                raise UpstreamError(f'API调用失败: {response.status_code}, {response.text}',
+                                    retryable=response.status_code in RETRYABLE_STATUS)
+
+            total_tokens = 0
+            completion_tokens = 0
+            content = ''
+            finished = False
+            decoder = SSEDecoder()
+            try:
+                for event in iter_events(_iter_body(response), decoder):
+                    if cancelled is not None and cancelled.is_set():
+                        return
+                    if event.data == '[DONE]':
+                        finished = True
+                        break
+                    try:
+                        chunk = json.loads(event.data)
+                    except json.JSONDecodeError:
+                        raise UpstreamError(f'上游返回了无法解析的数据块: {event.data[:100]}')
+
+                    if chunk.get('usage'):
+                        total_tokens = chunk['usage'].get('total_tokens', 0)
+                        completion_tokens = chunk['usage'].get('completion_tokens', 0)
+
+                    if chunk.get('choices'):
+                        choice = chunk['choices'][0]
+                        if choice.get('finish_reason'):
+                            finished = True
+                        chunk_content = (choice.get('delta') or {}).get('content', '')
+                        if chunk_content:
+                            content += chunk_content
+                            yield {
+                                'type': 'content_update',
+                                'content': chunk_content,
+                                'total_length': len(content),
+                                'total_tokens': total_tokens,
+                                'completion_tokens': completion_tokens
+                            }
+            except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+                raise UpstreamError(f'网络请求错误: {str(e)}')
+            # 既没有 [DONE] 也没有 finish_reason：连接在输出中途断开，内容不完整
+            if not finished:
+                raise UpstreamError('上游流式响应中途断开' + ('（最后一个事件不完整）' if decoder.pending else ''))
+
+        try:
+            yield {'result': json.loads(content), 'total_tokens': total_tokens, 'completion_tokens': completion_tokens}
+        except json.JSONDecodeError:
+            yield {'raw_response': content, 'total_tokens': total_tokens, 'completion_tokens': completion_tokens}
+
+
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def load_backends():
+    entries = json.loads(Config.AI_BACKENDS) if Config.AI_BACKENDS else [{
+        'name': 'ark', 'endpoint': Config.VOLCANO_ARK_ENDPOINT, 'model': Config.AI_MODEL_ID,
+        'api_key': Config.VOLCANO_ARK_API_KEY, 'api_key_required': True,
+    }]
+    backends = []
+    for entry in entries:
+        api_key = entry.get('api_key')
+        if api_key is None and entry.get('api_key_env'):
+            api_key = os.environ.get(entry['api_key_env'])
+        required = entry.get('api_key_required', bool(entry.get('api_key_env')))
+        backends.append(Backend(
+            entry['name'], entry['endpoint'], entry.get('model') or Config.AI_MODEL_ID, api_key=api_key,
+            cost=entry.get('cost', 0), timeout=entry.get('timeout', 180), configured=bool(api_key) or not required
+        ))
+    return backends
+
+
+def get_backends():
+    global _backends
+    if _backends is None:
+        with _backends_lock:
+            if _backends is None:
+                _backends = load_backends()
+    return _backends
+
+
+def backend_stats():
+    return [backend.snapshot() for backend in get_backends()]
+
+
+def rank_backends(backends, strategy=None):
+    strategy = strategy or Config.AI_ROUTING
+    if strategy == 'latency':
+        return sorted(backends, key=lambda b: (b.ttft_ewma or 0.0, b.cost))
+    if strategy == 'cost':
+        return sorted(backends, key=lambda b: (b.cost, b.ttft_ewma or 0.0))
+    return list(backends)
+
+
+class _Attempt:
+    """在后台线程中调用一个服务，产生的条目放入共享队列；传入 usage（database.usage.CallUsage）时结束后记一行台账"""
+
+    def __init__(self, backend, messages, api_key, events, usage=None, prompt_tokens=0):
+        self.backend = backend
+        self.cancelled = threading.Event()
+        self.response = None
+        self.usage = usage
+        self.prompt_tokens = prompt_tokens
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, args=(messages, api_key, events), daemon=True)
+        self.thread.start()
+
+    def _run(self, messages, api_key, events):
+        ttft = None
+        completed = False
+        outcome = 'cancelled'
+        last = {}
+        content = []
+        try:
+            for item in self.backend.stream(messages, api_key, self.cancelled, self._set_response):
+                if item.get('type') == 'content_update':
+                    if ttft is None:
+                        ttft = time.perf_counter() - self.started
+                    content.append(item['content'])
+                completed = item.get('type') != 'content_update'
+                last = item
+                events.put((self, item))
+        except Exception as e:
+            if not isinstance(e, UpstreamError):
+                e = UpstreamError(f'调用模型服务出错: {str(e)}')
+            # 被取消的请求关闭连接后可能抛出网络错误，不算服务的失败
+            if self.cancelled.is_set():
+                self.backend.record_cancelled()
+            else:
+                outcome = 'error'
+                self.backend.record_failure(e)
+            events.put((self, {'error': str(e)}))
+        else:
+            if completed:
+                outcome = 'ok'
+                self.backend.record_success(ttft)
+            else:
+                self.backend.record_cancelled()
+        finally:
+            if self.usage is not None:
+                self.usage.end_attempt(outcome, self._usage_item(last, content), time.perf_counter() - self.started,
+                                       ttft)
+
+    def _usage_item(self, last, content):
+        """上游报告了用量时照用；被取消或中途失败时通常没有，按 prompt 与已收到的内容估算"""
+        total_tokens = last.get('total_tokens') or 0
+        completion_tokens = last.get('completion_tokens') or 0
+        if not total_tokens:
+            completion_tokens = completion_tokens or count_tokens(''.join(content))
+            total_tokens = self.prompt_tokens + completion_tokens
+        return {'total_tokens': total_tokens, 'completion_tokens': completion_tokens,
+                'backend': self.backend.name, 'model': self.backend.model}
+
+    def _set_response(self, response):
+        with self._lock:
+            self.response = response
+        if self.cancelled.is_set():
+            _abort_response(response)
+
+    def cancel(self):
+        """标记取消并关闭连接：阻塞在读取首个事件上的请求立即结束，不必等到上游输出或超时。
+        还没收到响应头时没有可关闭的响应，收到后 _set_response 会立即关闭它"""
+        self.cancelled.set()
+        with self._lock:
+            response = self.response
+        if response is not None:
+            _abort_response(response)
+
+
+def stream_completion(messages, api_key=None, usage=None):
+    """按路由顺序调用可用的服务，处理后备与对冲；产生的条目格式与单个服务相同，最终结果附带 backend 和 model 字段。
+    usage 为 database.usage.CallUsage 时每个上游请求占用一个并发名额并各记一行台账，名额已满时不发出对冲"""
+    backends = get_backends()
+    if api_key:
+        candidates = backends[:1]
+    else:
+        candidates = rank_backends([b for b in backends if b.configured])
+    if not candidates:
+        yield {'error': '未配置API密钥，请设置VOLCANO_ARK_API_KEY环境变量'}
+        return
+
+    pending = iter(candidates)
+    events = queue.Queue()
+    running, errors = [], []
+    winner = hedge = None
+    hedge_after = Config.AI_HEDGE_AFTER if not api_key else 0
+    prompt_tokens = sum(count_tokens(message['content']) for message in messages) if usage is not None else 0
+
+    def start_next(hedge=False):
+        if usage is not None and not usage.begin_attempt(hedge):
+            log_event('ai_hedge_skipped', reason='concurrency')
+            return False
+        for backend in pending:
+            if backend.acquire():
+                running.append(_Attempt(backend, messages, api_key, events, usage, prompt_tokens))
+                return True
+        if usage is not None:
+            usage.abandon_attempt()
+        return False
+
+    if not start_next():
+        yield {'error': '所有模型服务都处于熔断状态，请稍后重试'}
+        return
+    hedge_at = time.perf_counter() + hedge_after if hedge_after > 0 else None
+
+    try:
+        while True:
+            timeout = None
+            if winner is None and hedge_at is not None:
+                timeout = max(0.0, hedge_at - time.perf_counter())
+            try:
+                attempt, item = events.get(timeout=timeout)
+            except queue.Empty:
+                # 对冲只发一次
+                hedge_at = None
+                if start_next(hedge=True):
+                    hedge = running[-1]
+                    AI_HEDGES.inc(outcome='fired')
+                    log_event('ai_hedge', primary=running[0].backend.name, hedge=hedge.backend.name)
+                continue
+
+            if winner is not None and attempt is not winner:
+                continue
+            if 'error' in item:
+                if winner is not None:
+                    yield item
+                    return
+                errors.append((attempt.backend.name, item['error']))
+                running.remove(attempt)
+                if running or start_next():
+                    continue
+                if len(errors) == 1:
+                    yield {'error': errors[0][1]}
+                else:
+                    yield {'error': '所有模型服务调用失败：' + '；'.join(f'{name}: {error}' for name, error in errors)}
+                return
+
+            if winner is None:
+                winner = attempt
+                for other in running:
+                    if other is not attempt:
+                        other.cancel()
+                if hedge is not None:
+                    AI_HEDGES.inc(outcome='hedge_won' if attempt is hedge else 'primary_won')
+            if item.get('type') == 'content_update':
+                yield item
+            else:
+                yield dict(item, backend=attempt.backend.name, model=attempt.backend.model)
+                return
+    finally:
+        # 调用方提前关闭生成器时停止所有后台请求
+        for attempt in running:
+            attempt.cancel()
@@ -0,0 +1,416 @@
+"""
+可插拔的响应缓存
+
+后端由 CACHE_URL 选择：
+    memory://?maxsize=1024     进程内 LRU（默认），每个 worker 各有一份
+    disk:///path/to/cache.db   本机 SQLite 文件，同一台机器上的多个 worker 共享
+    redis://host:6379/0        任意兼容 Redis 协议的服务，多台机器共享；
+                               本地开发或测试可用 python -m utils.fake_redis 启动一个替身
+
+失效按标签进行：每个标签在后端里有一个版本号，写入条目时记下所带标签当时的版本，读取时版本不一致即视为未命中。
+invalidate_contact(contact_id) 只推进 contact:<id> 与 contacts（首页、联系人列表等汇总数据）两个标签，
+其他联系人的条目不受影响。后端不可用时只记录日志，请求照常直接计算。
+"""
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+from flask import current_app
+
+CONTACTS_TAG = 'contacts'
+DEFAULT_MEMORY_MAXSIZE = 1024
+DEFAULT_DISK_MAX_ENTRIES = 10000
+# 磁盘后端每写入这么多次清理一次过期条目
+DISK_PRUNE_INTERVAL = 256
+# 磁盘后端读取命中时最多每隔这么多秒更新一次条目的访问时间，避免每次命中都写库
+DISK_TOUCH_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+def contact_tag(contact_id):
+    return f'contact:{contact_id}'
+
+
+class MemoryBackend:
+    """进程内 LRU；标签版本号单独存放，不参与淘汰"""
+
+    def __init__(self, maxsize=DEFAULT_MEMORY_MAXSIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_counters(self, keys):
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskBackend:
+    """SQLite 文件存储，值用 pickle 序列化；每个线程一个连接，WAL 模式下多进程读写互不阻塞。
+    超过 max_entries 时与 MemoryBackend 一样按最近访问时间淘汰（访问时间精确到 DISK_TOUCH_INTERVAL 秒）"""
+
+    def __init__(self, path, max_entries=DEFAULT_DISK_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_entry '
+                     '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL, accessed_at REAL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_counter (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        if 'accessed_at' not in [row[1] for row in conn.execute('PRAGMA table_info(cache_entry)')]:
+            # 旧版本创建的缓存文件
+            try:
+                conn.execute('ALTER TABLE cache_entry ADD COLUMN accessed_at REAL')
+            except sqlite3.OperationalError:
+                pass  # 另一个 worker 同时加上了
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def reset(self):
+        """fork 之后调用：SQLite 连接不能跨进程使用，丢弃继承来的连接，各线程重新打开"""
+        self._local = threading.local()
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires_at, accessed_at FROM cache_entry WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] is not None and row[1] < now:
+            self.delete(key)
+            return None
+        if row[2] is None or row[2] < now - DISK_TOUCH_INTERVAL:
+            conn.execute('UPDATE cache_entry SET accessed_at = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+            (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at, now)
+        )
+        self._writes += 1
+        if self._writes % DISK_PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def prune(self):
+        conn = self._conn()
+        conn.execute('DELETE FROM cache_entry WHERE expires_at IS NOT NULL AND expires_at < ?', (time.time(),))
+        # 旧版本写入、还没被访问过的条目 accessed_at 为 NULL，排在最前面先淘汰
+        conn.execute('DELETE FROM cache_entry WHERE key NOT IN '
+                     '(SELECT key FROM cache_entry ORDER BY accessed_at DESC LIMIT ?)', (self.max_entries,))
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache_entry WHERE key = ?', (key,))
+
+    def get_counters(self, keys):
+        if not keys:
+            return []
+        placeholders = ','.join('?' * len(keys))
+        rows = dict(self._conn().execute(
+            f'SELECT key, value FROM cache_counter WHERE key IN ({placeholders})', list(keys)
+        ).fetchall())
+        return [rows.get(key, 0) for key in keys]
+
+    def incr(self, key):
+        conn = self._conn()
+        conn.execute('INSERT INTO cache_counter (key, value) VALUES (?, 1) '
+                     'ON CONFLICT(key) DO UPDATE SET value = value + 1', (key,))
+        return conn.execute('SELECT value FROM cache_counter WHERE key = ?', (key,)).fetchone()[0]
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute('DELETE FROM cache_entry')
+        conn.execute('DELETE FROM cache_counter')
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    """最小的 RESP2 客户端，只实现缓存用到的几条命令，不依赖 redis-py"""
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._file = sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', self.db)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._file = None
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode('utf-8')
+            elif isinstance(arg, int):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('Redis 连接已关闭')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(payload)
+            return None if count < 0 else [self._read() for _ in range(count)]
+        raise RedisError(f'无法解析的响应: {line!r}')
+
+    def _call(self, *args):
+        self._sock.sendall(self._encode(args))
+        return self._read()
+
+    def execute(self, *args):
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            try:
+                return self._call(*args)
+            except (OSError, ConnectionError):
+                # 连接断开后重连一次；仍失败时交给上层降级处理
+                self.close()
+                self._connect()
+                return self._call(*args)
+
+
+class RedisBackend:
+    """使用 Redis 协议的共享缓存；所有键带 prefix，clear 只删除本应用的键"""
+
+    def __init__(self, connection, prefix='msl:'):
+        self.conn = connection
+        self.prefix = prefix
+
+    def reset(self):
+        """fork 之后调用：不与父进程共用同一个套接字，下次请求时重新连接"""
+        self.conn.close()
+
+    def get(self, key):
+        data = self.conn.execute('GET', self.prefix + key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl=None):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if ttl:
+            self.conn.execute('SET', self.prefix + key, data, 'PX', int(ttl * 1000))
+        else:
+            self.conn.execute('SET', self.prefix + key, data)
+
+    def delete(self, key):
+        self.conn.execute('DEL', self.prefix + key)
+
+    def get_counters(self, keys):
+        if not keys:
+            return []
+        values = self.conn.execute('MGET', *[self.prefix + key for key in keys])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def incr(self, key):
+        return self.conn.execute('INCR', self.prefix + key)
+
+    def clear(self):
+        cursor = '0'
+        while True:
+            cursor, keys = self.conn.execute('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)
+            cursor = cursor.decode() if isinstance(cursor, bytes) else cursor
+            if keys:
+                self.conn.execute('DEL', *keys)
+            if cursor == '0':
+                break
+
+
+def create_backend(url):
+    parsed = urlparse(url or 'memory://')
+    options = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+    if parsed.scheme == 'memory':
+        return MemoryBackend(int(options.get('maxsize', DEFAULT_MEMORY_MAXSIZE)))
+    if parsed.scheme == 'disk':
+        path = parsed.netloc + parsed.path
+        return DiskBackend(path, int(options.get('max_entries', DEFAULT_DISK_MAX_ENTRIES)))
+    if parsed.scheme == 'redis':
+        connection = RedisConnection(
+            host=parsed.hostname or '127.0.0.1',
+            port=parsed.port or 6379,
+            db=int(parsed.path.lstrip('/') or 0),
+            password=parsed.password,
+            timeout=float(options.get('timeout', 1.0))
+        )
+        return RedisBackend(connection, prefix=options.get('prefix', 'msl:'))
+    raise ValueError(f'不支持的 CACHE_URL: {url}')
+
+
+class ResponseCache:
+    """在后端之上实现带标签失效的读写；后端出错时降级为直接计算"""
+
+    def __init__(self, backend, default_ttl=300):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _tag_keys(tags):
+        return [f'tag:{tag}' for tag in tags]
+
+    def get(self, key):
+        try:
+            entry = self.backend.get(f'entry:{key}')
+            if entry is not None:
+                value, tags, versions = entry
+                if not tags or self.backend.get_counters(self._tag_keys(tags)) == versions:
+                    self.hits += 1
+                    return value
+        except Exception:
+            logger.exception('读取缓存失败: %s', key)
+        self.misses += 1
+        return None
+
+    def _current_versions(self, tags):
+        return self.backend.get_counters(self._tag_keys(tags)) if tags else []
+
+    def set(self, key, value, tags=(), ttl=None, versions=None):
+        tags = list(tags)
+        try:
+            if versions is None:
+                versions = self._current_versions(tags)
+            self.backend.set(f'entry:{key}', (value, tags, versions), ttl or self.default_ttl)
+        except Exception:
+            logger.exception('写入缓存失败: %s', key)
+
+    def get_or_set(self, key, compute, tags=(), ttl=None):
+        value = self.get(key)
+        if value is not None:
+            return value
+        tags = list(tags)
+        # 在计算之前读取标签版本：计算期间发生的写入会让这个条目在下次读取时失效
+        try:
+            versions = self._current_versions(tags)
+        except Exception:
+            logger.exception('读取缓存标签失败: %s', key)
+            return compute()
+        value = compute()
+        self.set(key, value, tags, ttl, versions)
+        return value
+
+    def invalidate_tags(self, *tags):
+        for key in self._tag_keys(tags):
+            try:
+                self.backend.incr(key)
+            except Exception:
+                logger.exception('缓存失效失败: %s', key)
+
+    def invalidate_contact(self, contact_id=None):
+        if contact_id is None:
+            self.invalidate_tags(CONTACTS_TAG)
+        else:
+            self.invalidate_tags(contact_tag(contact_id), CONTACTS_TAG)
+
+    def clear(self):
+        self.backend.clear()
+
+    def reset_connections(self):
+        reset = getattr(self.backend, 'reset', None)
+        if reset is not None:
+            reset()
+
+
+def init_response_cache(app):
+    cache = ResponseCache(create_backend(app.config.get('CACHE_URL')), app.config.get('CACHE_DEFAULT_TTL', 300))
+    app.extensions['response_cache'] = cache
+    return cache
+
+
+def get_response_cache():
+    return current_app.extensions['response_cache']
@@ -0,0 +1,361 @@
+"""
+聊天记录的本地向量索引
+
+不依赖网络和外部模型：用字符 n-gram 特征哈希得到定长向量（对中文按字切分同样有效），
+向量以 float16 存放在可内存映射的文件中，检索使用 IVF（k-means 粗聚类 + 倒排列表）
+近似最近邻，数据量较小时退化为暴力检索。
+
+删除联系人时 remove_contacts 把它的向量标记为已删除（id 与 contact_id 置为 -1），检索时跳过。
+SQLite 在删除最新的几行后会复用 chat_log.id，标记后这些 id 重新视为未索引，新消息会照常建立向量，
+不会错配到已删除联系人的旧向量上。已删除的行仍占用空间，直到删除索引目录后重建。
+"""
+import json
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+from flask import current_app, has_app_context
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只做进程内加锁
+    fcntl = None
+
+from config import Config
+
+DIM = 256
+NGRAM_SIZES = (1, 2, 3)
+# 数据量达到该值后才训练聚类中心，之前直接暴力检索
+MIN_TRAIN_SIZE = 2048
+# 相对上次训练时的数据量增长到该倍数时重新训练
+RETRAIN_GROWTH = 4
+TRAIN_SAMPLE_SIZE = 20000
+KMEANS_ITERATIONS = 10
+DEFAULT_NPROBE = 8
+INITIAL_CAPACITY = 4096
+
+
+def _ngrams(text):
+    text = ''.join(text.lower().split())
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            yield text[i:i + n]
+
+
+def embed_text(text):
+    """特征哈希：每个 n-gram 按哈希值落到一个维度，符号位避免冲突时系统性偏移"""
+    vector = np.zeros(DIM, dtype=np.float32)
+    for gram in _ngrams(text or ''):
+        h = zlib.crc32(gram.encode('utf-8'))
+        # n-gram 越长越有区分度，给予更高权重
+        vector[h % DIM] += (1.0 if (h >> 16) & 1 else -1.0) * len(gram)
+    # 次线性词频，避免长消息里的重复字主导向量方向
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def embed_batch(texts):
+    matrix = np.zeros((len(texts), DIM), dtype=np.float32)
+    for i, text in enumerate(texts):
+        matrix[i] = embed_text(text)
+    return matrix
+
+
+def _kmeans(data, k, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(data @ centroids.T, axis=1)
+        for c in range(k):
+            members = data[assignments == c]
+            if len(members):
+                centroid = members.mean(axis=0)
+                norm = np.linalg.norm(centroid)
+                centroids[c] = centroid / norm if norm > 0 else centroid
+            else:
+                centroids[c] = data[rng.integers(len(data))]
+    return centroids
+
+
+class VectorIndex:
+    """追加写入的向量存储 + IVF 索引；写入时加文件锁，多个 worker 进程可共享同一份索引"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.vectors_path = os.path.join(directory, 'vectors.f16')
+        self.ids_path = os.path.join(directory, 'ids.i64')
+        self.contacts_path = os.path.join(directory, 'contacts.i32')
+        self.centroids_path = os.path.join(directory, 'centroids.npy')
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        meta = {}
+        self.meta_mtime = None
+        if os.path.exists(self.meta_path):
+            self.meta_mtime = os.path.getmtime(self.meta_path)
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        if meta.get('dim', DIM) != DIM:
+            meta = {}
+        self.count = meta.get('count', 0)
+        self.capacity = max(meta.get('capacity', INITIAL_CAPACITY), INITIAL_CAPACITY)
+        self.trained_count = meta.get('trained_count', 0)
+        self.max_id = meta.get('max_id', 0)
+        self.deleted = meta.get('deleted', 0)
+        self._open_arrays()
+        # 已索引 id 的有序副本，add 用它去重：并发写入时 id 较小的事务可能后提交，不能只和 max_id 比较
+        ids = self.ids[:self.count]
+        self.sorted_ids = np.sort(ids[ids >= 0])
+        self.centroids = np.load(self.centroids_path) if self.trained_count and os.path.exists(self.centroids_path) else None
+        self._build_lists()
+
+    @staticmethod
+    def _open_memmap(path, dtype, shape):
+        needed = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, 'ab') as f:
+            if f.tell() < needed:
+                f.truncate(needed)
+        return np.memmap(path, dtype=dtype, mode='r+', shape=shape)
+
+    def _open_arrays(self):
+        self.vectors = self._open_memmap(self.vectors_path, np.float16, (self.capacity, DIM))
+        self.ids = self._open_memmap(self.ids_path, np.int64, (self.capacity,))
+        self.contact_ids = self._open_memmap(self.contacts_path, np.int32, (self.capacity,))
+
+    def _grow(self, needed):
+        if needed <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self.vectors.flush()
+        self.ids.flush()
+        self.contact_ids.flush()
+        del self.vectors, self.ids, self.contact_ids
+        self.capacity = capacity
+        self._open_arrays()
+
+    def _assign(self, vectors):
+        return np.argmax(vectors.astype(np.float32) @ self.centroids.T, axis=1)
+
+    def _build_lists(self):
+        self.lists = None
+        if self.centroids is None or self.count == 0:
+            return
+        assignments = np.empty(self.count, dtype=np.int32)
+        for start in range(0, self.count, 65536):
+            end = min(start + 65536, self.count)
+            assignments[start:end] = self._assign(self.vectors[start:end])
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]].astype(np.int64) for c in range(len(self.centroids))]
+
+    def _reload_if_stale(self):
+        """多个 worker 进程共享同一份索引文件，其他进程写入后需要重新加载"""
+        mtime = os.path.getmtime(self.meta_path) if os.path.exists(self.meta_path) else None
+        if mtime != self.meta_mtime:
+            del self.vectors, self.ids, self.contact_ids
+            self._load()
+
+    @contextmanager
+    def _write_lock(self):
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._reload_if_stale()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_meta(self):
+        meta = {
+            'dim': DIM,
+            'count': self.count,
+            'capacity': self.capacity,
+            'trained_count': self.trained_count,
+            'max_id': self.max_id,
+            'deleted': self.deleted
+        }
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        self.meta_mtime = os.path.getmtime(self.meta_path)
+
+    def _maybe_train(self):
+        if self.count < MIN_TRAIN_SIZE:
+            return
+        if self.trained_count and self.count < self.trained_count * RETRAIN_GROWTH:
+            return
+        rng = np.random.default_rng(self.count)
+        sample_size = min(self.count, TRAIN_SAMPLE_SIZE)
+        sample_rows = np.sort(rng.choice(self.count, size=sample_size, replace=False))
+        sample = self.vectors[sample_rows].astype(np.float32)
+        nlist = max(16, int(np.sqrt(self.count)))
+        self.centroids = _kmeans(sample, min(nlist, sample_size))
+        np.save(self.centroids_path, self.centroids)
+        self.trained_count = self.count
+        self._build_lists()
+
+    def missing_ids(self, ids):
+        """ids 中尚未索引的部分"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids) or not len(self.sorted_ids):
+            return ids
+        positions = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.sorted_ids) - 1)
+        return ids[self.sorted_ids[positions] != ids]
+
+    def add(self, ids, contact_ids, texts):
+        """追加一批消息向量；已索引过的 id 会被跳过"""
+        with self._write_lock():
+            missing = set(self.missing_ids(ids).tolist())
+            rows = [(i, c, t) for i, c, t in zip(ids, contact_ids, texts) if i in missing]
+            # 同一批内的重复 id 只保留一条
+            rows = list({i: (i, c, t) for i, c, t in rows}.values())
+            if not rows:
+                return 0
+            vectors = embed_batch([t for _, _, t in rows])
+            start = self.count
+            self._grow(start + len(rows))
+            end = start + len(rows)
+            self.vectors[start:end] = vectors.astype(np.float16)
+            self.ids[start:end] = [i for i, _, _ in rows]
+            self.contact_ids[start:end] = [c for _, c, _ in rows]
+            self.count = end
+            self.max_id = max(self.max_id, max(i for i, _, _ in rows))
+            new_ids = np.sort(np.asarray([i for i, _, _ in rows], dtype=np.int64))
+            self.sorted_ids = np.insert(self.sorted_ids, np.searchsorted(self.sorted_ids, new_ids), new_ids)
+            if self.lists is not None:
+                clusters = self._assign(vectors)
+                for cluster in np.unique(clusters):
+                    new_rows = start + np.flatnonzero(clusters == cluster)
+                    self.lists[cluster] = np.concatenate([self.lists[cluster], new_rows])
+            self._maybe_train()
+            self.vectors.flush()
+            self.ids.flush()
+            self.contact_ids.flush()
+            self._save_meta()
+            return len(rows)
+
+    def remove_contacts(self, contact_ids):
+        """把这些联系人的向量标记为已删除，返回标记的条数"""
+        contact_ids = np.asarray(sorted(contact_ids), dtype=np.int32)
+        if not len(contact_ids):
+            return 0
+        with self._write_lock():
+            rows = np.flatnonzero(np.isin(self.contact_ids[:self.count], contact_ids))
+            if not len(rows):
+                return 0
+            removed = self.ids[rows]
+            self.ids[rows] = -1
+            self.contact_ids[rows] = -1
+            self.deleted += len(rows)
+            self.sorted_ids = self.sorted_ids[~np.isin(self.sorted_ids, removed)]
+            self.ids.flush()
+            self.contact_ids.flush()
+            self._save_meta()
+            return len(rows)
+
+    def indexed_contact_ids(self):
+        with self.lock:
+            self._reload_if_stale()
+            contact_ids = np.unique(self.contact_ids[:self.count])
+        return set(contact_ids[contact_ids >= 0].tolist())
+
+    def search(self, query, k=20, contact_id=None, nprobe=DEFAULT_NPROBE):
+        """返回 [(chat_log_id, contact_id, score)]，按余弦相似度倒序"""
+        query_vector = embed_text(query)
+        with self.lock:
+            self._reload_if_stale()
+            if self.count == 0 or not query_vector.any():
+                return []
+            if self.lists is not None:
+                probe = np.argsort(-(self.centroids @ query_vector))[:nprobe]
+                rows = np.sort(np.concatenate([self.lists[c] for c in probe]))
+            else:
+                rows = np.arange(self.count)
+            if contact_id is not None and len(rows):
+                rows = rows[self.contact_ids[rows] == contact_id]
+            elif self.deleted and len(rows):
+                rows = rows[self.contact_ids[rows] >= 0]
+            if not len(rows):
+                return []
+            scores = self.vectors[rows].astype(np.float32) @ query_vector
+            top = np.argsort(-scores)[:k]
+            return [(int(self.ids[rows[i]]), int(self.contact_ids[rows[i]]), float(scores[i])) for i in top]
+
+    def stats(self):
+        return {
+            'count': self.count - self.deleted,
+            'deleted': self.deleted,
+            'dim': DIM,
+            'trained': self.lists is not None,
+            'nlist': 0 if self.centroids is None else len(self.centroids),
+            'size_bytes': self.count * DIM * 2
+        }
+
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def get_vector_index():
+    """按当前应用的 EMBEDDING_DIR 取索引（没有应用上下文时用 Config），每个目录在进程内只打开一次"""
+    directory = current_app.config.get('EMBEDDING_DIR', Config.EMBEDDING_DIR) if has_app_context() \
+        else Config.EMBEDDING_DIR
+    with _index_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            index = _indexes[directory] = VectorIndex(directory)
+        return index
+
+
+def remove_contact_vectors(contact_id):
+    """删除联系人后调用"""
+    return get_vector_index().remove_contacts([contact_id])
+
+
+def index_chat_logs(rows):
+    """add_chat_logs 提交后调用，把新消息追加到向量索引
+
+    rows 为 (id, contact_id, content)，应在提交之前从 ChatLog 上取出：提交会使对象过期，
+    之后再读属性会为每条消息单独执行一次 SELECT。
+    """
+    rows = sorted(rows)
+    return get_vector_index().add([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+
+
+def rebuild_from_database(batch_size=5000):
+    """把尚未索引的消息写入向量索引，可中断后继续
+
+    按 id 顺序扫描全部 id 而不是从 max_id 往后接着建：并发写入时 id 较小的事务可能后提交，
+    实时索引之外漏掉的消息会落在 max_id 之前。扫描只取 id，正文只为缺失的消息读取。
+    先清掉已不存在的联系人的向量（删除联系人时没来得及标记，或 reset_dev.py 清空后），
+    否则复用的 id 会被当作已经索引。
+    """
+    from database.models import ChatLog, Contact
+    from database.shards import chat_logs_by_ids, iter_chat_log_batches
+    index = get_vector_index()
+    existing = {contact_id for contact_id, in Contact.query.with_entities(Contact.id)}
+    index.remove_contacts(index.indexed_contact_ids() - existing)
+    total = 0
+    for rows in iter_chat_log_batches((ChatLog.id,), batch_size=batch_size):
+        missing = index.missing_ids([r.id for r in rows]).tolist()
+        if not missing:
+            continue
+        logs = chat_logs_by_ids(missing)
+        logs = [logs[log_id] for log_id in missing if log_id in logs]
+        total += index.add([log.id for log in logs], [log.contact_id for log in logs], [log.content for log in logs])
+    return total
@@ -1,11 +1,16 @@
-import pandas as pd
 from datetime import datetime
 import os
 import json
 import zipfile
 from io import BytesIO
 
+def _pandas():
+    """pandas（连带 numpy、openpyxl）导入要数百毫秒，只在真正导出表格时加载，不拖慢 worker 启动"""
+    import pandas
+    return pandas
+
 def export_chat_logs_to_excel(chat_logs, contact_name, include_analysis=False):
+    pd = _pandas()
     data = []
     for log in chat_logs:
         row = {
@@ -29,6 +34,7 @@ def export_chat_logs_to_excel(chat_logs, contact_name, include_analysis=False):
     return filepath, filename
 
 def export_chat_logs_to_csv(chat_logs, contact_name):
+    pd = _pandas()
     data = []
     for log in chat_logs:
         data.append({
@@ -75,6 +81,7 @@ def export_chat_logs_to_multiple_formats(chat_logs, contact_name, formats, inclu
     return filepath, filename
 
 def export_analysis_to_excel(analysis, contact_name, include_personality=True, include_interests=True, include_guide=True):
+    pd = _pandas()
     parsed_data = analysis.get_parsed_data()
     
     filename = f"分析报告_{contact_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
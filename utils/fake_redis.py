@@ -0,0 +1,177 @@
+"""
+本地的 Redis 协议替身，用于开发和测试 redis:// 缓存后端
+
+只实现 utils/cache.py 用到的命令（GET/SET/DEL/MGET/INCR/SCAN/FLUSHDB/PING/SELECT/AUTH），
+数据保存在进程内存里，支持 SET 的 EX/PX 过期。
+
+用法: python -m utils.fake_redis --port 6390
+      然后设置 CACHE_URL=redis://127.0.0.1:6390/0
+"""
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class FakeRedisStore:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def _alive(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at < time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def execute(self, command, args):
+        with self.lock:
+            handler = getattr(self, 'cmd_' + command.lower(), None)
+            if handler is None:
+                return RespError(f"ERR unknown command '{command}'")
+            return handler(*args)
+
+    def cmd_ping(self, *args):
+        return args[0] if args else SimpleString('PONG')
+
+    def cmd_select(self, db):
+        return SimpleString('OK')
+
+    def cmd_auth(self, *args):
+        return SimpleString('OK')
+
+    def cmd_get(self, key):
+        return self.data.get(key) if self._alive(key) else None
+
+    def cmd_set(self, key, value, *options):
+        self.data[key] = value
+        self.expires.pop(key, None)
+        options = [option.upper() for option in options]
+        for flag, scale in ((b'EX', 1), (b'PX', 0.001)):
+            if flag in options:
+                ttl = int(options[options.index(flag) + 1]) * scale
+                self.expires[key] = time.time() + ttl
+        return SimpleString('OK')
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                removed += 1
+        return removed
+
+    def cmd_mget(self, *keys):
+        return [self.data.get(key) if self._alive(key) else None for key in keys]
+
+    def cmd_incr(self, key):
+        try:
+            value = int(self.data.get(key, b'0')) + 1 if self._alive(key) else 1
+        except ValueError:
+            return RespError('ERR value is not an integer or out of range')
+        self.data[key] = str(value).encode()
+        return value
+
+    def cmd_scan(self, cursor, *options):
+        options = list(options)
+        pattern = b'*'
+        if b'MATCH' in [option.upper() for option in options]:
+            pattern = options[[option.upper() for option in options].index(b'MATCH') + 1]
+        keys = [key for key in list(self.data) if self._alive(key)
+                and fnmatch.fnmatchcase(key.decode('utf-8', 'replace'), pattern.decode('utf-8', 'replace'))]
+        # 一次返回全部匹配的键，游标直接归零
+        return [b'0', keys]
+
+    def cmd_flushdb(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return SimpleString('OK')
+
+
+class SimpleString(str):
+    pass
+
+
+class RespError(str):
+    pass
+
+
+def encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, RespError):
+        return b'-' + value.encode() + b'\r\n'
+    if isinstance(value, SimpleString):
+        return b'+' + value.encode() + b'\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if not args:
+                return
+            reply = self.server.store.execute(args[0].decode(), args[1:])
+            self.wfile.write(encode(reply))
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), RespHandler)
+        self.store = FakeRedisStore()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'redis://{host}:{port}/0'
+
+
+def start_fake_redis(host='127.0.0.1', port=0):
+    """在后台线程启动一个替身服务并返回它；port 为 0 时自动分配端口，见 server.url"""
+    server = FakeRedisServer(host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 Redis 协议替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+
+    server = FakeRedisServer(args.host, args.port)
+    print(f'Fake Redis 监听 {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+读接口与页面的 HTTP 条件缓存
+
+ETag 由几项很便宜的版本信息拼成：Contact.updated_at、AnalysisResult.updated_at 和
+ContactStats.chat_log_version（每次新增聊天记录加一）。带 If-None-Match / If-Modified-Since
+的请求在进入视图函数之前就比较版本，命中时直接返回 304，不会加载联系人、聊天记录或渲染模板。
+
+渲染好的页面片段另外存放在响应缓存（utils/cache.py）中，键里带着 ETag，数据变化后旧条目自然失效；
+写接口还会调用 invalidate_contact 按联系人标签主动失效相关条目。
+"""
+import hashlib
+from collections import namedtuple
+from datetime import date, timezone
+from functools import wraps
+
+from flask import g, make_response, request
+from sqlalchemy import func
+
+from database.models import db, Contact, AnalysisResult, ContactStats
+from utils.cache import CONTACTS_TAG, contact_tag, get_response_cache
+
+Validators = namedtuple('Validators', ['etag', 'last_modified'])
+
+
+def _validators(parts, timestamps):
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:24]
+    timestamps = [ts for ts in timestamps if ts is not None]
+    last_modified = max(timestamps).replace(microsecond=0, tzinfo=timezone.utc) if timestamps else None
+    return Validators(digest, last_modified)
+
+
+def contact_validators(contact_id):
+    """资料页及联系人维度接口的版本；关系趋势按天刷新，因此日期也计入 ETag"""
+    row = db.session.query(Contact.updated_at, AnalysisResult.updated_at,
+                           ContactStats.chat_log_version, ContactStats.updated_at) \
+        .outerjoin(AnalysisResult, AnalysisResult.contact_id == Contact.id) \
+        .outerjoin(ContactStats, ContactStats.contact_id == Contact.id) \
+        .filter(Contact.id == contact_id) \
+        .first()
+    if row is None:
+        return None
+    return _validators(('contact', contact_id, tuple(row), date.today()), [row[0], row[1], row[3]])
+
+
+def analysis_validators(contact_id):
+    row = db.session.query(AnalysisResult.id, AnalysisResult.updated_at) \
+        .filter(AnalysisResult.contact_id == contact_id) \
+        .first()
+    if row is None:
+        return None
+    return _validators(('analysis', contact_id, tuple(row)), [row.updated_at])
+
+
+def contact_list_validators():
+    """联系人列表页的版本。删除联系人不会推进任何时间戳，所以列表只给 ETag 不给 Last-Modified"""
+    contacts = db.session.query(func.count(Contact.id), func.max(Contact.updated_at)).one()
+    analysis = db.session.query(func.max(AnalysisResult.updated_at)).scalar()
+    chat_version = db.session.query(func.coalesce(func.sum(ContactStats.chat_log_version), 0)).scalar()
+    parts = ('contacts', tuple(contacts), analysis, chat_version, date.today(), request.query_string)
+    return _validators(parts, [])._replace(last_modified=None)
+
+
+def _not_modified(validators):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(validators.etag)
+    if validators.last_modified is not None and request.if_modified_since is not None:
+        return validators.last_modified <= request.if_modified_since
+    return False
+
+
+def _set_validators(response, validators):
+    response.set_etag(validators.etag, weak=True)
+    if validators.last_modified is not None:
+        response.last_modified = validators.last_modified
+    # 允许浏览器缓存，但每次使用前都要带条件请求回来确认
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+
+def conditional(get_validators):
+    """视图装饰器：get_validators 以视图的 URL 参数调用，返回 None 表示资源不存在，交给视图自己处理"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            validators = get_validators(**kwargs)
+            if validators is None:
+                return view(*args, **kwargs)
+            if _not_modified(validators):
+                response = make_response('', 304)
+            else:
+                g.http_validators = validators
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            _set_validators(response, validators)
+            return response
+        return wrapper
+    return decorator
+
+
+def render_cached(name, contact_id, render):
+    """在 conditional 装饰的视图里使用：以当前 ETag 为键缓存 render() 的结果"""
+    validators = g.get('http_validators')
+    if validators is None:
+        return render()
+    tags = [contact_tag(contact_id)] if contact_id is not None else [CONTACTS_TAG]
+    return get_response_cache().get_or_set(f'fragment:{name}:{contact_id}:{validators.etag}', render, tags)
+
+
+def invalidate_contact(contact_id=None):
+    get_response_cache().invalidate_contact(contact_id)
@@ -0,0 +1,135 @@
+"""
+与 HTTP 连接解耦的分析任务：浏览器断线后模型调用继续进行，客户端带 Last-Event-ID 重新连接即可接着接收
+
+分析流路由不再直接把生成器交给响应，而是 analysis_jobs.start() 在后台线程中运行它：
+    产生的每个事件编号后编码为 SSE，放入任务的环形缓冲区（最多 ANALYSIS_JOB_BUFFER 个，较早的进度事件被挤掉）；
+    响应只是任务的一个订阅者（AnalysisJob.subscribe），客户端断开只结束订阅，不影响模型调用和结果保存；
+    重新连接 GET /api/analysis-jobs/<job_id>/stream 时从 Last-Event-ID 之后的事件继续输出，缓冲区已丢弃的事件直接跳过——
+    进度事件里的长度和 token 数都是累计值，跳过中间的几个不影响显示，最后的 complete / error 事件总在缓冲区里。
+任务结束后保留 ANALYSIS_JOB_TTL 秒供断线的客户端取回结果，之后在创建新任务时清理。
+任务只存在于创建它的进程中，多 worker 部署时重新连接需要落到同一个 worker（按会话粘滞），
+否则返回 404，客户端改为读取已保存的分析结果。
+
+合并请求：同一联系人、同一份整理后的聊天记录（以及同一个用户密钥）的分析同时只运行一个，
+键为 job_key() 计算的 (contact_id, 摘要)。重复点击"分析"或多人同时打开同一联系人时，后来的请求直接订阅进行中的任务，
+从缓冲区开头收到相同的事件，不再重复调用模型，也不会有两个任务同时写入该联系人唯一的 AnalysisResult。
+"""
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from config import Config
+from utils.metrics import ANALYSIS_COALESCED, log_event
+from utils.sse import encode_comment, encode_event
+
+logger = logging.getLogger(__name__)
+
+
+def job_key(contact_id, text, api_key=None):
+    """合并请求的键；用户自己的密钥也计入摘要，不同密钥的请求不会合并，token 记在各自的账上"""
+    digest = hashlib.sha256(text.encode('utf-8'))
+    if api_key:
+        digest.update(b'\0' + api_key.encode('utf-8'))
+    return contact_id, digest.hexdigest()
+
+
+class AnalysisJob:
+    def __init__(self, contact_id, scope, buffer_size, key=None):
+        self.id = uuid.uuid4().hex
+        self.contact_id = contact_id
+        self.scope = scope
+        self.key = key
+        self.last_id = 0
+        self.done = False
+        self.finished_at = None
+        self._events = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+
+    def publish(self, payload):
+        """追加一个事件，事件名取 payload 的 type"""
+        with self._cond:
+            self.last_id += 1
+            self._events.append((self.last_id, encode_event(payload, event=payload['type'], id=self.last_id)))
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def subscribe(self, last_event_id=0):
+        """输出 last_event_id 之后的事件直到任务结束；超过 SSE_HEARTBEAT_INTERVAL 秒没有新事件时输出心跳注释"""
+        heartbeat = Config.SSE_HEARTBEAT_INTERVAL
+        cursor = last_event_id
+        while True:
+            with self._cond:
+                if self.last_id <= cursor and not self.done:
+                    self._cond.wait(heartbeat if heartbeat > 0 else None)
+                frames = [(event_id, frame) for event_id, frame in self._events if event_id > cursor]
+                done = self.done
+            if frames:
+                if frames[0][0] > cursor + 1:
+                    log_event('analysis_job.skipped', job=self.id, events=frames[0][0] - cursor - 1)
+                cursor = frames[-1][0]
+                for _, frame in frames:
+                    yield frame
+            elif done:
+                return
+            else:
+                yield encode_comment()
+
+
+class JobRegistry:
+    def __init__(self):
+        self._jobs = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def start(self, contact_id, scope, run, key=None):
+        """key 相同的任务仍在进行时直接返回它；否则在后台线程中运行 run()（返回产生事件 payload 的可迭代对象）"""
+        with self._lock:
+            self._prune()
+            job = self._inflight.get(key) if key is not None else None
+            if job is not None:
+                ANALYSIS_COALESCED.inc(scope=scope)
+                log_event('analysis_job.coalesced', job=job.id, contact_id=contact_id, scope=scope)
+                return job
+            job = AnalysisJob(contact_id, scope, Config.ANALYSIS_JOB_BUFFER, key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._inflight[key] = job
+        threading.Thread(target=self._run, args=(job, run), name=f'analysis-job-{job.id[:8]}',
+                         daemon=True).start()
+        log_event('analysis_job.start', job=job.id, contact_id=contact_id, scope=scope)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        expires = time.monotonic() - Config.ANALYSIS_JOB_TTL
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < expires]:
+            del self._jobs[job_id]
+
+    def _run(self, job, run):
+        try:
+            for payload in run():
+                job.publish(payload)
+        except Exception as e:
+            logger.exception('分析任务 %s 异常终止', job.id)
+            job.publish({'type': 'error', 'message': f'分析任务异常终止: {e}'})
+        finally:
+            with self._lock:
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+            job.finish()
+            log_event('analysis_job.finish', job=job.id, contact_id=job.contact_id, events=job.last_id)
+
+
+analysis_jobs = JobRegistry()
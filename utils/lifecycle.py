@@ -0,0 +1,108 @@
+"""
+生产环境下的进程生命周期：预加载共享、fork 后重置连接、优雅退出
+
+gunicorn 以 preload_app 启动时，master 先导入 wsgi.py 创建应用，再调用 preload_shared_state(app)
+导入较重的模块、编译页面模板并冻结 GC；fork 出来的 worker 以写时复制的方式共享这些只读对象
+（AI 提示词、配置、模板、pandas/numpy），不必各自再导入一遍。
+fork 之后每个 worker 要先调用 after_fork(app)，丢弃从 master 继承的数据库和缓存连接。
+
+收到 SIGTERM 后 streams.begin_drain()：新的分析流请求直接返回 503，已经开始的分析流照常执行到结束。
+分析任务在后台线程中运行，与请求无关，gunicorn 等待请求结束时不会等它们：gunicorn.conf.py 的 worker_exit
+（uvicorn worker 为 asgi.py 的 lifespan）调用 streams.wait_idle() 等待它们结束，最多 graceful_timeout 秒。
+"""
+import gc
+import importlib
+import logging
+import signal
+import threading
+import time
+
+from database.models import db
+from database.shards import get_shard_router
+from utils.cache import get_response_cache
+from utils.metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# preload 模式下在 master 中导入一次；非 preload 模式下这些模块仍按需加载，见 benchmarks/bench_startup.py
+PRELOAD_MODULES = ('utils.ai', 'utils.exporter', 'utils.embeddings', 'pandas')
+PRELOAD_TEMPLATES = ('base.html', 'home.html', 'index.html', 'profile.html', 'labeling.html', 'export.html')
+
+
+class StreamTracker:
+    """统计正在进行的流式响应，供优雅退出时等待"""
+
+    def __init__(self):
+        self._active = 0
+        self._cond = threading.Condition()
+        self.draining = False
+
+    @property
+    def active(self):
+        return self._active
+
+    def track(self, iterable):
+        """包装分析任务的生成器（见 utils/jobs.py）：从开始到结束期间计为进行中，与客户端是否仍然连接无关"""
+        with self._cond:
+            self._active += 1
+        try:
+            yield from iterable
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def begin_drain(self):
+        with self._cond:
+            self.draining = True
+
+    def wait_idle(self, timeout=None):
+        """等待进行中的流全部结束；返回超时后仍未结束的数量"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._active
+
+
+streams = StreamTracker()
+ANALYSIS_STREAMS = Gauge('analysis_streams_in_progress', '进行中的分析流', lambda: streams.active)
+
+
+def preload_shared_state(app):
+    """在 master 中、fork 之前调用"""
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logger.warning('预加载模块失败: %s', name)
+    for name in PRELOAD_TEMPLATES:
+        app.jinja_env.get_template(name)
+    # 把目前所有对象移出 GC 跟踪，worker 里的垃圾回收不会再触碰（进而复制）这些共享的内存页
+    gc.freeze()
+
+
+def after_fork(app):
+    """在 worker 中、处理请求之前调用；连接会在第一次使用时重新建立"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+        router = get_shard_router()
+        if router is not None:
+            router.dispose(close=False)
+        get_response_cache().reset_connections()
+
+
+def install_drain_handler(signum=signal.SIGTERM):
+    """在已有的信号处理函数之前先标记 draining；需在服务器安装完自己的处理函数之后调用"""
+    previous = signal.getsignal(signum)
+
+    def handler(sig, frame):
+        streams.begin_drain()
+        if callable(previous):
+            previous(sig, frame)
+
+    signal.signal(signum, handler)
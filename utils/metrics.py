@@ -0,0 +1,399 @@
+"""
+进程内指标（Prometheus 文本格式）与抽样的结构化日志
+
+指标在 /metrics 暴露，不依赖 prometheus_client：
+    http_request_duration_seconds   各路由的处理耗时（到返回响应头为止，流式响应的总时长见 AI 指标）
+    http_request_db_queries         每个请求执行的 SQL 语句数（主库、副本和分片都计入）
+    ai_*                            大模型调用次数、耗时、首 token 延迟、输出速度和 token 用量，各模型服务的调用结果、
+                                    首 token 延迟和对冲请求（见 utils/backends.py），
+                                    以及聊天记录整理前后的 token 数（见 utils/transcript.py）
+    export_*                        导出文件的耗时和大小
+    analysis_streams_in_progress    进行中的分析流
+
+多个 gunicorn worker 时设置 METRICS_DIR：每个进程每隔 METRICS_FLUSH_INTERVAL 秒把自己的指标写入
+METRICS_DIR/<pid>.json，/metrics 合并目录中所有进程的数据（gunicorn.conf.py 在启动时清空该目录，
+worker 退出时删除自己的文件）。被强制结束的 worker 来不及删除文件，合并时仍计入它的计数器和直方图，
+但跳过它的 gauge（如 analysis_streams_in_progress），避免已经不存在的分析流一直被计为进行中。
+
+结构化日志：log_event(event, **fields) 向 mysoullinker.events 输出一行 JSON；流式分块这类高频事件传 sample=True，
+只按 EVENT_LOG_SAMPLE_RATE 的比例抽样输出，避免日志本身成为瓶颈。
+"""
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_FLUSH_INTERVAL = 5
+
+event_logger = logging.getLogger('mysoullinker.events')
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'重复的指标名: {metric.name}')
+        self._metrics[metric.name] = metric
+
+    def metrics(self):
+        return list(self._metrics.values())
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics()}
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key, ensure_ascii=False): self._copy(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """取值由 function() 在采集时给出，不带标签"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function, registry=REGISTRY):
+        super().__init__(name, documentation, registry=registry)
+        self._function = function
+
+    def snapshot(self):
+        return {json.dumps([]): self._function()}
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 各桶的计数（非累计）、+Inf 桶、总和、总数
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+
+# ---- 指标定义 ----
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', '请求处理耗时（秒）', ['endpoint', 'method', 'status'])
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', '每个请求执行的 SQL 语句数', ['endpoint'],
+                               buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+AI_REQUESTS = Counter('ai_requests_total', '大模型调用次数', ['mode', 'outcome'])
+AI_DURATION = Histogram('ai_request_duration_seconds', '大模型调用总耗时（秒）', ['mode'],
+                        buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 180))
+AI_TTFT = Histogram('ai_time_to_first_token_seconds', '流式调用的首 token 延迟（秒）',
+                    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60))
+AI_TOKENS_PER_SECOND = Histogram('ai_completion_tokens_per_second', '流式输出速度（completion token/秒）',
+                                 buckets=(1, 5, 10, 20, 40, 80, 160, 320))
+AI_TOKENS = Histogram('ai_tokens', '每次调用的 token 用量', ['kind'],
+                      buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072))
+AI_BACKEND_REQUESTS = Counter('ai_backend_requests_total', '各模型服务的调用次数', ['backend', 'outcome'])
+AI_BACKEND_TTFT = Histogram('ai_backend_time_to_first_token_seconds', '各模型服务的首 token 延迟（秒）', ['backend'],
+                            buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60))
+AI_HEDGES = Counter('ai_hedged_requests_total', '对冲请求：发出次数及首选 / 对冲方胜出次数', ['outcome'])
+AI_QUOTA_REJECTIONS = Counter('ai_quota_rejections_total', '因配额（每日 token、并发数）被拒绝的大模型调用',
+                              ['quota'])
+ANALYSIS_RESUMES = Counter('analysis_stream_resumes_total', '断线后按 Last-Event-ID 重新连接分析任务的次数',
+                           ['outcome'])
+ANALYSIS_COALESCED = Counter('analysis_coalesced_total', '合并到进行中的相同分析任务、没有另外调用模型的请求数',
+                             ['scope'])
+TRANSCRIPT_TOKENS = Counter('ai_transcript_tokens_total', '聊天记录整理前（original）与实际发送（sent）的本地估算 token 数',
+                            ['kind'])
+
+EXPORT_DURATION = Histogram('export_duration_seconds', '生成导出文件的耗时（秒）', ['kind', 'format'])
+EXPORT_SIZE = Histogram('export_size_bytes', '导出文件大小（字节）', ['kind', 'format'],
+                        buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8))
+
+
+def observe_ai_tokens(total_tokens, completion_tokens):
+    if total_tokens:
+        AI_TOKENS.observe(total_tokens, kind='total')
+    if completion_tokens:
+        AI_TOKENS.observe(completion_tokens, kind='completion')
+
+
+def record_transcript(contact_id, scope, stats):
+    TRANSCRIPT_TOKENS.inc(stats.original_tokens, kind='original')
+    TRANSCRIPT_TOKENS.inc(stats.tokens, kind='sent')
+    log_event('transcript_compacted', contact_id=contact_id, scope=scope, **stats.to_dict())
+
+
+def record_export(kind, formats, started, filepath):
+    fmt = ','.join(sorted(formats))
+    duration = time.perf_counter() - started
+    size = os.path.getsize(filepath)
+    EXPORT_DURATION.observe(duration, kind=kind, format=fmt)
+    EXPORT_SIZE.observe(size, kind=kind, format=fmt)
+    log_event('export', kind=kind, format=fmt, duration_ms=round(duration * 1000, 1), bytes=size)
+
+
+# ---- 渲染与多进程合并 ----
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, values in snapshot.items():
+            target = merged.setdefault(name, {})
+            for key, value in values.items():
+                if key not in target:
+                    target[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target[key] = [a + b for a, b in zip(target[key], value)]
+                else:
+                    target[key] += value
+    return merged
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_bound(bound):
+    return repr(float(bound)) if bound != int(bound) else f'{bound:.1f}'
+
+
+def render(snapshot, registry=REGISTRY):
+    lines = []
+    for metric in registry.metrics():
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for key, value in sorted(snapshot.get(metric.name, {}).items()):
+            labels = json.loads(key)
+            if metric.kind != 'histogram':
+                lines.append(f'{metric.name}{_format_labels(metric.labelnames, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_bound(bound)
+                lines.append(f'{metric.name}_bucket{_format_labels(metric.labelnames, labels, [("le", le)])} {cumulative}')
+            lines.append(f'{metric.name}_sum{_format_labels(metric.labelnames, labels)} {value[-2]}')
+            lines.append(f'{metric.name}_count{_format_labels(metric.labelnames, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class _Flusher:
+    """METRICS_DIR 模式下定期把本进程的指标写到文件；fork 之后在子进程里重新启动"""
+
+    def __init__(self):
+        self.directory = None
+        self._pid = None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def path(self, pid=None):
+        return os.path.join(self.directory, f'{pid or os.getpid()}.json')
+
+    def flush(self):
+        if self._stopped:
+            return
+        tmp = self.path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(REGISTRY.snapshot(), f)
+        os.replace(tmp, self.path())
+
+    def ensure_started(self):
+        if self.directory is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                logging.getLogger(__name__).exception('写入指标文件失败')
+
+    def remove(self):
+        """worker 退出时调用：停止写入并删除本进程的指标文件"""
+        self._stopped = True
+        try:
+            os.remove(self.path())
+        except FileNotFoundError:
+            pass
+
+    def others(self):
+        snapshots = []
+        gauges = {metric.name for metric in REGISTRY.metrics() if metric.kind == 'gauge'}
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if path == self.path():
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _pid_alive(os.path.basename(path)[:-len('.json')]):
+                snapshot = {name: values for name, values in snapshot.items() if name not in gauges}
+            snapshots.append(snapshot)
+        return snapshots
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_flusher = _Flusher()
+
+
+def collect():
+    snapshots = [REGISTRY.snapshot()]
+    if _flusher.directory:
+        snapshots.extend(_flusher.others())
+    return render(_merge(snapshots))
+
+
+def remove_process_metrics():
+    if _flusher.directory:
+        _flusher.remove()
+
+
+def clear_metrics_dir(directory):
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+# ---- 结构化日志 ----
+
+_sample_rate = 0.01
+
+
+def log_event(name, sample=False, level=logging.INFO, **fields):
+    if sample and random.random() >= _sample_rate:
+        return
+    if not event_logger.isEnabledFor(level):
+        return
+    record = {'ts': round(time.time(), 3), 'event': name, 'pid': os.getpid()}
+    record.update(fields)
+    if sample:
+        record['sample_rate'] = _sample_rate
+    event_logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+
+# ---- Flask / SQLAlchemy 接入 ----
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.db_query_count = g.get('db_query_count', 0) + 1
+
+
+def _before_request():
+    _flusher.ensure_started()
+    g.request_started = time.perf_counter()
+    g.db_query_count = 0
+
+
+def _after_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    queries = g.get('db_query_count', 0)
+    REQUEST_LATENCY.observe(duration, endpoint=endpoint, method=request.method, status=response.status_code)
+    REQUEST_DB_QUERIES.observe(queries, endpoint=endpoint)
+    log_event('request', sample=True, endpoint=endpoint, method=request.method, status=response.status_code,
+              duration_ms=round(duration * 1000, 1), db_queries=queries)
+    return response
+
+
+def init_metrics(app):
+    global _sample_rate
+    _sample_rate = app.config.get('EVENT_LOG_SAMPLE_RATE', 0.01)
+    _flusher.directory = app.config.get('METRICS_DIR') or None
+
+    if not event_logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        event_logger.addHandler(handler)
+        event_logger.setLevel(logging.INFO)
+        event_logger.propagate = False
+
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -0,0 +1,325 @@
+"""
+本地的火山方舟 /chat/completions 替身，用于离线开发和分析链路的负载测试
+
+兼容 utils/ai.py 使用的 OpenAI 风格接口：普通请求返回一次性的 JSON，"stream": true 时按 SSE 逐块返回，
+最后一块带 usage。返回内容是一份格式正确的分析结果 JSON，按约每个汉字一个 token 切分输出。
+
+可以模拟的上游行为：
+    --latency / --jitter        首 token 前的等待（秒），实际值在 latency ± jitter 内均匀分布
+    --tokens-per-second         输出速度；普通请求同样要等全部 token "生成"完才返回
+    --error-rate                返回 500
+    --rate-limit-rate           返回 429（带 Retry-After）；--max-concurrency 之外的并发请求同样返回 429
+    --malformed-rate            普通请求返回截断的 JSON，流式请求中夹一个无法解析的数据块
+    --disconnect-rate           流式输出到一半直接断开连接，不发送 [DONE]
+请求头 X-Mock-Fault: error | rate_limit | malformed | disconnect 可对单个请求强制指定故障，便于复现。
+GET /stats 返回各类结果的计数、并发峰值和累计输出 token 数。
+
+用法: python -m utils.mock_ark --port 8790 --latency 0.8 --tokens-per-second 40 --rate-limit-rate 0.05
+      然后设置 VOLCANO_ARK_ENDPOINT=http://127.0.0.1:8790/api/v3
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.sse import encode_event
+
+FAULTS = ('error', 'rate_limit', 'malformed', 'disconnect')
+
+SAMPLE_ANALYSIS = {
+    'core_traits': {
+        'rationality': '偏理性，做决定前会先查资料、比较方案',
+        'introversion': '熟人面前健谈，陌生场合偏安静',
+        'planning': '周末活动喜欢提前约好，临时变动会有些不安',
+        'responsibility': '答应的事情基本都会做到',
+        'stress_resistance': '工作压力大时会吐槽，但很快调整过来',
+        'decision_style': '谨慎型，重要决定会征求朋友意见'
+    },
+    'behavior_preferences': {
+        'high_frequency_topics': ['工作', '美食', '电影'],
+        'interests': ['火锅', '看电影', '爬山'],
+        'hobbies': ['健身', '摄影'],
+        'preferences': '喜欢安静的小店和有故事的电影',
+        'avoidances': '不太喜欢人多嘈杂的场合',
+        'lifestyle': '作息规律，晚上十一点前休息'
+    },
+    'social_interaction': {
+        'initiative': '经常主动分享日常',
+        'expression_style': '直接、幽默，爱用表情',
+        'response_pattern': '工作时间回复较慢，晚上回复及时',
+        'empathy': '能察觉对方情绪并给予安慰',
+        'sharing_willingness': '分享欲强',
+        'boundary_awareness': '尊重彼此的私人空间',
+        'collaboration_style': '愿意分工合作，会主动承担琐碎的部分'
+    },
+    'cognitive_thinking': {
+        'knowledge_depth': '在本职领域有较深积累',
+        'knowledge_breadth': '兴趣广泛，关注科技与文化',
+        'values': '重视真诚和长期的关系',
+        'principles': '不接受欺骗'
+    },
+    'summary': '理性又有温度的美食爱好者',
+    'interests': ['火锅', '电影', '爬山', '摄影', '健身'],
+    'dos_and_donts': {
+        'dos': ['提前约时间', '分享新发现的小店'],
+        'donts': ['临时放鸽子', '在工作时间频繁打扰']
+    },
+    'topic_suggestions': ['最近上映的电影', '周边徒步路线', '新开的火锅店'],
+    'gift_suggestions': ['相机配件', '精品咖啡豆']
+}
+SAMPLE_CONTENT = json.dumps(SAMPLE_ANALYSIS, ensure_ascii=False, indent=2)
+
+_CJK = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+_TOKEN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]|[A-Za-z0-9_]+|\s+|[^\sA-Za-z0-9_\u3400-\u9fff\uf900-\ufaff]')
+
+
+def estimate_tokens(text):
+    """粗略的 token 数：每个汉字约 1 个，其余字符约 4 个一个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_tokens(text):
+    return _TOKEN.findall(text)
+
+
+class MockArkStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outcomes = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completion_tokens = 0
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return self.in_flight
+
+    def leave(self, outcome, completion_tokens=0):
+        with self.lock:
+            self.in_flight -= 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.completion_tokens += completion_tokens
+
+    def snapshot(self):
+        with self.lock:
+            return {'outcomes': dict(self.outcomes), 'in_flight': self.in_flight,
+                    'peak_in_flight': self.peak_in_flight, 'completion_tokens': self.completion_tokens}
+
+
+class MockArkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, code, message, headers=None):
+        self._send_json(status, {'error': {'code': code, 'message': message, 'type': 'mock'}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_error(404, 'NotFound', self.path)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length)
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_error(404, 'NotFound', self.path)
+        try:
+            payload = json.loads(raw or b'{}')
+        except ValueError:
+            return self._send_error(400, 'InvalidParameter', '请求体不是合法的 JSON')
+
+        server = self.server
+        concurrent = server.stats.enter()
+        outcome, completion_tokens = 'ok', 0
+        try:
+            fault = self.headers.get('X-Mock-Fault') or server.pick_fault()
+            if fault == 'rate_limit' or (server.max_concurrency and concurrent > server.max_concurrency):
+                outcome = 'rate_limit'
+                return self._send_error(429, 'RateLimitExceeded.EndpointRPMExceeded', '请求过于频繁，请稍后重试',
+                                        {'Retry-After': str(server.retry_after)})
+            if fault == 'error':
+                outcome = 'error'
+                return self._send_error(500, 'InternalServiceError', '模拟的服务端错误')
+
+            time.sleep(server.first_token_delay())
+            prompt = ''.join(str(m.get('content', '')) for m in payload.get('messages', []))
+            tokens = split_tokens(server.content)
+            usage = {'prompt_tokens': estimate_tokens(prompt), 'completion_tokens': len(tokens)}
+            usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+            if payload.get('stream'):
+                outcome, completion_tokens = self._stream(payload, tokens, usage, fault)
+            else:
+                outcome, completion_tokens = self._complete(payload, tokens, usage, fault)
+        finally:
+            server.stats.leave(outcome, completion_tokens)
+
+    def _complete(self, payload, tokens, usage, fault):
+        if self.server.tokens_per_second:
+            time.sleep(len(tokens) / self.server.tokens_per_second)
+        body = {
+            'id': f'chatcmpl-{uuid.uuid4().hex}', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': payload.get('model', 'mock'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                         'finish_reason': 'stop'}],
+            'usage': usage,
+        }
+        if fault != 'malformed':
+            self._send_json(200, body)
+            return 'ok', len(tokens)
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        data = data[:len(data) // 2]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return 'malformed', len(tokens)
+
+    def _stream(self, payload, tokens, usage, fault):
+        server = self.server
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        chunk_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time.time())
+        model = payload.get('model', 'mock')
+        step = server.chunk_tokens
+        chunks = [''.join(tokens[i:i + step]) for i in range(0, len(tokens), step)]
+        broken_at = len(chunks) // 2 if fault in ('malformed', 'disconnect') else None
+        interval = step / server.tokens_per_second if server.tokens_per_second else 0
+        sent = 0
+
+        def event(data):
+            self.wfile.write(encode_event(data).encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            for index, piece in enumerate(chunks):
+                if index == broken_at:
+                    if fault == 'disconnect':
+                        return 'disconnect', sent
+                    event('{"choices": [{"delta": {"content": "')
+                if interval and index:
+                    time.sleep(interval)
+                event(json.dumps({'id': chunk_id, 'object': 'chat.completion.chunk', 'created': created,
+                                  'model': model,
+                                  'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]},
+                                 ensure_ascii=False))
+                sent += min(step, len(tokens) - index * step)
+            event(json.dumps({'id': chunk_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                              'choices': [], 'usage': usage}))
+            event('[DONE]')
+        except (BrokenPipeError, ConnectionResetError):
+            return 'client_closed', sent
+        return ('malformed' if fault == 'malformed' else 'ok'), sent
+
+
+class MockArkServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, tokens_per_second=0.0, chunk_tokens=4,
+                 error_rate=0.0, rate_limit_rate=0.0, malformed_rate=0.0, disconnect_rate=0.0, max_concurrency=0,
+                 retry_after=1, content=SAMPLE_CONTENT, seed=None):
+        super().__init__((host, port), MockArkHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.rates = {'error': error_rate, 'rate_limit': rate_limit_rate, 'malformed': malformed_rate,
+                      'disconnect': disconnect_rate}
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.content = content
+        self.stats = MockArkStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    @property
+    def url(self):
+        """可直接用作 VOLCANO_ARK_ENDPOINT"""
+        host, port = self.server_address
+        return f'http://{host}:{port}/api/v3'
+
+    def pick_fault(self):
+        with self._random_lock:
+            roll = self._random.random()
+        for fault in FAULTS:
+            if roll < self.rates[fault]:
+                return fault
+            roll -= self.rates[fault]
+        return None
+
+    def first_token_delay(self):
+        with self._random_lock:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+
+def start_mock_ark(host='127.0.0.1', port=0, **options):
+    """在后台线程启动替身服务并返回它；port 为 0 时自动分配端口，见 server.url"""
+    server = MockArkServer(host, port, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    """替身服务的行为参数，负载测试脚本复用同一组参数"""
+    parser.add_argument('--latency', type=float, default=0.5, help='首 token 前的等待（秒）')
+    parser.add_argument('--jitter', type=float, default=0.2, help='等待时间的随机浮动（秒）')
+    parser.add_argument('--tokens-per-second', type=float, default=50, help='输出速度，0 表示不限速')
+    parser.add_argument('--chunk-tokens', type=int, default=4, help='流式输出每块包含的 token 数')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--disconnect-rate', type=float, default=0.0)
+    parser.add_argument('--max-concurrency', type=int, default=0, help='超过该并发返回 429，0 表示不限制')
+    parser.add_argument('--seed', type=int, help='故障抽样的随机种子')
+
+
+def options_from_args(args):
+    return {name: getattr(args, name) for name in (
+        'latency', 'jitter', 'tokens_per_second', 'chunk_tokens', 'error_rate', 'rate_limit_rate',
+        'malformed_rate', 'disconnect_rate', 'max_concurrency', 'seed')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地火山方舟 /chat/completions 替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8790)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockArkServer(args.host, args.port, **options_from_args(args))
+    print(f'Mock Ark 监听 {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+超长聊天记录的重要性采样
+
+联系人有几万到几十万条消息时，整理后的记录仍远超 token 预算，按日期截断只会留下最近一段时间的对话。
+select_messages 给每条消息打分，在预算内挑出有代表性的一部分：
+    长度：信息量大致随长度增长，超过 LENGTH_SATURATION 个字符后不再加分；
+    新颖度：以字符二元组为词的 TF-IDF，"好的""哈哈"这类常见寒暄得分低，少见的用词得分高；
+    发送者："对方"是画像对象，按 SPEAKER_SHARES 分得大部分预算，"我"的消息作为语境保留一小部分，某一方用不完的预算留给另一方；
+    时间：按 RECENCY_HALF_LIFE_DAYS 半衰期衰减，越近的消息得分越高；但每一方先拿出 MONTH_QUOTA_SHARE 的预算
+    平均分给涉及的各个月份，每月挑本月得分最高的消息，保证较早的月份也有代表，用不完的保底预算退回；
+    话题多样性：用 utils.embeddings 的向量对候选做 k-means 聚类，在各簇之间按得分轮流挑选，
+    同一簇已选得越多，其后续候选的得分折扣越大，避免高频话题占满预算。
+选出的消息按原来的时间顺序交给 compact_transcript 排版，文本开头注明是从多少条中挑选的。
+"""
+import heapq
+import math
+from collections import Counter
+
+from utils.transcript import TRANSCRIPT_FORMAT_NOTE, clean_content, compact_transcript, count_tokens
+
+SPEAKER_SHARES = {'我': 0.3, '对方': 0.7}
+SCORE_WEIGHTS = {'length': 0.25, 'novelty': 0.45, 'recency': 0.3}
+LENGTH_SATURATION = 120
+RECENCY_HALF_LIFE_DAYS = 180
+# 每一方预算中按月平均分配的保底部分，其余再按得分和话题多样性在全部记录中挑选
+MONTH_QUOTA_SHARE = 0.4
+# 每一方只对得分最高的这么多条候选做向量化和聚类，控制超长记录的耗时（向量化约每万条 2 秒）
+MAX_CANDIDATES = 5000
+MAX_CLUSTERS = 32
+# 同一簇每多选一条，该簇后续候选的得分除以 (1 + DIVERSITY_PENALTY * 已选条数)
+DIVERSITY_PENALTY = 0.5
+# 每条消息除内容外的开销（发送者、分隔符）及每个日期标题的开销
+LINE_OVERHEAD_TOKENS = 3
+DAY_HEADER_TOKENS = count_tokens('[2024-01-01]') + 1
+# 采样说明一行的预留
+SAMPLE_NOTE_TOKENS = 60
+
+
+def _bigrams(text):
+    text = ''.join(text.split())
+    if len(text) < 2:
+        return {text}
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def score_messages(chat_logs):
+    """返回 [(下标, 清洗后的内容, 得分), ...]；表情占位、系统提示等清洗后为空的消息不参与"""
+    items = [(i, clean_content(log.content)) for i, log in enumerate(chat_logs)]
+    items = [(i, content) for i, content in items if content]
+    if not items:
+        return []
+
+    grams = [_bigrams(content) for _, content in items]
+    df = Counter()
+    for g in grams:
+        df.update(g)
+    n = len(items)
+    # 平滑的 idf，与 scikit-learn 的 smooth_idf 相同；只出现一次的二元组得分最高
+    max_idf = math.log((n + 1) / 2) + 1
+    latest = max(chat_logs[i].chat_date for i, _ in items)
+    length_norm = math.log1p(LENGTH_SATURATION)
+
+    scored = []
+    for (i, content), g in zip(items, grams):
+        log = chat_logs[i]
+        novelty = sum(math.log((n + 1) / (df[gram] + 1)) + 1 for gram in g) / len(g) / max_idf
+        length = min(math.log1p(len(content)) / length_norm, 1.0)
+        recency = 0.5 ** ((latest - log.chat_date).days / RECENCY_HALF_LIFE_DAYS)
+        score = (SCORE_WEIGHTS['length'] * length + SCORE_WEIGHTS['novelty'] * novelty
+                 + SCORE_WEIGHTS['recency'] * recency)
+        scored.append((i, content, score))
+    return scored
+
+
+def _clusters(contents, seed):
+    # numpy 和向量化只有超出预算需要采样时才用到，不在导入 app 时加载
+    import numpy as np
+    from utils.embeddings import _kmeans, embed_batch
+
+    k = min(MAX_CLUSTERS, int(math.sqrt(len(contents) / 2)))
+    if k < 2:
+        return np.zeros(len(contents), dtype=np.int64)
+    vectors = embed_batch(contents)
+    centroids = _kmeans(vectors, k, seed=seed)
+    return np.argmax(vectors @ centroids.T, axis=1)
+
+
+def _cost(chat_logs, i, content, days):
+    return count_tokens(content) + LINE_OVERHEAD_TOKENS + (0 if chat_logs[i].chat_date in days else DAY_HEADER_TOKENS)
+
+
+def _select_by_month(chat_logs, scored, budget, seen, days):
+    """按月保底：budget 平均分给各月，每月按得分从高到低挑选；返回 (选中的下标, 实际用掉的预算)"""
+    by_month = {}
+    for item in scored:
+        by_month.setdefault(chat_logs[item[0]].chat_date.strftime('%Y-%m'), []).append(item)
+    per_month = budget // len(by_month)
+    selected = []
+    spent = 0
+    for items in by_month.values():
+        remaining = per_month
+        for i, content, _ in items:
+            if remaining <= LINE_OVERHEAD_TOKENS:
+                break
+            cost = _cost(chat_logs, i, content, days)
+            if content in seen or cost > remaining:
+                continue
+            selected.append(i)
+            seen.add(content)
+            days.add(chat_logs[i].chat_date)
+            remaining -= cost
+        spent += per_month - remaining
+    return selected, spent
+
+
+def _select(chat_logs, scored, budget, seen, days, seed):
+    """在一方的消息中挑选，返回 (选中的下标, 剩余预算)；seen、days 为已选的内容和日期，双方共享"""
+    scored = sorted(scored, key=lambda item: item[2], reverse=True)
+    if not scored:
+        return [], budget
+    selected, spent = _select_by_month(chat_logs, scored, int(budget * MONTH_QUOTA_SHARE), seen, days)
+    scored = scored[:MAX_CANDIDATES]
+
+    # scored 已按得分降序，按簇分组后每组内部仍然有序
+    queues = {}
+    for item, cluster in zip(scored, _clusters([content for _, content, _ in scored], seed)):
+        queues.setdefault(int(cluster), []).append(item)
+    heap = [(-queue[0][2], cluster, 0) for cluster, queue in queues.items()]
+    heapq.heapify(heap)
+
+    taken = Counter()
+    remaining = budget - spent
+    while heap and remaining > LINE_OVERHEAD_TOKENS:
+        _, cluster, position = heapq.heappop(heap)
+        queue = queues[cluster]
+        i, content, _ = queue[position]
+        cost = _cost(chat_logs, i, content, days)
+        if content not in seen and cost <= remaining:
+            selected.append(i)
+            seen.add(content)
+            days.add(chat_logs[i].chat_date)
+            remaining -= cost
+            taken[cluster] += 1
+        if position + 1 < len(queue):
+            priority = queue[position + 1][2] / (1 + DIVERSITY_PENALTY * taken[cluster])
+            heapq.heappush(heap, (-priority, cluster, position + 1))
+    return selected, remaining
+
+
+def select_messages(chat_logs, budget, seed=0):
+    """在 budget 个 token 内挑选有代表性的消息，按原顺序返回"""
+    by_speaker = {}
+    for item in score_messages(chat_logs):
+        by_speaker.setdefault(chat_logs[item[0]].speaker, []).append(item)
+    # 份额小的一方先选，剩余预算并入后面的一方
+    speakers = sorted(by_speaker, key=lambda speaker: SPEAKER_SHARES.get(speaker, 0))
+    share_left = sum(SPEAKER_SHARES.get(speaker, 0) for speaker in speakers)
+
+    selected, seen, days, left = [], set(), set(), budget
+    for speaker in speakers:
+        share = SPEAKER_SHARES.get(speaker, 0)
+        allowance = int(left * share / share_left) if share_left else left
+        picked, unused = _select(chat_logs, by_speaker[speaker], allowance, seen, days, seed)
+        selected.extend(picked)
+        left -= allowance - unused
+        share_left -= share
+
+    selected.sort()
+    return [chat_logs[i] for i in selected]
+
+
+def sampling_budget(budget):
+    """整段记录的预算中留给采样消息的部分，扣除格式说明和采样说明"""
+    return budget - count_tokens(TRANSCRIPT_FORMAT_NOTE) - SAMPLE_NOTE_TOKENS
+
+
+def build_analysis_transcript(chat_logs, budget, seed=0):
+    """整理后能放进预算时原样使用；需要省略较早的日期时改为在全部记录中采样"""
+    transcript = compact_transcript(chat_logs, budget)
+    if budget is None or not transcript.stats.omitted_days:
+        return transcript
+
+    selected = select_messages(chat_logs, sampling_budget(budget), seed)
+    first, last = chat_logs[0].chat_date, chat_logs[-1].chat_date
+    note = (f'（{first} 至 {last} 共 {len(chat_logs)} 条聊天记录，篇幅所限，以下是按信息量、话题和时间'
+            f'挑选出的 {len(selected)} 条，同一天内仍按原顺序排列）')
+    sampled = compact_transcript(selected, budget, note=note)
+    sampled.stats.messages = len(chat_logs)
+    sampled.stats.sampled_messages = len(selected)
+    sampled.stats.original_tokens = transcript.stats.original_tokens
+    return sampled
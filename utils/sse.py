@@ -0,0 +1,142 @@
+"""
+Server-Sent Events 的编码与解码，服务端（分析流路由、本地替身）和客户端（调用上游模型、基准测试）共用
+
+编码：encode_event 把一个事件写成 event / id / data 字段加空行；数据含换行时拆成多行 data，
+解码时按规范用 "\\n" 重新拼接。encode_comment 产生以冒号开头的注释行，用作心跳，
+让代理和浏览器在模型长时间没有输出时也不断开、不缓冲。
+
+解码：SSEDecoder 直接处理原始字节块，不假设每块是完整的一行或一个事件：
+    行可以被拆在任意两个块之间（包括 "\\r\\n" 中间和多字节 UTF-8 字符中间，按字节找换行再解码，
+    UTF-8 的多字节序列里不会出现换行字节）；
+    支持 "\\n"、"\\r"、"\\r\\n" 三种换行，忽略开头的 BOM 和注释行；
+    id 字段记录在 last_event_id 中，断线重连时作为 Last-Event-ID 发送。
+流结束时还没遇到空行的半个事件按规范丢弃，pending 为 True 表示发生了这种截断。
+
+浏览器一侧的同一套解码逻辑见 static/js/sse.js。
+"""
+import json
+from dataclasses import dataclass
+
+HEARTBEAT_COMMENT = 'ping'
+# SSE 响应头：禁止缓存，并让 nginx 之类的反向代理不要缓冲
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+@dataclass
+class Event:
+    data: str
+    event: str = 'message'
+    id: str = None
+    retry: int = None
+
+    def json(self):
+        return json.loads(self.data)
+
+
+def encode_event(data, event=None, id=None, retry=None):
+    """data 为字符串时原样发送，其他值序列化为 JSON"""
+    if not isinstance(data, str):
+        data = json.dumps(data)
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    if id is not None:
+        lines.append(f'id: {id}')
+    if retry is not None:
+        lines.append(f'retry: {int(retry)}')
+    lines.extend(f'data: {line}' for line in data.replace('\r\n', '\n').replace('\r', '\n').split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+def encode_comment(text=HEARTBEAT_COMMENT):
+    return ''.join(f': {line}\n' for line in text.split('\n')) + '\n'
+
+
+class SSEDecoder:
+    def __init__(self):
+        self.last_event_id = None
+        self.retry = None
+        self.comments = 0
+        self._buffer = b''
+        self._started = False
+        self._skip_lf = False
+        self._reset()
+
+    def _reset(self):
+        self._event = None
+        self._data = []
+        self._has_fields = False
+
+    @property
+    def pending(self):
+        """缓冲区里有未结束的行，或已有字段但还没遇到结束事件的空行"""
+        return bool(self._buffer) or self._has_fields
+
+    def feed(self, chunk):
+        """输入一段字节，返回其中完整的事件列表"""
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if not chunk:
+            return []
+        if self._skip_lf and chunk[:1] == b'\n':
+            chunk = chunk[1:]
+        self._skip_lf = False
+        buffer = self._buffer + chunk
+        events = []
+        start = 0
+        while True:
+            cr, lf = buffer.find(b'\r', start), buffer.find(b'\n', start)
+            if cr == -1 and lf == -1:
+                break
+            end = lf if cr == -1 or (lf != -1 and lf < cr) else cr
+            line = buffer[start:end]
+            start = end + 1
+            if buffer[end:end + 1] == b'\r':
+                if end + 1 == len(buffer):
+                    # "\r" 在块末尾，下一块若以 "\n" 开头则属于同一个换行
+                    self._skip_lf = True
+                elif buffer[end + 1:end + 2] == b'\n':
+                    start += 1
+            event = self._line(line.decode('utf-8', errors='replace'))
+            if event is not None:
+                events.append(event)
+        self._buffer = buffer[start:]
+        return events
+
+    def _line(self, line):
+        if not self._started:
+            self._started = True
+            if line.startswith('\ufeff'):
+                line = line[1:]
+        if not line:
+            event = None
+            if self._data:
+                event = Event(data='\n'.join(self._data), event=self._event or 'message', id=self.last_event_id,
+                              retry=self.retry)
+            self._reset()
+            return event
+        if line.startswith(':'):
+            self.comments += 1
+            return None
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        self._has_fields = True
+        if field == 'data':
+            self._data.append(value)
+        elif field == 'event':
+            self._event = value
+        elif field == 'id':
+            if '\0' not in value:
+                self.last_event_id = value
+        elif field == 'retry':
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+
+def iter_events(chunks, decoder=None):
+    """从字节块的迭代器（如 response.iter_content(None)）中逐个产生事件"""
+    decoder = decoder or SSEDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
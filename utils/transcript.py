@@ -0,0 +1,167 @@
+"""
+发送给大模型前的聊天记录整理与 token 预算
+
+原来每条消息都带完整的 "[YYYY-MM-DD]【对方】" 前缀，表情、图片占位和系统提示也原样发送。compact_transcript 改为：
+    同一天的消息放在一个日期标题下；
+    同一人连续发送的多条合并为一行，用 " / " 分隔；
+    去掉纯表情 / 媒体占位、空行和系统提示（撤回、加好友提示等），句中的表情代码一并去掉；
+    同一人连发的重复内容只保留一条，较长的消息在整段记录中重复出现（转发、复制粘贴）时只保留第一次；
+    "哈哈哈哈哈哈"这类重复字符压缩为三个。
+token 数在本地计算：安装了 tiktoken 时用 cl100k_base 分词器近似，否则按每个汉字约 1 个、其余字符约 4 个一个估算。
+整理后仍超出预算时从最早的日期开始省略，保留最近的对话；分析路由改用 utils.sampling 在全部记录中采样。
+
+整理后的格式由文本开头的 TRANSCRIPT_FORMAT_NOTE 说明（计入 token），系统提示词保持不变，便于上游复用相同前缀的缓存。
+"""
+import re
+from dataclasses import asdict, dataclass
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+RUN_SEPARATOR = ' / '
+# 这么长（字符数）以上的消息在整段记录中重复出现时只保留第一次
+DEDUPE_MIN_LENGTH = 8
+MAX_REPEATED_CHARS = 3
+
+TRANSCRIPT_FORMAT_NOTE = (
+    '（格式说明：以 [日期] 开头的行标出当天的对话，其后每行是"发送者：内容"，'
+    '同一人连续发送的多条消息用" / "分隔；表情、图片等占位和系统提示已省略。）'
+)
+
+_CJK = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+_PLACEHOLDER = re.compile(r'\[[^\[\]\s]{1,6}\]')
+_REPEATED_CHARS = re.compile(r'(.)\1{%d,}' % MAX_REPEATED_CHARS)
+_WHITESPACE = re.compile(r'\s+')
+_SYSTEM_LINE = re.compile(
+    r'^(?:.{0,20}撤回了一条消息'
+    r'|你已添加了.*现在可以开始聊天了'
+    r'|以上是打招呼的内容'
+    r'|.{0,20}拍了拍.{0,20}'
+    r'|\[?(?:系统消息|消息已发出，但被对方拒收了)\]?.*'
+    r'|对方已开启了?朋友验证.*)$'
+)
+
+_encoding = None
+
+
+def count_tokens(text):
+    """本地计算 token 数，只用于预算和统计，与服务端的计费可能略有出入"""
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        return len(_encoding.encode(text))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def format_line(log):
+    """原始格式：每条消息一行，带日期和发送者前缀"""
+    return f"[{log.chat_date}]【我】{log.content}" if log.speaker == '我' else f"[{log.chat_date}]【对方】{log.content}"
+
+
+def build_transcript(chat_logs):
+    return '\n'.join(format_line(log) for log in chat_logs)
+
+
+def clean_content(content):
+    """去掉表情 / 媒体占位并压缩重复字符；整条都是占位、空白或系统提示时返回空字符串"""
+    content = _WHITESPACE.sub(' ', content or '').strip()
+    if not content or _SYSTEM_LINE.match(content):
+        return ''
+    content = _PLACEHOLDER.sub('', content).strip()
+    return _REPEATED_CHARS.sub(lambda m: m.group(1) * MAX_REPEATED_CHARS, content)
+
+
+@dataclass
+class TranscriptStats:
+    messages: int = 0
+    kept_messages: int = 0
+    dropped_noise: int = 0
+    dropped_duplicates: int = 0
+    omitted_days: int = 0
+    # 重要性采样选出的消息数，0 表示未采样
+    sampled_messages: int = 0
+    original_tokens: int = 0
+    tokens: int = 0
+
+    @property
+    def tokens_saved(self):
+        return self.original_tokens - self.tokens
+
+    def to_dict(self):
+        data = asdict(self)
+        data['tokens_saved'] = self.tokens_saved
+        return data
+
+
+@dataclass
+class Transcript:
+    text: str
+    stats: TranscriptStats
+
+
+def _compact_days(chat_logs, stats):
+    """按日期分组，返回 [(日期, [行, ...], 保留的消息数), ...]"""
+    days = []
+    seen_long = set()
+    speaker, run = None, []
+
+    def flush_run():
+        if run:
+            days[-1][1].append(f'{speaker}：{RUN_SEPARATOR.join(run)}')
+            days[-1][2] += len(run)
+
+    for log in chat_logs:
+        stats.messages += 1
+        if not days or days[-1][0] != log.chat_date:
+            if days:
+                flush_run()
+            days.append([log.chat_date, [], 0])
+            speaker, run = None, []
+        content = clean_content(log.content)
+        if not content:
+            stats.dropped_noise += 1
+            continue
+        if log.speaker != speaker:
+            flush_run()
+            speaker, run = log.speaker, []
+        if content in run or (len(content) >= DEDUPE_MIN_LENGTH and content in seen_long):
+            stats.dropped_duplicates += 1
+            continue
+        if len(content) >= DEDUPE_MIN_LENGTH:
+            seen_long.add(content)
+        run.append(content)
+    if days:
+        flush_run()
+    return [day for day in days if day[1]]
+
+
+def compact_transcript(chat_logs, budget=None, note=None):
+    """整理聊天记录；budget 为整理后文本（含格式说明）的 token 上限，None 表示不限制；note 附加在格式说明之后"""
+    stats = TranscriptStats(original_tokens=count_tokens(build_transcript(chat_logs)))
+    days = _compact_days(chat_logs, stats)
+    blocks = ['\n'.join([f'[{day}]'] + lines) for day, lines, _ in days]
+
+    # 从最近的一天往前累加，超出预算的更早日期整体省略；最近一天本身超出预算时仍保留这一天。
+    # 格式说明和省略提示（约 20 个 token）也计入预算
+    first, total = len(blocks), count_tokens(TRANSCRIPT_FORMAT_NOTE) + count_tokens(note) + 20
+    while first > 0:
+        cost = count_tokens(blocks[first - 1]) + 1
+        if budget is not None and total + cost > budget and first < len(blocks):
+            break
+        first -= 1
+        total += cost
+    stats.omitted_days = first
+    stats.kept_messages = sum(kept for _, _, kept in days[first:])
+
+    header = [TRANSCRIPT_FORMAT_NOTE] + ([note] if note else [])
+    if first:
+        header.append(f'（更早的 {first} 天聊天记录因长度限制已省略）')
+    text = '\n'.join(header + blocks[first:])
+    stats.tokens = count_tokens(text)
+    return Transcript(text=text, stats=stats)
@@ -0,0 +1,11 @@
+"""
+生产环境 WSGI 入口
+
+    gunicorn -c gunicorn.conf.py        # worker 模型、数量和预加载见 gunicorn.conf.py
+    gunicorn -w 4 -k gthread wsgi:app   # 不使用配置文件时
+
+python app.py 启动的是单线程的调试服务器，只适合本地开发。
+"""
+from app import create_app
+
+app = create_app()